@@ -0,0 +1,168 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Index of the statements that are already on files on Commons.
+
+The depicts bots used to fetch the mediainfo of every file separately before deciding if a statement should be
+added. The index is filled in bulk, either with wbgetentities for 50 files per request or from the mediainfo dump
+(https://dumps.wikimedia.org/other/wikibase/commonswiki/), and keeps per file only the targets of the properties
+the bot is interested in. With that the exact set of missing statements can be computed up front and the bot only
+has to do the writes.
+
+Usage in a bot:
+
+    claim_index = ClaimIndex(properties=['P180'])
+    claim_index.load_entities(site, mediaids)
+    missing = claim_index.get_missing('P180', pairs)
+"""
+import pywikibot
+import gzip
+import json
+import re
+from mediainfo_generator import get_mediainfo_entities, preloading_mediainfo_generator
+
+DUMP_ID_REGEX = re.compile(r'"id":"(M\d+)"')
+
+
+class ClaimIndex:
+    """
+    The targets of some properties per file
+    """
+    def __init__(self, properties=('P180',)):
+        """
+        Arguments:
+            * properties - The properties to keep the targets of
+
+        """
+        self.properties = list(properties)
+        # mediaid -> dict with the lastrevid and per property the set of targets
+        self.entities = {}
+        # mediaids that were looked up, also the ones without structured data
+        self.loaded = set()
+
+    def add_entity(self, mediaid, mediainfo):
+        """
+        Add the mediainfo json of a file. Empty json is a file without structured data
+        """
+        self.loaded.add(mediaid)
+        if not mediainfo:
+            self.entities.pop(mediaid, None)
+            return
+        entity = {'lastrevid': mediainfo.get('lastrevid')}
+        statements = mediainfo.get('statements') or {}
+        for prop in self.properties:
+            targets = set()
+            for statement in statements.get(prop, []):
+                mainsnak = statement.get('mainsnak')
+                if mainsnak.get('snaktype') == 'value' and mainsnak.get('datavalue').get('type') == 'wikibase-entityid':
+                    targets.add(mainsnak.get('datavalue').get('value').get('id'))
+                else:
+                    # Some value and no value still count as having the property
+                    targets.add(None)
+            if targets:
+                entity[prop] = targets
+        self.entities[mediaid] = entity
+
+    def add_claim(self, mediaid, prop, qid):
+        """
+        Record a statement the bot just added
+        """
+        self.entities.setdefault(mediaid, {}).setdefault(prop, set()).add(qid)
+
+    def discard(self, mediaid):
+        """
+        Forget a file, to keep the index small when working through a generator
+        """
+        self.loaded.discard(mediaid)
+        self.entities.pop(mediaid, None)
+
+    def load_entities(self, site, mediaids, groupsize=50):
+        """
+        Load the files that are not in the index yet with wbgetentities, 50 per request
+
+        :param site: The Commons site
+        :param mediaids: Iterable of mediaids (like M1234, pageid prefixed with M)
+        """
+        toload = sorted(set(mediaids) - self.loaded)
+        for i in range(0, len(toload), groupsize):
+            batch = toload[i:i + groupsize]
+            mediainfos = get_mediainfo_entities(site, batch)
+            for mediaid in batch:
+                self.add_entity(mediaid, mediainfos.get(mediaid))
+            if i and i % (groupsize * 100) == 0:
+                pywikibot.output('Loaded %s of %s files in the claim index' % (i, len(toload)))
+
+    def load_dump(self, dump_file, mediaids=None):
+        """
+        Load the files from the mediainfo json dump. Only lines of the files asked for are parsed
+
+        :param dump_file: The (gzipped) mediainfo json dump
+        :param mediaids: The mediaids to load. If None, all files with one of the properties are loaded
+        """
+        if mediaids is not None:
+            mediaids = set(mediaids)
+        propertystrings = ['"%s"' % (prop,) for prop in self.properties]
+        if dump_file.endswith('.gz'):
+            dump = gzip.open(dump_file, 'rt', encoding='utf-8')
+        else:
+            dump = open(dump_file, 'r', encoding='utf-8')
+        with dump:
+            for line in dump:
+                match = DUMP_ID_REGEX.search(line, 0, 100)
+                if not match:
+                    continue
+                mediaid = match.group(1)
+                if mediaids is not None:
+                    if mediaid not in mediaids:
+                        continue
+                elif not any(propertystring in line for propertystring in propertystrings):
+                    continue
+                self.add_entity(mediaid, json.loads(line.strip().rstrip(',')))
+        if mediaids is not None:
+            # Files not in the dump don't have structured data
+            for mediaid in mediaids - self.loaded:
+                self.add_entity(mediaid, {})
+
+    def preloading_generator(self, generator, groupsize=50):
+        """
+        Go over the file pages and add their mediainfo to the index in batches
+
+        :return: Generator yielding tuples of file page and mediaid
+        """
+        for (filepage, mediaid, mediainfo) in preloading_mediainfo_generator(generator, groupsize=groupsize):
+            self.add_entity(mediaid, mediainfo)
+            yield (filepage, mediaid)
+
+    def exists(self, mediaid):
+        """
+        Check if the file has structured data
+        """
+        return mediaid in self.entities
+
+    def get_lastrevid(self, mediaid):
+        """
+        Get the revision id of the mediainfo to use as baserevid
+        """
+        return self.entities.get(mediaid, {}).get('lastrevid')
+
+    def has_property(self, mediaid, prop):
+        """
+        Check if the file has a statement with the property
+        """
+        return bool(self.entities.get(mediaid, {}).get(prop))
+
+    def has_claim(self, mediaid, prop, qid):
+        """
+        Check if the file has a statement with the property and the item as value
+        """
+        return qid in self.entities.get(mediaid, {}).get(prop, ())
+
+    def get_missing(self, prop, pairs):
+        """
+        Get the statements that are not on the files yet
+
+        :param prop: The property
+        :param pairs: Iterable of tuples of mediaid and Qid
+        :return: List of the tuples that are missing
+        """
+        return [(mediaid, qid) for (mediaid, qid) in pairs if not self.has_claim(mediaid, prop, qid)]
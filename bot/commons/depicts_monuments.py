@@ -14,6 +14,7 @@ import time
 import json
 import random
 from pywikibot import pagegenerators
+from claim_index import ClaimIndex
 
 class DepictsMonumentsBot:
     """
@@ -47,6 +48,7 @@ class DepictsMonumentsBot:
         else:
             self.generator = pagegenerators.PreloadingGenerator(pagegenerators.SearchPageGenerator(self.search, namespaces=6, site=self.site))
         (self.monuments, self.monumentsLocations) = self.getMonumentsOnWikidata(self.property, self.designation)
+        self.claimIndex = ClaimIndex(properties=[u'P180', u'P1071'])
 
     def getMonumentsOnWikidata(self, property, designation=None):
         """
@@ -82,32 +84,16 @@ class DepictsMonumentsBot:
         """
         Run on the items
         """
-        for filepage in self.generator:
-            if not filepage.exists():
-                continue
-            # Probably want to get this all in a preloading generator to make it faster
-            mediaid = u'M%s' % (filepage.pageid,)
-            currentdata = self.getCurrentMediaInfo(mediaid)
-            self.handleMonument(filepage, mediaid, currentdata)
-
-    def getCurrentMediaInfo(self, mediaid):
-        """
-        Check if the media info exists. If that's the case, return that so we can expand it.
-        Otherwise return an empty dict
-        :param mediaid: The entity ID (like M1234, pageid prefixed with M)
-        :return: json
-            """
-        request = self.site.simple_request(action='wbgetentities',ids=mediaid)
-        data = request.submit()
-        if data.get(u'entities').get(mediaid).get(u'pageid'):
-            return data.get(u'entities').get(mediaid)
-        return {}
-
-    def handleMonument(self, filepage, mediaid, currentdata):
+        for (filepage, mediaid) in self.claimIndex.preloading_generator(self.generator):
+            self.handleMonument(filepage, mediaid)
+            self.claimIndex.discard(mediaid)
+
+    def handleMonument(self, filepage, mediaid):
         """
         Handle a single monument. Try to extract the template, look up the id and add the Q if no mediainfo is present.
 
         :param filepage: The page of the file to work on.
+        :param mediaid: The mediaid of the file, already in the claim index
         :return: Nothing, edit in place
         """
         pywikibot.output(u'Working on %s' % (filepage.title(),))
@@ -141,8 +127,8 @@ class DepictsMonumentsBot:
         # Here we're collecting
         newclaims = {}
 
-        newclaims['depicts'] = self.addDepicts(mediaid, currentdata, depictstoadd)
-        newclaims['location'] = self.addLocation(mediaid, currentdata, locationstoadd)
+        newclaims['depicts'] = self.addDepicts(mediaid, depictstoadd)
+        newclaims['location'] = self.addLocation(mediaid, locationstoadd)
 
         for (monumentid, qid) in summarytoadd:
             if len(summarytoadd)==1:
@@ -182,9 +168,9 @@ class DepictsMonumentsBot:
                         'summary' : summary,
                         'bot' : True,
                         }
-            if currentdata:
+            if self.claimIndex.exists(mediaid):
                 # This only works when the entity has been created
-                postdata['baserevid'] = currentdata.get('lastrevid')
+                postdata['baserevid'] = self.claimIndex.get_lastrevid(mediaid)
 
             request = self.site.simple_request(**postdata)
             try:
@@ -196,17 +182,15 @@ class DepictsMonumentsBot:
                 time.sleep(30)
                 self. site.tokens.load_tokens(['csrf'])
 
-    def addDepicts(self, mediaid, currentdata, depictstoadd):
+    def addDepicts(self, mediaid, depictstoadd):
         """
         Add the author info to filepage
         :param mediaid: Media ID of the file
-        :param currentdata: What's currently on the fiel
         :param depictstoadd: List of Q id's to add
         :return:
         """
-        if currentdata.get('statements'):
-            if currentdata.get('statements').get('P180'):
-                return False
+        if self.claimIndex.has_property(mediaid, u'P180'):
+            return False
 
         result = []
 
@@ -215,17 +199,15 @@ class DepictsMonumentsBot:
             result.extend(self.addClaimJson(mediaid, u'P180', depicts))
         return result
 
-    def addLocation(self, mediaid, currentdata, locationstoadd):
+    def addLocation(self, mediaid, locationstoadd):
         """
         Add the author info to filepage
         :param mediaid: Media ID of the file
-        :param currentdata: What's currently on the fiel
         :param depictstoadd: List of Q id's to add
         :return:
         """
-        if currentdata.get('statements'):
-            if currentdata.get('statements').get('P1071'):
-                return False
+        if self.claimIndex.has_property(mediaid, u'P1071'):
+            return False
 
         locationstoadd = list(set(locationstoadd))
         if len(locationstoadd) !=1:
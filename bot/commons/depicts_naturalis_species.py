@@ -14,6 +14,7 @@ import datetime
 from pywikibot.comms import http
 import json
 from pywikibot import pagegenerators
+from claim_index import ClaimIndex
 
 class DepictsNaturalisSpeciesBot:
     """
@@ -31,6 +32,7 @@ class DepictsNaturalisSpeciesBot:
 
         self.generator = pagegenerators.PreloadingGenerator(pagegenerators.SearchPageGenerator(self.search, namespaces=6, site=self.site))
         self.speciescategories = self.speciesCategoriesOnWikidata()
+        self.claimIndex = ClaimIndex(properties=[u'P180'])
 
     def speciesCategoriesOnWikidata(self):
         """"
@@ -57,14 +59,16 @@ class DepictsNaturalisSpeciesBot:
         """
         Run on the items
         """
-        for filepage in self.generator:
-            self.handleTaxon(filepage)
+        for (filepage, mediaid) in self.claimIndex.preloading_generator(self.generator):
+            self.handleTaxon(filepage, mediaid)
+            self.claimIndex.discard(mediaid)
 
-    def handleTaxon(self, filepage):
+    def handleTaxon(self, filepage, mediaid):
         """
         Handle a single taxon image.
 
         :param filepage: The page of the file to work on.
+        :param mediaid: The mediaid of the file, already in the claim index
         :return: Nothing, edit in place
         """
         pywikibot.output(u'Working on %s' % (filepage.title(),))
@@ -92,8 +96,7 @@ class DepictsNaturalisSpeciesBot:
 
         pywikibot.output(u'Found %s based on %s' % (qid, taxonName,))
 
-        mediaid = u'M%s' % (filepage.pageid,)
-        if self.mediaInfoHasStatement(mediaid, u'P180'):
+        if self.claimIndex.has_property(mediaid, u'P180'):
             return
 
         summary = u'based on Naturalis Leiden image in [[Category:%s]]' % (taxonName, )
@@ -131,26 +134,6 @@ class DepictsNaturalisSpeciesBot:
                     }
         apipage = http.fetch(u'https://commons.wikimedia.org/w/api.php', method='POST', data=postdata)
 
-    def mediaInfoHasStatement(self, mediaid, property):
-        """
-        Check if the media info exists or not
-        :param mediaid: The entity ID (like M1234, pageid prefixed with M)
-        :param property: The property ID to check for (like P180)
-        :return: True if it exists, otherwise False
-        """
-        # https://commons.wikimedia.org/w/api.php?action=wbgetentities&format=json&ids=M72643194
-        request = self.site._simple_request(action='wbgetentities',ids=mediaid)
-        data = request.submit()
-        # No structured data at all is no pageid
-        if not data.get(u'entities').get(mediaid).get(u'pageid'):
-            return False
-        # Has structured data, but the list of statements is empty
-        if not data.get(u'entities').get(mediaid).get(u'statements'):
-            return False
-        if property in data.get(u'entities').get(mediaid).get(u'statements'):
-            return True
-        return False
-
 
 def main():
     depictsNaturalisSpeciesBot = DepictsNaturalisSpeciesBot()
@@ -3,8 +3,9 @@
 """
 Bot to depicts statements for species.
 
-This is just a proof of concept to show that this is possible. When we're actually going to import,
-I should probably optimize it.
+The depicts statements already on the images are collected in bulk in a claim index (from the API, 50 files per
+request, or with -dump:<file> from the mediainfo dump) so the missing statements are known up front and the bot
+only has to do the writes.
 """
 
 import pywikibot
@@ -14,56 +15,83 @@ import datetime
 from pywikibot.comms import http
 import json
 from pywikibot import pagegenerators
+from urllib.parse import unquote
+from claim_index import ClaimIndex
 
 class DepictsSpeciesBot:
     """
     Bot to add depicts statements on Commons
     """
-    def __init__(self):
+    def __init__(self, dump_file=None):
         """
-        Grab generator based on SPARQL to work on.
+        Grab the taxon items with their images based on SPARQL to work on.
+
+        Arguments:
+            * dump_file - The Commons mediainfo dump to build the claim index from. Without it the API is used
 
         """
         self.site = pywikibot.Site(u'commons', u'commons')
         self.repo = self.site.data_repository()
+        self.dump_file = dump_file
+        self.claimIndex = ClaimIndex(properties=[u'P180'])
+
+        self.taxonImages = self.getTaxonImages()
 
+    def getTaxonImages(self):
+        """
+        Get the images of the taxon items directly from SPARQL so the items don't have to be loaded
+        :return: Dict with per file title the list of Qids
+        """
+        result = {}
         query = u"""SELECT ?item ?image WHERE {
   ?item wdt:P105 wd:Q7432 .
   ?item wdt:P18 ?image .
   ?item wdt:P31 wd:Q16521 .
   } LIMIT 200000"""
+        sq = pywikibot.data.sparql.SparqlQuery()
+        queryresult = sq.select(query)
 
-        self.generator = pagegenerators.PreloadingEntityGenerator(pagegenerators.WikidataSPARQLPageGenerator(query, site=self.repo))
+        for resultitem in queryresult:
+            qid = resultitem.get('item').replace(u'http://www.wikidata.org/entity/', u'')
+            filename = unquote(resultitem.get('image').replace(u'http://commons.wikimedia.org/wiki/Special:FilePath/', u''))
+            title = u'File:%s' % (filename.replace(u'_', u' '),)
+            if qid not in result.get(title, []):
+                result.setdefault(title, []).append(qid)
+        return result
 
     def run(self):
         """
-        Run on the items
+        Build the claim index for all the images, work out which depicts statements are missing and only add these
         """
-        for item in self.generator:
-            self.handleTaxonItem(item)
-
-    def handleTaxonItem(self, item):
+        pairs = self.getMediaidPairs()
+        mediaids = set(mediaid for (mediaid, qid) in pairs)
+        pywikibot.output(u'Found %s taxon items with %s images on Commons' % (len(pairs), len(mediaids)))
+        if self.dump_file:
+            self.claimIndex.load_dump(self.dump_file, mediaids=mediaids)
+        else:
+            self.claimIndex.load_entities(self.site, mediaids)
+
+        missing = self.claimIndex.get_missing(u'P180', pairs)
+        pywikibot.output(u'%s depicts statements are missing' % (len(missing),))
+        for (mediaid, qid) in missing:
+            self.addDepicts(mediaid, qid)
+            self.claimIndex.add_claim(mediaid, u'P180', qid)
+
+    def getMediaidPairs(self):
         """
+        Look up the pageids of the images, 50 per request
 
-        :param item:
-        :return:
+        :return: List of tuples of mediaid and Qid
         """
-        data = item.get()
-        claims = data.get('claims')
-
-        if u'P18' not in claims:
-            return
-
-        filepage = claims.get('P18')[0].getTarget()
-
-        if not filepage.exists():
-            return
-
-        mediaid = u'M%s' % (filepage.pageid,)
-        if self.mediaInfoExists(mediaid):
-            return
-
-        self.addDepicts(mediaid, item.title())
+        result = []
+        filepages = [pywikibot.FilePage(self.site, title=title) for title in self.taxonImages]
+        for filepage in self.site.preloadpages(filepages, groupsize=50, content=False):
+            if not filepage.exists():
+                continue
+            mediaid = u'M%s' % (filepage.pageid,)
+            for qid in self.taxonImages.get(filepage.title(), []):
+                result.append((mediaid, qid))
+        return result
 
     def addDepicts(self, mediaid, qid):
         """
@@ -99,23 +127,14 @@ class DepictsSpeciesBot:
         pywikibot.output(summary)
         apipage = http.fetch(u'https://commons.wikimedia.org/w/api.php', method='POST', data=postdata)
 
-    def mediaInfoExists(self, mediaid):
-        """
-        Check if the media info exists or not
-        :param mediaid: The entity ID (like M1234, pageid prefixed with M)
-        :return: True if it exists, otherwise False
-        """
-        # https://commons.wikimedia.org/w/api.php?action=wbgetentities&format=json&ids=M52611909
-        # https://commons.wikimedia.org/w/api.php?action=wbgetentities&format=json&ids=M10038
-        request = self.site._simple_request(action='wbgetentities',ids=mediaid)
-        data = request.submit()
-        if data.get(u'entities').get(mediaid).get(u'pageid'):
-            return True
-        return False
 
+def main(*args):
+    dump_file = None
+    for arg in pywikibot.handle_args(args):
+        if arg.startswith('-dump:'):
+            dump_file = arg[len('-dump:'):]
 
-def main():
-    depictsSpeciesBot = DepictsSpeciesBot()
+    depictsSpeciesBot = DepictsSpeciesBot(dump_file=dump_file)
     depictsSpeciesBot.run()
 
 if __name__ == "__main__":
@@ -7,6 +7,10 @@ Bot to clean up files which have digital representation of (P6243).
 * For 3D works, the digital representation of (P6243) should be removed
 * For 2D works, the missing digital representation of (P6243) should be added
 
+The linked Wikidata items are fetched in batches for a window of files and kept in an EntityCache. The 2D classes
+are expanded to all their subclasses once, so classifying a work doesn't need any extra requests. The 3D classes are
+only matched exactly because some of them (like cultural heritage) are far too broad.
+
 Should be switched to a more general Pywikibot implementation.
 
 """
@@ -16,15 +20,20 @@ import re
 import pywikibot.data.sparql
 import time
 import json
+import itertools
 from pywikibot import pagegenerators
+from entity_cache import EntityCache, SubclassClosure
+from mediainfo_generator import preloading_mediainfo_generator
 
 class DigitalRepresentationCleaanupBot:
     """
     Bot to add structured data statements on Commons
     """
-    def __init__(self, gen, alwaystouch, remove3d):
+    def __init__(self, gen, alwaystouch, remove3d, window=250):
         """
         Grab generator based on search to work on.
+
+        :param window: Number of files to prefetch the linked items for
         """
         self.site = pywikibot.Site('commons', 'commons')
         self.site.login()
@@ -33,11 +42,18 @@ class DigitalRepresentationCleaanupBot:
         self.generator = gen
         self.alwaystouch = alwaystouch
         self.remove3d = remove3d
+        self.window = window
         (self.works_2d, self.works_3d, self.works_both) = self.load_work_types()
+        self.entityCache = EntityCache(self.repo, properties=['P31', 'P180'])
+        if self.remove3d:
+            # The 3D roots like cultural heritage are too broad to include all the subclasses of
+            self.workTypes = SubclassClosure({'2d': self.works_2d, '3d': self.works_3d, 'both': self.works_both},
+                                             expand=['2d', 'both'])
 
     def load_work_types(self):
         """
         Load the different kinds of works. For now just static lists. Can do it later on the wiki
+        These are the root classes, the subclasses of the 2D and both ones are included with the SubclassClosure
         :return: The three lists as a tuple
         """
         works_2d = ['Q18396864',  # aquatint print
@@ -52,7 +68,7 @@ class DigitalRepresentationCleaanupBot:
                     'Q15123870',  # lithograph
                     'Q21647744',  # mezzotint print
                     'Q3305213',  # painting
-                    'Q12043905'  # pastel
+                    'Q12043905',  # pastel
                     'Q125191',  # photograph
                     'Q282129',  # portrait miniature
                     'Q11060274',  # print
@@ -100,42 +116,61 @@ class DigitalRepresentationCleaanupBot:
         """
         Run on the items
         """
-        for filepage in self.generator:
-            if not filepage.exists():
-                continue
-            # Probably want to get this all in a preloading generator to make it faster
-            mediaid = u'M%s' % (filepage.pageid,)
-            currentdata = self.getCurrentMediaInfo(mediaid)
-
-            pywikibot.output(u'Working on %s' % (filepage.title(),))
-
-            if not filepage.exists():
-                continue
-
-            if not filepage.has_permission():
-                # Picture might be protected
-                continue
-
-            self.resolve_redirects(filepage, mediaid, currentdata)
-            self.update_recursive_depicts(filepage, mediaid, currentdata)
-            self.addMissingStatementsToFile(filepage, mediaid, currentdata)
-            if self.remove3d:
-                self.removeDigitalRepresentation3d(filepage, mediaid, currentdata)
+        generator = preloading_mediainfo_generator(self.generator)
+        while True:
+            files = list(itertools.islice(generator, self.window))
+            if not files:
+                break
+            self.prefetch_items(files)
+
+            for (filepage, mediaid, currentdata) in files:
+                pywikibot.output(u'Working on %s' % (filepage.title(),))
+
+                if not filepage.has_permission():
+                    # Picture might be protected
+                    continue
+
+                self.resolve_redirects(filepage, mediaid, currentdata)
+                self.update_recursive_depicts(filepage, mediaid, currentdata)
+                self.addMissingStatementsToFile(filepage, mediaid, currentdata)
+                if self.remove3d:
+                    self.removeDigitalRepresentation3d(filepage, mediaid, currentdata)
+        self.entityCache.output_statistics()
+
+    def get_statement_targets(self, currentdata, prop):
+        """
+        Get the Wikidata items a property on the file points to
+        :param currentdata: The current structured data
+        :param prop: The property
+        :return: List of qids
+        """
+        result = []
+        if not currentdata.get('statements'):
+            return result
+        for statement in currentdata.get('statements').get(prop, []):
+            if statement.get('mainsnak').get('datavalue'):
+                result.append(statement.get('mainsnak').get('datavalue').get('value').get('id'))
+        return result
 
-    def getCurrentMediaInfo(self, mediaid):
+    def prefetch_items(self, files):
         """
-        Check if the media info exists. If that's the case, return that so we can expand it.
-        Otherwise return an empty structure with just <s>claims</>statements in it to start
-        :param mediaid: The entity ID (like M1234, pageid prefixed with M)
-        :return: json
-            """
-        # https://commons.wikimedia.org/w/api.php?action=wbgetentities&format=json&ids=M52611909
-        # https://commons.wikimedia.org/w/api.php?action=wbgetentities&format=json&ids=M10038
-        request = self.site.simple_request(action='wbgetentities',ids=mediaid)
-        data = request.submit()
-        if data.get(u'entities').get(mediaid).get(u'pageid'):
-            return data.get(u'entities').get(mediaid)
-        return {}
+        Get all the items the files in the window link to in batches. The targets of redirected artworks are
+        fetched too, these are used to classify the work
+        :param files: List of tuples of file page, mediaid and structured data
+        :return:
+        """
+        qids = set()
+        artwork_qids = set()
+        for (filepage, mediaid, currentdata) in files:
+            for prop in ['P180', 'P921', 'P6243']:
+                qids.update(self.get_statement_targets(currentdata, prop))
+            artwork_qids.update(self.get_statement_targets(currentdata, 'P6243'))
+        self.entityCache.prefetch(qids)
+        targets = set()
+        for qid in artwork_qids:
+            if qid in self.entityCache and self.entityCache.get_redirect_target(qid):
+                targets.add(self.entityCache.get_redirect_target(qid))
+        self.entityCache.prefetch(targets)
 
     def resolve_redirects(self, filepage, mediaid, currentdata):
         """
@@ -153,11 +188,10 @@ class DigitalRepresentationCleaanupBot:
                     if statement.get('mainsnak').get('datavalue'):
                         qid = statement.get('mainsnak').get('datavalue').get('value').get('id')
                         claim_id = statement.get('id')
-                        item = pywikibot.ItemPage(self.repo, qid)
-                        if item.isRedirectPage():
-                            target_item = item.getRedirectTarget()
+                        target_qid = self.entityCache.get_redirect_target(qid)
+                        if target_qid:
                             summary = 'resolving redirect'
-                            self.update_statement(filepage, claim_id, target_item.title(), summary)
+                            self.update_statement(filepage, claim_id, target_qid, summary)
 
     def update_recursive_depicts(self, filepage, mediaid, currentdata):
         """
@@ -185,22 +219,18 @@ class DigitalRepresentationCleaanupBot:
         if artwork_qid == depicts_qid:
             return
 
-        artwork_item = pywikibot.ItemPage(self.repo, artwork_qid)
-        depicts_item = pywikibot.ItemPage(self.repo, depicts_qid)
-
-        if artwork_item.isRedirectPage() or depicts_item.isRedirectPage():
+        if self.entityCache.get_redirect_target(artwork_qid) or self.entityCache.get_redirect_target(depicts_qid):
             # Handled in redirect function
             return
 
-        artwork_claims = artwork_item.get().get('claims')
+        artwork_depicts = self.entityCache.get_claim_targets(artwork_qid, 'P180')
 
-        if 'P180' in artwork_claims:
-            for depicts_claim in artwork_claims.get('P180'):
-                if depicts_claim.getTarget() == depicts_item:
-                    # Found it, update Commons
-                    summary = '[[d:Special:EntityPage/P180]]->[[d:Special:EntityPage/%s]] is on [[d:Special:EntityPage/%s]]' % (depicts_qid, artwork_qid)
-                    self.update_statement(filepage, depicts_claim_id, artwork_qid, summary)
-                    return
+        if artwork_depicts:
+            if depicts_qid in artwork_depicts:
+                # Found it, update Commons
+                summary = '[[d:Special:EntityPage/P180]]->[[d:Special:EntityPage/%s]] is on [[d:Special:EntityPage/%s]]' % (depicts_qid, artwork_qid)
+                self.update_statement(filepage, depicts_claim_id, artwork_qid, summary)
+                return
             # TODO: We did not find it. Add it to the Wikidata item??
             return
         else:
@@ -343,27 +373,23 @@ class DigitalRepresentationCleaanupBot:
         else:
             return
 
-        artworkitem = pywikibot.ItemPage(self.repo, artworkqid)
-
-        if artworkitem.isRedirectPage():
-            artworkitem = artworkitem. getRedirectTarget()
-
-        claims = artworkitem.get().get('claims')
+        # Redirects are followed by the cache
+        instances = self.entityCache.get_claim_targets(artworkqid, 'P31')
 
-        if 'P31' in claims:
+        if instances:
             found_2d = 0
             found_3d = 0
             found_both = 0
             found_unknown = 0
             found_3d_example = None
-            for claim in claims.get('P31'):
-                instanceof = claim.getTarget().title()
-                if instanceof in self.works_2d:
+            for instanceof in instances:
+                kind = self.workTypes.get_kind(instanceof)
+                if kind == '2d':
                     found_2d += 1
-                elif instanceof in self.works_3d:
+                elif kind == '3d':
                     found_3d += 1
                     found_3d_example = instanceof
-                elif instanceof in self.works_both:
+                elif kind == 'both':
                     found_both += 1
                 else:
                     found_unknown += 1
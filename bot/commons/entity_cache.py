@@ -0,0 +1,255 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Cache of the Wikidata items the structured data bots look at.
+
+Files in the same category tend to point to the same artworks and the artworks to the same classes. Getting every
+linked item file by file means the same items are fetched over and over again. The EntityCache keeps for every item
+only the redirect target and the targets of a few properties, is filled with wbgetentities for 50 items per request
+and throws out the least recently used items when it gets too big.
+
+The SubclassClosure is a table of all the subclasses (P279*) of some root classes, made with one SPARQL query per
+kind and kept in a JSON file in the pywikibot directory for a week. Classifying an item is then a dict lookup. Kinds
+with very broad roots can be left out of the expansion, for these only the roots themselves are in the table. A table
+that could not be made completely is only used for the current run and never saved.
+
+Usage in a bot:
+
+    entity_cache = EntityCache(self.repo, properties=['P31', 'P180'])
+    entity_cache.prefetch(qids)
+    entity_cache.get_redirect_target(qid)
+    entity_cache.get_claim_targets(qid, 'P180')
+"""
+import pywikibot
+import pywikibot.data.sparql
+import datetime
+import json
+import os
+from collections import OrderedDict
+
+
+class EntityCache:
+    """
+    Size bounded LRU cache with the redirect target and the targets of some properties per item
+    """
+    def __init__(self, repo, properties=('P31',), maxsize=50000):
+        """
+        Arguments:
+            * repo       - The Wikidata repository
+            * properties - The properties to keep the targets of
+            * maxsize    - Maximum number of items in the cache
+
+        """
+        self.repo = repo
+        self.properties = list(properties)
+        self.maxsize = maxsize
+        # qid -> dict with the redirect target (or None) and per property the list of targets
+        self.entities = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, qid):
+        return qid in self.entities
+
+    def __len__(self):
+        return len(self.entities)
+
+    def add_entity(self, qid, entity):
+        """
+        Add the json of an item like wbgetentities returns it
+        """
+        result = {'redirect': None}
+        for prop in self.properties:
+            targets = []
+            for statement in (entity.get('claims') or {}).get(prop, []):
+                mainsnak = statement.get('mainsnak')
+                if mainsnak.get('snaktype') == 'value' and mainsnak.get('datavalue').get('type') == 'wikibase-entityid':
+                    targets.append(mainsnak.get('datavalue').get('value').get('id'))
+            result[prop] = targets
+        self.store(qid, result)
+
+    def add_redirect(self, qid, target):
+        """
+        Add an item that is a redirect to another item
+        """
+        self.store(qid, {'redirect': target})
+
+    def store(self, qid, data):
+        """
+        Put an item in the cache and make room if needed
+        """
+        self.entities[qid] = data
+        self.entities.move_to_end(qid)
+        while len(self.entities) > self.maxsize:
+            self.entities.popitem(last=False)
+
+    def prefetch(self, qids):
+        """
+        Get all the items that are not in the cache yet, 50 per request
+        """
+        toload = []
+        for qid in set(qids):
+            if qid in self.entities:
+                self.entities.move_to_end(qid)
+            elif qid:
+                toload.append(qid)
+        for i in range(0, len(toload), 50):
+            self.load_entities(sorted(toload)[i:i + 50])
+
+    def load_entities(self, qids):
+        """
+        Get up to 50 items in one request and put them in the cache
+        """
+        request = self.repo.simple_request(action='wbgetentities', ids=qids, props='info|claims')
+        data = request.submit()
+        for (qid, entity) in data.get('entities').items():
+            if 'missing' in entity:
+                self.store(qid, {'redirect': None})
+                continue
+            redirects = entity.get('redirects')
+            if redirects:
+                self.add_redirect(redirects.get('from'), redirects.get('to'))
+            elif entity.get('id') and entity.get('id') != qid:
+                self.add_redirect(qid, entity.get('id'))
+            self.add_entity(entity.get('id', qid), entity)
+
+    def get(self, qid):
+        """
+        Get the cached data of an item, fetch it if it's not in the cache
+        """
+        if qid in self.entities:
+            self.hits += 1
+            self.entities.move_to_end(qid)
+        else:
+            self.misses += 1
+            self.load_entities([qid])
+            if qid not in self.entities:
+                self.store(qid, {'redirect': None})
+        return self.entities[qid]
+
+    def get_redirect_target(self, qid):
+        """
+        Get the item the item redirects to
+
+        :return: The qid of the target or None if it's not a redirect
+        """
+        return self.get(qid).get('redirect')
+
+    def get_claim_targets(self, qid, prop):
+        """
+        Get the targets of a property on an item. Redirects are followed
+
+        :return: List of qids
+        """
+        data = self.get(qid)
+        if data.get('redirect'):
+            data = self.get(data.get('redirect'))
+        return data.get(prop, [])
+
+    def output_statistics(self):
+        """
+        Output how well the cache worked
+        """
+        pywikibot.output('Entity cache: %s items, %s hits, %s misses' % (len(self.entities), self.hits, self.misses))
+
+
+class SubclassClosure:
+    """
+    Table of all subclasses of the root classes of each kind
+    """
+    def __init__(self, kinds, expand=None, filename=None, max_age=datetime.timedelta(days=7)):
+        """
+        Arguments:
+            * kinds    - Dict with per kind a list of root classes, like {'2d': ['Q3305213'], '3d': ['Q860861']}
+            * expand   - List of the kinds to get the subclasses of. Defaults to all kinds
+            * filename - JSON file to keep the table in. Defaults to subclass_closure.json in the pywikibot directory
+            * max_age  - How long the table is used before it's made again
+
+        """
+        if not filename:
+            filename = os.path.join(pywikibot.config.base_dir, 'subclass_closure.json')
+        self.filename = filename
+        self.max_age = max_age
+        self.kinds = kinds
+        if expand is None:
+            expand = list(kinds)
+        self.expand = sorted(expand)
+        self.classes = self.load()
+
+    def load(self):
+        """
+        Load the table from the file or make it again if it's too old or made with other root classes. If making it
+        fails, an old table with the same root classes is used and otherwise the incomplete one, without saving it.
+
+        :return: Dict of class -> kind
+        """
+        closure = None
+        if os.path.exists(self.filename):
+            with open(self.filename, 'r') as closurefile:
+                closure = json.load(closurefile)
+            if closure.get('kinds') != self.kinds or closure.get('expand') != self.expand:
+                closure = None
+            else:
+                closure_time = datetime.datetime.strptime(closure.get('timestamp'), '%Y-%m-%dT%H:%M:%S')
+                if closure_time > datetime.datetime.utcnow() - self.max_age:
+                    return closure.get('classes')
+
+        (classes, complete) = self.make_closure()
+        if not complete:
+            if closure:
+                pywikibot.output('Could not make the subclass table, using the one of %s' % (closure.get('timestamp'),))
+                return closure.get('classes')
+            pywikibot.output('Could not make the subclass table, only using the roots for this run')
+            return classes
+        tempfilename = '%s.tmp' % (self.filename,)
+        with open(tempfilename, 'w') as tempfile:
+            json.dump({'kinds': self.kinds,
+                       'expand': self.expand,
+                       'timestamp': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S'),
+                       'classes': classes,
+                       }, tempfile)
+        os.replace(tempfilename, self.filename)
+        return classes
+
+    def make_closure(self):
+        """
+        Get the subclasses of the roots of every kind that should be expanded. A class that ends up in more than one
+        kind gets the kind 'both', that's the safe one.
+
+        :return: Tuple of a dict of class -> kind and if all the queries worked
+        """
+        result = {}
+        complete = True
+        sq = pywikibot.data.sparql.SparqlQuery()
+        for (kind, roots) in self.kinds.items():
+            subclasses = set(roots)
+            if kind in self.expand:
+                query = """SELECT DISTINCT ?class WHERE {
+  VALUES ?root { %s }
+  ?class wdt:P279* ?root .
+  }""" % (' '.join(['wd:%s' % (root,) for root in roots]),)
+                try:
+                    queryresult = sq.select(query)
+                except pywikibot.exceptions.Error:
+                    queryresult = None
+                if queryresult:
+                    for resultitem in queryresult:
+                        subclasses.add(resultitem.get('class').replace('http://www.wikidata.org/entity/', ''))
+                else:
+                    pywikibot.output('Could not get the subclasses of %s' % (kind,))
+                    complete = False
+            for qid in subclasses:
+                if qid in result and result.get(qid) != kind:
+                    result[qid] = 'both'
+                else:
+                    result[qid] = kind
+        pywikibot.output('Made the subclass table with %s classes' % (len(result),))
+        return (result, complete)
+
+    def get_kind(self, qid):
+        """
+        Get the kind of a class
+
+        :return: The kind or None if it's not a subclass of any of the roots
+        """
+        return self.classes.get(qid)
@@ -17,6 +17,7 @@ import pywikibot.data.sparql
 # import time
 # import json
 from pywikibot import pagegenerators
+from mediainfo_generator import preloading_mediainfo_generator
 
 class FixLocationBot:
     """
@@ -183,11 +184,10 @@ def mediainfo_to_fix_generator():
                       ]
     for search in search_strings:
         print(search)
-        # Do something with preloading here?
         gen = pagegenerators.PageClassGenerator(pagegenerators.SearchPageGenerator(search, namespaces=[6], site=site))
-        for filepage in gen:
+        for (filepage, mediaid, mediainfo) in preloading_mediainfo_generator(gen, entities=True):
             print(filepage.title())
-            yield filepage.data_item()
+            yield mediainfo
 
 
 
@@ -0,0 +1,226 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Persistent index of the Geograph ids that are already on Commons.
+
+The ids are kept in a bitmap: one bit per Geograph id, so the few million ids fit in about a megabyte and checking
+an id is a single lookup. The bitmap is saved in the pywikibot directory together with a small JSON file that
+remembers which id ranges were read from the category and when the uploads of GeographBot were last checked.
+
+Ranges that were read from the category recently are not read again. New uploads are added incrementally from the
+upload log of GeographBot.
+
+Usage: python geograph_id_index.py -startid:<id> -endid:<id> to (re)build the index for a range of ids
+"""
+import pywikibot
+import datetime
+import json
+import os
+import re
+
+
+class GeographIdIndex:
+    """
+    Bitmap of the Geograph ids on Commons
+    """
+    def __init__(self, filename=None, max_age=datetime.timedelta(days=7), user='GeographBot'):
+        """
+        Arguments:
+            * filename - The bitmap file. Defaults to geograph_ids.bitmap in the pywikibot directory. The state is
+                         kept in the same file with .json added
+            * max_age  - How long a range read from the category is trusted
+            * user     - The user whose uploads are added incrementally
+
+        """
+        if not filename:
+            filename = os.path.join(pywikibot.config.base_dir, 'geograph_ids.bitmap')
+        self.filename = filename
+        self.state_filename = '%s.json' % (filename,)
+        self.max_age = max_age
+        self.user = user
+        self.bitmap = bytearray()
+        self.state = {'ranges': [], 'last_upload': None}
+        if os.path.exists(self.filename):
+            with open(self.filename, 'rb') as bitmapfile:
+                self.bitmap = bytearray(bitmapfile.read())
+        if os.path.exists(self.state_filename):
+            with open(self.state_filename, 'r') as statefile:
+                self.state = json.load(statefile)
+
+    def __contains__(self, identifier):
+        identifier = int(identifier)
+        byte = identifier >> 3
+        if byte >= len(self.bitmap):
+            return False
+        return bool(self.bitmap[byte] & (1 << (identifier & 7)))
+
+    def __len__(self):
+        return sum(bin(byte).count('1') for byte in self.bitmap)
+
+    def add(self, identifier):
+        """
+        Add a Geograph id. The bitmap grows when needed
+        """
+        identifier = int(identifier)
+        byte = identifier >> 3
+        if byte >= len(self.bitmap):
+            # Grow in steps so adding increasing ids doesn't copy the bitmap every time
+            self.bitmap.extend(bytes(max(byte + 1 - len(self.bitmap), 1 << 16)))
+        self.bitmap[byte] |= 1 << (identifier & 7)
+
+    def add_many(self, identifiers):
+        """
+        Add several Geograph ids
+
+        :return: The number of ids added
+        """
+        count = 0
+        for identifier in identifiers:
+            self.add(identifier)
+            count += 1
+        return count
+
+    def save(self):
+        """
+        Save the bitmap and the state. Written to a temporary file first so a crash doesn't leave half a file
+        """
+        for (filename, data, mode) in [(self.filename, self.bitmap, 'wb'),
+                                       (self.state_filename, json.dumps(self.state), 'w')]:
+            tempfilename = '%s.tmp' % (filename,)
+            with open(tempfilename, mode) as tempfile:
+                tempfile.write(data)
+            os.replace(tempfilename, filename)
+
+    def is_range_scanned(self, startid, endid):
+        """
+        Check if the range was read from the category less than max_age ago
+        """
+        oldest = (datetime.datetime.utcnow() - self.max_age).isoformat()
+        covered = startid
+        for (rangestart, rangeend, scanned) in sorted(self.state.get('ranges')):
+            if scanned < oldest:
+                continue
+            if rangestart <= covered:
+                covered = max(covered, rangeend)
+            if covered >= endid:
+                return True
+        return False
+
+    def scan_range(self, startid, endid):
+        """
+        Read the ids in the range from the category and remember when that was done
+        """
+        pywikibot.output('Reading the Geograph ids %s to %s from the category' % (startid, endid))
+        count = self.add_many(get_commons_geograph_ids(startid, endid))
+        now = datetime.datetime.utcnow().isoformat()
+        oldest = (datetime.datetime.utcnow() - self.max_age).isoformat()
+        self.state['ranges'] = [scannedrange for scannedrange in self.state.get('ranges') if scannedrange[2] >= oldest]
+        self.state['ranges'].append([startid, endid, now])
+        pywikibot.output('Found %s Geograph ids in the category' % (count,))
+
+    def update_from_uploads(self):
+        """
+        Add the ids of the files uploaded by the user since the last update. The upload log is newest first
+        """
+        site = pywikibot.Site('commons', 'commons')
+        user = pywikibot.User(site, self.user)
+        last_upload = self.state.get('last_upload')
+        newest = None
+        count = 0
+        for (filepage, timestamp, comment, exists) in user.uploadedImages(total=None):
+            timestamp = timestamp.isoformat()
+            if last_upload and timestamp <= last_upload:
+                break
+            if not newest:
+                newest = timestamp
+            identifier = get_geograph_id_from_title(filepage.title())
+            if identifier:
+                self.add(identifier)
+                count += 1
+            # The first run only looks at the most recent uploads, the category scan does the rest
+            if not last_upload and count >= 5000:
+                break
+        if newest:
+            self.state['last_upload'] = newest
+        pywikibot.output('Added %s Geograph ids from the uploads of %s' % (count, self.user))
+
+    def update(self, startid, endid):
+        """
+        Make sure the index is up to date for the range and save it
+        """
+        if not self.is_range_scanned(startid, endid):
+            self.scan_range(startid, endid)
+        self.update_from_uploads()
+        self.save()
+
+
+def get_geograph_id_from_title(title):
+    """
+    Get the Geograph id from a title in the standard format
+
+    :return: The id as int or None
+    """
+    titlematch = re.match(r'^File:.+ - geograph\.org\.uk - (\d+)\.jpg$', title)
+    if titlematch:
+        return int(titlematch.group(1))
+    return None
+
+
+def get_commons_geograph_ids(startid, endid):
+    """
+    Get a generator giving the id's of Geograph files currently on Commons
+    :param startid: Id to start at
+    :param endid: Id to end at
+    :return:
+    """
+    site = pywikibot.Site('commons', 'commons')
+    category = pywikibot.Category(site, title='Images_from_Geograph_Britain_and_Ireland')
+    startprefix = ' %s' % (str(startid).zfill(8),)
+    sloppyidregex = r'^File:[^\d]*(\d+)[^\d]*\.jpg'
+    templateregex = r'\{\{[gG]eograph\|(\d+)\|[^\}]+\}\}'
+    alsotemplateregex = r'\{\{[aA]lso[ _]geograph\|(\d+)\}\}'
+    for filepage in category.articles(content=False, namespaces=6, startprefix=startprefix):
+        identifier = get_geograph_id_from_title(filepage.title())
+        sloppytitlematch = re.match(sloppyidregex, filepage.title())
+        if not identifier and sloppytitlematch and startid < int(sloppytitlematch.group(1)) < endid:
+            identifier = int(sloppytitlematch.group(1))
+        elif not identifier:
+            # Only for the few files with a very different title the text is needed
+            templatematch = re.search(templateregex, filepage.text)
+            alsotemplatematch = re.search(alsotemplateregex, filepage.text)
+            if templatematch:
+                identifier = int(templatematch.group(1))
+            elif alsotemplatematch:
+                identifier = int(alsotemplatematch.group(1))
+        if not identifier:
+            continue
+        yield identifier
+
+        # Break out when identifier is higher than what we're looking for
+        if identifier > endid:
+            return
+
+
+def main(*args):
+    """
+    Rebuild the index for a range of ids
+    """
+    startid = None
+    endid = None
+    for arg in pywikibot.handle_args(args):
+        if arg.startswith('-startid:'):
+            startid = int(arg[len('-startid:'):])
+        elif arg.startswith('-endid:'):
+            endid = int(arg[len('-endid:'):])
+    if startid is None or endid is None:
+        pywikibot.output('Use -startid:<id> -endid:<id> to set the range to read')
+        return
+    geograph_id_index = GeographIdIndex()
+    geograph_id_index.scan_range(startid, endid)
+    geograph_id_index.update_from_uploads()
+    geograph_id_index.save()
+    pywikibot.output('The index has %s Geograph ids' % (len(geograph_id_index),))
+
+
+if __name__ == "__main__":
+    main()
@@ -22,6 +22,7 @@ import time
 from pywikibot.comms import http
 import json
 from pywikibot import pagegenerators
+from mediainfo_generator import preloading_mediainfo_generator
 
 class GeographSDOCBot:
     """
@@ -45,27 +46,9 @@ class GeographSDOCBot:
         """
         Run on the items
         """
-        for filepage in self.generator:
-            if not filepage.exists():
-                continue
-            # Probably want to get this all in a preloading generator to make it faster
-            mediaid = u'M%s' % (filepage.pageid,)
-            currentdata = self.getCurrentMediaInfo(mediaid)
+        for (filepage, mediaid, currentdata) in preloading_mediainfo_generator(self.generator):
             self.handleGeographFile(filepage, mediaid, currentdata)
 
-    def getCurrentMediaInfo(self, mediaid):
-        """
-        Check if the media info exists. If that's the case, return that so we can check against it
-        Otherwise return an empty dict
-        :param mediaid: The entity ID (like M1234, pageid prefixed with M)
-        :return: dict
-        """
-        request = self.site._simple_request(action='wbgetentities',ids=mediaid)
-        data = request.submit()
-        if data.get(u'entities').get(mediaid).get(u'pageid'):
-            return data.get(u'entities').get(mediaid)
-        return {}
-
     def handleGeographFile(self, filepage, mediaid, currentdata):
         """
         Handle a Geograph file.
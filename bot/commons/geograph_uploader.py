@@ -19,6 +19,12 @@ import requests
 import json
 import math
 import csv
+import queue
+import threading
+import reverse_geocoder
+import geograph_id_index
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import closing
 from html.parser import HTMLParser
 #from pyproj import Proj, transform
@@ -27,10 +33,12 @@ class GeographUploaderBot:
     """
     A bot to upload images
     """
-    def __init__(self, generator):
+    def __init__(self, generator, downloadWorkers=4, chunkSize=10000000):
         """
         Arguments:
-            * generator    - A generator that yields Dict objects.
+            * generator       - A generator that yields Dict objects.
+            * downloadWorkers - Number of files to download at the same time
+            * chunkSize       - Files larger than this are uploaded in chunks of this size
 
         """
         self.site = pywikibot.Site('commons', 'commons')
@@ -38,121 +46,226 @@ class GeographUploaderBot:
         self.site.get_tokens('csrf')
         self.repo = self.site.data_repository()
         self.generator = generator
+        self.downloadWorkers = downloadWorkers
+        self.chunkSize = chunkSize
+        self.uploadedHashes = set()
+        self.structuredDataQueue = queue.Queue()
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.starttime = time.time()
 
     def run(self):
         """
         Starts the robot.
+
+        Works as a pipeline: several threads download (and hash) the next files while the current file is uploaded
+        and another thread adds the structured data to the files that were uploaded before.
         """
-        for metadata in self.generator:
-            self.uploadImage(metadata)
+        self.starttime = time.time()
+        structuredDataThread = threading.Thread(target=self.structuredDataWorker, daemon=True)
+        structuredDataThread.start()
+        try:
+            with ThreadPoolExecutor(max_workers=self.downloadWorkers) as executor:
+                pending = deque()
+                for metadata in self.generator:
+                    pending.append(executor.submit(self.downloadImage, metadata))
+                    if len(pending) >= self.downloadWorkers * 2:
+                        self.uploadDownloadedImage(pending.popleft().result())
+                while pending:
+                    self.uploadDownloadedImage(pending.popleft().result())
+        finally:
+            self.structuredDataQueue.put(None)
+            structuredDataThread.join()
+            self.outputThroughput()
 
     def uploadImage(self, metadata):
         """
-        Process the metadata and if suitable, upload the painting
+        Process the metadata and if suitable, upload the painting. Does one file without the pipeline.
         """
-        pywikibot.debug(metadata, 'bot')
-        description = self.getDescription(metadata)
-        title = self.cleanUpTitle(self.getTitle(metadata))
+        uploaded = self.uploadDownloadedImage(self.downloadImage(metadata), addStructuredData=False)
+        if uploaded:
+            self.addStructuredData(*uploaded)
 
-        #pywikibot.output(title)
-        #pywikibot.output(description)
+    def downloadImage(self, metadata):
+        """
+        Download the image to a temporary file and hash it while it's coming in. Runs in the download threads.
 
+        :return: Dict with the metadata, the filename, the size and the SHA1 or None if it shouldn't be uploaded
+        """
+        pywikibot.debug(metadata, 'bot')
+        hashObject = hashlib.sha1()
+        size = 0
+        t = tempfile.NamedTemporaryFile(suffix='.jpg', delete=False)
         try:
-            response = requests.get(metadata.get('imageurl'))
-        except requests.exceptions.ConnectionError:
+            with t, closing(requests.get(metadata.get('imageurl'), stream=True, timeout=120)) as response:
+                response.raise_for_status()
+                for chunk in response.iter_content(chunk_size=1 << 16):
+                    hashObject.update(chunk)
+                    t.write(chunk)
+                    size += len(chunk)
+        except requests.exceptions.RequestException:
             pywikibot.output('Got a connection error for %(imageurl)s' % metadata)
-            return False
-
-        pywikibot.output ('Ready to upload %s' % (title,))
-        #print (json.dumps(metadata, sort_keys=True, indent=4))
-        #print (description)
-        #print (json.dumps(self.getStructuredData(metadata), sort_keys=True, indent=4))
-
-        if response.status_code == 200:
-            hashObject = hashlib.sha1()
-            hashObject.update(response.content)
-            sha1base64 = base64.b16encode(hashObject.digest())
-            duplicates = list(self.site.allimages(sha1=sha1base64))
-            if duplicates:
-                return
-
-            # This part is commented out because only sysop users can do this :-(
-            ## self.site.filearchive does not exist, have to dig deeper
-            ## deleted = list(self.site.filearchive(sha1=sha1base64))
-            #deleted_url = u'https://commons.wikimedia.org/w/api.php?action=query&list=filearchive&faprop=sha1&fasha1=%s&format=json'
-            #fa_response = http.fetch(deleted_url % (sha1base64,))
-            #fa_data = json.loads(fa_response.text)
-            #print (fa_data)
-            #if fa_data.get(u'query').get(u'filearchive'):
-            #    fa_title = fa_data.get(u'query').get(u'filearchive')[0].get(u'title')
-            #    pywikibot.output(u'Found a deleted file %s with the same hash %s, skipping it' % (fa_title, sha1base64))
-            #    return
-
-            with tempfile.NamedTemporaryFile() as t:
-                t.write(response.content)
-                t.flush()
-
-                imagefile = pywikibot.FilePage(self.site, title=title)
-                if imagefile.exists():
-                    # If it exists, it already got uploaded
-                    return
-                imagefile.text=description
+            os.remove(t.name)
+            return None
+
+        downloaded = {'metadata': metadata,
+                      'filename': t.name,
+                      'size': size,
+                      'sha1': hashObject.hexdigest(),
+                      }
+        # The API can only look up one hash at the time, doing it here runs the checks of a batch in parallel
+        sha1base64 = base64.b16encode(hashObject.digest())
+        if list(self.site.allimages(sha1=sha1base64, total=1)):
+            os.remove(t.name)
+            self.count('duplicate')
+            return None
+
+        # This part is commented out because only sysop users can do this :-(
+        ## self.site.filearchive does not exist, have to dig deeper
+        ## deleted = list(self.site.filearchive(sha1=sha1base64))
+        #deleted_url = u'https://commons.wikimedia.org/w/api.php?action=query&list=filearchive&faprop=sha1&fasha1=%s&format=json'
+        #fa_response = http.fetch(deleted_url % (sha1base64,))
+        #fa_data = json.loads(fa_response.text)
+        #print (fa_data)
+        #if fa_data.get(u'query').get(u'filearchive'):
+        #    fa_title = fa_data.get(u'query').get(u'filearchive')[0].get(u'title')
+        #    pywikibot.output(u'Found a deleted file %s with the same hash %s, skipping it' % (fa_title, sha1base64))
+        #    return
+        return downloaded
+
+    def uploadDownloadedImage(self, downloaded, addStructuredData=True):
+        """
+        Upload a downloaded image and queue it for the structured data
 
-                comment = 'Uploading geograph.org.uk image from %(sourceurl)s' % metadata
-                pywikibot.output(comment)
-                try:
-                    uploadsuccess = self.site.upload(imagefile, source_filename=t.name, ignore_warnings=True, comment=comment) # chunk_size=1000000)
-                except pywikibot.exceptions.APIError:
-                    # Sometimes we have a time out, but file was uploaded. Bot will get an API error on retry
-                    try:
-                        # Check if the file exists or not
-                        imagefile.get(force=True)
-                        uploadsuccess = True
-                        pywikibot.output('Got an API error, but looks like uploading worked for %(imageurl)s' % metadata)
-                    except pywikibot.exceptions.NoPageError:
-                        # The upload really failed
-                        pywikibot.output('Failed to upload image %(imageurl)s' % metadata)
-                        uploadsuccess = False
-                        # Grab a new token
-                        time.sleep(30)
-                        self. site.tokens.load_tokens(['csrf'])
-            if uploadsuccess:
-                pywikibot.output('Uploaded a file, now grabbing structured data')
-                itemdata = self.getStructuredData(metadata)
-                # Also add the title
-                #if metadata.get('title'):
-                #    itemdata['labels']
-                #pywikibot.output(json.dumps(itemdata, indent=2))
-                time.sleep(5)
-                imagefile.get(force=True)
-                mediaid = 'M%s' % (imagefile.pageid,)
-                pywikibot.debug(mediaid, 'bot')
-                summary = 'Adding structured data to this newly uploaded geograph.org.uk image'
-                token = self.site.tokens['csrf']
-                postdata = {'action' : 'wbeditentity',
-                            'format' : 'json',
-                            'id' : mediaid,
-                            'data' : json.dumps(itemdata),
-                            'token' : token,
-                            'summary' : summary,
-                            'bot' : True,
-                            }
-                pywikibot.debug(json.dumps(postdata, sort_keys=True, indent=4), 'bot')
-                request = self.site.simple_request(**postdata)
+        :param downloaded: What downloadImage returned
+        :param addStructuredData: Queue the file for the structured data thread
+        :return: Tuple of the uploaded file page and the metadata or None if nothing got uploaded
+        """
+        if not downloaded:
+            return None
+        metadata = downloaded.get('metadata')
+        try:
+            # Geograph sometimes has the same image under different ids
+            if downloaded.get('sha1') in self.uploadedHashes:
+                self.count('duplicate')
+                return None
+
+            description = self.getDescription(metadata)
+            title = self.cleanUpTitle(self.getTitle(metadata))
+            pywikibot.output ('Ready to upload %s' % (title,))
+
+            imagefile = pywikibot.FilePage(self.site, title=title)
+            if imagefile.exists():
+                # If it exists, it already got uploaded
+                return None
+            imagefile.text=description
+
+            # Large files are uploaded in chunks so a hiccup doesn't mean starting all over
+            chunk_size = self.chunkSize if downloaded.get('size') > self.chunkSize else 0
+            comment = 'Uploading geograph.org.uk image from %(sourceurl)s' % metadata
+            pywikibot.output(comment)
+            try:
+                uploadsuccess = self.site.upload(imagefile, source_filename=downloaded.get('filename'),
+                                                 ignore_warnings=True, comment=comment, chunk_size=chunk_size)
+            except pywikibot.exceptions.APIError:
+                # Sometimes we have a time out, but file was uploaded. Bot will get an API error on retry
                 try:
-                    data = request.submit()
-                    pywikibot.debug(data,  'bot')
-                    # A gentle touch to show the structured data we just added
-                    #imagefile.touch() # Keeps getting broken
-                    imagefile.put(imagefile.text)
-                except (pywikibot.exceptions.APIError, pywikibot.exceptions.OtherPageSaveError):
-                    pywikibot.output('Got an API error while saving page. Sleeping, getting a new token and retrying')
+                    # Check if the file exists or not
+                    imagefile.get(force=True)
+                    uploadsuccess = True
+                    pywikibot.output('Got an API error, but looks like uploading worked for %(imageurl)s' % metadata)
+                except pywikibot.exceptions.NoPageError:
+                    # The upload really failed
+                    pywikibot.output('Failed to upload image %(imageurl)s' % metadata)
+                    uploadsuccess = False
+                    # Grab a new token
                     time.sleep(30)
                     self. site.tokens.load_tokens(['csrf'])
-                    postdata['token'] = self.site.tokens['csrf']
-                    request = self.site.simple_request(**postdata)
-                    data = request.submit()
-                    imagefile.put(imagefile.text)
+        finally:
+            os.remove(downloaded.get('filename'))
+
+        if not uploadsuccess:
+            return None
+        self.uploadedHashes.add(downloaded.get('sha1'))
+        self.count('uploaded')
+        if addStructuredData:
+            self.structuredDataQueue.put((time.time(), imagefile, metadata))
+        if self.counts['uploaded'] % 50 == 0:
+            self.outputThroughput()
+        return (imagefile, metadata)
+
+    def structuredDataWorker(self):
+        """
+        Add the structured data to the uploaded files. Runs in its own thread.
+        """
+        while True:
+            queued = self.structuredDataQueue.get()
+            if queued is None:
+                return
+            (uploadtime, imagefile, metadata) = queued
+            # Give the upload a moment to show up in the API
+            time.sleep(max(uploadtime + 5 - time.time(), 0))
+            try:
+                self.addStructuredData(imagefile, metadata)
+            except Exception as exception:
+                pywikibot.output('Failed to add structured data to %s: %s' % (imagefile.title(), exception))
+
+    def addStructuredData(self, imagefile, metadata):
+        """
+        Add the structured data to a file that just got uploaded
+        """
+        pywikibot.output('Uploaded a file, now grabbing structured data')
+        itemdata = self.getStructuredData(metadata)
+        # Also add the title
+        #if metadata.get('title'):
+        #    itemdata['labels']
+        #pywikibot.output(json.dumps(itemdata, indent=2))
+        imagefile.get(force=True)
+        mediaid = 'M%s' % (imagefile.pageid,)
+        pywikibot.debug(mediaid, 'bot')
+        summary = 'Adding structured data to this newly uploaded geograph.org.uk image'
+        token = self.site.tokens['csrf']
+        postdata = {'action' : 'wbeditentity',
+                    'format' : 'json',
+                    'id' : mediaid,
+                    'data' : json.dumps(itemdata),
+                    'token' : token,
+                    'summary' : summary,
+                    'bot' : True,
+                    }
+        pywikibot.debug(json.dumps(postdata, sort_keys=True, indent=4), 'bot')
+        request = self.site.simple_request(**postdata)
+        try:
+            data = request.submit()
+            pywikibot.debug(data,  'bot')
+            # A gentle touch to show the structured data we just added
+            #imagefile.touch() # Keeps getting broken
+            imagefile.put(imagefile.text)
+        except (pywikibot.exceptions.APIError, pywikibot.exceptions.OtherPageSaveError):
+            pywikibot.output('Got an API error while saving page. Sleeping, getting a new token and retrying')
+            time.sleep(30)
+            self. site.tokens.load_tokens(['csrf'])
+            postdata['token'] = self.site.tokens['csrf']
+            request = self.site.simple_request(**postdata)
+            data = request.submit()
+            imagefile.put(imagefile.text)
+        self.count('structured')
+
+    def count(self, what):
+        """
+        Keep track of what happened to the files
+        """
+        with self.lock:
+            self.counts[what] += 1
+
+    def outputThroughput(self):
+        """
+        Output how many files were handled and the files per minute
+        """
+        minutes = max(time.time() - self.starttime, 1) / 60
+        pywikibot.output('Uploaded %s files (%s files per minute), added structured data to %s and skipped %s '
+                         'duplicates' % (self.counts['uploaded'], round(self.counts['uploaded'] / minutes, 1),
+                                         self.counts['structured'], self.counts['duplicate']))
 
     def getDescription(self, metadata):
         """
@@ -571,25 +684,68 @@ class GeographUploaderBot:
         return toclaim
 
 
-def getFilteredGeographGenerator(startid, endid):
+def getFilteredGeographGenerator(startid, endid, queuesize=200):
     """
     Get files from Geograph, but filtered to only return id's we don't already have on Commons
+
+    The Geograph API and the reverse geocoding run in a separate thread ahead of the uploader. At most queuesize
+    photos are waiting to be uploaded.
     :param startid: Integer to start with
     :param endid: Integer to end with
+    :param queuesize: Maximum number of photos prepared ahead
     :return: Yields metadata
     """
-    commonsgenerator = getCommonsGeographIdGenerator(startid, endid)
-    geographgenerator = getGeographGenerator(startid, endid)
+    idindex = geograph_id_index.GeographIdIndex()
+    idindex.update(startid, endid)
 
-    toskiplist = []
-    for toskip in commonsgenerator:
-        toskiplist.append(toskip)
+    def getUnfilteredGenerator():
+        for metadata in getGeographGenerator(startid, endid):
+            if int(metadata.get('id')) not in idindex:
+                # Reverse geocoding is slow so only do it on images likely to be uploaded
+                yield addReverseGeocodingMetadata(metadata)
 
-    for metadata in geographgenerator:
-        if int(metadata.get('id')) not in toskiplist:
-            # Reverse geocoding is slow so only do it on images likely to be uploaded
-            yield addReverseGeocodingMetadata(metadata)
-    return
+    return getPrefetchGenerator(getUnfilteredGenerator(), queuesize=queuesize)
+
+def getPrefetchGenerator(generator, queuesize=200):
+    """
+    Run a generator in a separate thread and yield the results as they come in
+    :param generator: The generator to run ahead
+    :param queuesize: Maximum number of results waiting in the queue
+    :return: Yields whatever the generator yields
+    """
+    resultqueue = queue.Queue(maxsize=queuesize)
+    done = object()
+    stopped = threading.Event()
+
+    def producer():
+        try:
+            for result in generator:
+                # Check once in a while if the consumer is gone so the thread doesn't block forever
+                while not stopped.is_set():
+                    try:
+                        resultqueue.put((result, None), timeout=5)
+                        break
+                    except queue.Full:
+                        pass
+                if stopped.is_set():
+                    return
+        except Exception as exception:
+            resultqueue.put((done, exception))
+            return
+        resultqueue.put((done, None))
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    try:
+        while True:
+            (result, exception) = resultqueue.get()
+            if result is done:
+                if exception:
+                    raise exception
+                return
+            yield result
+    finally:
+        stopped.set()
 
 def addReverseGeocodingMetadata(metadata):
     """
@@ -614,9 +770,10 @@ def addReverseGeocodingMetadata(metadata):
             metadata['objectcommonscat'] = objectcc
     return metadata
 
-def reverseGeocode(lat, lon, tries=3):
+def reverseGeocode(lat, lon):
     """
     Do reverse geocoding based on latitude & longitude and return Wikidata item and Commons category
+    Uses the local index and only falls back to the remote service if the point is not in it.
     :param lat: The latitude
     :parim lon: The longitude
     :return: Tuple of Wikidata item and Commons category
@@ -624,26 +781,8 @@ def reverseGeocode(lat, lon, tries=3):
     qid = None
     commonscat = None
 
-    url = 'http://edwardbetts.com/geocode/?lat=%s&lon=%s' % (lat, lon)
-    try:
-        page = requests.get(url)
-        jsondata = page.json()
-    except ValueError:
-        # Either json.decoder.JSONDecodeError or simplejson.scanner.JSONDecodeError, both subclass of ValueError
-        pywikibot.output('Got invalid json at %s' % (url,))
-        time.sleep(60)
-        if tries > 0:
-            return reverseGeocode(lat, lon, tries=tries-1)
-        return (qid, commonscat)
-    except IOError:
-        # RequestExceptions was thrown
-        pywikibot.output('Got an IOError at %s' % (url,))
-        time.sleep(60)
-        if tries > 0:
-            return reverseGeocode(lat, lon, tries=tries-1)
-        return (qid, commonscat)
-
-    if not jsondata.get('missing'):
+    jsondata = reverse_geocoder.get_reverse_geocoder().lookup(lat, lon)
+    if jsondata:
         if jsondata.get('wikidata'):
             qid = jsondata.get('wikidata')
         if jsondata.get('commons_cat') and jsondata.get('commons_cat').get('title'):
@@ -678,35 +817,7 @@ def getCommonsGeographIdGenerator(startid, endid):
     :param endid: Id to end at
     :return:
     """
-    site = pywikibot.Site(u'commons', u'commons')
-    category = pywikibot.Category(site, title='Images_from_Geograph_Britain_and_Ireland')
-    startprefix = ' %s' % (str(startid).zfill(8),)
-    idregex = u'^File\:.+ - geograph\.org\.uk - (\d+)\.jpg$'
-    sloppyidregex =u'^File:[^\d]*(\d+)[^\d]*\.jpg'
-    for filepage in category.articles(content=False, namespaces=6, startprefix=startprefix):
-        titlematch = re.match(idregex, filepage.title())
-        sloppytitlematch = re.match(sloppyidregex, filepage.title())
-        if titlematch:
-            identifier = int(titlematch.group(1))
-            yield identifier
-        elif sloppytitlematch and startid < int(sloppytitlematch.group(1)) < endid:
-            identifier = int(sloppytitlematch.group(1))
-            yield identifier
-        else:
-            templateregex = u'\{\{[gG]eograph\|(\d+)\|[^\}]+\}\}'
-            alsotemplateregex = u'\{\{[aA]lso[ _]geograph\|(\d+)\}\}'
-            templatematch = re.search(templateregex, filepage.text)
-            alsotemplatematch = re.search(alsotemplateregex, filepage.text)
-            if templatematch:
-                identifier = int(templatematch.group(1))
-                yield identifier
-            elif alsotemplatematch:
-                identifier = int(alsotemplatematch.group(1))
-                yield identifier
-
-        # Break out when identifier is higher than what we're looking for
-        if identifier > endid:
-            return
+    return geograph_id_index.get_commons_geograph_ids(startid, endid)
 
 def getGeographGenerator(startid, endid):
     """
@@ -8,6 +8,7 @@ Bot to import id's from wikitext into Structured data on Commons
 import re
 import pywikibot
 from pywikibot import pagegenerators
+from mediainfo_generator import preloading_mediainfo_generator
 
 class IdImportBot:
     """
@@ -42,17 +43,17 @@ class IdImportBot:
         """
         Run on the items
         """
-        for filepage in self.generator:
+        for (filepage, mediaid, mediainfo) in preloading_mediainfo_generator(self.generator, entities=True):
             print(filepage.title())
-            self.extract_identifiers(filepage)
+            self.extract_identifiers(filepage, mediainfo)
 
-    def extract_identifiers(self, filepage):
+    def extract_identifiers(self, filepage, mediainfo):
         """
 
         :param filepage:
+        :param mediainfo:
         :return:
         """
-        mediainfo = filepage.data_item()
         if not mediainfo:
             return
 
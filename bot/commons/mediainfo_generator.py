@@ -0,0 +1,84 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Preloading generator for the structured data (mediainfo) of files on Commons.
+
+The SDoC bots used to load every file page and after that do a wbgetentities request for every file. This generator
+takes any generator of file pages and loads the page text, the pageids and the mediainfo entities in batches of 50.
+
+Usage in a bot:
+
+    for (filepage, mediaid, currentdata) in preloading_mediainfo_generator(self.generator):
+        self.handleFile(filepage, mediaid, currentdata)
+
+The mediainfo is the json like wbgetentities returns it ({} for files without structured data) or with
+entities=True a pywikibot.MediaInfo that already has its content loaded. With templates=True the templates on the
+pages are loaded in the same request as the text, so templates() doesn't need a request per file.
+"""
+import pywikibot
+import itertools
+
+
+def preloading_mediainfo_generator(generator, groupsize=50, entities=False, templates=False):
+    """
+    Preload the file pages and their mediainfo in batches
+
+    :param generator: Generator yielding file pages
+    :param groupsize: Number of files per batch. 50 is the maximum for wbgetentities
+    :param entities: Yield pywikibot.MediaInfo objects instead of the json
+    :param templates: Also preload the templates used on the pages
+    :return: Generator yielding tuples of file page, mediaid and mediainfo. Files that don't exist are skipped
+    """
+    generator = iter(generator)
+    while True:
+        group = list(itertools.islice(generator, groupsize))
+        if not group:
+            return
+        site = group[0].site
+
+        # Pages that came from a preloading generator already have their text
+        toload = [filepage for filepage in group
+                  if not filepage.has_content() or (templates and not hasattr(filepage, '_templates'))]
+        if toload:
+            for filepage in site.preloadpages(toload, groupsize=groupsize, templates=templates):
+                pass
+        filepages = [filepage for filepage in group if filepage.exists()]
+        if not filepages:
+            continue
+
+        mediaids = ['M%s' % (filepage.pageid,) for filepage in filepages]
+        mediainfos = get_mediainfo_entities(site, mediaids)
+
+        for (filepage, mediaid) in zip(filepages, mediaids):
+            mediainfo = mediainfos.get(mediaid, {})
+            if entities:
+                mediainfo = make_mediainfo_entity(site, mediaid, mediainfo)
+            yield (filepage, mediaid, mediainfo)
+
+
+def get_mediainfo_entities(site, mediaids):
+    """
+    Get the mediainfo of several files in one request
+
+    :param site: The Commons site
+    :param mediaids: List of at most 50 entity ids (like M1234, pageid prefixed with M)
+    :return: Dict with the json per mediaid. Files without structured data are left out
+    """
+    request = site.simple_request(action='wbgetentities', ids=mediaids)
+    data = request.submit()
+    result = {}
+    for (mediaid, mediainfo) in data.get('entities').items():
+        if mediainfo.get('pageid') and 'missing' not in mediainfo:
+            result[mediaid] = mediainfo
+    return result
+
+
+def make_mediainfo_entity(site, mediaid, mediainfo):
+    """
+    Make a pywikibot.MediaInfo with the content already loaded, like site.preload_entities does for items
+    """
+    entity = pywikibot.MediaInfo(site, mediaid)
+    if mediainfo:
+        entity._content = mediainfo
+        entity.get()
+    return entity
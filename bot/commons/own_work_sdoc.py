@@ -21,6 +21,8 @@ import pywikibot.data.sparql
 import time
 import json
 from pywikibot import pagegenerators
+from mediainfo_generator import preloading_mediainfo_generator
+from wikitext_scanner import TemplateClassifier, template_key
 
 class OwnWorkBot:
     """
@@ -38,6 +40,14 @@ class OwnWorkBot:
         self.informationTemplates = ['information',
                                      'photograph',
                                      'specimen']
+        self.ownTemplates = ['own',
+                             'own photograph',
+                             'own work by original uploader',
+                             'self-photographed',
+                             ]
+        self.selfTemplates = ['self',
+                              'pd-self',
+                              ]
         self.validLicenses = self.getLicenseTemplates()
         self.pubDedication = ['Q6938433',
                               'Q98592850',
@@ -47,6 +57,14 @@ class OwnWorkBot:
         self.participantTemplates = self.getParticipantTemplates()
         self.sponsorTemplates = self.getSponsorTemplates()
         self.exifCameraMakeModel = self.getExifCameraMakeModel()
+        self.templateClassifier = TemplateClassifier({'license' : self.validLicenses,
+                                                      'own' : dict((template, template) for template in self.ownTemplates),
+                                                      'self' : dict((template, template) for template in self.selfTemplates),
+                                                      'information' : dict((template, template) for template in self.informationTemplates),
+                                                      'participant' : self.participantTemplates,
+                                                      'sponsor' : self.sponsorTemplates,
+                                                      })
+        self.templateClassifier.load_redirects(self.site)
         self.generator = gen
         self.loose = loose
         self.alwaystouch = alwaystouch
@@ -421,29 +439,9 @@ class OwnWorkBot:
         """
         Run on the items
         """
-        for filepage in self.generator:
-            if not filepage.exists():
-                continue
-            # Probably want to get this all in a preloading generator to make it faster
-            mediaid = u'M%s' % (filepage.pageid,)
-            currentdata = self.getCurrentMediaInfo(mediaid)
+        for (filepage, mediaid, currentdata) in preloading_mediainfo_generator(self.generator, templates=True):
             self.handleOwnWork(filepage, mediaid, currentdata)
 
-    def getCurrentMediaInfo(self, mediaid):
-        """
-        Check if the media info exists. If that's the case, return that so we can expand it.
-        Otherwise return an empty structure with just <s>claims</>statements in it to start
-        :param mediaid: The entity ID (like M1234, pageid prefixed with M)
-        :return: json
-            """
-        # https://commons.wikimedia.org/w/api.php?action=wbgetentities&format=json&ids=M52611909
-        # https://commons.wikimedia.org/w/api.php?action=wbgetentities&format=json&ids=M10038
-        request = self.site.simple_request(action='wbgetentities', ids=mediaid)
-        data = request.submit()
-        if data.get(u'entities').get(mediaid).get(u'pageid'):
-            return data.get(u'entities').get(mediaid)
-        return {}
-
     def handleOwnWork(self, filepage, mediaid, currentdata):
         """
         Handle a single own work file.
@@ -460,20 +458,23 @@ class OwnWorkBot:
             # Picture might be protected
             return
 
+        # Scan the templates once for all the checks below
+        record = self.getTemplateRecord(filepage)
+
         # Check if the file is own work
-        ownwork = self.isOwnWorkFile(filepage)
+        ownwork = self.isOwnWorkFile(filepage, record)
         if not ownwork and not self.loose:
             pywikibot.output(u'No own and self templates found on %s, skipping' % (filepage.title(),))
             return
 
         # Get the author
-        authorInfo = self.getAuthor(filepage)
+        authorInfo = self.getAuthor(filepage, record)
         if not authorInfo and not self.authorqid and not self.loose:
             pywikibot.output(u'Unable to extract author on %s, skipping' % (filepage.title(),))
             return
 
         # Get one or more licenses
-        licenses = self.getSelfLicenses(filepage)
+        licenses = self.getSelfLicenses(filepage, record)
         if not licenses and not self.loose:
             pywikibot.output(u'Unable to extract licenses on %s, skipping' % (filepage.title(),))
             return
@@ -496,20 +497,20 @@ class OwnWorkBot:
             newclaims['author'] = self.addAuthor(mediaid, currentdata, authorPage, authorName)
         # Try alternatives for sourcing like Flickr, Geograph and Panoramico
         if not ownwork and not self.authorqid and not authorInfo:
-            othersource = self.getOtherSource(mediaid, currentdata, filepage)
+            othersource = self.getOtherSource(mediaid, currentdata, filepage, record)
             if othersource:
                 (othersourcename, othersouceclaims) = othersource
                 newclaims[othersourcename] = othersouceclaims
         if licenses:
             newclaims['copyright'] = self.addLicenses(mediaid, currentdata, licenses)
         # Optional stuff, maybe split that up too
-        newclaims['date'] = self.handleDate(mediaid, currentdata, filepage)
+        newclaims['date'] = self.handleDate(mediaid, currentdata, filepage, record)
         # TODO: Consider adding date from exif DateTimeOriginal if nothing is found
         newclaims['coordinates'] = self.handlePointOfViewCoordinates(mediaid, currentdata, filepage)
         newclaims['object coordinates'] = self.handleObjectCoordinates(mediaid, currentdata, filepage)
         newclaims['camera'] = self.handleCameraMakeModel(mediaid, currentdata, filepage)
-        newclaims['participant'] = self.handleParticipant(mediaid, currentdata, filepage)
-        newclaims['sponsor'] = self.handleSponsor(mediaid, currentdata, filepage)
+        newclaims['participant'] = self.handleParticipant(mediaid, currentdata, filepage, record)
+        newclaims['sponsor'] = self.handleSponsor(mediaid, currentdata, filepage, record)
 
         addedclaims = []
 
@@ -567,42 +568,39 @@ class OwnWorkBot:
                 self. site.tokens.load_tokens(['csrf'])
 
 
-    def isOwnWorkFile(self, filepage):
+    def getTemplateRecord(self, filepage):
+        """
+        Scan the wikitext once and classify the templates. The templates transcluded through other templates (like
+        license wrappers and user templates) are preloaded with the page
+        :param filepage: The page of the file to work on.
+        :return: The record of the TemplateClassifier
+        """
+        return self.templateClassifier.classify(filepage.text,
+                                                extranames=[template.title() for template in filepage.templates()])
+
+    def isOwnWorkFile(self, filepage, record):
         """
         Check if the file is own work. We do that by looking for both the "own" and the "self" template.
         :param filepage: The page of the file to work on.
+        :param record: The templates on the page from getTemplateRecord
         :return:
         """
         if self.fileownwork:
             pywikibot.output(u'Own work forced!')
             return True
-        ownfound = False
-        selfFound = False
-
-        ownTemplates = ['Template:Own',
-                        'Template:Own photograph',
-                        'Template:Own work by original uploader',
-                        'Template:Self-photographed',
-                        ]
-        selfTemplates = ['Template:Self',
-                         'Template:PD-self',
-                         ]
-
-        for template in filepage.itertemplates():
-            if template.title() in ownTemplates:
-                ownfound = True
-            elif template.title() in selfTemplates:
-                selfFound = True
+        ownfound = bool(record.get('own'))
+        selfFound = bool(record.get('self'))
 
         if ownfound and selfFound:
             pywikibot.output(u'Own work found!')
             return True
         return False
 
-    def getAuthor(self, filepage):
+    def getAuthor(self, filepage, record):
         """
         Extract the author form the information template
         :param filepage: The page of the file to work on.
+        :param record: The templates on the page from getTemplateRecord
         :return: Tuple with a User and a string
         """
         if self.authorpage and self.authorname:
@@ -614,29 +612,27 @@ class OwnWorkBot:
 
         authorRegex = u'^\s*[aA]uthor\s*\=\s*\[\[[uU]ser\:([^\|^\]]+)\|([^\|^\]]+)\]\](\s*\(\s*\[\[[uU]ser talk\:[^\|^\]]+\|[^\|^\]]+\]\]\s*\)\s*)?\s*$'
 
-        for template, parameters in filepage.templatesWithParams():
-            lowertemplate = template.title(underscore=False, with_ns=False).lower()
-            if lowertemplate in self.informationTemplates:
-                for field in parameters:
-                    if field.lower().startswith(u'author'):
-                        match = re.match(authorRegex, field)
-                        if match:
-                            try:
-                                authorPage = pywikibot.User(self.site, match.group(1))
-                            except pywikibot.exceptions.InvalidTitleError:
-                                # Sometimes weird junk in the field. Just skip it
-                                return False
-                            authorName = match.group(2).strip()
-                            return (authorPage, authorName)
-                        # The author regex didn't match. Let's get the uploader in the log to compare
-                        # Todo, do a bit of trickery to detect a customer user template like {{User:<user>/<something}}
-                        else:
-                            pywikibot.output(field)
-                        break
+        for template, parameters in record.get('information'):
+            for field in parameters:
+                if field.lower().startswith(u'author'):
+                    match = re.match(authorRegex, field)
+                    if match:
+                        try:
+                            authorPage = pywikibot.User(self.site, match.group(1))
+                        except pywikibot.exceptions.InvalidTitleError:
+                            # Sometimes weird junk in the field. Just skip it
+                            return False
+                        authorName = match.group(2).strip()
+                        return (authorPage, authorName)
+                    # The author regex didn't match. Let's get the uploader in the log to compare
+                    # Todo, do a bit of trickery to detect a customer user template like {{User:<user>/<something}}
+                    else:
+                        pywikibot.output(field)
+                    break
 
         return False
 
-    def getOtherSource(self, mediaid, currentdata, filepage):
+    def getOtherSource(self, mediaid, currentdata, filepage, record):
         """
         The file is not some standard own work file. Try to extract other sources like Flickr
         :return: Tuple with (type of source, list of statements)
@@ -647,20 +643,18 @@ class OwnWorkBot:
         authorregexes = { 'flickr' : '^\s*author\s*\=\s*\[(?P<url>https?:\/\/(www\.)?flickr\.com\/(people|photos)\/(?P<id>\d{5,11}@N\d{2}))\/?\s+(?P<authorname>[^\]]+)\].*$'}
         sourcefound = {}
         authorfound = {}
-        for template, parameters in filepage.templatesWithParams():
-            lowertemplate = template.title(underscore=False, with_ns=False).lower()
-            if lowertemplate in self.informationTemplates:
-                for field in parameters:
-                    if field.lower().startswith('source'):
-                        for operator in sourceregexes:
-                            match = re.match(sourceregexes.get(operator), field, flags=re.IGNORECASE)
-                            if match:
-                                sourcefound[operator] = match.groupdict()
-                    elif field.lower().startswith('author'):
-                        for operator in authorregexes:
-                            match = re.match(authorregexes.get(operator), field, flags=re.IGNORECASE)
-                            if match:
-                                authorfound[operator] = match.groupdict()
+        for template, parameters in record.get('information'):
+            for field in parameters:
+                if field.lower().startswith('source'):
+                    for operator in sourceregexes:
+                        match = re.match(sourceregexes.get(operator), field, flags=re.IGNORECASE)
+                        if match:
+                            sourcefound[operator] = match.groupdict()
+                elif field.lower().startswith('author'):
+                    for operator in authorregexes:
+                        match = re.match(authorregexes.get(operator), field, flags=re.IGNORECASE)
+                        if match:
+                            authorfound[operator] = match.groupdict()
         # Check if we got one match for both
         if sourcefound and authorfound and len(sourcefound)==1 and sourcefound.keys()==authorfound.keys():
             result = []
@@ -732,10 +726,11 @@ class OwnWorkBot:
                 return (operator, result)
         return False
 
-    def getSelfLicenses(self, filepage):
+    def getSelfLicenses(self, filepage, record):
         """
         Extract one or more licenses from the Self template
         :param filepage: The page of the file to work on.
+        :param record: The templates on the page from getTemplateRecord
         :return: List of Q ids of licenses
         """
         result = []
@@ -751,12 +746,14 @@ class OwnWorkBot:
                 else:
                     return False
 
-        for template, parameters in filepage.templatesWithParams():
-            if template.title()==u'Template:Self':
+        for template, parameters in record.get('self'):
+            if template==u'self':
                 for license in parameters:
                     cleanlicense = license.lower().strip().replace(' =', '=')
-                    if cleanlicense in self.validLicenses:
-                        licenseqid = self.validLicenses.get(cleanlicense)
+                    # Also redirects to license templates can be used in the self template
+                    licenseqid = self.templateClassifier.lookup.get(template_key(license), {}).get('license') \
+                                 or self.validLicenses.get(cleanlicense)
+                    if licenseqid:
                         if isinstance(licenseqid, list):
                             result.extend(licenseqid)
                         else:
@@ -777,14 +774,11 @@ class OwnWorkBot:
                         return False
                 break
         # When we reach this point it means we didn't find an invalid self template or no self at all
-        for template in filepage.templates():
-            lowertemplate = template.title(underscore=False, with_ns=False).lower()
-            if lowertemplate in self.validLicenses:
-                licenseqid = self.validLicenses.get(lowertemplate)
-                if isinstance(licenseqid, list):
-                    result.extend(licenseqid)
-                else:
-                    result.append(licenseqid)
+        for licenseqid, parameters in record.get('license'):
+            if isinstance(licenseqid, list):
+                result.extend(licenseqid)
+            else:
+                result.append(licenseqid)
         return list(set(result))
 
     def addSourceOwn(self, mediaid, currentdata):
@@ -886,7 +880,7 @@ class OwnWorkBot:
                     result.extend(self.addClaimJson(mediaid, u'P6216', u'Q50423863'))
         return result
 
-    def handleDate(self, mediaid, currentdata, filepage):
+    def handleDate(self, mediaid, currentdata, filepage, record):
         """
         Handle the date on the filepage. If it matches an ISO date (YYYY-MM-DD) (with or without time), add a date claim
         :param filepage:
@@ -901,21 +895,19 @@ class OwnWorkBot:
 
         dateString = None
 
-        for template, parameters in filepage.templatesWithParams():
-            lowertemplate = template.title(underscore=False, with_ns=False).lower()
-            if lowertemplate in self.informationTemplates:
-                for field in parameters:
-                    if field.lower().startswith(u'date'):
-                        datematch = re.match(dateRegex, field, flags=re.IGNORECASE)
-                        takenmatch = re.match(takenRegex, field, flags=re.IGNORECASE)
-                        exifmatch = re.match(exifRegex, field, flags=re.IGNORECASE)
-                        if datematch:
-                            dateString = datematch.group('date').strip()
-                        elif takenmatch:
-                            dateString = takenmatch.group('date').strip()
-                        elif exifmatch:
-                            dateString = exifmatch.group('date').strip()
-                        break
+        for template, parameters in record.get('information'):
+            for field in parameters:
+                if field.lower().startswith(u'date'):
+                    datematch = re.match(dateRegex, field, flags=re.IGNORECASE)
+                    takenmatch = re.match(takenRegex, field, flags=re.IGNORECASE)
+                    exifmatch = re.match(exifRegex, field, flags=re.IGNORECASE)
+                    if datematch:
+                        dateString = datematch.group('date').strip()
+                    elif takenmatch:
+                        dateString = takenmatch.group('date').strip()
+                    elif exifmatch:
+                        dateString = exifmatch.group('date').strip()
+                    break
         if not dateString:
             return False
 
@@ -1145,32 +1137,26 @@ class OwnWorkBot:
             return False
         return self.addClaimJson(mediaid, 'P4082', cameraqid)
 
-    def handleParticipant(self, mediaid, currentdata, filepage):
+    def handleParticipant(self, mediaid, currentdata, filepage, record):
         """
         Add the participant in based on template usage
         :return:
         """
         if currentdata.get('statements') and currentdata.get('statements').get('P1344'):
             return False
-        for template in filepage.templates():
-            lowertemplate = template.title(underscore=False, with_ns=False).lower()
-            if lowertemplate in self.participantTemplates:
-                qid = self.participantTemplates.get(lowertemplate)
-                return self.addClaimJson(mediaid, 'P1344', qid)
+        for qid, parameters in record.get('participant'):
+            return self.addClaimJson(mediaid, 'P1344', qid)
         return False
 
-    def handleSponsor(self, mediaid, currentdata, filepage):
+    def handleSponsor(self, mediaid, currentdata, filepage, record):
         """
         Add the sponsor based on template usage
         :return:
         """
         if currentdata.get('statements') and currentdata.get('statements').get('P859'):
             return False
-        for template in filepage.templates():
-            lowertemplate = template.title(underscore=False, with_ns=False).lower()
-            if lowertemplate in self.sponsorTemplates:
-                qid = self.sponsorTemplates.get(lowertemplate)
-                return self.addClaimJson(mediaid, 'P859', qid)
+        for qid, parameters in record.get('sponsor'):
+            return self.addClaimJson(mediaid, 'P859', qid)
         return False
 
     def addClaimJson(self, mediaid, pid, qid):
@@ -7,6 +7,7 @@ Bot to add PD-USgov claims to Structured data on Commons
 import pywikibot
 from pywikibot import pagegenerators
 import time
+from mediainfo_generator import preloading_mediainfo_generator
 
 
 class PDUSGovBot:
@@ -118,18 +119,16 @@ class PDUSGovBot:
         """
         Run on the items
         """
-        for file_page in self.generator:
+        for (file_page, media_id, media_info) in preloading_mediainfo_generator(self.generator, entities=True):
             try:
-                if not file_page.exists():
-                    continue
-                self.process_file(file_page)
+                self.process_file(file_page, media_info)
                 file_page.touch()
             except pywikibot.exceptions.Error:
                 # Just sleep for 1 minute and continue
                 pywikibot.output('Got an error while working on %s' % (file_page.title(),) )
                 time.sleep(60)
 
-    def process_file(self, file_page):
+    def process_file(self, file_page, media_info):
         """
         """
         pd_found = False
@@ -142,8 +141,7 @@ class PDUSGovBot:
         if not pd_found:
             return
 
-        media_info = file_page.data_item()
-        data = media_info.get('data')
+        data = media_info.get()
         claims = data.get('statements')
 
         sdc_action = ''
@@ -4,6 +4,13 @@
 Bot to remove duplicate claims (statements).
 
 These are usually caused by bots doing the same edit twice on a file.
+
+With -usedumps the Commons mediainfo dump is scanned instead (-dumpfile: to use another file than the latest one). The
+dump is split in byte ranges that are checked by a pool of worker processes. Every worker reads its own range from an
+uncompressed dump. A gzip stream can't be entered at an arbitrary offset, so a .gz dump is decompressed by one process
+(pigz if available) and handed to the workers in blocks of whole lines, without looking at the lines. How far the
+scan got is saved as byte offset in a checkpoint file so an interrupted run continues where it stopped. For an
+uncompressed dump that's a seek, a .gz dump has to be decompressed up to that point again.
 """
 
 import pywikibot
@@ -11,7 +18,97 @@ import hashlib
 import time
 import json
 import gzip
+import itertools
+import os
+import re
+import shutil
+import subprocess
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pywikibot import pagegenerators
+from mediainfo_generator import preloading_mediainfo_generator
+
+# In the dump every statement starts with the main snak with its hash. Identical statements have identical hashes
+MAINSNAK_HASH_REGEX = re.compile(r'"mainsnak":\{"snaktype":"\w+","property":"P\d+","hash":"([0-9a-f]+)"')
+
+
+def may_have_duplicate_claims(line):
+    """
+    Cheap check on the raw line from the dump. Only if a main snak hash is used more than once, there can be
+    duplicate statements.
+    """
+    snak_hashes = MAINSNAK_HASH_REGEX.findall(line)
+    if not snak_hashes:
+        # Not the format we expected, leave it to the full check
+        return line.count('"mainsnak"') > 1
+    return len(snak_hashes) != len(set(snak_hashes))
+
+
+def has_duplicate_claims(entity_data):
+    """
+    Check if an entity has duplicate claims
+    :param entity_data: Data for one entity
+    :return: True if duplicates, False if not
+    """
+    if not entity_data.get('statements'):
+        return False
+    for wb_property in entity_data.get('statements'):
+        statement_hashes = set()
+        for property_statement in entity_data.get('statements').get(wb_property):
+            property_statement = dict(property_statement)
+            property_statement.pop('id', None)
+            statement_json = json.dumps(property_statement, sort_keys=True, separators=(',', ':'))
+            if statement_json in statement_hashes:
+                return True
+            statement_hashes.add(statement_json)
+    return False
+
+
+def scan_dump_lines(lines):
+    """
+    Check a chunk of lines from the dump. This runs in the worker processes
+    :param lines: List of lines
+    :return: List of dicts with the id and title of the entities with duplicate claims
+    """
+    result = []
+    for line in lines:
+        if line.startswith('{') and may_have_duplicate_claims(line):
+            json_data = json.loads(line.strip().rstrip(','))
+            if has_duplicate_claims(json_data):
+                result.append({'id': json_data.get('id'), 'title': json_data.get('title')})
+    return result
+
+
+def scan_dump_block(block):
+    """
+    Check a block of whole lines from the decompressed dump. This runs in the worker processes
+    :param block: Bytes with complete lines
+    :return: List of dicts with the id and title of the entities with duplicate claims
+    """
+    return scan_dump_lines([line.decode('utf-8') for line in block.split(b'\n')])
+
+
+def scan_dump_range(dump_file, start, end):
+    """
+    Check the lines that start in a byte range of an uncompressed dump. This runs in the worker processes, every
+    worker reads its own range from the file
+    :param dump_file: Name of the uncompressed dump file
+    :param start: Offset of the start of the range
+    :param end: Offset of the end of the range
+    :return: List of dicts with the id and title of the entities with duplicate claims
+    """
+    lines = []
+    with open(dump_file, 'rb') as file:
+        if start:
+            # The line the range starts in belongs to the previous range
+            file.seek(start - 1)
+            file.readline()
+        while file.tell() < end:
+            line = file.readline()
+            if not line:
+                break
+            lines.append(line.decode('utf-8'))
+    return scan_dump_lines(lines)
 
 
 class DuplicateClaimsBot:
@@ -33,14 +130,27 @@ class DuplicateClaimsBot:
         """
         Run on the items
         """
-        for filepage in self.generator:
-            if not filepage.exists():
-                continue
-            # Probably want to get this all in a preloading generator to make it faster
-            mediaid = u'M%s' % (filepage.pageid,)
+        generator = iter(self.generator)
+        while True:
+            filepages = list(itertools.islice(generator, 50))
+            if not filepages:
+                return
+            self.work_on_filepages(filepages)
+
+    def work_on_filepages(self, filepages):
+        """
+        Load the structured data of a batch of files in one go and remove the duplicate claims. An API error skips the
+        file or the batch
+        """
+        try:
+            files = list(preloading_mediainfo_generator(filepages))
+        except pywikibot.exceptions.Error:
+            # Just sleep for 5 minutes and continue
+            pywikibot.output('Got an error while loading %s files' % (len(filepages),))
+            time.sleep(300)
+            return
+        for (filepage, mediaid, currentdata) in files:
             try:
-                currentdata = self.get_current_mediainfo(mediaid)
-
                 pywikibot.output(u'Working on %s' % (filepage.title(),))
 
                 if not filepage.exists():
@@ -56,21 +166,6 @@ class DuplicateClaimsBot:
                 pywikibot.output('Got an error while working on %s' % (mediaid,) )
                 time.sleep(300)
 
-    def get_current_mediainfo(self, mediaid):
-        """
-        Check if the media info exists. If that's the case, return that so we can expand it.
-        Otherwise return an empty structure with just <s>claims</>statements in it to start
-        :param mediaid: The entity ID (like M1234, pageid prefixed with M)
-        :return: json
-            """
-        # https://commons.wikimedia.org/w/api.php?action=wbgetentities&format=json&ids=M52611909
-        # https://commons.wikimedia.org/w/api.php?action=wbgetentities&format=json&ids=M10038
-        request = self.site.simple_request(action='wbgetentities',ids=mediaid)
-        data = request.submit()
-        if data.get(u'entities').get(mediaid).get(u'pageid'):
-            return data.get(u'entities').get(mediaid)
-        return {}
-
     def remove_duplicate_claims(self, filepage, mediaid, currentdata):
         """
         Remove the duplicate claims on a single file
@@ -84,7 +179,7 @@ class DuplicateClaimsBot:
             return
         to_remove = []
         for wb_property in currentdata.get('statements'):
-            statement_hashes = []
+            statement_hashes = set()
             for property_statement in currentdata.get('statements').get(wb_property):
                 statement_id = property_statement.get('id')
                 del property_statement['id']
@@ -93,7 +188,7 @@ class DuplicateClaimsBot:
                 if statement_hash in statement_hashes:
                     to_remove.append(statement_id)
                 else:
-                    statement_hashes.append(statement_hash)
+                    statement_hashes.add(statement_hash)
 
         if len(to_remove) > 0:
             summary = 'Removing %s duplicate claims from structured data' % (len(to_remove),)
@@ -147,7 +242,7 @@ class DuplicateClaimsDumpsBot(DuplicateClaimsBot):
     """
     Bot to remove structured data statements on Commons
     """
-    def __init__(self, dump_file, always_touch):
+    def __init__(self, dump_file, always_touch, workers=None, block_size=1 << 24, checkpoint_file=None):
         """
         Grab generator based on search to work on.
         """
@@ -155,10 +250,37 @@ class DuplicateClaimsDumpsBot(DuplicateClaimsBot):
         self.site.login()
         self.site.get_tokens('csrf')
         self.repo = self.site.data_repository()
-        self.full_generator = self.get_generator_from_dump(dump_file)
-        self.filtered_generator = self.get_duplicates_generator(self.full_generator)
+        self.workers = workers or os.cpu_count()
+        self.block_size = block_size
+        if not checkpoint_file:
+            checkpoint_file = os.path.join(pywikibot.config.base_dir, 'remove_duplicate_claims_checkpoint.json')
+        self.checkpoint_file = checkpoint_file
+        self.dump_file = dump_file
+        self.filtered_generator = self.get_duplicates_generator(dump_file)
         self.always_touch = always_touch
 
+    def get_lines_from_dump(self, dump_file):
+        """
+        Open the dump file and crash if that doesn't work. Uses pigz to decompress if it's installed.
+
+        This reads the file line by line to not load everything in memory
+
+        :param dump_file: Name of the dump file
+        :return: Generator with lines
+        """
+        if dump_file.endswith('.gz') and shutil.which('pigz'):
+            process = subprocess.Popen(['pigz', '-dc', dump_file], stdout=subprocess.PIPE)
+            try:
+                for line in process.stdout:
+                    yield line.decode('utf-8')
+            finally:
+                process.kill()
+                process.wait()
+        else:
+            with gzip.open(dump_file, 'rt') as file:
+                for line in file:
+                    yield line
+
     def get_generator_from_dump(self, dump_file):
         """
         Try to open the dump file and crash if that doesn't work
@@ -168,21 +290,116 @@ class DuplicateClaimsDumpsBot(DuplicateClaimsBot):
         :param dump_file: Name of the dump file
         :return: Generator with mediainfo
         """
-        file = gzip.open(dump_file, 'rt')
-        for line in file:
+        for line in self.get_lines_from_dump(dump_file):
             if line.startswith('{'):
                 json_data = json.loads(line.strip().rstrip(','))
                 yield json_data
 
-    def get_duplicates_generator(self, full_generator):
+    def get_blocks_from_dump(self, dump_file, offset):
+        """
+        Decompress a .gz dump and cut it in blocks of whole lines. Uses pigz to decompress if it's installed.
+
+        :param dump_file: Name of the dump file
+        :param offset: Number of decompressed bytes to skip, always the end of a line
+        :return: Generator yielding tuples of the offset after the block and the block
         """
-        Do filter for entities that have duplicate statements in the dump
-        :param full_generator:
-        :return:
+        process = None
+        if shutil.which('pigz'):
+            process = subprocess.Popen(['pigz', '-dc', dump_file], stdout=subprocess.PIPE)
+            stream = process.stdout
+        else:
+            stream = gzip.open(dump_file, 'rb')
+        try:
+            skip = offset
+            while skip:
+                skipped = len(stream.read(min(skip, self.block_size)))
+                if not skipped:
+                    return
+                skip -= skipped
+            remainder = b''
+            while True:
+                data = stream.read(self.block_size)
+                if not data:
+                    if remainder:
+                        yield (offset + len(remainder), remainder)
+                    return
+                data = remainder + data
+                cut = data.rfind(b'\n') + 1
+                (block, remainder) = (data[:cut], data[cut:])
+                if block:
+                    offset += len(block)
+                    yield (offset, block)
+        finally:
+            stream.close()
+            if process:
+                process.kill()
+                process.wait()
+
+    def get_dump_tasks(self, dump_file, offset):
         """
-        for entity_data in full_generator:
-            if self.entity_has_duplicate_claims(entity_data):
-                yield entity_data
+        Split the rest of the dump in tasks for the workers
+
+        :param dump_file: Name of the dump file
+        :param offset: Offset in the (decompressed) dump to start at
+        :return: Generator yielding tuples of the offset after the task, the function and its arguments
+        """
+        if dump_file.endswith('.gz'):
+            for (end, block) in self.get_blocks_from_dump(dump_file, offset):
+                yield (end, scan_dump_block, (block,))
+        else:
+            size = os.path.getsize(dump_file)
+            for start in range(offset, size, self.block_size):
+                end = min(start + self.block_size, size)
+                yield (end, scan_dump_range, (dump_file, start, end))
+
+    def get_duplicates_generator(self, dump_file):
+        """
+        Scan the dump with a pool of processes and yield the entities that have duplicate statements per byte range
+        as soon as they are found. The checkpoint is saved by run() after all entities of a range have been handled.
+
+        :param dump_file: Name of the dump file
+        :return: Generator yielding tuples of a list of dicts with the id and title and the offset in the
+                 (decompressed) dump after the range
+        """
+        offset = self.load_checkpoint(dump_file)
+        if offset:
+            pywikibot.output('Continuing the scan of %s after byte %s' % (dump_file, offset))
+        tasks = self.get_dump_tasks(dump_file, offset)
+
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            pending = deque()
+            while True:
+                # Keep a limited number of ranges in flight so the dump isn't read faster than it can be checked
+                for (end, function, arguments) in itertools.islice(tasks, self.workers * 2 - len(pending)):
+                    pending.append((end, executor.submit(function, *arguments)))
+                if not pending:
+                    break
+                (end, future) = pending.popleft()
+                yield (future.result(), end)
+
+    def load_checkpoint(self, dump_file):
+        """
+        Get the offset in the (decompressed) dump that is already done. Only if the checkpoint is for the same dump
+        file
+        """
+        if not os.path.exists(self.checkpoint_file):
+            return 0
+        with open(self.checkpoint_file, 'r') as checkpoint:
+            checkpoint_data = json.load(checkpoint)
+        if checkpoint_data.get('dump_file') != dump_file or checkpoint_data.get('mtime') != os.path.getmtime(dump_file):
+            return 0
+        return checkpoint_data.get('offset', 0)
+
+    def save_checkpoint(self, dump_file, offset):
+        """
+        Save the offset that is done
+        """
+        checkpoint_data = {'dump_file': dump_file,
+                           'mtime': os.path.getmtime(dump_file),
+                           'offset': offset}
+        with open(self.checkpoint_file + '.tmp', 'w') as checkpoint:
+            json.dump(checkpoint_data, checkpoint)
+        os.replace(self.checkpoint_file + '.tmp', self.checkpoint_file)
 
     def entity_has_duplicate_claims(self, entity_data):
         """
@@ -190,43 +407,25 @@ class DuplicateClaimsDumpsBot(DuplicateClaimsBot):
         :param entity_data: Data for one entity
         :return: True if duplicates, False if not
         """
-        if not entity_data.get('statements'):
-            return False
-        for wb_property in entity_data.get('statements'):
-            statement_hashes = []
-            for property_statement in entity_data.get('statements').get(wb_property):
-                del property_statement['id']
-                statement_json = json.dumps(property_statement, sort_keys=True).encode('utf8')
-                statement_hash = hash(statement_json)  # Should be faster than SHA512
-                if statement_hash in statement_hashes:
-                    return True
-                else:
-                    statement_hashes.append(statement_hash)
-        return False
+        return has_duplicate_claims(entity_data)
 
     def run(self):
         """
         Run on the items
         """
-        for entity in self.filtered_generator:
-            filepage = pywikibot.FilePage(self.site, title=entity.get('title'))
-
-            if not filepage.exists():
-                continue
-            # Probably want to get this all in a preloading generator to make it faster
-            mediaid = u'M%s' % (filepage.pageid,)
-            currentdata = self.get_current_mediainfo(mediaid)
-
-            pywikibot.output('Working on %s' % (filepage.title(),))
-
-            if not filepage.exists():
-                continue
-
-            if not filepage.has_permission():
-                # Picture might be protected
-                continue
-
-            self.remove_duplicate_claims(filepage, mediaid, currentdata)
+        last_save = time.time()
+        offset = None
+        for (entities, offset) in self.filtered_generator:
+            # The whole range is handled before the checkpoint can move past it
+            for i in range(0, len(entities), 50):
+                self.work_on_filepages([pywikibot.FilePage(self.site, title=entity.get('title'))
+                                        for entity in entities[i:i + 50]])
+            if time.time() - last_save > 60:
+                self.save_checkpoint(self.dump_file, offset)
+                last_save = time.time()
+        if offset is not None:
+            self.save_checkpoint(self.dump_file, offset)
+            pywikibot.output('Done scanning %s bytes of %s' % (offset, self.dump_file))
 
 def main(*args):
     always_touch = False
@@ -240,6 +439,8 @@ def main(*args):
             always_touch = True
         elif arg == '-usedumps':
             use_dumps = True
+        elif arg.startswith('-dumpfile:'):
+            dump_file = arg[len('-dumpfile:'):]
         elif gen_factory.handle_arg(arg):
             continue
     if use_dumps:
@@ -0,0 +1,26 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+The ReportBuilder and ReportPublisher for the Commons bots.
+
+The code lives in bot/wikidata/report_publisher.py so there is only one copy. The bots are started from their own
+directory (python wikidata_osm_checker.py), so bot/commons and bot/wikidata are separate script directories and the
+Commons bots can't import a module from bot/wikidata by name. Adding bot/wikidata to sys.path would make every module
+in there importable from here, so only this one file is loaded by its path instead.
+
+This means bot/commons only works together with bot/wikidata next to it, like they are in this repository. When
+bot/commons is deployed on its own, copy bot/wikidata/report_publisher.py over this file.
+"""
+import importlib.util
+import os
+
+_filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'wikidata', 'report_publisher.py')
+if not os.path.exists(_filename):
+    raise ImportError('%s not found. bot/commons needs bot/wikidata next to it, or a copy of that file here'
+                      % (_filename,))
+_spec = importlib.util.spec_from_file_location('wikidata_report_publisher', _filename)
+_report_publisher = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(_report_publisher)
+
+ReportBuilder = _report_publisher.ReportBuilder
+ReportPublisher = _report_publisher.ReportPublisher
@@ -0,0 +1,246 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Offline reverse geocoding of coordinates to administrative areas.
+
+The boundaries come from a GeoJSON file with (multi)polygons, for example an export of the OSM administrative
+boundaries. Every feature should have the properties "wikidata" and "admin_level" and can have "commons_cat" with
+the Commons category. The polygons are put in a grid so a lookup only has to check the few polygons near the point.
+
+Lookups are cached per rounded coordinate because a lot of files are made at the same spot. If the point is not in
+any of the loaded areas, or only in areas with an admin level below min_admin_level (the boundaries file might only
+have the countries and provinces for some regions), the remote service at edwardbetts.com can be used as fallback.
+Failed requests to the remote service are not cached, so the next lookup of the coordinate tries again.
+
+The result is a dict like the remote service returns:
+{'wikidata': 'Q123', 'admin_level': 10, 'commons_cat': {'title': 'Category:Something'}}
+"""
+import pywikibot
+import functools
+import json
+import math
+import os
+import pickle
+import threading
+import time
+import requests
+from collections import OrderedDict
+
+
+class ReverseGeocoder:
+    """
+    Look up the smallest administrative area a coordinate is in
+    """
+    def __init__(self, boundaries_file=None, cell_size=0.1, remote_fallback=True, cache_size=100000, precision=4,
+                 min_admin_level=10):
+        """
+        Arguments:
+            * boundaries_file - GeoJSON file with the boundaries. Defaults to admin_boundaries.geojson in the
+                                pywikibot directory. Without the file only the remote service is used
+            * cell_size       - Size of the grid cells in degrees
+            * remote_fallback - Ask edwardbetts.com for points that are not in any of the loaded areas
+            * cache_size      - Number of rounded coordinates to keep the result of
+            * precision       - Number of decimals to round the coordinates to for the cache (4 is about 10 meter)
+            * min_admin_level - Ask the remote service if the smallest local area has a lower admin level than this
+
+        """
+        if not boundaries_file:
+            boundaries_file = os.path.join(pywikibot.config.base_dir, 'admin_boundaries.geojson')
+        self.cell_size = cell_size
+        self.remote_fallback = remote_fallback
+        self.precision = precision
+        self.min_admin_level = min_admin_level
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.areas = []
+        self.grid = {}
+        if os.path.exists(boundaries_file):
+            self.load_index(boundaries_file)
+        elif not remote_fallback:
+            raise FileNotFoundError(boundaries_file)
+
+    def load_index(self, boundaries_file):
+        """
+        Load the areas and the grid. The index is pickled next to the GeoJSON so it only has to be built once
+        """
+        index_file = '%s.%s.index' % (boundaries_file, self.cell_size)
+        if os.path.exists(index_file) and os.path.getmtime(index_file) >= os.path.getmtime(boundaries_file):
+            with open(index_file, 'rb') as index:
+                (self.areas, self.grid) = pickle.load(index)
+            return
+        pywikibot.output('Building the reverse geocoding index of %s' % (boundaries_file,))
+        with open(boundaries_file, 'r', encoding='utf-8') as boundaries:
+            geojson = json.load(boundaries)
+        for feature in geojson.get('features'):
+            self.add_feature(feature)
+        with open(index_file, 'wb') as index:
+            pickle.dump((self.areas, self.grid), index, protocol=pickle.HIGHEST_PROTOCOL)
+        pywikibot.output('Indexed %s areas in %s grid cells' % (len(self.areas), len(self.grid)))
+
+    def add_feature(self, feature):
+        """
+        Add one GeoJSON feature to the areas and the grid
+        """
+        properties = feature.get('properties') or {}
+        geometry = feature.get('geometry') or {}
+        if not properties.get('wikidata') or not properties.get('admin_level'):
+            return
+        if geometry.get('type') == 'Polygon':
+            polygons = [geometry.get('coordinates')]
+        elif geometry.get('type') == 'MultiPolygon':
+            polygons = geometry.get('coordinates')
+        else:
+            return
+        # Rings as tuples of (lon, lat) tuples to keep the pickle small
+        polygons = [[tuple((point[0], point[1]) for point in ring) for ring in polygon] for polygon in polygons]
+        lons = [point[0] for polygon in polygons for point in polygon[0]]
+        lats = [point[1] for polygon in polygons for point in polygon[0]]
+        area_id = len(self.areas)
+        self.areas.append({'wikidata': properties.get('wikidata'),
+                           'admin_level': int(properties.get('admin_level')),
+                           'commons_cat': properties.get('commons_cat'),
+                           'bbox': (min(lons), min(lats), max(lons), max(lats)),
+                           'polygons': polygons,
+                           })
+        for cell_x in range(self.get_cell(min(lons)), self.get_cell(max(lons)) + 1):
+            for cell_y in range(self.get_cell(min(lats)), self.get_cell(max(lats)) + 1):
+                self.grid.setdefault((cell_x, cell_y), []).append(area_id)
+
+    def get_cell(self, degrees):
+        """
+        Get the number of the grid cell for a latitude or longitude
+        """
+        return int(math.floor(degrees / self.cell_size))
+
+    def lookup(self, lat, lon):
+        """
+        Look up the smallest area the coordinate is in
+
+        :param lat: The latitude
+        :param lon: The longitude
+        :return: Dict with wikidata, admin_level and commons_cat or None if nothing was found
+        """
+        key = (round(float(lat), self.precision), round(float(lon), self.precision))
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+        (result, complete) = self.lookup_uncached(*key)
+        if complete:
+            with self.lock:
+                self.cache[key] = result
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return result
+
+    def lookup_many(self, coordinates):
+        """
+        Look up a batch of coordinates
+
+        :param coordinates: List of (lat, lon) tuples
+        :return: List of results in the same order
+        """
+        return [self.lookup(lat, lon) for (lat, lon) in coordinates]
+
+    def lookup_uncached(self, lat, lon):
+        """
+        Look up a coordinate in the local index and fall back to the remote service if nothing or only a large area
+        was found
+
+        :return: Tuple of the result and if the lookup was complete. It's not complete if the remote service failed
+        """
+        result = self.lookup_local(lat, lon)
+        if result and result.get('admin_level') >= self.min_admin_level or not self.remote_fallback:
+            return (result, True)
+        try:
+            remote_result = self.lookup_remote(lat, lon)
+        except IOError:
+            return (result, False)
+        if remote_result and (not result or int(remote_result.get('admin_level') or 0) >= result.get('admin_level')):
+            return (remote_result, True)
+        return (result, True)
+
+    def lookup_local(self, lat, lon):
+        """
+        Look up a coordinate in the local index. The area with the highest admin level wins
+        """
+        best = None
+        for area_id in self.grid.get((self.get_cell(lon), self.get_cell(lat)), []):
+            area = self.areas[area_id]
+            (min_lon, min_lat, max_lon, max_lat) = area.get('bbox')
+            if not (min_lon <= lon <= max_lon and min_lat <= lat <= max_lat):
+                continue
+            if best and best.get('admin_level') >= area.get('admin_level'):
+                continue
+            for polygon in area.get('polygons'):
+                if point_in_polygon(lon, lat, polygon):
+                    best = area
+                    break
+        if not best:
+            return None
+        result = {'wikidata': best.get('wikidata'),
+                  'admin_level': best.get('admin_level'),
+                  }
+        if best.get('commons_cat'):
+            result['commons_cat'] = {'title': best.get('commons_cat')}
+        return result
+
+    def lookup_remote(self, lat, lon, tries=3):
+        """
+        Ask the remote service at edwardbetts.com
+
+        :return: The json of the service or None if it didn't find anything
+        :raises IOError: If all the tries failed
+        """
+        url = 'http://edwardbetts.com/geocode/?lat=%s&lon=%s' % (lat, lon)
+        for attempt in range(tries):
+            try:
+                page = requests.get(url, timeout=60)
+                jsondata = page.json()
+                if jsondata.get('missing'):
+                    return None
+                return jsondata
+            except ValueError:
+                # Either json.decoder.JSONDecodeError or simplejson.scanner.JSONDecodeError, both subclass of ValueError
+                pywikibot.output('Got invalid json at %s' % (url,))
+            except IOError:
+                # RequestExceptions was thrown
+                pywikibot.output('Got an IOError at %s' % (url,))
+            time.sleep(10 * 2 ** attempt)
+        raise IOError('The remote reverse geocoding of %s, %s failed' % (lat, lon))
+
+
+def point_in_polygon(lon, lat, polygon):
+    """
+    Check if the point is in the polygon. The first ring is the outside, the other rings are holes
+    """
+    if not point_in_ring(lon, lat, polygon[0]):
+        return False
+    for hole in polygon[1:]:
+        if point_in_ring(lon, lat, hole):
+            return False
+    return True
+
+
+def point_in_ring(lon, lat, ring):
+    """
+    Ray casting: count how many edges of the ring a line from the point to the east crosses
+    """
+    inside = False
+    (previous_lon, previous_lat) = ring[-1]
+    for (current_lon, current_lat) in ring:
+        if (current_lat > lat) != (previous_lat > lat):
+            crossing_lon = current_lon + (lat - current_lat) * (previous_lon - current_lon) / (previous_lat - current_lat)
+            if lon < crossing_lon:
+                inside = not inside
+        (previous_lon, previous_lat) = (current_lon, current_lat)
+    return inside
+
+
+@functools.lru_cache(maxsize=None)
+def get_reverse_geocoder():
+    """
+    Get the shared reverse geocoder so the index is only loaded once
+    """
+    return ReverseGeocoder()
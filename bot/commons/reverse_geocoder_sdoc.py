@@ -13,13 +13,14 @@ import pywikibot.data.sparql
 import time
 import json
 import requests
+import reverse_geocoder
 from pywikibot import pagegenerators
 
 class ReverseGeocodingBot:
     """
     Bot to add structured data statements on Commons
     """
-    def __init__(self, generator):
+    def __init__(self, generator, boundaries_file=None):
         """
         Grab generator based on search to work on.
         """
@@ -28,6 +29,7 @@ class ReverseGeocodingBot:
         self.site.get_tokens('csrf')
         self.repo = self.site.data_repository()
         self.generator = generator
+        self.reverse_geocoder = reverse_geocoder.ReverseGeocoder(boundaries_file=boundaries_file)
 
     def run(self):
         """
@@ -102,7 +104,7 @@ class ReverseGeocodingBot:
 
 
 
-    def lookup_location(self, lat, lon, tries=3):
+    def lookup_location(self, lat, lon):
         """
         Do reverse geocoding based on latitude & longitude and return Wikidata item
         :param lat: The latitude
@@ -110,28 +112,10 @@ class ReverseGeocodingBot:
         :return: Wikidata item
         """
         qid = None
-        url = 'http://edwardbetts.com/geocode/?lat=%s&lon=%s' % (lat, lon)
-        print(url)
-        try:
-            page = requests.get(url)
-            jsondata = page.json()
-            print(jsondata)
-        except ValueError:
-            # Either json.decoder.JSONDecodeError or simplejson.scanner.JSONDecodeError, both subclass of ValueError
-            pywikibot.output('Got invalid json at %s' % (url,))
-            time.sleep(60)
-            if tries > 0:
-                return self.lookup_location(lat, lon, tries=tries-1)
-            return qid
-        except IOError:
-            # RequestExceptions was thrown
-            pywikibot.output('Got an IOError at %s' % (url,))
-            time.sleep(60)
-            if tries > 0:
-                return self.lookup_location(lat, lon, tries=tries-1)
-            return qid
-
-        if not jsondata.get('missing'):
+        jsondata = self.reverse_geocoder.lookup(lat, lon)
+        print(jsondata)
+
+        if jsondata:
             if jsondata.get('wikidata') and jsondata.get('admin_level'):
                 if jsondata.get('admin_level') > 9:
                     qid = jsondata.get('wikidata')
@@ -170,19 +154,22 @@ def main(*args):
     """
     #site = pywikibot.Site('commons', 'commons')
     gen = None
+    boundaries_file = None
 
     genFactory = pagegenerators.GeneratorFactory()
 
     for arg in pywikibot.handle_args(args):
         if arg == '-loose':
             pass
+        elif arg.startswith('-boundaries:'):
+            boundaries_file = arg[len('-boundaries:'):]
         elif genFactory.handle_arg(arg):
             continue
 
 
     gen = pagegenerators.PageClassGenerator(genFactory.getCombinedGenerator(gen, preload=True))
 
-    reverse_geocoding_bot = ReverseGeocodingBot(gen)
+    reverse_geocoding_bot = ReverseGeocodingBot(gen, boundaries_file=boundaries_file)
     reverse_geocoding_bot.run()
 
 
@@ -5,6 +5,10 @@ A bot to compare Wikidata with OpenStreetMap for reverse geocoding.
 
 See https://commons.wikimedia.org/wiki/Commons:Reverse_geocoding/Reports
 
+With -snapshot the query results are kept on disk (see wikidata_osm_snapshot.py) and only queried again after a day
+(or -snapshotage:<hours>) or when the query changed. The reports then also list what changed since the previous
+snapshot. With -offline no queries are done at all and the reports are made from the snapshots.
+
 """
 import pywikibot
 from pywikibot import pagegenerators
@@ -14,14 +18,24 @@ import re
 import datetime
 import time
 import json
+from wikidata_osm_snapshot import WikidataOsmSnapshot
+from report_publisher import ReportBuilder, ReportPublisher
 
 class WikidataOsmChecker:
     """
     A bot to compare Wikidata and OpenStreetMap
     """
-    def __init__(self, countrycode, report_page, admin_levels, do_edits = False):
+    def __init__(self, countrycode, report_page, admin_levels, do_edits = False, snapshot=None, offline=False,
+                 publisher=None):
         """
-        Arguments: None
+        Arguments:
+            * countrycode  - The code of the region to work on
+            * report_page  - The page on Commons to put the report on
+            * admin_levels - The configuration of the admin levels
+            * do_edits     - Add missing OSM backlinks on Wikidata
+            * snapshot     - A WikidataOsmSnapshot to reuse query results from. Without it every query is done
+            * offline      - Only use what is in the snapshot, don't query at all
+            * publisher    - The ReportPublisher to queue the report at. Without it the report is published right away
         """
         self.site = pywikibot.Site('commons', 'commons')
         self.repo = pywikibot.Site().data_repository()
@@ -29,6 +43,12 @@ class WikidataOsmChecker:
         self.report_page = report_page
         self.admin_levels = admin_levels
         self.do_edits = do_edits
+        self.snapshot = snapshot
+        self.offline = offline
+        self.publisher = publisher
+        self.publish_now = publisher is None
+        if self.publish_now:
+            self.publisher = ReportPublisher()
         self.wd_item_relation = {}
         self.wd_item_id = {}
         self.wd_item_relation_id = {}
@@ -43,7 +63,8 @@ class WikidataOsmChecker:
             self.wd_item_id[admin_level] = set()
             self.wd_item_commons_category[admin_level] = set()
             self.wd_item_relation_id[admin_level] = set()
-            self.do_sparql_query(sparql_query, admin_level)
+            rows = self.get_rows(admin_level, 'wikidata', sparql_query, self.do_sparql_query, sparql_query)
+            self.add_wikidata_rows(rows, admin_level)
 
             overpass_query = admin_levels.get(admin_level).get('overpass')
             id_tag = admin_levels.get(admin_level).get('id_tag')
@@ -52,36 +73,74 @@ class WikidataOsmChecker:
             self.osm_item_relation[admin_level] = set()
             self.osm_relation_id[admin_level] = set()
             self.osm_item_relation_id[admin_level] = set()
-            self.do_overpass_query(overpass_query, admin_level, id_tag, id_transform)
+            # The tag and transform change the rows just like the query does
+            snapshot_query = '%s\n%s\n%s' % (overpass_query, id_tag, id_transform)
+            rows = self.get_rows(admin_level, 'osm', snapshot_query, self.do_overpass_query, overpass_query, id_tag,
+                                 id_transform)
+            self.add_osm_rows(rows, admin_level)
+
+    def get_rows(self, admin_level, source, snapshot_query, query_function, *args):
+        """
+        Get the rows for an admin level from the snapshot if it's still fresh, otherwise do the query and update
+        the snapshot
 
-    def do_sparql_query(self, query, admin_level):
+        :param admin_level: Admin level to get the rows for
+        :param source: 'wikidata' or 'osm'
+        :param snapshot_query: The query as used to check if the snapshot is still valid
+        :param query_function: The function to do the query with
+        :param args: The arguments for the query function
+        :return: List of tuples of qid, OSM relation, Commons category and identifier
         """
-        Do the sparql query and store the results for an admin_level
+        if not self.snapshot:
+            return query_function(*args)
+        if self.offline or self.snapshot.is_fresh(self.countrycode, admin_level, source, snapshot_query):
+            if not self.snapshot.get_timestamp(self.countrycode, admin_level, source):
+                pywikibot.output('No %s snapshot for %s admin level %s' % (source, self.countrycode, admin_level))
+            return self.snapshot.get_rows(self.countrycode, admin_level, source)
+        rows = query_function(*args)
+        (added, removed) = self.snapshot.store(self.countrycode, admin_level, source, snapshot_query, rows)
+        pywikibot.output('Updated the %s snapshot for %s admin level %s: %s added and %s removed' %
+                         (source, self.countrycode, admin_level, len(added), len(removed)))
+        return rows
+
+    def do_sparql_query(self, query):
+        """
+        Do the sparql query
         :param query: The sparql query to execute
-        :param admin_level: Admin level to store it at
-        :return: None
+        :return: List of tuples of qid, OSM relation, Commons category and identifier
         """
         sq = pywikibot.data.sparql.SparqlQuery()
         queryresult = sq.select(query)
 
+        result = []
         for resultitem in queryresult:
             qid = resultitem.get('item').replace(u'http://www.wikidata.org/entity/', u'')
             osmrelation = resultitem.get('osmrelation')
             commonscategory = resultitem.get('commonscategory')
             id = resultitem.get('id')
+            result.append((qid, osmrelation, commonscategory, id))
+        return result
+
+    def add_wikidata_rows(self, rows, admin_level):
+        """
+        Store the Wikidata rows for an admin_level
+        :param rows: List of tuples of qid, OSM relation, Commons category and identifier
+        :param admin_level: Admin level to store it at
+        :return: None
+        """
+        for (qid, osmrelation, commonscategory, id) in rows:
             self.wd_item_relation[admin_level].add((qid, osmrelation))
             self.wd_item_id[admin_level].add((qid, id))
             self.wd_item_commons_category[admin_level].add((qid, commonscategory))
             self.wd_item_relation_id[admin_level].add((qid, osmrelation, id))
 
-    def do_overpass_query(self, query, admin_level, id_tag, id_transform):
+    def do_overpass_query(self, query, id_tag, id_transform):
         """
-        Do the overpass query and store it at admin_level
+        Do the overpass query
         :param query: The overpass query to execute
-        :param admin_level: Admin level to store it at
         :param id_tag: The identifier tag to look for
         :param id_transform: How to transform the identifier tag
-        :return:
+        :return: List of tuples of qid, OSM relation, None (no Commons category) and identifier
         """
 
         url = 'http://overpass-api.de/api/interpreter?data=%s' % (requests.utils.quote(query),)
@@ -89,6 +148,7 @@ class WikidataOsmChecker:
         page = requests.get(url)
 
         json = page.json()
+        result = []
         for element in json.get('elements'):
             osmrelation = '%s' % (element.get('id'),)
             qid = element.get('tags').get('wikidata')
@@ -101,6 +161,17 @@ class WikidataOsmChecker:
                         id = id_transform % (int(id), )
             else:
                 id = None
+            result.append((qid, osmrelation, None, id))
+        return result
+
+    def add_osm_rows(self, rows, admin_level):
+        """
+        Store the OpenStreetMap rows for an admin_level
+        :param rows: List of tuples of qid, OSM relation, Commons category and identifier
+        :param admin_level: Admin level to store it at
+        :return: None
+        """
+        for (qid, osmrelation, commonscategory, id) in rows:
             self.osm_relation_item[admin_level].add((osmrelation, qid))
             self.osm_relation_id[admin_level].add((osmrelation, id))
             self.osm_item_relation[admin_level].add((qid, osmrelation))
@@ -110,37 +181,41 @@ class WikidataOsmChecker:
         """
         Starts the robot.
         """
-        text = 'This is the [[Commons:Reverse geocoding|reverse geocoding]] [[Commons:Reverse geocoding/Reports|report]] for {{SUBPAGENAME}}.\n'
+        text = ReportBuilder()
+        text.add('This is the [[Commons:Reverse geocoding|reverse geocoding]] [[Commons:Reverse geocoding/Reports|report]] for {{SUBPAGENAME}}.\n')
         for admin_level in self.admin_levels:
-            text += '== %s ==\n' % (self.admin_levels.get(admin_level).get('label'),)
+            text.add('== %s ==\n' % (self.admin_levels.get(admin_level).get('label'),))
             item = requests.utils.quote(self.admin_levels.get(admin_level).get('item'))
-            text += 'Working on {{Q|%s}} which corresponds to admin level %s on OpenStreetMap\n' % (item, admin_level)
+            text.add('Working on {{Q|%s}} which corresponds to admin level %s on OpenStreetMap\n' % (item, admin_level))
 
             sparql_query = requests.utils.quote(self.admin_levels.get(admin_level).get('sparql'))
             overpass_query = requests.utils.quote(self.admin_levels.get(admin_level).get('overpass'))
-            text += '* [https://query.wikidata.org/#%s SPARQL query]\n' % (sparql_query, )
-            text += '* [http://overpass-api.de/api/interpreter?data=%s overpass query]\n' % (overpass_query, )
+            text.add('* [https://query.wikidata.org/#%s SPARQL query]\n' % (sparql_query, ))
+            text.add('* [http://overpass-api.de/api/interpreter?data=%s overpass query]\n' % (overpass_query, ))
 
             id_property = self.admin_levels.get(admin_level).get('id_property')
             id_tag = self.admin_levels.get(admin_level).get('id_tag')
             if id_property and id_tag:
-                text += '* {{P|%s}} will be matched with OSM tag "[[openstreetmap:key:%s|%s]]"\n' % (id_property, id_tag, id_tag)
-            text += self.check_count(admin_level)
+                text.add('* {{P|%s}} will be matched with OSM tag "[[openstreetmap:key:%s|%s]]"\n' % (id_property, id_tag, id_tag))
+            text.add(self.check_count(admin_level))
+            if self.snapshot:
+                text.add(self.check_changes(admin_level))
 
-            text += self.check_completeness_links(self.wd_item_relation.get(admin_level), 'Wikidata', 'OpenStreetMap')
-            text += self.check_completeness_links(self.osm_relation_item.get(admin_level), 'OpenStreetMap', 'Wikidata')
-            text += self.check_interlinks(self.wd_item_relation.get(admin_level), self.osm_item_relation.get(admin_level))
+            text.add(self.check_completeness_links(self.wd_item_relation.get(admin_level), 'Wikidata', 'OpenStreetMap'))
+            text.add(self.check_completeness_links(self.osm_relation_item.get(admin_level), 'OpenStreetMap', 'Wikidata'))
+            text.add(self.check_interlinks(self.wd_item_relation.get(admin_level), self.osm_item_relation.get(admin_level)))
 
             if not self.admin_levels.get(admin_level).get('no_commons_category'):
-                text += self.check_completeness_links(self.wd_item_commons_category.get(admin_level), 'Wikidata', 'Commons category')
+                text.add(self.check_completeness_links(self.wd_item_commons_category.get(admin_level), 'Wikidata', 'Commons category'))
 
             if id_property and id_tag:
                 id_property_text = '{{P|%s}}' % (id_property)
                 id_tag_text = 'tag "%s"' % (id_tag)
-                text += self.check_completeness_links(self.wd_item_id.get(admin_level), 'Wikidata', id_property_text)
-                text += self.check_completeness_links(self.osm_relation_id.get(admin_level), 'OpenStreetMap', id_tag_text)
-                text += self.check_id_interlinks(self.wd_item_relation_id.get(admin_level), self.osm_item_relation_id.get(admin_level))
+                text.add(self.check_completeness_links(self.wd_item_id.get(admin_level), 'Wikidata', id_property_text))
+                text.add(self.check_completeness_links(self.osm_relation_id.get(admin_level), 'OpenStreetMap', id_tag_text))
+                text.add(self.check_id_interlinks(self.wd_item_relation_id.get(admin_level), self.osm_item_relation_id.get(admin_level)))
 
+        text = text.render()
         # Might produce very large reports that exceed the max page size
         if len(text) > 2000000:
             text = text[0:800000]
@@ -148,7 +223,9 @@ class WikidataOsmChecker:
 
         page = pywikibot.Page(self.site, title=self.report_page)
         summary = 'Updating report'
-        page.put(text, summary)
+        self.publisher.add(page, text, summary)
+        if self.publish_now:
+            self.publisher.flush()
         print(text)
 
 
@@ -174,6 +251,34 @@ class WikidataOsmChecker:
 
         return text
 
+    def check_changes(self, admin_level, max_changes=50):
+        """
+        Report what changed on both sides since the previous snapshot
+        :param admin_level: admin level to work on
+        :param max_changes: maximum number of added and of removed rows to list per source, the rest is only counted
+        :return: string
+        """
+        text = '=== Changes since the previous snapshot ===\n'
+        for (source, source_link) in [('wikidata', 'Wikidata'), ('osm', 'OpenStreetMap')]:
+            timestamp = self.snapshot.get_timestamp(self.countrycode, admin_level, source)
+            (added, removed) = self.snapshot.get_changes(self.countrycode, admin_level, source)
+            text += '* %s snapshot of %s: %s added and %s removed\n' % (source_link, timestamp, len(added),
+                                                                        len(removed))
+            for (change, rows) in [('added', added), ('removed', removed)]:
+                for (qid, osm, commonscategory, id) in rows[:max_changes]:
+                    if qid:
+                        text += '** %s {{Q|%s}}' % (change, qid)
+                    else:
+                        text += '** %s item without Wikidata link' % (change, )
+                    if osm:
+                        text += ' with https://www.openstreetmap.org/relation/%s' % (osm, )
+                    if id:
+                        text += ' and identifier %s' % (id, )
+                    text += '\n'
+                if len(rows) > max_changes:
+                    text += '** and %s more %s\n' % (len(rows) - max_changes, change)
+        return text
+
     def check_completeness_links(self, set_to_check, source_link, target_link):
         """
         """
@@ -309,11 +414,22 @@ def main(*args):
     """
     regioncode = None
     do_edits = False
+    snapshot = None
+    offline = False
     for arg in pywikibot.handle_args(args):
         if arg.startswith('-regioncode:'):
             regioncode = arg[12:]
         elif arg == '-do_edits':
             do_edits = True
+        elif arg == '-snapshot':
+            snapshot = WikidataOsmSnapshot()
+        elif arg.startswith('-snapshotage:'):
+            snapshot = WikidataOsmSnapshot(max_age=datetime.timedelta(hours=int(arg[13:])))
+        elif arg == '-offline':
+            offline = True
+
+    if offline and not snapshot:
+        snapshot = WikidataOsmSnapshot()
 
     regions = {
         'at': {
@@ -1108,16 +1224,23 @@ out tags;''',
         if regioncode in regions:
             report_page = regions.get(regioncode).get('report_page')
             admin_levels = regions.get(regioncode).get('admin_levels')
-            wikidata_osm_checker = WikidataOsmChecker(regioncode, report_page, admin_levels, do_edits=do_edits)
+            wikidata_osm_checker = WikidataOsmChecker(regioncode, report_page, admin_levels, do_edits=do_edits,
+                                                      snapshot=snapshot, offline=offline)
             wikidata_osm_checker.run()
         else:
             pywikibot.output('Unknown region code %s' % (regioncode,))
     else:
+        # Publish the reports of every region that changed together, right after the region is done so a crash in
+        # a later region doesn't lose them
+        publisher = ReportPublisher()
         for regioncode in regions:
             report_page = regions.get(regioncode).get('report_page')
             admin_levels = regions.get(regioncode).get('admin_levels')
-            wikidata_osm_checker = WikidataOsmChecker(regioncode, report_page, admin_levels, do_edits=do_edits)
+            wikidata_osm_checker = WikidataOsmChecker(regioncode, report_page, admin_levels, do_edits=do_edits,
+                                                      snapshot=snapshot, offline=offline, publisher=publisher)
             wikidata_osm_checker.run()
+            publisher.flush()
+        pywikibot.output('Saved %s reports, %s reports did not change' % (publisher.saved, publisher.skipped))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,133 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Snapshots of the Wikidata and OpenStreetMap side of the reverse geocoding reports.
+
+The results of the SPARQL and the Overpass query of every region and admin level are kept in a SQLite file in the
+pywikibot directory, indexed on region, admin level and source. A query is only done again when its snapshot is
+older than the maximum age or when the query itself changed, so adding a region only costs the queries of that
+region. When a snapshot is replaced, the rows that were added and removed are stored so the report can show what
+changed since the previous snapshot.
+
+Rows are tuples of qid, OSM relation, Commons category and identifier. The Commons category is None on the
+OpenStreetMap side.
+"""
+import pywikibot
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+
+
+class WikidataOsmSnapshot:
+    """
+    The Wikidata and OpenStreetMap rows per region and admin level, kept on disk
+    """
+    def __init__(self, filename=None, max_age=datetime.timedelta(days=1)):
+        """
+        Arguments:
+            * filename - The SQLite file. Defaults to wikidata_osm_snapshot.sqlite in the pywikibot directory
+            * max_age  - How long a snapshot is used before the query is done again
+
+        """
+        if not filename:
+            filename = os.path.join(pywikibot.config.base_dir, 'wikidata_osm_snapshot.sqlite')
+        self.max_age = max_age
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS snapshots (region TEXT, admin_level INTEGER, '
+                                'source TEXT, queryhash TEXT, timestamp TEXT, '
+                                'PRIMARY KEY (region, admin_level, source))')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS rows (region TEXT, admin_level INTEGER, source TEXT, '
+                                'qid TEXT, osmrelation TEXT, commonscategory TEXT, identifier TEXT)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS rows_index ON rows (region, admin_level, source)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS changes (region TEXT, admin_level INTEGER, '
+                                'source TEXT, change TEXT, row TEXT)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS changes_index ON changes (region, admin_level, source)')
+        self.connection.commit()
+
+    def get_query_hash(self, query):
+        """
+        Hash of the query (and everything else that changes the rows) to notice a changed configuration
+        """
+        return hashlib.sha1(query.encode('utf-8')).hexdigest()
+
+    def get_timestamp(self, region, admin_level, source, query=None):
+        """
+        Get when the snapshot was made
+
+        :param query: If set, only return the timestamp if the snapshot was made with this query
+        :return: The timestamp as isoformat string or None if there is no (matching) snapshot
+        """
+        row = self.connection.execute('SELECT queryhash, timestamp FROM snapshots '
+                                      'WHERE region=? AND admin_level=? AND source=?',
+                                      (region, admin_level, source)).fetchone()
+        if not row:
+            return None
+        (queryhash, timestamp) = row
+        if query is not None and queryhash != self.get_query_hash(query):
+            return None
+        return timestamp
+
+    def is_fresh(self, region, admin_level, source, query):
+        """
+        Check if there is a snapshot made with this query less than max_age ago
+        """
+        timestamp = self.get_timestamp(region, admin_level, source, query=query)
+        if not timestamp:
+            return False
+        return timestamp >= (datetime.datetime.utcnow() - self.max_age).isoformat()
+
+    def get_rows(self, region, admin_level, source):
+        """
+        Get the rows of a snapshot
+
+        :return: List of tuples of qid, OSM relation, Commons category and identifier
+        """
+        return [tuple(row) for row in self.connection.execute('SELECT qid, osmrelation, commonscategory, identifier '
+                                                              'FROM rows WHERE region=? AND admin_level=? '
+                                                              'AND source=?', (region, admin_level, source))]
+
+    def store(self, region, admin_level, source, query, rows):
+        """
+        Replace the snapshot and store what changed compared to the previous one. Nothing is recorded as change for
+        the first snapshot.
+
+        :return: Tuple of the set of added rows and the set of removed rows
+        """
+        rows = set(rows)
+        added = set()
+        removed = set()
+        if self.get_timestamp(region, admin_level, source):
+            oldrows = set(self.get_rows(region, admin_level, source))
+            added = rows - oldrows
+            removed = oldrows - rows
+        key = (region, admin_level, source)
+        with self.connection:
+            self.connection.execute('DELETE FROM rows WHERE region=? AND admin_level=? AND source=?', key)
+            self.connection.executemany('INSERT INTO rows VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                        [key + row for row in rows])
+            self.connection.execute('DELETE FROM changes WHERE region=? AND admin_level=? AND source=?', key)
+            self.connection.executemany('INSERT INTO changes VALUES (?, ?, ?, ?, ?)',
+                                        [key + ('added', json.dumps(row)) for row in sorted(added, key=str)] +
+                                        [key + ('removed', json.dumps(row)) for row in sorted(removed, key=str)])
+            self.connection.execute('INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?)',
+                                    key + (self.get_query_hash(query), datetime.datetime.utcnow().isoformat()))
+        return (added, removed)
+
+    def get_changes(self, region, admin_level, source):
+        """
+        Get what changed when the current snapshot replaced the previous one
+
+        :return: Tuple of the list of added rows and the list of removed rows
+        """
+        added = []
+        removed = []
+        for (change, row) in self.connection.execute('SELECT change, row FROM changes WHERE region=? '
+                                                     'AND admin_level=? AND source=?',
+                                                     (region, admin_level, source)):
+            if change == 'added':
+                added.append(tuple(json.loads(row)))
+            else:
+                removed.append(tuple(json.loads(row)))
+        return (added, removed)
@@ -0,0 +1,282 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Single pass scanner for the templates on file pages.
+
+templatesWithParams() parses the whole wikitext and makes a Page object for every template each time it's called and
+templates() is an API call. The SDoC bots did that several times per file. The scanner goes over the wikitext once
+and returns every template with its parameters. The TemplateClassifier looks the template names up (case-insensitive,
+like the bots always did) in one table with all the templates the bot is interested in, including the redirects to these templates. Templates that are
+only transcluded through other templates are not in the wikitext, the names of these (from prop=templates) can be
+passed along to be classified too.
+
+Usage: python wikitext_scanner.py -savecorpus:<directory> <generator> to save the wikitext of files as corpus
+       python wikitext_scanner.py -benchmark:<directory> to compare the scanner with templatesWithParams on the corpus
+"""
+import pywikibot
+import os
+import re
+import time
+from pywikibot import pagegenerators, textlib
+
+TOKEN_REGEX = re.compile(r'\{\{\{|\}\}\}|\{\{|\}\}|\[\[|\]\]|\||=')
+REMOVE_REGEX = re.compile(r'<!--.*?-->|<nowiki>.*?</nowiki>', flags=re.DOTALL | re.IGNORECASE)
+TEMPLATE_PREFIX_REGEX = re.compile(r'^\s*:?\s*template\s*:\s*', flags=re.IGNORECASE)
+WHITESPACE_REGEX = re.compile(r'[\s_]+')
+
+
+def normalize_template_name(name):
+    """
+    Normalize a template name: no namespace, spaces instead of underscores and the first letter in lower case. Like
+    MediaWiki only the first letter is case-insensitive
+    """
+    name = WHITESPACE_REGEX.sub(' ', TEMPLATE_PREFIX_REGEX.sub('', name)).strip()
+    return name[:1].lower() + name[1:]
+
+
+def template_key(name):
+    """
+    Get the key to look a template up in the table of the TemplateClassifier. The tables of the bots are all lower
+    case, so the whole name is case-insensitive here. The normalized name is kept for display
+    """
+    return normalize_template_name(name).casefold()
+
+
+def scan_templates(text):
+    """
+    Get all the templates with their parameters in one pass over the wikitext
+
+    :param text: The wikitext
+    :return: List of tuples of normalized template name and list of parameters in the order they are in the text.
+             Parameters are like templatesWithParams() returns them: "name=value" or just the value, both stripped
+    """
+    text = REMOVE_REGEX.sub('', text)
+    result = []
+    # Every frame is a list of the kind, the start, the start of the current part, the first = in it and the parts
+    stack = []
+    position = 0
+    while True:
+        match = TOKEN_REGEX.search(text, position)
+        if not match:
+            break
+        token = match.group(0)
+        position = match.end()
+        frame = stack[-1] if stack else None
+        if token == '{{':
+            stack.append(['template', match.start(), position, None, []])
+        elif token == '{{{':
+            stack.append(['parameter', match.start(), position, None, []])
+        elif token == '[[':
+            stack.append(['link', match.start(), position, None, []])
+        elif token == ']]':
+            if frame and frame[0] == 'link':
+                stack.pop()
+        elif token == '}}}' and frame and frame[0] == 'parameter':
+            stack.pop()
+        elif token in ('}}', '}}}'):
+            if token == '}}}':
+                # Template closing followed by a single }
+                position -= 1
+            # Close the template, links that were never closed are dropped
+            while stack and stack[-1][0] != 'template':
+                stack.pop()
+            if not stack:
+                continue
+            frame = stack.pop()
+            frame[4].append((frame[2], match.start(), frame[3]))
+            result.append((frame[1], make_template(text, frame[4])))
+        elif frame and frame[0] == 'template':
+            if token == '|':
+                frame[4].append((frame[2], match.start(), frame[3]))
+                frame[2] = position
+                frame[3] = None
+            elif token == '=' and frame[3] is None and frame[4]:
+                frame[3] = match.start()
+    return [template for (start, template) in sorted(result, key=lambda startandtemplate: startandtemplate[0])]
+
+
+def make_template(text, parts):
+    """
+    Make the name and the parameters of a template from the positions of the parts
+    """
+    (start, end, equals) = parts[0]
+    name = normalize_template_name(text[start:end])
+    parameters = []
+    for (start, end, equals) in parts[1:]:
+        if equals is None:
+            parameters.append(text[start:end].strip())
+        else:
+            parameters.append('%s=%s' % (text[start:equals].strip(), text[equals + 1:end].strip()))
+    return (name, parameters)
+
+
+class TemplateClassifier:
+    """
+    Look up all the templates of a page in a single table of the templates the bot is interested in
+    """
+    def __init__(self, groups):
+        """
+        Arguments:
+            * groups - Dict with per group (like "license") a dict of template name to value (like a Qid)
+
+        """
+        self.groups = groups
+        self.lookup = {}
+        for group, templates in groups.items():
+            for name, value in templates.items():
+                self.lookup.setdefault(template_key(name), {})[group] = value
+
+    def load_redirects(self, site):
+        """
+        Add the templates the names in the table redirect to and the redirects to these templates to the table. The
+        names in the table don't have to be the exact names of the templates, but only the names that exist with the
+        first letter in upper case are looked up here. Done once with batches of 50 templates per request
+        """
+        names = sorted(self.lookup)
+        count = 0
+        missing = set()
+        for i in range(0, len(names), 50):
+            titles = dict(('Template:%s' % (name,), name) for name in names[i:i + 50])
+            parameters = {'action': 'query',
+                          'prop': 'redirects',
+                          'titles': sorted(titles),
+                          'redirects': 1,
+                          'rdnamespace': 10,
+                          'rdlimit': 'max',
+                          }
+            while True:
+                data = site.simple_request(**parameters).submit()
+                query = data.get('query')
+                # Follow the normalization of the titles and the redirects back to the names in the table
+                for conversion in query.get('normalized', []) + query.get('redirects', []):
+                    if conversion.get('from') in titles:
+                        titles[conversion.get('to')] = titles.get(conversion.get('from'))
+                for page in query.get('pages').values():
+                    name = titles.get(page.get('title'))
+                    if name is None:
+                        continue
+                    if 'missing' in page:
+                        missing.add(name)
+                        continue
+                    target = self.lookup.get(name)
+                    redirectnames = [page.get('title')] + [redirect.get('title') for redirect in page.get('redirects', [])]
+                    for redirectname in redirectnames:
+                        redirectname = template_key(redirectname)
+                        if redirectname not in self.lookup:
+                            self.lookup[redirectname] = dict(target)
+                            count += 1
+                        else:
+                            for (group, value) in target.items():
+                                self.lookup[redirectname].setdefault(group, value)
+                if not data.get('continue'):
+                    break
+                parameters.update(data.get('continue'))
+        pywikibot.output('Loaded %s template redirects' % (count,))
+        if missing:
+            pywikibot.output('No redirects loaded for these templates, these names do not exist: %s' %
+                             (', '.join(sorted(missing)),))
+
+    def classify(self, text, extranames=None):
+        """
+        Scan the wikitext once and sort the templates into the groups
+
+        :param text: The wikitext
+        :param extranames: Names of all the templates on the page (like templates() returns them), to also find the
+                           templates that are transcluded through other templates
+        :return: Dict with 'templates' (all the templates with their parameters), 'usertemplates' (True if user
+                 templates are used) and per group a list of tuples of value and parameters in the order of the text
+        """
+        templates = scan_templates(text)
+        record = {'templates': templates,
+                  'usertemplates': False,
+                  }
+        for group in self.groups:
+            record[group] = []
+        for (name, parameters) in templates:
+            if name.startswith('user:'):
+                record['usertemplates'] = True
+            for (group, value) in self.lookup.get(template_key(name), {}).items():
+                record[group].append((value, parameters))
+        for name in extranames or []:
+            for (group, value) in self.lookup.get(template_key(name), {}).items():
+                if value not in [found for (found, parameters) in record[group]]:
+                    record[group].append((value, []))
+        return record
+
+
+def save_corpus(generator, directory):
+    """
+    Save the wikitext of the pages as corpus for the benchmark
+    """
+    os.makedirs(directory, exist_ok=True)
+    count = 0
+    for page in generator:
+        if not page.exists():
+            continue
+        filename = os.path.join(directory, '%s.wikitext' % (page.pageid,))
+        with open(filename, 'w', encoding='utf-8') as corpusfile:
+            corpusfile.write(page.text)
+        count += 1
+    pywikibot.output('Saved %s pages in %s' % (count, directory))
+
+
+def benchmark(directory):
+    """
+    Compare the time templatesWithParams would need (called four times per file like the own work bot did) with
+    the time of one scan per file
+    """
+    texts = []
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith('.wikitext'):
+            with open(os.path.join(directory, filename), 'r', encoding='utf-8') as corpusfile:
+                texts.append(corpusfile.read())
+    if not texts:
+        pywikibot.output('No .wikitext files found in %s' % (directory,))
+        return
+
+    starttime = time.perf_counter()
+    for text in texts:
+        for i in range(4):
+            textlib.extract_templates_and_params(text, True, True)
+    oldtime = time.perf_counter() - starttime
+
+    starttime = time.perf_counter()
+    for text in texts:
+        scan_templates(text)
+    newtime = time.perf_counter() - starttime
+
+    pywikibot.output('%s files' % (len(texts),))
+    pywikibot.output('templatesWithParams parsing 4 times: %.3f ms per file' % (oldtime / len(texts) * 1000,))
+    pywikibot.output('Single scan: %.3f ms per file (%.1f times faster)' % (newtime / len(texts) * 1000,
+                                                                          oldtime / max(newtime, 1e-9)))
+
+
+def main(*args):
+    """
+    Save a corpus or run the benchmark
+    """
+    gen_factory = pagegenerators.GeneratorFactory()
+    corpusdirectory = None
+    benchmarkdirectory = None
+    for arg in pywikibot.handle_args(args):
+        if arg.startswith('-savecorpus:'):
+            corpusdirectory = arg[len('-savecorpus:'):]
+        elif arg.startswith('-benchmark:'):
+            benchmarkdirectory = arg[len('-benchmark:'):]
+        elif gen_factory.handle_arg(arg):
+            continue
+
+    if corpusdirectory:
+        generator = gen_factory.getCombinedGenerator(preload=True)
+        if not generator:
+            pywikibot.output('Add a generator to select the pages to save')
+            return
+        save_corpus(generator, corpusdirectory)
+    elif benchmarkdirectory:
+        benchmark(benchmarkdirectory)
+    else:
+        pywikibot.output('Use -savecorpus:<directory> with a generator or -benchmark:<directory>')
+
+
+if __name__ == "__main__":
+    main()
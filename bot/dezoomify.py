@@ -4,6 +4,17 @@
 TAKE A URL CONTAINING A PAGE CONTAINING A ZOOMIFY OBJECT, A ZOOMIFY BASE
 DIRECTORY OR A LIST OF THESE, AND RECONSTRUCT THE FULL RESOLUTION IMAGE
 
+The tiles are downloaded by a pool of threads that keep their connections open
+and the image is assembled one row of tiles (a strip) at a time. For TIFF output
+every strip is written to the file as soon as it's complete (BigTIFF when the
+image is over 4GB), so the memory use only depends on the width of the image.
+Other formats are converted from such a TIFF with pyvips if it's installed,
+otherwise the whole image is built in memory. Without pyvips images over
+MAX_MEMORY_PIXELS are refused before any tile is downloaded, use TIFF output
+for these.
+
+See dezoomify_benchmark.py to measure the speed against a local tile pyramid.
+
 License
 
 This software is licensed under the Expat License (also called the MIT license).
@@ -15,15 +26,32 @@ import sys, time, os
 import re
 import cStringIO
 import urllib, urlparse
+import httplib, socket
 import optparse
+import struct, zlib
+import threading
+import collections, itertools
+from multiprocessing.pool import ThreadPool
 
 from math import ceil, floor
 
 try:
-    import Image
+    from PIL import Image
+except ImportError:
+    try:
+        import Image
+    except ImportError:
+        print('Needs PIL to run. Exiting.')
+        sys.exit()
+
+try:
+    import pyvips
 except ImportError:
-    print('Needs PIL to run. Exiting.')
-    sys.exit()
+    pyvips = None
+
+# largest image (in pixels, about 800MB as RGB) built in memory for formats
+# that can't be written a strip at a time when pyvips isn't available
+MAX_MEMORY_PIXELS = 2**28
 
 def main():
 
@@ -46,6 +74,10 @@ def main():
                              help='save all tiles locally' )
     parser.add_option('-o', dest='out', action='store',\
                              help='the output file for the image (required)' )
+    parser.add_option('-t', dest='threads', action='store', default='8',\
+                             help='number of threads downloading tiles (default=8)' )
+    parser.add_option('-r', dest='retries', action='store', default='5',\
+                             help='number of attempts to get a tile before it is left blank (default=5)' )
 
     (opts, args) = parser.parse_args()
 
@@ -66,7 +98,7 @@ def main():
         if ((cont == 'n') or (cont == 'N') ):
             exit(-1)
 
-    Dezoomify(url=opts.url, out=opts.out, urlBase=opts.base, urlList=opts.list, debug=opts.debug, ext=opts.ext, qual=opts.qual, zoomLevel=opts.zoomLevel, store=opts.store)
+    Dezoomify(url=opts.url, out=opts.out, urlBase=opts.base, urlList=opts.list, debug=opts.debug, ext=opts.ext, qual=opts.qual, zoomLevel=opts.zoomLevel, store=opts.store, threads=int(opts.threads), retries=int(opts.retries))
 
 def urlConcat(url1, url2):
     #simple concatenation routine for parts of urls
@@ -83,6 +115,236 @@ def getFilePath(level, col, row, ext):
     name = str(level) + '-' + str(col) + '-' + str(row) + '.' + ext
     return name
 
+class TileFetcher():
+    """Download tiles with a pool of threads. Every thread keeps its own
+    connection open to each host so not every tile needs a new connection."""
+
+    def __init__(self, threads=8, retries=5, debug=False):
+        self.retries = retries
+        self.debug = debug
+        self.local = threading.local()
+        self.pool = ThreadPool(threads)
+
+    def getConnection(self, scheme, netloc):
+        connections = self.local.__dict__.setdefault('connections', {})
+        if (scheme, netloc) not in connections:
+            if scheme == 'https':
+                connections[(scheme, netloc)] = httplib.HTTPSConnection(netloc, timeout=60)
+            else:
+                connections[(scheme, netloc)] = httplib.HTTPConnection(netloc, timeout=60)
+        return connections[(scheme, netloc)]
+
+    def dropConnection(self, scheme, netloc):
+        connection = self.local.__dict__.get('connections', {}).pop((scheme, netloc), None)
+        if connection:
+            connection.close()
+
+    def fetch(self, url):
+        """Get the contents of the url. Dropped connections and server errors are
+        retried with an increasing delay, up to the number of retries.
+        Returns a tuple of the data (None on failure) and the HTTP code"""
+
+        delay = 0.2
+        code = None
+        for attempt in range(self.retries):
+            parsedURL = urlparse.urlsplit(url)
+            path = parsedURL.path or '/'
+            if parsedURL.query:
+                path = path + '?' + parsedURL.query
+            try:
+                connection = self.getConnection(parsedURL.scheme, parsedURL.netloc)
+                connection.request('GET', path)
+                response = connection.getresponse()
+                data = response.read()
+                code = response.status
+            except (httplib.HTTPException, socket.error):
+                self.dropConnection(parsedURL.scheme, parsedURL.netloc)
+                code = None
+            else:
+                if code in (301, 302, 303, 307, 308) and response.getheader('location'):
+                    url = urlparse.urljoin(url, response.getheader('location'))
+                    continue
+                if code == 200:
+                    return (data, code)
+                if code < 500: # not found or forbidden, trying again won't help
+                    return (None, code)
+
+            if self.debug:
+                print("INF: Failed to retreive tile (%s): retrying." % (code,))
+            time.sleep(delay) #wait a moment
+            delay = delay * 2
+        return (None, code)
+
+    def fetchTile(self, url):
+        """Get a tile and decode it. Done in the worker thread so the decoding
+        also happens in parallel.
+        Returns a tuple of the tile (None if missing or corrupt), the data and the HTTP code"""
+
+        (data, code) = self.fetch(url)
+        if data is None:
+            return (None, None, code)
+        try:
+            tile = Image.open(cStringIO.StringIO(data))
+            tile.load()
+        except IOError: #failure to read the image tile
+            return (None, data, code)
+        return (tile, data, code)
+
+    def fetchRows(self, rows, prefetch=2):
+        """Generator returning the fetched tiles for every row of tile urls, in
+        order. Only the next prefetch rows are downloaded ahead so the memory
+        use stays bounded when the assembling is slower than the network."""
+
+        rows = iter(rows)
+        pending = collections.deque()
+        for urls in itertools.islice(rows, prefetch):
+            pending.append(self.pool.map_async(self.fetchTile, urls, chunksize=1))
+        while pending:
+            result = pending.popleft().get()
+            for urls in itertools.islice(rows, 1):
+                pending.append(self.pool.map_async(self.fetchTile, urls, chunksize=1))
+            yield result
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+class StripTiffWriter():
+    """Write an RGB TIFF one strip at a time. The strips are deflate compressed
+    and the directory is written at the end, so nothing but the current strip
+    has to be kept in memory. Uses BigTIFF when the image could go over 4GB."""
+
+    SHORT = 3
+    LONG = 4
+    LONG8 = 16
+    FORMATS = { SHORT : 'H', LONG : 'I', LONG8 : 'Q' }
+
+    def __init__(self, filename, width, height, compress=True, bigTiff=None):
+        self.width = width
+        self.height = height
+        self.compress = compress
+        if bigTiff is None:
+            bigTiff = width * height * 3 > 2**32 - 2**24 # keep room for the directory
+        self.bigTiff = bigTiff
+        self.rowsPerStrip = None
+        self.stripOffsets = []
+        self.stripByteCounts = []
+
+        self.file = open(filename, 'wb')
+        if self.bigTiff:
+            self.file.write(struct.pack('<2sHHHQ', 'II', 43, 8, 0, 0))
+        else:
+            self.file.write(struct.pack('<2sHI', 'II', 42, 0))
+
+    def addStrip(self, strip):
+        # all strips but the last one need to have the same height
+        if self.rowsPerStrip is None:
+            self.rowsPerStrip = strip.size[1]
+        if strip.mode != 'RGB':
+            strip = strip.convert('RGB')
+        data = strip.tobytes()
+        if self.compress:
+            data = zlib.compress(data, 1) # the fast level, compressing is the bottleneck otherwise
+        self.stripOffsets.append(self.file.tell())
+        self.stripByteCounts.append(len(data))
+        self.file.write(data)
+
+    def close(self):
+        if self.bigTiff:
+            offsetType = self.LONG8
+            inlineSize = 8
+        else:
+            offsetType = self.LONG
+            inlineSize = 4
+
+        entries = [ (256, self.LONG, [self.width]),
+                    (257, self.LONG, [self.height]),
+                    (258, self.SHORT, [8, 8, 8]),
+                    (259, self.SHORT, [8 if self.compress else 1]),
+                    (262, self.SHORT, [2]), # RGB
+                    (273, offsetType, self.stripOffsets),
+                    (277, self.SHORT, [3]),
+                    (278, self.LONG, [self.rowsPerStrip or self.height]),
+                    (279, offsetType, self.stripByteCounts),
+                    (284, self.SHORT, [1]),
+                    ]
+
+        # values that don't fit in the directory entry go before the directory
+        directory = []
+        for (tag, fieldType, values) in entries:
+            data = struct.pack('<%d%s' % (len(values), self.FORMATS[fieldType]), *values)
+            if len(data) > inlineSize:
+                if self.file.tell() % 2:
+                    self.file.write('\0')
+                offset = self.file.tell()
+                self.file.write(data)
+                data = struct.pack('<Q' if self.bigTiff else '<I', offset)
+            directory.append((tag, fieldType, len(values), data.ljust(inlineSize, '\0')))
+
+        if self.file.tell() % 2:
+            self.file.write('\0')
+        directoryOffset = self.file.tell()
+        if self.bigTiff:
+            self.file.write(struct.pack('<Q', len(directory)))
+            for (tag, fieldType, count, data) in directory:
+                self.file.write(struct.pack('<HHQ', tag, fieldType, count) + data)
+            self.file.write(struct.pack('<Q', 0))
+            self.file.seek(8)
+            self.file.write(struct.pack('<Q', directoryOffset))
+        else:
+            self.file.write(struct.pack('<H', len(directory)))
+            for (tag, fieldType, count, data) in directory:
+                self.file.write(struct.pack('<HHI', tag, fieldType, count) + data)
+            self.file.write(struct.pack('<I', 0))
+            self.file.seek(4)
+            self.file.write(struct.pack('<I', directoryOffset))
+        self.file.close()
+
+class ImageStripWriter():
+    """Put the strips in one image in memory and save it at the end. Used for
+    formats that can't be written a strip at a time when pyvips isn't
+    available, so the memory use is the size of the whole image."""
+
+    def __init__(self, filename, width, height, qual='75'):
+        self.filename = filename
+        self.qual = qual
+        self.y = 0
+        try:
+            self.image = Image.new('RGB', (width, height), "#000000")
+        except MemoryError:
+            print "ERR: Image too large to fit into memory. Exiting"
+            raise IOError()
+
+    def addStrip(self, strip):
+        self.image.paste(strip, (0, self.y))
+        self.y += strip.size[1]
+
+    def close(self):
+        self.image.save(self.filename, quality=int(self.qual) )
+
+class VipsStripWriter(StripTiffWriter):
+    """Write the strips to a temporary TIFF and let vips convert it to the
+    output format. vips reads the TIFF sequentially, so it's never completely
+    in memory either."""
+
+    def __init__(self, filename, width, height, qual='75'):
+        self.filename = filename
+        self.qual = qual
+        self.tempFilename = filename + '.strips.tif'
+        StripTiffWriter.__init__(self, self.tempFilename, width, height)
+
+    def close(self):
+        StripTiffWriter.close(self)
+        try:
+            image = pyvips.Image.new_from_file(self.tempFilename, access='sequential')
+            root, ext = os.path.splitext(self.filename)
+            if ext.lower() in ('.jpg', '.jpeg', '.webp'):
+                image.write_to_file(self.filename, Q=int(self.qual))
+            else:
+                image.write_to_file(self.filename)
+        finally:
+            os.remove(self.tempFilename)
+
 class Dezoomify():
 
     def getImageDirectory(self, url):
@@ -232,53 +494,63 @@ class Dezoomify():
         return index
 
 
-    def constructBlankImage(self):
-        try:
-            self.image = Image.new('RGB', (self.width, self.height), "#000000")
-        except MemoryError:
-            print "ERR: Image too large to fit into memory. Exiting"
+    def getWriter(self, destination):
+        # choose how to write the image: streaming for TIFF, vips if available, in memory otherwise
+        root, ext = os.path.splitext(destination)
+        if ext.lower() in ('.tif', '.tiff'):
+            return StripTiffWriter(destination, self.width, self.height)
+        elif pyvips:
+            return VipsStripWriter(destination, self.width, self.height, qual=self.qual)
+        elif self.width * self.height > MAX_MEMORY_PIXELS:
+            print "ERR: Image of %dx%d pixels too large to build in memory. Use TIFF output or install pyvips. Exiting" % (self.width, self.height)
             raise IOError()
-        return
+        else:
+            return ImageStripWriter(destination, self.width, self.height, qual=self.qual)
 
     def blankTile(self):
         return Image.new('RGB', (self.tileSize, self.tileSize), "#000000")
 
 
-    def addTiles(self, imageDir):
-        for col in range(self.xTiles):
-            for row in range(self.yTiles):
+    def getTileUrl(self, imageDir, col, row):
+        tileIndex = self.getTileIndex(self.zoomLevel, col, row)
+        tileGroup = tileIndex // 256
 
-                tileIndex = self.getTileIndex(self.zoomLevel, col, row)
-                tileGroup = tileIndex // 256
+        if self.debug:
+            print("\tINF: Getting image number (row, col): " + str(row).rjust(2) +', ' + str(col).rjust(2)  + ': Index: '+ str(tileIndex).rjust(3) + ', Tilegroup: %d'% tileGroup)
 
-                if self.debug:
-                    print("\tINF: Getting image number (row, col): " + str(row).rjust(2) +', ' + str(col).rjust(2)  + ': Index: '+ str(tileIndex).rjust(3) + ', Tilegroup: %d'% tileGroup)
-
-                filepath = getFilePath(self.zoomLevel, col, row, self.ext) #construct the filename (zero indexed level)
-                url = imageDir + '/' + 'TileGroup%d'%tileGroup + '/' + filepath
-
-                while True: #loop to protect against a dropped connection
-                    try:
-                        tileFile = urllib.urlopen(url)
-                        break
-                    except:
-                        time.sleep(0.2) #wait a moment
-                        if self.debug:
-                            print "INF: Failed to retreive tile: retrying."
-
-                #construct the image using the data.
-                try:
-                    imageData = cStringIO.StringIO(tileFile.read()) # constructs a StringIO holding the image
-                    tile = Image.open(imageData)
-                except IOError: #failure to read the image tile
+        filepath = getFilePath(self.zoomLevel, col, row, self.ext) #construct the filename (zero indexed level)
+        return imageDir + '/' + 'TileGroup%d'%tileGroup + '/' + filepath
+
+
+    def addTiles(self, imageDir, writer):
+        # only the tiles that overlap the image at this zoom level
+        xTiles = min(self.xTiles, int(ceil(self.width/float(self.tileSize))))
+        yTiles = min(self.yTiles, int(ceil(self.height/float(self.tileSize))))
+
+        rows = ([self.getTileUrl(imageDir, col, row) for col in range(xTiles)] for row in range(yTiles))
+
+        for row, tiles in enumerate(self.fetcher.fetchRows(rows, prefetch=self.prefetch)):
+            stripHeight = min(self.tileSize, self.height - self.tileSize*row)
+            strip = Image.new('RGB', (self.width, stripHeight), "#000000")
+
+            for col, (tile, data, code) in enumerate(tiles):
+                if tile is None:
                     if self.debug:
-                        print ('\t\tERR: Tile not found or corrupted, skipping. HTTP code:%d' % (tileFile.code))
+                        print ('\t\tERR: Tile not found or corrupted, skipping. HTTP code:%s' % (code,))
                     tile = self.blankTile() #make a blank tile instead
 
                 if self.store:
-                    tile.save(os.path.join(self.store , filepath), quality=int(self.qual) ) #save the tile
+                    filepath = getFilePath(self.zoomLevel, col, row, self.ext)
+                    if data:
+                        tileFile = open(os.path.join(self.store , filepath), 'wb') #save the tile as downloaded
+                        tileFile.write(data)
+                        tileFile.close()
+                    else:
+                        tile.save(os.path.join(self.store , filepath), quality=int(self.qual) )
+
+                strip.paste(tile, (self.tileSize*col, 0)) #paste into position
 
-                self.image.paste(tile, (self.tileSize*col, self.tileSize*row)) #paste into position
+            writer.addStrip(strip)
 
 
     def getUrls(self, url, urlBase, urlList): #returns a list of base URLs for the given Dezoomify object(s)
@@ -314,7 +586,7 @@ class Dezoomify():
 
 
 
-    def __init__(self, url, out, urlBase=False, urlList=False, debug=False, ext=u'jpg', qual='75', zoomLevel=False, store=False):
+    def __init__(self, url, out, urlBase=False, urlList=False, debug=False, ext=u'jpg', qual='75', zoomLevel=False, store=False, threads=8, retries=5, prefetch=2):
         self.url = url
         self.out = out
         self.urlBase = urlBase
@@ -324,6 +596,8 @@ class Dezoomify():
         self.qual = qual
         self.zoomLevel = zoomLevel
         self.store = store
+        self.prefetch = prefetch
+        self.fetcher = TileFetcher(threads=threads, retries=retries, debug=debug)
 
         self.setupDirectory()
         self.getUrls(self.url, self.urlBase, self.urlList)
@@ -333,22 +607,23 @@ class Dezoomify():
 
             self.getProperties(imageDir, self.zoomLevel)       # inspect the ImageProperties.xml file to get properties, and derive the rest
 
-            self.constructBlankImage() # create the blank image to fill with tiles
-            self.addTiles(imageDir)            # find, download and paste tiles into place
-
             if self.urlList: #add a suffix to the output file names if needed
                 root, ext = os.path.splitext(self.out)
                 destination = root + '%03d' % i + ext
             else:
                 destination = self.out
-            
-            self.image.save(destination, quality=int(self.qual) ) #save the dezoomified file
+
+            writer = self.getWriter(destination)  # where the strips of tiles go
+            self.addTiles(imageDir, writer)        # find, download and paste tiles into place
+            writer.close()                         # save the dezoomified file
 
             if self.debug:
                 print( 'INF: Dezoomifed image created and saved to ' + destination )
 
             i += 1
 
+        self.fetcher.close()
+
 if __name__ == "__main__":
     try:
         main()
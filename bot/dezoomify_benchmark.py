@@ -0,0 +1,151 @@
+#!/usr/bin/python
+# coding=utf8
+'''
+BENCHMARK DEZOOMIFY AGAINST A LOCALLY SERVED ZOOMIFY TILE PYRAMID
+
+Builds a synthetic tile pyramid in a temporary directory (tile by tile, so the
+full image never has to fit in memory), serves it on localhost with a delay
+per request to act like a remote museum server and dezoomifies it with one
+thread and with the given number of threads. The outputs are compared to make
+sure the parallel version builds exactly the same image.
+
+Example: python dezoomify_benchmark.py -w 8000 -h 6000 -l 20 -t 16
+'''
+
+import sys, time, os
+import shutil, tempfile
+import threading
+import optparse
+import BaseHTTPServer, SimpleHTTPServer, SocketServer
+
+from math import ceil
+
+import dezoomify
+from dezoomify import Image
+
+def main():
+
+    parser = optparse.OptionParser(usage='Usage: %prog <options>', add_help_option=False)
+    parser.add_option('--help', action='help',\
+                             help='show this help message and exit' )
+    parser.add_option('-w', dest='width', action='store', default='4000',\
+                             help='width of the image (default=4000)' )
+    parser.add_option('-h', dest='height', action='store', default='3000',\
+                             help='height of the image (default=3000)' )
+    parser.add_option('-s', dest='tileSize', action='store', default='256',\
+                             help='tile size (default=256)' )
+    parser.add_option('-l', dest='latency', action='store', default='20',\
+                             help='delay per request in milliseconds (default=20)' )
+    parser.add_option('-t', dest='threads', action='store', default='8',\
+                             help='number of threads for the parallel run (default=8)' )
+    parser.add_option('-o', dest='ext', action='store', default='tif',\
+                             help='output format (default=tif)' )
+
+    (opts, args) = parser.parse_args()
+
+    runBenchmark(int(opts.width), int(opts.height), int(opts.tileSize), int(opts.latency)/1000.0, int(opts.threads), opts.ext)
+
+def getLevelSizes(width, height, tileSize):
+    # the size of every zoom level in pixels, smallest first, the same way Dezoomify.getMaxZoom counts the levels
+    levels = 1
+    xTiles = int(ceil(width/float(tileSize)))
+    yTiles = int(ceil(height/float(tileSize)))
+    while xTiles > 1 or yTiles > 1:
+        xTiles = int(ceil(xTiles/2.0))
+        yTiles = int(ceil(yTiles/2.0))
+        levels += 1
+
+    return [ (width // 2**(levels - level - 1), height // 2**(levels - level - 1)) for level in range(levels) ]
+
+def makePyramid(directory, width, height, tileSize):
+    """Write the tiles and ImageProperties.xml of a Zoomify pyramid of a
+    mandelbrot image. Returns the number of tiles at the deepest level"""
+
+    tileIndex = 0 # tiles are numbered through all levels, 256 in every TileGroup
+    for level, (levelWidth, levelHeight) in enumerate(getLevelSizes(width, height, tileSize)):
+        xTiles = int(ceil(levelWidth/float(tileSize)))
+        yTiles = int(ceil(levelHeight/float(tileSize)))
+        for row in range(yTiles):
+            for col in range(xTiles):
+                tileWidth = min(tileSize, levelWidth - tileSize*col)
+                tileHeight = min(tileSize, levelHeight - tileSize*row)
+                extent = ( -2.5 + 3.5 * tileSize*col / float(levelWidth),
+                           -1.25 + 2.5 * tileSize*row / float(levelHeight),
+                           -2.5 + 3.5 * (tileSize*col + tileWidth) / float(levelWidth),
+                           -1.25 + 2.5 * (tileSize*row + tileHeight) / float(levelHeight) )
+                tile = Image.effect_mandelbrot((tileWidth, tileHeight), extent, 64).convert('RGB')
+
+                tileGroup = os.path.join(directory, 'TileGroup%d' % (tileIndex // 256))
+                if not os.path.exists(tileGroup):
+                    os.mkdir(tileGroup)
+                tile.save(os.path.join(tileGroup, dezoomify.getFilePath(level, col, row, 'jpg')), quality=90)
+                tileIndex += 1
+
+    propertiesFile = open(os.path.join(directory, 'ImageProperties.xml'), 'w')
+    propertiesFile.write('<IMAGE_PROPERTIES WIDTH="%d" HEIGHT="%d" NUMTILES="%d" NUMIMAGES="1" VERSION="1.8" TILESIZE="%d"/>' % (width, height, tileIndex, tileSize))
+    propertiesFile.close()
+    return xTiles * yTiles
+
+def servePyramid(directory, latency):
+    """Serve the directory on a free port on localhost in a background thread,
+    with keep-alive and a delay for every request. Returns the server"""
+
+    class LatencyHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True # otherwise every keep-alive response waits for a delayed ACK
+
+        def translate_path(self, path):
+            return os.path.join(directory, path.lstrip('/'))
+
+        def do_GET(self):
+            time.sleep(latency)
+            SimpleHTTPServer.SimpleHTTPRequestHandler.do_GET(self)
+
+        def log_message(self, format, *args):
+            return
+
+    class ThreadingServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+        daemon_threads = True
+
+    server = ThreadingServer(('127.0.0.1', 0), LatencyHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+def runBenchmark(width, height, tileSize, latency, threads, ext):
+    directory = tempfile.mkdtemp(prefix='dezoomify_benchmark')
+    try:
+        pyramid = os.path.join(directory, 'pyramid')
+        os.mkdir(pyramid)
+        start = time.time()
+        tiles = makePyramid(pyramid, width, height, tileSize)
+        print('INF: Made a pyramid of %dx%d pixels with %d tiles at full resolution in %.1f seconds' % (width, height, tiles, time.time() - start))
+
+        server = servePyramid(pyramid, latency)
+        url = 'http://127.0.0.1:%d' % (server.server_address[1],)
+
+        outputs = []
+        for runThreads in sorted(set([1, threads])):
+            destination = os.path.join(directory, 'threads%d.%s' % (runThreads, ext))
+            start = time.time()
+            dezoomify.Dezoomify(url=url, out=destination, urlBase=True, qual='90', threads=runThreads)
+            elapsed = time.time() - start
+            print('INF: %2d thread(s): %.2f seconds, %.1f tiles/second, %.1f megapixels/second, output %.1f MB' % (runThreads, elapsed, tiles/elapsed,
+                  width*height/elapsed/10**6, os.path.getsize(destination)/float(2**20)))
+            outputs.append(destination)
+
+        server.shutdown()
+
+        if len(outputs) > 1:
+            first = Image.open(outputs[0])
+            second = Image.open(outputs[1])
+            if first.size == (width, height) and first.tobytes() == second.tobytes():
+                print('INF: The outputs are identical')
+            else:
+                print('ERR: The outputs are different')
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
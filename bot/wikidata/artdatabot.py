@@ -10,27 +10,63 @@ import pywikibot.data.sparql
 import datetime
 import time
 import itertools
+import os
+import sqlite3
 import copy
 import requests
+import threading
+import materials
+import date_parser
+import wayback_queue
+import sparql_client
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pywikibot import pagegenerators
+
+
+def thread_local_queue(name, doc):
+    """
+    Make a property that stores the value in the thread local state of the bot
+    :param name: The name of the attribute in the thread local state
+    :param doc: The docstring of the property
+    :return: property
+    """
+    def getter(self):
+        return getattr(self.get_thread_state(), name, None)
+
+    def setter(self, value):
+        setattr(self.get_thread_state(), name, value)
+
+    return property(getter, setter, doc=doc)
+
 
 class ArtDataBot:
     """
     A bot to enrich and create paintings on Wikidata
     """
-    def __init__(self, dictGenerator, create=False):
+    def __init__(self, dictGenerator, create=False, prefetch=50, workers=0, max_edits_per_minute=None,
+                 id_cache_file=None):
         """
         Arguments:
             * generator    - A generator that yields Dict objects.
             The dict in this generator needs to contain 'idpid' and 'collectionqid'
             * create       - Boolean to say if you want to create new items or just update existing
+            * prefetch     - Number of records to read ahead and load the existing items for in one go
+            * workers      - Number of worker threads to update items with. 0 updates everything in order
+            * max_edits_per_minute - Cap on the edit rate when using workers
+            * id_cache_file - The SQLite file to keep the id cache in. False to always run the full query
 
         """
         firstrecord = next(dictGenerator)
         self.generator = itertools.chain([firstrecord], dictGenerator)
         self.repo = pywikibot.Site().data_repository()
-        self.wayback_session = requests.Session()
         self.create = create
+        self.prefetch = prefetch
+        self.workers = workers
+        self.max_edits_per_minute = max_edits_per_minute
+        self.id_cache = None
+        if id_cache_file is not False:
+            self.id_cache = ArtworkIdCache(id_cache_file)
         
         self.idProperty = firstrecord.get(u'idpid')
         self.collectionqid = firstrecord.get(u'collectionqid')
@@ -42,7 +78,6 @@ class ArtDataBot:
         Build an ID cache so we can quickly look up the id's for property
         """
         result = {}
-        sq = pywikibot.data.sparql.SparqlQuery()
 
         # FIXME: Do something with the collection qualifier
         #query = u'SELECT ?item ?id WHERE { ?item wdt:P195 wd:%s . ?item wdt:%s ?id }' % (collectionqid, idProperty)
@@ -53,36 +88,215 @@ class ArtDataBot:
         ?idstatement ps:%s ?id
         MINUS { ?idstatement wikibase:rank wikibase:DeprecatedRank }
         }""" % (collectionqid, idProperty, collectionqid, idProperty)
-        sq = pywikibot.data.sparql.SparqlQuery()
-        queryresult = sq.select(query)
+        if getattr(self, 'id_cache', None):
+            return self.id_cache.get_lookup_table((collectionqid, idProperty), query)
+        # Never use an old result here, that would lead to duplicate items
+        queryresult = sparql_client.SparqlClient().select(query, ttl=datetime.timedelta(0))
 
         for resultitem in queryresult:
             qid = resultitem.get('item').replace(u'http://www.wikidata.org/entity/', u'')
             result[resultitem.get('id')] = qid
         pywikibot.output(u'The query "%s" returned %s items' % (query, len(result)))
         return result
+
+    def store_artwork_id(self, cache_key, artwork_ids, artwork_id, qid):
+        """
+        Add a newly created item to the id lookup table and to the id cache on disk
+        :param cache_key: Tuple of the collection and the id property
+        :param artwork_ids: The id lookup table
+        :param artwork_id: The identifier
+        :param qid: The id of the new Wikidata item
+        :return: Nothing
+        """
+        artwork_ids[artwork_id] = qid
+        if getattr(self, 'id_cache', None):
+            self.id_cache.add(cache_key, artwork_id, qid)
                         
     def run(self):
         """
         Starts the robot.
         """
-        for metadata in self.generator:
-            metadata = self.enrichMetadata(metadata)
+        self.start_workers()
+        try:
+            for metadata_batch in self.get_metadata_batches(self.generator):
+                prefetched_items = self.prefetch_artwork_items(metadata_batch, self.artworkIds, u'id')
+                for metadata in metadata_batch:
+                    self.process_metadata(metadata, prefetched_items)
+        finally:
+            self.stop_workers()
+            self.stop_wayback_queue()
+            materials.save_unmatched_report()
+            date_parser.report_unparsed()
+            date_parser.save_corpus()
+
+    def start_workers(self):
+        """
+        Start the worker pool if workers are configured.
+
+        Looking up and creating items is still done in the main thread to prevent duplicates. Only updating
+        existing items is handed to the workers. The pywikibot write throttle is shared by all threads so
+        that is used to cap the edit rate.
+        """
+        self.executor = None
+        self.pending_updates = {}
+        workers = getattr(self, 'workers', 0)
+        if not workers:
+            return
+        if getattr(self, 'max_edits_per_minute', None):
+            self.repo.throttle.setDelays(writedelay=60.0 / self.max_edits_per_minute)
+        pywikibot.output('Starting %s workers to update items' % (workers,))
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def stop_workers(self):
+        """
+        Wait for all the pending updates to finish and shut down the worker pool.
+        """
+        if not getattr(self, 'executor', None):
+            return
+        try:
+            self.wait_for_updates(0)
+        finally:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def schedule_update(self, artworkItem, metadata):
+        """
+        Update the item right away or hand it to the worker pool if that's running.
+
+        Updates on the same item are never done at the same time, a new update waits for the previous one. Redirects
+        are resolved first so two id's pointing to a redirect and to its target end up on the same item.
+
+        :param artworkItem: The artwork item to work on
+        :param metadata: All the metadata about this artwork
+        :return: Nothing
+        """
+        if not getattr(self, 'executor', None):
+            self.update_existing_item(artworkItem, metadata)
+            return
+        if artworkItem.exists() and artworkItem.isRedirectPage():
+            artworkItem = artworkItem.getRedirectTarget()
+        qid = artworkItem.title()
+        previous_update = self.pending_updates.get(qid)
+        if previous_update:
+            previous_update.result()
+        self.pending_updates[qid] = self.executor.submit(self.update_existing_item, artworkItem, metadata)
+        # Don't read too far ahead of the workers
+        self.wait_for_updates(self.workers * 2)
+
+    def wait_for_updates(self, max_pending):
+        """
+        Wait until no more than max_pending updates are still running. Errors in the workers are raised here.
+
+        :param max_pending: The number of updates that is allowed to still be running
+        :return: Nothing
+        """
+        while True:
+            for qid, future in list(self.pending_updates.items()):
+                if future.done():
+                    del self.pending_updates[qid]
+                    future.result()
+            if len(self.pending_updates) <= max_pending:
+                return
+            oldest_update = next(iter(self.pending_updates.values()))
+            oldest_update.result()
+
+    def update_existing_item(self, artworkItem, metadata):
+        """
+        Update the artwork item if it exists. Redirects are followed.
+
+        :param artworkItem: The artwork item to work on
+        :param metadata: All the metadata about this artwork
+        :return: Nothing
+        """
+        if artworkItem.exists():
+            if artworkItem.isRedirectPage():
+                artworkItem = artworkItem.getRedirectTarget()
+            metadata['wikidata'] = artworkItem.title()
+            self.updateArtworkItem(artworkItem, metadata)
+
+    # The changes queued for the item being updated. Every worker thread has its own queues.
+    statements_queue = thread_local_queue('statements_queue', 'New statements as JSON')
+    changed_claims_queue = thread_local_queue('changed_claims_queue', 'Existing claims that were modified')
+    labels_queue = thread_local_queue('labels_queue', 'Missing labels')
+    descriptions_queue = thread_local_queue('descriptions_queue', 'Missing or replaced descriptions')
+    disambiguated_descriptions_queue = thread_local_queue('disambiguated_descriptions_queue',
+                                                          'Descriptions to use if the label/description is taken')
+
+    def get_thread_state(self):
+        """
+        Get the thread local state. Created on first use because subclasses don't always call __init__
+        """
+        if '_thread_state' not in self.__dict__:
+            self.__dict__['_thread_state'] = threading.local()
+        return self.__dict__['_thread_state']
+
+    def get_metadata_batches(self, generator):
+        """
+        Read ahead in the generator and yield lists of metadata dicts
+
+        :param generator: The generator that yields the metadata dicts
+        :return: Generator of lists of at most self.prefetch metadata dicts
+        """
+        batch_size = getattr(self, 'prefetch', 1) or 1
+        while True:
+            metadata_batch = list(itertools.islice(generator, batch_size))
+            if not metadata_batch:
+                return
+            yield metadata_batch
+
+    def prefetch_artwork_items(self, metadata_batch, artwork_ids, id_field):
+        """
+        Load all the existing artwork items for a batch of metadata in as few requests as possible.
+
+        The items are fetched with wbgetentities in batches of 50 ids. Redirects are resolved by the API in the
+        same request.
+
+        :param metadata_batch: List of metadata dicts
+        :param artwork_ids: The id cache to look up the Wikidata id's in
+        :param id_field: The field in the metadata that contains the identifier
+        :return: Dict with the Wikidata id as key and the loaded ItemPage as value
+        """
+        qids = []
+        for metadata in metadata_batch:
+            qid = artwork_ids.get(metadata.get(id_field))
+            if qid and qid not in qids:
+                qids.append(qid)
+        if len(qids) < 2:
+            # Not worth the trouble, just let the item load itself
+            return {}
 
-            artworkItem = None
-            if metadata[u'id'] in self.artworkIds:
-                artworkItemTitle = self.artworkIds.get(metadata[u'id'])
-                print (artworkItemTitle)
+        result = {}
+        items = [pywikibot.ItemPage(self.repo, title=qid) for qid in qids]
+        for item in pagegenerators.PreloadingEntityGenerator(items, groupsize=50):
+            result[item.title()] = item
+        requests_made = (len(qids) + 49) // 50
+        pywikibot.output('Prefetched %s of %s items in %s request(s)' % (len(result), len(qids), requests_made))
+        return result
+
+    def process_metadata(self, metadata, prefetched_items):
+        """
+        Work on a single metadata dict. Look up or create the item and update it.
+
+        :param metadata: The metadata dict of one artwork
+        :param prefetched_items: Dict of already loaded items from prefetch_artwork_items
+        :return: Nothing
+        """
+        metadata = self.enrichMetadata(metadata)
+
+        artworkItem = None
+        if metadata[u'id'] in self.artworkIds:
+            artworkItemTitle = self.artworkIds.get(metadata[u'id'])
+            print (artworkItemTitle)
+            if artworkItemTitle in prefetched_items:
+                artworkItem = prefetched_items.get(artworkItemTitle)
+            else:
                 artworkItem = pywikibot.ItemPage(self.repo, title=artworkItemTitle)
 
-            elif self.create:
-                artworkItem = self.createArtworkItem(metadata)
+        elif self.create:
+            artworkItem = self.createArtworkItem(metadata)
 
-            if artworkItem and artworkItem.exists():
-                if artworkItem.isRedirectPage():
-                    artworkItem = artworkItem.getRedirectTarget()
-                metadata['wikidata'] = artworkItem.title()
-                self.updateArtworkItem(artworkItem, metadata)
+        if artworkItem:
+            self.schedule_update(artworkItem, metadata)
 
     def enrichMetadata(self, metadata):
         """
@@ -175,43 +389,75 @@ class ArtDataBot:
 
         artworkItemTitle = result.get(u'entity').get('id')
 
-        # Make a backup to the Wayback Machine when we have to wait anyway
+        # Make a backup to the Wayback Machine in the background
         self.doWaybackup(metadata)
 
-        # Wikidata is sometimes lagging. Wait for additional 5 seconds before trying to actually use the item
-        time.sleep(5)
-
-        artworkItem = pywikibot.ItemPage(self.repo, title=artworkItemTitle)
+        artworkItem = self.get_created_item(artworkItemTitle)
 
         # Add to self.artworkIds so that we don't create dupes
-        self.artworkIds[metadata[u'id']] = artworkItemTitle
+        self.store_artwork_id((self.collectionqid, self.idProperty), self.artworkIds, metadata[u'id'],
+                              artworkItemTitle)
 
         return artworkItem
 
+    def get_created_item(self, title, max_wait=10):
+        """
+        Get an item that was just created. Wikidata is sometimes lagging, so wait until the item can be found
+        before it's used. Usually it's there right away, otherwise it's tried again with increasing waits.
+
+        :param title: The qid of the new item
+        :param max_wait: Maximum number of seconds to wait
+        :return: pywikibot.ItemPage
+        """
+        wait = 0.5
+        waited = 0
+        while True:
+            # A new ItemPage every time, exists() remembers that it was missing
+            item = pywikibot.ItemPage(self.repo, title=title)
+            if item.exists():
+                return item
+            if waited >= max_wait:
+                pywikibot.output('The new item %s still can not be found after %s seconds' % (title, waited))
+                return item
+            time.sleep(wait)
+            waited += wait
+            wait *= 2
+
     def doWaybackup(self, metadata):
         """
         Links to paintings are subject to link rot. When creating a new item, have the Wayback Machine make a snapshot.
         That way always have a copy of the page we used to source a bunch of statements.
 
+        The url's are added to the persistent Wayback queue and submitted in the background.
+
         See also https://www.wikidata.org/wiki/Wikidata:WikiProject_sum_of_all_paintings/Link_rot
 
         :param metadata: Metadata containing url fields
         :return: Nothing
         """
         urfields = [u'url', u'idrefurl', u'refurl', u'describedbyurl', u'imagesourceurl']
-        doneurls = []
+        backup_queue = self.get_wayback_queue()
         for urlfield in urfields:
             url = metadata.get(urlfield)
-            if url and url not in doneurls:
-                pywikibot.output ('Backing up this url to the Wayback Machine: %s' % (url,))
-                waybackUrl = 'https://web.archive.org/save/%s' % (url,)
-                try:
-                    waybackPage = self.wayback_session.post(waybackUrl)
-                except requests.exceptions.RequestException as err:
-                    pywikibot.output('Requests threw an exception. The wayback backup failed')
-                    print(err)
-                    pass
-                doneurls.append(url)
+            if url:
+                backup_queue.add(url)
+
+    def get_wayback_queue(self):
+        """
+        Get the Wayback queue. It's started on first use so bots that never create items don't start threads.
+        """
+        if not getattr(self, 'wayback_queue', None):
+            self.wayback_queue = wayback_queue.WaybackQueue()
+            self.wayback_queue.start()
+        return self.wayback_queue
+
+    def stop_wayback_queue(self):
+        """
+        Stop the Wayback queue. What's left in it will be done on the next run.
+        """
+        if getattr(self, 'wayback_queue', None):
+            self.wayback_queue.stop()
+            pywikibot.output('Wayback queue status: %s' % (self.wayback_queue.get_counts(),))
 
     def updateArtworkItem(self, artworkItem, metadata):
         """
@@ -221,13 +467,13 @@ class ArtDataBot:
         :return: Nothing, updates item in place
         """
 
+        self.reset_queue()
+
         # Add the (missing) labels to the item based on the title.
-        self.addLabels(artworkItem, metadata)
+        self.addLabels(artworkItem, metadata, queue=True)
 
         # Add the (missing) descriptions to the item.
-        self.addDescriptions(artworkItem, metadata)
-
-        self.statements_queue = []
+        self.addDescriptions(artworkItem, metadata, queue=True)
 
         # Add instance of (P31) to the item.
         self.addItemStatement(artworkItem, u'P31', metadata.get(u'instanceofqid'), metadata.get(u'refurl'), queue=True)
@@ -292,10 +538,10 @@ class ArtDataBot:
         self.addCollectionLink(artworkItem, metadata, queue=True)
 
         # Update the collection with a start and end date
-        self.updateCollection(artworkItem, metadata)
+        self.updateCollection(artworkItem, metadata, queue=True)
 
         # Add extra collections
-        self.add_extra_collections(artworkItem, metadata)
+        self.add_extra_collections(artworkItem, metadata, queue=True)
 
         # Add catalog code
         self.addCatalogCode(artworkItem, metadata, queue=True)
@@ -303,10 +549,10 @@ class ArtDataBot:
         # Add Iconclass
         self.add_iconclass(artworkItem, metadata, queue=True)
 
-        # Save all the queued statements
+        # Save all the queued changes in one edit
         self.save_statements(artworkItem)
 
-    def addLabels(self, item, metadata):
+    def addLabels(self, item, metadata, queue=False):
         """
         Add the (missing) labels to the item based.
 
@@ -315,7 +561,11 @@ class ArtDataBot:
         :return: Nothing, updates item in place
         """
         labels = item.get().get('labels')
-        if metadata.get('labels'):
+        if metadata.get('labels') and queue:
+            for lang, label in metadata['labels'].items():
+                if lang not in labels:
+                    self.labels_queue[lang] = label
+        elif metadata.get('labels'):
             labelschanged = False
             for lang, label in metadata['labels'].items():
                 if lang not in labels:
@@ -330,7 +580,7 @@ class ArtDataBot:
                     pywikibot.output(u'Oops, already had that label/description combination. Skipping')
                     pass
 
-    def addDescriptions(self, item, metadata):
+    def addDescriptions(self, item, metadata, queue=False):
         """
         Add the (missing) descriptions to the item
 
@@ -346,7 +596,17 @@ class ArtDataBot:
                                 'nl': 'schilderij',
                                 }
 
-        if metadata.get('description'):
+        if metadata.get('description') and queue:
+            disambiguation_text = self.get_disambiguation_text(metadata)
+            for lang, description in metadata['description'].items():
+                if lang not in descriptions:
+                    self.descriptions_queue[lang] = description
+                    if disambiguation_text:
+                        self.disambiguated_descriptions_queue[lang] = '%s (%s)' % (description, disambiguation_text,)
+                elif lang in replace_descriptions:
+                    if descriptions.get(lang).lower() == replace_descriptions.get(lang).lower():
+                        self.descriptions_queue[lang] = description
+        elif metadata.get('description'):
             descriptionschanged = False
             for lang, description in metadata['description'].items():
                 if lang not in descriptions:
@@ -363,11 +623,7 @@ class ArtDataBot:
                 except pywikibot.exceptions.OtherPageSaveError: # pywikibot.exceptions.APIError:
                     # We got ourselves a duplicate label and description, let's correct that by adding collection and the id
                     descriptions = copy.deepcopy(item.get().get('descriptions'))
-                    disambiguation_text = None
-                    if metadata.get('collectionshort') and metadata.get('id'):
-                        disambiguation_text = '%s %s' % (metadata['collectionshort'], metadata['id'],)
-                    elif metadata.get('artworkid'):
-                        disambiguation_text = metadata['artworkid']
+                    disambiguation_text = self.get_disambiguation_text(metadata)
                     if disambiguation_text:
                         pywikibot.output(u'Oops, already had that label/description combination. Trying again')
                         for lang, description in metadata['description'].items():
@@ -378,6 +634,18 @@ class ArtDataBot:
                         except pywikibot.exceptions.OtherPageSaveError:
                             pywikibot.output('Disambiguation (%s) did not work, skipping' % (disambiguation_text,))
 
+    def get_disambiguation_text(self, metadata):
+        """
+        Get the text to add to descriptions in case the label/description combination is already taken
+        :param metadata: All the metadata about this artwork
+        :return: The disambiguation text or None
+        """
+        if metadata.get('collectionshort') and metadata.get('id'):
+            return '%s %s' % (metadata['collectionshort'], metadata['id'],)
+        elif metadata.get('artworkid'):
+            return metadata['artworkid']
+        return None
+
 
     def add_creator(self, item, metadata, queue=False):
         """
@@ -411,6 +679,7 @@ class ArtDataBot:
                 newqualifier.setTarget(attribution_item)
 
                 if queue:
+                    self.queue_qualifier(newclaim, newqualifier)
                     self.addReference(item, newclaim, metadata['refurl'], queue=True)
                     self.statements_queue.append(newclaim.toJSON())
                 else:
@@ -549,6 +818,17 @@ class ArtDataBot:
             # Already has inception. Could add logic for sourcing
             return
 
+        inception = metadata.get('inception')
+        if inception and not (type(inception) is int or (len(inception)==4 and inception.isnumeric())):
+            # Something like "c. 1650" or "17th century", let the shared parser turn it into the inception fields
+            parsed_inception = date_parser.parse_inception(inception)
+            if not parsed_inception:
+                pywikibot.output('Can not parse inception "%s", skipping' % (inception,))
+                return
+            metadata = dict(metadata)
+            del metadata['inception']
+            metadata.update(parsed_inception)
+
         if metadata.get('inception'):
             if type(metadata['inception']) is int or (len(metadata['inception'])==4 and \
                                                                metadata['inception'].isnumeric()):  # It's a year
@@ -695,7 +975,7 @@ class ArtDataBot:
                 else:
                     self.addReference(item, newclaim, metadata[u'refurl'])
 
-    def updateCollection(self, item, metadata):
+    def updateCollection(self, item, metadata, queue=False):
         """
         Update the collection with a start/end date and add extra collections.
 
@@ -727,13 +1007,21 @@ class ArtDataBot:
                     if acquisitiondate and not collectionclaim.qualifiers.get('P580'):
                         colqualifier = pywikibot.Claim(self.repo, 'P580')
                         colqualifier.setTarget(acquisitiondate)
-                        pywikibot.output('Update collection claim with start time on %s' % item)
-                        collectionclaim.addQualifier(colqualifier)
+                        if queue:
+                            self.queue_qualifier(collectionclaim, colqualifier)
+                            self.queue_changed_claim(collectionclaim)
+                        else:
+                            pywikibot.output('Update collection claim with start time on %s' % item)
+                            collectionclaim.addQualifier(colqualifier)
                     if deaccessiondate and not collectionclaim.qualifiers.get('P582'):
                         colqualifier = pywikibot.Claim(self.repo, 'P582')
                         colqualifier.setTarget(deaccessiondate)
-                        pywikibot.output('Update collection claim with end time on %s' % item)
-                        collectionclaim.addQualifier(colqualifier)
+                        if queue:
+                            self.queue_qualifier(collectionclaim, colqualifier)
+                            self.queue_changed_claim(collectionclaim)
+                        else:
+                            pywikibot.output('Update collection claim with end time on %s' % item)
+                            collectionclaim.addQualifier(colqualifier)
 
     def parse_date(self, date_string):
         """
@@ -741,15 +1029,16 @@ class ArtDataBot:
         :param date_string: The date string to pars
         :return: pywikibot.WbTime
         """
-        date_regex = '^(\d\d\d\d)-(\d\d)-(\d\d)'
-        date_match = re.match(date_regex, str(date_string))
+        # The shared parser remembers the strings it already parsed
+        parsed = date_parser.parse_date(date_string)
         parsed_date = None
-        if type(date_string) is int or (len(date_string)==4 and date_string.isnumeric()): # It's a year
-            return pywikibot.WbTime(year=int(date_string))
-        elif date_match:
-            return pywikibot.WbTime(year=int(date_match.group(1)),
-                                    month=int(date_match.group(2)),
-                                    day=int(date_match.group(3)))
+        if parsed:
+            (year, month, day) = parsed
+            if day:
+                return pywikibot.WbTime(year=year, month=month, day=day)
+            elif month:
+                return pywikibot.WbTime(year=year, month=month)
+            return pywikibot.WbTime(year=year)
         else:
             try:
                 parsed_date = pywikibot.WbTime.fromTimestr(date_string)
@@ -767,7 +1056,7 @@ class ArtDataBot:
                     pywikibot.output(u'Also can not parse %sZ' % (date_string,))
             return parsed_date
 
-    def add_extra_collections(self, item, metadata):
+    def add_extra_collections(self, item, metadata, queue=False):
         """
         Add extra collections and identifiers
 
@@ -777,7 +1066,7 @@ class ArtDataBot:
         """
         if metadata.get('extracollectionqids'):
             for extracollectionqid in metadata.get('extracollectionqids'):
-                self.addCollection(item, extracollectionqid, metadata)
+                self.addCollection(item, extracollectionqid, metadata, queue=queue)
                 # TODO: Figure out how to handle the inventory numbers
                 #if metadata.get('extraid'):
                 #    self.addExtraId(item, metadata.get('extraid'), metadata.get('extracollectionqid'), metadata)
@@ -788,17 +1077,20 @@ class ArtDataBot:
         #        self.addExtraId(item, metadata.get('id'), metadata.get('collectionqid'), metadata)
 
         if metadata.get('extracollectionqid'):
-            self.addCollection(item, metadata.get('extracollectionqid'), metadata)
+            self.addCollection(item, metadata.get('extracollectionqid'), metadata, queue=queue)
             if metadata.get('extraid'):
-                self.addExtraId(item, metadata.get('extraid'), metadata.get('extracollectionqid'), metadata)
+                self.addExtraId(item, metadata.get('extraid'), metadata.get('extracollectionqid'), metadata,
+                                queue=queue)
         if metadata.get('extracollectionqid2'):
-            self.addCollection(item, metadata.get('extracollectionqid2'), metadata)
+            self.addCollection(item, metadata.get('extracollectionqid2'), metadata, queue=queue)
             if metadata.get('extraid2'):
-                self.addExtraId(item, metadata.get('extraid2'), metadata.get('extracollectionqid2'), metadata)
+                self.addExtraId(item, metadata.get('extraid2'), metadata.get('extracollectionqid2'), metadata,
+                                queue=queue)
         if metadata.get('extracollectionqid3'):
-            self.addCollection(item, metadata.get('extracollectionqid3'), metadata)
+            self.addCollection(item, metadata.get('extracollectionqid3'), metadata, queue=queue)
             if metadata.get('extraid3'):
-                self.addExtraId(item, metadata.get('extraid3'), metadata.get('extracollectionqid3'), metadata)
+                self.addExtraId(item, metadata.get('extraid3'), metadata.get('extracollectionqid3'), metadata,
+                                queue=queue)
 
     def addCollection(self, item, collectionqid, metadata, queue=False):
         """
@@ -820,7 +1112,10 @@ class ArtDataBot:
             for collectionclaim in claims.get('P195'):
                 if collectionclaim.getTarget() == collectionitem:
                     foundCollection = True
-                    if not collectionclaim.getSources():
+                    if not collectionclaim.getSources() and queue:
+                        self.addReference(item, collectionclaim, metadata['refurl'], queue=True)
+                        self.queue_changed_claim(collectionclaim)
+                    elif not collectionclaim.getSources():
                         try:
                             self.addReference(item, collectionclaim, metadata['refurl'])
                         except pywikibot.exceptions.APIError:
@@ -829,11 +1124,15 @@ class ArtDataBot:
         if not foundCollection:
             newclaim = pywikibot.Claim(self.repo, u'P195')
             newclaim.setTarget(collectionitem)
-            pywikibot.output('Adding (extra) collection claim to %s' % item)
-            item.addClaim(newclaim)
-            self.addReference(item, newclaim, metadata['refurl'])
+            if queue:
+                self.addReference(item, newclaim, metadata['refurl'], queue=True)
+                self.statements_queue.append(newclaim.toJSON())
+            else:
+                pywikibot.output('Adding (extra) collection claim to %s' % item)
+                item.addClaim(newclaim)
+                self.addReference(item, newclaim, metadata['refurl'])
 
-    def addExtraId(self, item, extraid, collectionqid, metadata):
+    def addExtraId(self, item, extraid, collectionqid, metadata, queue=False):
         """
         Add an extra identifier (usually inventory number) if it's not already in the item
 
@@ -856,7 +1155,15 @@ class ArtDataBot:
                     if qualifier.getTarget() == collectionitem:
                         foundIdentifier = True
 
-        if not foundIdentifier:
+        if not foundIdentifier and queue:
+            newclaim = pywikibot.Claim(self.repo, self.idProperty)
+            newclaim.setTarget(extraid)
+            newqualifier = pywikibot.Claim(self.repo, 'P195')
+            newqualifier.setTarget(collectionitem)
+            self.queue_qualifier(newclaim, newqualifier)
+            self.addReference(item, newclaim, metadata['refurl'], queue=True)
+            self.statements_queue.append(newclaim.toJSON())
+        elif not foundIdentifier:
             newclaim = pywikibot.Claim(self.repo, self.idProperty)
             newclaim.setTarget(extraid)
             pywikibot.output('Adding extra new id claim to %s' % item)
@@ -915,85 +1222,29 @@ class ArtDataBot:
         """
         Add the material used (P186) based on the medium to the item.
 
-        Strings like "oil on canvas" are mapped to statements. Missing statements and missing sources will be added.
+        Strings like "oil on canvas" are mapped to statements with the shared lookup in materials.py. Missing
+        statements and missing sources will be added.
 
         :param item: The artwork item to work on
         :param metadata: All the metadata about this artwork, should contain the medium field
         :return: Nothing, updates item in place
         """
         claims = item.get().get('claims')
-        mediums = { 'oil on canvas' : {'paint' : 'Q296955', 'surface' : 'Q12321255'},
-                    'oil on panel' : {'paint' : 'Q296955', 'surface' : 'Q106857709'},
-                    'oil on wood panel' : {'paint' : 'Q296955', 'surface' : 'Q106857709'},
-                    'oil on fir panel' : {'paint' : 'Q296955', 'surface' : 'Q107103505'},
-                    'oil on lime panel' : {'paint' : 'Q296955', 'surface' : 'Q107296639'},
-                    'oil on oak panel' : {'paint' : 'Q296955', 'surface' : 'Q106857823'},
-                    'oil on pine panel' : {'paint' : 'Q296955', 'surface' : 'Q106940268'},
-                    'oil on poplar panel' : {'paint' : 'Q296955', 'surface' : 'Q106857865'},
-                    'oil on walnut panel' : {'paint' : 'Q296955', 'surface' : 'Q107103575'},
-                    'oil on paper' : {'paint' : 'Q296955', 'surface' : 'Q11472'},
-                    'oil on copper' : {'paint' : 'Q296955', 'surface' : 'Q753'},
-                    'oil on cardboard' : {'paint' : 'Q296955', 'surface' : 'Q18668582'},
-                    'tempera on canvas' : {'paint' : 'Q175166', 'surface' : 'Q12321255'},
-                    'tempera on panel' : {'paint' : 'Q175166', 'surface' : 'Q106857709'},
-                    'tempera on wood panel' : {'paint' : 'Q175166', 'surface' : 'Q106857709'},
-                    'tempera on fir panel' : {'paint' : 'Q175166', 'surface' : 'Q107103505'},
-                    'tempera on lime panel' : {'paint' : 'Q175166', 'surface' : 'Q107296639'},
-                    'tempera on oak panel' : {'paint' : 'Q175166', 'surface' : 'Q106857823'},
-                    'tempera on pine panel' : {'paint' : 'Q175166', 'surface' : 'Q106940268'},
-                    'tempera on poplar panel' : {'paint' : 'Q175166', 'surface' : 'Q106857865'},
-                    'tempera on walnut panel' : {'paint' : 'Q175166', 'surface' : 'Q107103575'},
-                    'tempera on paper' : {'paint' : 'Q175166', 'surface' : 'Q11472'},
-                    'acrylic paint on canvas' : {'paint' : 'Q207849', 'surface' : 'Q12321255'},
-                    'acrylic on canvas' : {'paint' : 'Q207849', 'surface' : 'Q12321255'},
-                    'acrylic paint on panel' : {'paint' : 'Q207849', 'surface' : 'Q106857709'},
-                    'acrylic on panel' : {'paint' : 'Q207849', 'surface' : 'Q106857709'},
-                    'acrylic on wood panel' : {'paint' : 'Q207849', 'surface' : 'Q106857709'},
-                    'acrylic paint on paper' : {'paint' : 'Q207849', 'surface' : 'Q11472'},
-                    'acrylic on paper' : {'paint' : 'Q207849', 'surface' : 'Q11472'},
-                    'watercolor on paper' : {'paint' : 'Q22915256', 'surface' : 'Q11472'},
-                    # In Germany often the type of paint is not mentioned.
-                    'paint on canvas' : {'paint' : 'Q174219', 'surface' : 'Q12321255'},
-                    'paint on panel' : {'paint' : 'Q174219', 'surface' : 'Q106857709'},
-                    'paint on wood panel' : {'paint' : 'Q174219', 'surface' : 'Q106857709'},
-                    'paint on fir panel' : {'paint' : 'Q174219', 'surface' : 'Q107103505'},
-                    'paint on lime panel' : {'paint' : 'Q174219', 'surface' : 'Q107296639'},
-                    'paint on oak panel' : {'paint' : 'Q174219', 'surface' : 'Q106857823'},
-                    'paint on pine panel' : {'paint' : 'Q174219', 'surface' : 'Q106940268'},
-                    'paint on poplar panel' : {'paint' : 'Q174219', 'surface' : 'Q106857865'},
-                    'paint on walnut panel' : {'paint' : 'Q174219', 'surface' : 'Q107103575'},
-                    'paint on paper': {'paint': 'Q174219', 'surface': 'Q11472'},
-                    'paint on copper': {'paint': 'Q174219', 'surface': 'Q753'},
-                    'black chalk on paper': {'paint': 'Q3387833', 'surface': 'Q11472'},
-                    'black chalk on cardboard': {'paint': 'Q3387833', 'surface': 'Q18668582'},
-                    'chalk on paper': {'paint': 'Q183670', 'surface': 'Q11472'},
-                    'chalk on cardboard': {'paint': 'Q183670', 'surface': 'Q18668582'},
-                    'charcoal on paper': {'paint': 'Q1424515', 'surface': 'Q11472'},
-                    'charcoal on cardboard': {'paint': 'Q1424515', 'surface': 'Q18668582'},
-                    'pencil on paper': {'paint': 'Q14674', 'surface': 'Q11472'},
-                    'pencil on cardboard': {'paint': 'Q14674', 'surface': 'Q18668582'},
-                    'oil on canvas on panel': {'paint': 'Q296955', 'surface': 'Q12321255', 'mount': 'Q106857709'},
-                    'oil on paper on panel': {'paint': 'Q296955', 'surface': 'Q11472', 'mount': 'Q106857709'},
-                    'oil on cardboard on panel': {'paint': 'Q296955', 'surface': 'Q18668582', 'mount': 'Q106857709'},
-                    'oil on copper on panel': {'paint': 'Q296955', 'surface': 'Q753', 'mount': 'Q106857709'},
-                    'oil on canvas on cardboard': {'paint': 'Q296955', 'surface': 'Q12321255', 'mount': 'Q18668582'},
-                    'oil on paper on cardboard': {'paint': 'Q296955', 'surface': 'Q11472', 'mount': 'Q18668582'},
-                    'tempera on canvas on panel': {'paint': 'Q175166', 'surface': 'Q12321255', 'mount': 'Q106857709'},
-                    }
         if not metadata.get('medium'):
             return
-        medium = metadata.get('medium').lower().strip()
-        if medium not in mediums:
+        materials_used = materials.match_medium(metadata.get('medium'))
+        if not materials_used:
             pywikibot.output('Unable to match medium "%s" to materials' % (metadata.get('medium'),))
+            materials.add_unmatched(metadata.get('medium'))
             return
-        paint = pywikibot.ItemPage(self.repo, mediums.get(medium).get('paint'))
-        surface = pywikibot.ItemPage(self.repo, mediums.get(medium).get('surface'))
+        paint = materials.get_material_item(self.repo, materials_used.get('paint'))
+        surface = materials.get_material_item(self.repo, materials_used.get('surface'))
         mount = None
-        if mediums.get(medium).get('mount'):
-            mount = pywikibot.ItemPage(self.repo, mediums.get(medium).get('mount'))
+        if materials_used.get('mount'):
+            mount = materials.get_material_item(self.repo, materials_used.get('mount'))
 
-        painting_surface = pywikibot.ItemPage(self.repo, 'Q861259')
-        painting_mount = pywikibot.ItemPage(self.repo, 'Q107105674')
+        painting_surface = materials.get_material_item(self.repo, materials.PAINTING_SURFACE)
+        painting_mount = materials.get_material_item(self.repo, materials.PAINTING_MOUNT)
 
         if 'P186' not in claims:
             # Paint
@@ -1048,30 +1299,38 @@ class ArtDataBot:
             madeclaim = claims.get('P186')[0]
             if madeclaim.getTarget() == surface:
                 if not madeclaim.getSources():
-                    self.addReference(item, madeclaim, metadata['refurl'])
+                    self.add_missing_reference(item, madeclaim, metadata['refurl'], queue=queue)
                 newclaim = pywikibot.Claim(self.repo, 'P186')
                 newclaim.setTarget(paint)
-                pywikibot.output('Adding missing paint claim to %s' % item)
-                item.addClaim(newclaim, summary='Adding missing paint statement')
-                self.addReference(item, newclaim, metadata['refurl'])
+                if queue:
+                    self.addReference(item, newclaim, metadata['refurl'], queue=True)
+                    self.statements_queue.append(newclaim.toJSON())
+                else:
+                    pywikibot.output('Adding missing paint claim to %s' % item)
+                    item.addClaim(newclaim, summary='Adding missing paint statement')
+                    self.addReference(item, newclaim, metadata['refurl'])
             elif madeclaim.getTarget() == paint:
                 if not madeclaim.getSources():
-                    self.addReference(item, madeclaim, metadata['refurl'])
+                    self.add_missing_reference(item, madeclaim, metadata['refurl'], queue=queue)
                 newclaim = pywikibot.Claim(self.repo, 'P186')
                 newclaim.setTarget(surface)
-                pywikibot.output('Adding missing painting surface claim to %s' % item)
-                item.addClaim(newclaim, summary='Adding missing painting surface statement')
-
                 newqualifier = pywikibot.Claim(self.repo, 'P518') #Applies to part
                 newqualifier.setTarget(painting_surface)
-                pywikibot.output('Adding new painting surface qualifier claim to %s' % item)
-                newclaim.addQualifier(newqualifier)
-                self.addReference(item, newclaim, metadata['refurl'])
+                if queue:
+                    self.queue_qualifier(newclaim, newqualifier)
+                    self.addReference(item, newclaim, metadata['refurl'], queue=True)
+                    self.statements_queue.append(newclaim.toJSON())
+                else:
+                    pywikibot.output('Adding missing painting surface claim to %s' % item)
+                    item.addClaim(newclaim, summary='Adding missing painting surface statement')
+                    pywikibot.output('Adding new painting surface qualifier claim to %s' % item)
+                    newclaim.addQualifier(newqualifier)
+                    self.addReference(item, newclaim, metadata['refurl'])
         elif 'P186' in claims and len(claims.get('P186')) == 2 and not mount:
             for madeclaim in claims.get('P186'):
                 if madeclaim.getTarget()==surface or madeclaim.getTarget()==paint:
                     if not madeclaim.getSources():
-                        self.addReference(item, madeclaim, metadata['refurl'])
+                        self.add_missing_reference(item, madeclaim, metadata['refurl'], queue=queue)
 
     def addDimensions(self, item, metadata, queue=False):
         """
@@ -1339,22 +1598,103 @@ class ArtDataBot:
                         self.addReference(item, newclaim, metadata.get('refurl'))
                         # TO DO: Add sourcing of existing statements
 
+    def reset_queue(self):
+        """
+        Start with empty queues for the next item to update
+        """
+        self.statements_queue = []
+        self.changed_claims_queue = []
+        self.labels_queue = {}
+        self.descriptions_queue = {}
+        self.disambiguated_descriptions_queue = {}
+
+    def queue_changed_claim(self, claim):
+        """
+        Queue an existing claim that got modified (new qualifier, reference added or removed) to be saved
+        :param claim: The modified claim
+        :return:
+        """
+        for changed_claim in self.changed_claims_queue:
+            if changed_claim is claim:
+                return
+        self.changed_claims_queue.append(claim)
+
     def save_statements(self, item):
         """
-        Save the queued statements
+        Save all the queued changes in one edit.
+
+        New statements, modified existing statements, labels and descriptions are all combined in one
+        wbeditentity. If the label/description combination is already taken, try again with disambiguated
+        descriptions and finally without any labels and descriptions.
         """
-        if not self.statements_queue:
+        changed_claims = self.changed_claims_queue or []
+        labels = self.labels_queue or {}
+        descriptions = self.descriptions_queue or {}
+        if not self.statements_queue and not changed_claims and not labels and not descriptions:
             return
-        properties = set()
-        for statement in self.statements_queue:
-            properties.add(statement.get('mainsnak').get('property'))
-
-        summary = 'Added'
-        for prop in properties:
-            summary += ' [[Property:%s]]' % (prop,)
 
+        data = {}
+        claims = list(self.statements_queue or [])
+        for claim in changed_claims:
+            claims.append(claim.toJSON())
+        if claims:
+            data['claims'] = claims
+        if labels:
+            data['labels'] = labels
+        if descriptions:
+            data['descriptions'] = descriptions
+
+        summary = self.get_queue_summary()
         pywikibot.output(summary)
-        item.editEntity(data={'claims': self.statements_queue}, summary=summary)
+        try:
+            item.editEntity(data=data, summary=summary)
+            return
+        except pywikibot.exceptions.OtherPageSaveError:
+            if not labels and not descriptions:
+                raise
+
+        # We got ourselves a duplicate label and description
+        if descriptions and self.disambiguated_descriptions_queue:
+            pywikibot.output('Oops, already had that label/description combination. Trying again')
+            data['descriptions'] = self.disambiguated_descriptions_queue
+            try:
+                item.editEntity(data=data, summary=summary)
+                return
+            except pywikibot.exceptions.OtherPageSaveError:
+                pywikibot.output('Disambiguation did not work')
+
+        pywikibot.output('Oops, already had that label/description combination. Saving without them')
+        data.pop('labels', None)
+        data.pop('descriptions', None)
+        if data:
+            item.editEntity(data=data, summary=summary)
+
+    def get_queue_summary(self):
+        """
+        Make an edit summary for the queued changes
+        :return: The summary
+        """
+        added_properties = []
+        for statement in self.statements_queue or []:
+            prop = statement.get('mainsnak').get('property')
+            if prop not in added_properties:
+                added_properties.append(prop)
+        updated_properties = []
+        for claim in self.changed_claims_queue or []:
+            if claim.getID() not in updated_properties:
+                updated_properties.append(claim.getID())
+
+        summary_parts = []
+        if added_properties:
+            summary_parts.append('Added' + ''.join([' [[Property:%s]]' % (prop,) for prop in added_properties]))
+        if updated_properties:
+            summary_parts.append('updated' + ''.join([' [[Property:%s]]' % (prop,) for prop in updated_properties]))
+        if self.labels_queue:
+            summary_parts.append('added missing label(s)')
+        if self.descriptions_queue:
+            summary_parts.append('added missing description(s)')
+        summary = ', '.join(summary_parts)
+        return summary[0].upper() + summary[1:]
 
     def addItemStatement(self, item, pid, qid, url, queue=False):
         """
@@ -1369,10 +1709,14 @@ class ArtDataBot:
                 claim = claims.get(pid)[0]
                 if claim and claim.getTarget() and claim.getTarget().title() and claim.getTarget().title() == qid:
                     if not claim.getSources():
-                        self.addReference(item, claim, url)
+                        self.add_missing_reference(item, claim, url, queue=queue)
                     else:
                         removable_source = self.is_removable_sources(claim.getSources())
-                        if removable_source:
+                        if removable_source and queue:
+                            # is_removable_sources only returns something if it's the only source
+                            claim.sources = []
+                            self.add_missing_reference(item, claim, url, queue=True)
+                        elif removable_source:
                             claim.removeSource(removable_source, summary='Removing to add better source')
                             self.addReference(item, claim, url)
             return
@@ -1424,6 +1768,16 @@ class ArtDataBot:
             pywikibot.output('Adding new reference claim to %s' % item)
             newclaim.addSources([refurl, refdate])
 
+    def add_missing_reference(self, item, claim, url, queue=False):
+        """
+        Add a reference to an existing claim. When queued the claim will be saved with the other queued changes
+        """
+        if queue:
+            self.addReference(item, claim, url, queue=True)
+            self.queue_changed_claim(claim)
+        else:
+            self.addReference(item, claim, url)
+
     def is_removable_sources(self, sources):
         """
         Will return the source claim if the list of sources is one entry and only is imported from and nothing else
@@ -1445,20 +1799,30 @@ class ArtDataIdentifierBot(ArtDataBot):
     """
     Art data bot version that uses identifier properties instead of combination of inventory number and collection
     """
-    def __init__(self, generator, id_property, create=False):
+    def __init__(self, generator, id_property, create=False, prefetch=50, workers=0, max_edits_per_minute=None,
+                 id_cache_file=None):
         """
         Arguments:
             * generator    - A generator that yields Dict objects.
             * id_property  - The identifier property on Wikidata to work on
             * create       - Boolean to say if you want to create new items or just update existing
+            * prefetch     - Number of records to read ahead and load the existing items for in one go
+            * workers      - Number of worker threads to update items with. 0 updates everything in order
+            * max_edits_per_minute - Cap on the edit rate when using workers
+            * id_cache_file - The SQLite file to keep the id cache in. False to always run the full query
 
         """
         self.generator = generator
         self.idProperty = 'P217'  # The inventory number property probably needs some refactoring
         self.id_property = id_property
         self.create = create
+        self.prefetch = prefetch
+        self.workers = workers
+        self.max_edits_per_minute = max_edits_per_minute
         self.repo = pywikibot.Site().data_repository()
-        self.wayback_session = requests.Session()
+        self.id_cache = None
+        if id_cache_file is not False:
+            self.id_cache = ArtworkIdCache(id_cache_file)
         self.artwork_ids = self.fillCache()
 
     def fillCache(self):
@@ -1472,8 +1836,10 @@ class ArtDataIdentifierBot(ArtDataBot):
         ?idstatement ps:%s ?id
         MINUS { ?idstatement wikibase:rank wikibase:DeprecatedRank }
         }""" % (self.id_property, self.id_property, )
-        sq = pywikibot.data.sparql.SparqlQuery()
-        queryresult = sq.select(query)
+        if self.id_cache:
+            return self.id_cache.get_lookup_table(('', self.id_property), query)
+        # Identifiers can be on a lot of items so split the query if it times out
+        queryresult = sparql_client.SparqlClient().select(query, ttl=datetime.timedelta(0), split_variable='item')
 
         for resultitem in queryresult:
             qid = resultitem.get('item').replace('http://www.wikidata.org/entity/', '')
@@ -1488,31 +1854,51 @@ class ArtDataIdentifierBot(ArtDataBot):
 
         # FIXME: Add inventory / collection somewhere if it's available 
 
-        for metadata in self.generator:
-            metadata = super().enrichMetadata(metadata)
-
-            if 'artworkidpid' not in metadata:
-                pywikibot.output('artworkidpid not found in metadata')
-                continue
-            if metadata.get('artworkidpid') != self.id_property:
-                pywikibot.output('id_property mismatch: "%s" & "%s"' % (metadata.get('artworkidpid'),
-                                                                        self.id_property))
-                continue
-
-            artwork_item = None
-            if metadata['artworkid'] in self.artwork_ids:
-                artwork_item_title = self.artwork_ids.get(metadata['artworkid'])
-                print(artwork_item_title)
+        self.start_workers()
+        try:
+            for metadata_batch in self.get_metadata_batches(iter(self.generator)):
+                prefetched_items = self.prefetch_artwork_items(metadata_batch, self.artwork_ids, 'artworkid')
+                for metadata in metadata_batch:
+                    self.process_metadata(metadata, prefetched_items)
+        finally:
+            self.stop_workers()
+            self.stop_wayback_queue()
+            materials.save_unmatched_report()
+            date_parser.report_unparsed()
+            date_parser.save_corpus()
+
+    def process_metadata(self, metadata, prefetched_items):
+        """
+        Work on a single metadata dict. Look up or create the item and update it.
+
+        :param metadata: The metadata dict of one artwork
+        :param prefetched_items: Dict of already loaded items from prefetch_artwork_items
+        :return: Nothing
+        """
+        metadata = super().enrichMetadata(metadata)
+
+        if 'artworkidpid' not in metadata:
+            pywikibot.output('artworkidpid not found in metadata')
+            return
+        if metadata.get('artworkidpid') != self.id_property:
+            pywikibot.output('id_property mismatch: "%s" & "%s"' % (metadata.get('artworkidpid'),
+                                                                    self.id_property))
+            return
+
+        artwork_item = None
+        if metadata['artworkid'] in self.artwork_ids:
+            artwork_item_title = self.artwork_ids.get(metadata['artworkid'])
+            print(artwork_item_title)
+            if artwork_item_title in prefetched_items:
+                artwork_item = prefetched_items.get(artwork_item_title)
+            else:
                 artwork_item = pywikibot.ItemPage(self.repo, title=artwork_item_title)
 
-            elif self.create:
-                artwork_item = self.create_artwork_item(metadata)
+        elif self.create:
+            artwork_item = self.create_artwork_item(metadata)
 
-            if artwork_item and artwork_item.exists():
-                if artwork_item.isRedirectPage():
-                    artwork_item = artwork_item.getRedirectTarget()
-                metadata['wikidata'] = artwork_item.title()
-                super().updateArtworkItem(artwork_item, metadata)
+        if artwork_item:
+            self.schedule_update(artwork_item, metadata)
 
     def create_artwork_item(self, metadata):
         """
@@ -1560,16 +1946,13 @@ class ArtDataIdentifierBot(ArtDataBot):
 
         artwork_item_title = result.get(u'entity').get('id')
 
-        # Make a backup to the Wayback Machine when we have to wait anyway
+        # Make a backup to the Wayback Machine in the background
         self.doWaybackup(metadata)
 
-        # Wikidata is sometimes lagging. Wait for additional 5 seconds before trying to actually use the item
-        time.sleep(5)
-
-        artwork_item = pywikibot.ItemPage(self.repo, title=artwork_item_title)
+        artwork_item = self.get_created_item(artwork_item_title)
 
         # Add to self.artworkIds so that we don't create dupes
-        self.artwork_ids[metadata['artworkid']] = artwork_item_title
+        self.store_artwork_id(('', self.id_property), self.artwork_ids, metadata['artworkid'], artwork_item_title)
 
         # Moved to the generic bot
         ## Only add the collection and inventory number at creation to prevent messy data
@@ -1581,6 +1964,91 @@ class ArtDataIdentifierBot(ArtDataBot):
         return artwork_item
 
 
+class ArtworkIdCache:
+    """
+    Keeps the identifier to Wikidata item lookup tables in a SQLite file so the bots don't have to run the full
+    (slow) SPARQL query on every start.
+
+    A lookup table is stored per (collectionqid, idpid). After the first full query only the items modified since
+    the last sync are queried. Incremental refreshes don't notice items that lost their identifier, so a full
+    refresh is done again once the table is older than max_age.
+    """
+    def __init__(self, filename=None, max_age=datetime.timedelta(days=7), lag=datetime.timedelta(hours=1)):
+        """
+        Arguments:
+            * filename     - The SQLite file. Defaults to artdatabot_id_cache.sqlite in the pywikibot directory
+            * max_age      - Do a full refresh if the last full refresh is older than this
+            * lag          - Margin for the query service lagging behind Wikidata
+
+        """
+        if not filename:
+            filename = os.path.join(pywikibot.config.base_dir, 'artdatabot_id_cache.sqlite')
+        self.max_age = max_age
+        self.lag = lag
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS artwork_ids '
+                                '(cache_key TEXT, artwork_id TEXT, qid TEXT, PRIMARY KEY (cache_key, artwork_id))')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS artwork_ids_qid ON artwork_ids (cache_key, qid)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS syncs '
+                                '(cache_key TEXT PRIMARY KEY, full_sync TEXT, last_sync TEXT)')
+        self.connection.commit()
+
+    def get_lookup_table(self, cache_key, query):
+        """
+        Get the lookup table. Refreshes the cache first.
+
+        :param cache_key: Tuple of the collection and the id property
+        :param query: The SPARQL query returning ?item and ?id. The last } is used to add the modified filter
+        :return: Dict with the identifier as key and the Wikidata id as value
+        """
+        cache_key = '|'.join(cache_key)
+        sync_start = datetime.datetime.utcnow()
+        row = self.connection.execute('SELECT full_sync, last_sync FROM syncs WHERE cache_key=?',
+                                      (cache_key,)).fetchone()
+        if row and datetime.datetime.fromisoformat(row[0]) + self.max_age > sync_start:
+            last_sync = datetime.datetime.fromisoformat(row[1]) - self.lag
+            full_sync = row[0]
+            modified_filter = """?item schema:dateModified ?modified .
+        FILTER(?modified >= "%s"^^xsd:dateTime)
+        """ % (last_sync.strftime('%Y-%m-%dT%H:%M:%SZ'),)
+            end = query.rindex('}')
+            query = query[:end] + modified_filter + query[end:]
+        else:
+            full_sync = sync_start.isoformat()
+            self.connection.execute('DELETE FROM artwork_ids WHERE cache_key=?', (cache_key,))
+
+        # The sync filter makes every query different, so no point in caching the result
+        queryresult = sparql_client.SparqlClient().select(query, ttl=datetime.timedelta(0))
+        changed = []
+        for resultitem in queryresult:
+            qid = resultitem.get('item').replace('http://www.wikidata.org/entity/', '')
+            changed.append((cache_key, resultitem.get('id'), qid))
+        pywikibot.output('The query "%s" returned %s items' % (query, len(changed)))
+
+        # Throw away what we knew about the changed items and store the current state
+        self.connection.executemany('DELETE FROM artwork_ids WHERE cache_key=? AND qid=?',
+                                    set([(key, qid) for (key, artwork_id, qid) in changed]))
+        self.connection.executemany('INSERT OR REPLACE INTO artwork_ids VALUES (?, ?, ?)', changed)
+        self.connection.execute('INSERT OR REPLACE INTO syncs VALUES (?, ?, ?)',
+                                (cache_key, full_sync, sync_start.isoformat()))
+        self.connection.commit()
+
+        result = {}
+        for (artwork_id, qid) in self.connection.execute('SELECT artwork_id, qid FROM artwork_ids WHERE cache_key=?',
+                                                         (cache_key,)):
+            result[artwork_id] = qid
+        pywikibot.output('The id cache contains %s items for %s' % (len(result), cache_key))
+        return result
+
+    def add(self, cache_key, artwork_id, qid):
+        """
+        Store a newly created item right away
+        """
+        self.connection.execute('INSERT OR REPLACE INTO artwork_ids VALUES (?, ?, ?)',
+                                ('|'.join(cache_key), artwork_id, qid))
+        self.connection.commit()
+
+
 def main():
     print('Dude, write your own bot')
 
@@ -134,20 +134,8 @@ def getBelvedereGenerator():
             mediumregex = '\<span class\=\"detailFieldLabel\"\>Material\/Technik\s*\<\/span\>\<span property\=\"artMedium\" itemprop\=\"artMedium\" class\=\"detailFieldValue\"\>([^\<]+)\<\/span\>'
             mediummatch = match = re.search(mediumregex, itempage.text)
             if mediummatch:
-                medium = mediummatch.group(1)
-                # Not quite complete
-                mediums = { 'Öl auf Leinwand' : 'oil on canvas',
-                            'Öl auf Holz' : 'oil on panel',
-                            'Öl auf Papier' : 'oil on paper',
-                            'Öl auf Kupfer' : 'oil on copper',
-                            'Tempera auf Leinwand' : 'tempera on canvas',
-                            'Tempera auf Holz' : 'tempera on panel',
-                            'Acryl auf Leinwand' : 'acrylic paint on canvas',
-                            }
-                if medium in mediums:
-                    metadata['medium'] = mediums.get(medium)
-                else:
-                    print('Unable to match medium %s' % (medium,))
+                # The shared materials lookup understands German
+                metadata['medium'] = mediummatch.group(1)
 
             measurementsregex = '\<div class\=\"detailField dimensionsField\"\>\<span class\=\"detailFieldLabel\"\>Maße\s*\<\/span\>\<span class\=\"detailFieldValue\"\>\<div\>([^\<]+)\<\/div>'
             measurementsmatch = re.search(measurementsregex, itempage.text)
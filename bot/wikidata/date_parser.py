@@ -0,0 +1,510 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Shared parser for the date strings of the importers and ArtDataBot.
+
+Every importer had its own set of regexes for things like "c. 1650", "1650-1660" or "17th century" and ArtDataBot
+parsed every acquisition date again. This parser has one table of precompiled patterns for years, circa, ranges,
+decades and centuries in the languages the museums use. The results are memoized in an LRU cache on the raw string,
+so the same string is only parsed once. Strings that couldn't be parsed are counted so the most common ones can be
+reported and added to the table.
+
+parse_inception() returns the inception fields of the metadata ArtDataBot uses (inception, inceptioncirca,
+inceptionstart, inceptionend, inceptionprecision and inceptionrefine). parse_date() returns a tuple of year, month
+and day for dates like the acquisition date. Dates like 03-05-2001 are only parsed if the caller says if the day or
+the month comes first.
+
+Also works with Python 2 because some of the importers still do.
+
+Usage in an importer:
+
+    inception = date_parser.parse_inception(item.get('date'))
+    if inception:
+        metadata.update(inception)
+
+Run this file to benchmark the parser against the collected date strings (or a file with -corpus:<filename>) and
+to see the most common strings it can't parse. Collecting the date strings the bots see is opt-in: run this file
+with -startcorpus once to create date_strings.tsv in the pywikibot directory. From then on every run of ArtDataBot
+adds its strings to it.
+"""
+import pywikibot
+import io
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+
+CIRCA = (u'c\\.?|ca\\.?|circa|approx\\.?|approximately|about|around|omstreeks|ca|rond|ong\\.?|um|ok\\.?|oko[lł]o|'
+         u'vers|environ|hacia|verso|cerca|omkring|noin|kring')
+RANGE_SEPARATOR = u'-|/|to|until|tot|bis|à|a|al|till'
+BETWEEN = u'between|tussen|zwischen|entre|tra|fra|mellan|mellem|mi[eę]dzy'
+AND = u'and|en|und|et|e|y|och|og|a'
+ORDINAL = u'st|nd|rd|th|e|de|ste|\\.|er|ème|eme|o|º|°|-?tal'
+CENTURY = (u'century|cent\\.?|c\\.|eeuw|jahrhundert|jh\\.?|siècle|siecle|s\\.|secolo|sec\\.|siglo|wiek|wieku|'
+           u'århundrede|århundradet|sekel|vuosisata')
+ROMAN = u'[IVX]+'
+# A range with a shortened end like 1695/05 is only taken over the end of the century if it's this short
+MAX_WRAPPED_SPAN = 20
+# The shape of an ISO year and month like 1923-05. Too likely to be a month to read it as a range
+YEAR_MONTH = re.compile(u'^\\d{4}-(?:0[1-9]|1[0-2])$')
+
+# The table. The first pattern that matches wins, so the more specific ones go first
+INCEPTION_PATTERNS = [
+    (u'year', u'^(?P<year>\\d{3,4})$'),
+    (u'range', u'^(?P<start>\\d{3,4})\\s*(?:%s)\\s*(?P<end>\\d{1,4})$' % (RANGE_SEPARATOR,)),
+    (u'range', u'^(?:%s)\\s+(?P<start>\\d{3,4})\\s+(?:%s)\\s+(?P<end>\\d{1,4})$' % (BETWEEN, AND)),
+    (u'range', u'^(?P<start>\\d{3,4})\\s*-\\s*(?P<end>\\d{4})-12-31$'),
+    (u'decade', u'^(?:the\\s+)?(?P<year>\\d{3}0)\\s*(?:s|\'s|’s|er|er\\s*jahre|-?tal(?:et)?)$'),
+    (u'decade', u'^(?:the\\s+|de\\s+)?(?:jaren|années|anni|años|decade|decennium|lata)\\s+(?P<year>\\d{3}0)$'),
+    (u'century', u'^(?:the\\s+)?(?P<century>\\d{1,2})\\s*(?:%s)?\\s*(?:%s)$' % (ORDINAL, CENTURY)),
+    (u'century', u'^(?P<roman>%s)\\s*(?:%s)?\\s*(?:%s)$' % (ROMAN, ORDINAL, CENTURY)),
+    (u'century', u'^(?:%s)\\s+(?P<roman>%s)$' % (CENTURY, ROMAN)),
+]
+
+# Prefixes and suffixes that change the meaning of what's left. The rest is parsed with the table again
+INCEPTION_MODIFIERS = [
+    (u'circa', u'^(?:%s)\\s*:?\\s*(?P<rest>\\d.*)$' % (CIRCA,)),
+    (u'circa', u'^(?P<rest>.*\\d)\\s*\\(?(?:%s)\\)?$' % (CIRCA,)),
+    (u'circarange', u'^(?:%s)\\s*(?P<start>\\d{3,4})\\s*(?:%s)\\s*(?:%s)\\s*(?P<end>\\d{3,4})$' % (CIRCA, RANGE_SEPARATOR,
+                                                                                                  CIRCA)),
+    (u'beginning of', u'^(?:early|beginning of|begin|vroeg|anfang|frühes|début|debut|inizio|principios del|'
+                      u'początek)\\s*(?:the\\s+|de\\s+|des\\s+|du\\s+|del\\s+)?(?P<rest>.+)$'),
+    (u'middle of', u'^(?:mid|middle of|midden|mitte|milieu|metà|mediados del|połowa)\\s*-?\\s*'
+                   u'(?:the\\s+|de\\s+|des\\s+|du\\s+|del\\s+)?(?P<rest>.+)$'),
+    (u'end of', u'^(?:late|end of|eind|laat|ende|spätes|fin|fine|finales del|koniec)\\s*'
+                u'(?:the\\s+|de\\s+|des\\s+|du\\s+|del\\s+)?(?P<rest>.+)$'),
+]
+
+DATE_PATTERNS = [
+    (u'date', u'^\\+?(?P<year>\\d{4})-(?P<month>\\d\\d)-(?P<day>\\d\\d)'),
+    (u'date', u'^(?P<year>\\d{4})-(?P<month>\\d\\d)$'),
+    (u'date', u'^(?P<year>\\d{4})$'),
+    (u'numericdate', u'^(?P<first>\\d\\d?)[\\.-](?P<second>\\d\\d?)[\\.-](?P<year>\\d{4})$'),
+]
+
+ROMAN_VALUES = {u'I': 1, u'V': 5, u'X': 10}
+
+
+def compile_table(table):
+    """
+    Compile the patterns of a table once
+    """
+    return [(name, re.compile(pattern, re.I | re.U)) for (name, pattern) in table]
+
+
+def normalize_date_string(text):
+    """
+    Make the differences that don't matter go away: surrounding whitespace and brackets, double spaces and the
+    different dashes
+    """
+    text = u'%s' % (text,)
+    text = text.replace(u'–', u'-').replace(u'—', u'-').replace(u'‐', u'-')
+    text = u' '.join(text.split()).strip(u' []')
+    # A full stop after the year, but not the one of an abbreviation like "c."
+    return re.sub(u'(\\d)\\.$', u'\\1', text)
+
+
+def roman_to_int(roman):
+    """
+    Convert a Roman numeral up to XXX to an int
+    """
+    result = 0
+    previous = 0
+    for char in reversed(roman.upper()):
+        value = ROMAN_VALUES.get(char, 0)
+        if value < previous:
+            result -= value
+        else:
+            result += value
+            previous = value
+    return result
+
+
+class DateParser:
+    """
+    Table driven date parser with an LRU memo on the raw string
+    """
+    def __init__(self, maxsize=10000, collect=False, maxstrings=10000):
+        """
+        Arguments:
+            * maxsize    - Maximum number of strings in the memo. 0 disables it
+            * collect    - Count all the strings for the corpus
+            * maxstrings - Maximum number of different strings counted for the corpus and the unparsed report
+
+        """
+        self.maxsize = maxsize
+        self.collect = collect
+        self.maxstrings = maxstrings
+        self.memo = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.unparsed = Counter()
+        self.seen = Counter()
+        # ArtDataBot can parse from several worker threads
+        self.lock = threading.Lock()
+        self.inception_patterns = compile_table(INCEPTION_PATTERNS)
+        self.inception_modifiers = compile_table(INCEPTION_MODIFIERS)
+        self.date_patterns = compile_table(DATE_PATTERNS)
+
+    def memoized(self, kind, text, function):
+        """
+        Get the result from the memo or parse it and put it in the memo. Unparsed strings are counted every time
+        """
+        key = (kind, text)
+        with self.lock:
+            if self.collect:
+                self.count(self.seen, key)
+            if key in self.memo:
+                self.hits += 1
+                # Move it to the end, the least recently used ones are at the front
+                result = self.memo.pop(key)
+                self.memo[key] = result
+            else:
+                self.misses += 1
+                result = function(normalize_date_string(text))
+                if self.maxsize:
+                    self.memo[key] = result
+                    if len(self.memo) > self.maxsize:
+                        self.memo.popitem(last=False)
+            if result is None:
+                self.count(self.unparsed, key)
+        return result
+
+    def count(self, counter, key):
+        """
+        Count a string, new strings are only added while there are less than maxstrings
+        """
+        if key in counter or len(counter) < self.maxstrings:
+            counter[key] += 1
+
+    def parse_inception(self, text):
+        """
+        Parse the inception of a work
+
+        :param text: The date string (or int) from the museum
+        :return: Dict with the inception fields or None if it can't be parsed
+        """
+        if text is None or text == u'':
+            return None
+        result = self.memoized(u'inception', text, self.parse_inception_string)
+        if result is None:
+            return None
+        return dict(result)
+
+    def parse_date(self, text, dayfirst=None):
+        """
+        Parse a date like an acquisition date
+
+        :param text: The date string (or int)
+        :param dayfirst: True if the museum puts the day first (03-05-2001 is 3 May), False if it puts the month
+                         first (5 March). With None these dates are only parsed if the day is over 12
+        :return: Tuple of year, month and day. Month and day are None if unknown. None if it can't be parsed
+        """
+        if text is None or text == u'':
+            return None
+        if dayfirst is None:
+            kind = u'date'
+        elif dayfirst:
+            kind = u'date dayfirst'
+        else:
+            kind = u'date monthfirst'
+        return self.memoized(kind, text, lambda normalized: self.parse_date_string(normalized, dayfirst=dayfirst))
+
+    def parse_inception_string(self, text, depth=0):
+        """
+        Do the actual parsing of an inception string. Modifiers like circa or early are taken off and the rest is
+        parsed again
+
+        :return: Tuple of the (field, value) pairs so it can be stored in the memo, or None
+        """
+        for (name, regex) in self.inception_patterns:
+            match = regex.match(text)
+            if match:
+                result = self.make_inception(name, match)
+                if result is not None:
+                    return tuple(sorted(result.items()))
+
+        if depth > 1:
+            return None
+        for (name, regex) in self.inception_modifiers:
+            match = regex.match(text)
+            if not match:
+                continue
+            if name == u'circarange':
+                result = self.make_inception(u'range', match)
+                if result is not None:
+                    result[u'inceptioncirca'] = True
+                    return tuple(sorted(result.items()))
+                continue
+            rest = self.parse_inception_string(match.group(u'rest').strip(), depth=depth + 1)
+            if rest is None:
+                continue
+            result = dict(rest)
+            if name == u'circa':
+                result[u'inceptioncirca'] = True
+            elif result.get(u'inceptionprecision') in (u'decade', u'century'):
+                # Only refine decades and centuries, "early 1650" doesn't mean anything
+                result[u'inceptionrefine'] = name
+            else:
+                continue
+            return tuple(sorted(result.items()))
+        return None
+
+    def make_inception(self, name, match):
+        """
+        Make the inception fields from a match of the table
+
+        :return: Dict or None if the values don't make sense
+        """
+        if name == u'year':
+            return {u'inception': int(match.group(u'year'))}
+        elif name == u'range':
+            if YEAR_MONTH.match(match.group(0)):
+                # 1923-05 and 2001-02 look like a year and month (an ISO date), these are not guessed
+                return None
+            start = match.group(u'start')
+            end = match.group(u'end')
+            shortened = len(end) < len(start)
+            if shortened:
+                # 1650-60 or 1650-5
+                end = start[:len(start) - len(end)] + end
+            if shortened and int(end) < int(start):
+                # Over the end of the century or decade like 1695/05 or 1658-2
+                end = int(end) + 10 ** (len(match.group(u'end')))
+                if end - int(start) > MAX_WRAPPED_SPAN:
+                    return None
+            (start, end) = (int(start), int(end))
+            if start == end:
+                return {u'inception': start}
+            if start > end:
+                return None
+            return {u'inceptionstart': start, u'inceptionend': end}
+        elif name == u'decade':
+            return {u'inception': int(match.group(u'year')), u'inceptionprecision': u'decade'}
+        elif name == u'century':
+            if match.groupdict().get(u'roman'):
+                century = roman_to_int(match.group(u'roman'))
+            else:
+                century = int(match.group(u'century'))
+            if not 1 <= century <= 21:
+                return None
+            # The middle of the century, this is shown as the right century whatever convention is used
+            return {u'inception': (century - 1) * 100 + 50, u'inceptionprecision': u'century'}
+        return None
+
+    def parse_date_string(self, text, dayfirst=None):
+        """
+        Do the actual parsing of a date string
+
+        :return: Tuple of year, month and day or None
+        """
+        for (name, regex) in self.date_patterns:
+            match = regex.match(text)
+            if not match:
+                continue
+            groups = match.groupdict()
+            year = int(groups.get(u'year'))
+            if name == u'numericdate':
+                (first, second) = (int(groups.get(u'first')), int(groups.get(u'second')))
+                if first == second or first > 12 or (dayfirst and second <= 12):
+                    (day, month) = (first, second)
+                elif second > 12 or dayfirst is False:
+                    (day, month) = (second, first)
+                else:
+                    # Both can be the month
+                    return None
+            else:
+                month = int(groups.get(u'month')) if groups.get(u'month') else None
+                day = int(groups.get(u'day')) if groups.get(u'day') else None
+            # Wikibase style dates use 00 for unknown
+            if not month:
+                (month, day) = (None, None)
+            elif not day:
+                day = None
+            if month and not 1 <= month <= 12 or day and not 1 <= day <= 31:
+                return None
+            return (year, month, day)
+        return None
+
+    def report_unparsed(self, limit=25):
+        """
+        Output the strings that couldn't be parsed, the most common first
+        """
+        total = sum(self.unparsed.values())
+        if not total:
+            return
+        pywikibot.output(u'Could not parse %s date strings (%s different ones). The top %s:' % (total,
+                                                                                                 len(self.unparsed),
+                                                                                                 limit))
+        for ((kind, text), count) in self.unparsed.most_common(limit):
+            pywikibot.output(u'* %s "%s" %s times' % (kind, text, count))
+
+
+def get_corpus_filename():
+    """
+    The corpus file of the collected strings: date_strings.tsv in the pywikibot directory
+    """
+    return os.path.join(pywikibot.config.base_dir, 'date_strings.tsv')
+
+
+# Only collect the strings if the corpus was started
+DEFAULT_PARSER = DateParser(collect=os.path.exists(get_corpus_filename()))
+
+
+def parse_inception(text):
+    """
+    Parse the inception of a work with the shared parser, see DateParser.parse_inception
+    """
+    return DEFAULT_PARSER.parse_inception(text)
+
+
+def parse_date(text, dayfirst=None):
+    """
+    Parse a date with the shared parser, see DateParser.parse_date
+    """
+    return DEFAULT_PARSER.parse_date(text, dayfirst=dayfirst)
+
+
+def report_unparsed(limit=25):
+    """
+    Output the most common strings the shared parser couldn't parse
+    """
+    DEFAULT_PARSER.report_unparsed(limit=limit)
+
+
+def save_corpus(filename=None):
+    """
+    Add the date strings the shared parser saw since the last save to the corpus file used by the benchmark. The
+    file has a line with the count, the kind and the string (tab separated) for every string. Does nothing if the
+    corpus wasn't started with -startcorpus
+
+    :param filename: Defaults to date_strings.tsv in the pywikibot directory
+    """
+    if not DEFAULT_PARSER.collect:
+        return
+    if not filename:
+        filename = get_corpus_filename()
+    corpus = load_corpus(filename) if os.path.exists(filename) else Counter()
+    with DEFAULT_PARSER.lock:
+        for ((kind, text), count) in DEFAULT_PARSER.seen.items():
+            corpus[(kind, u'%s' % (text,))] += count
+        DEFAULT_PARSER.seen.clear()
+    tempfilename = '%s.tmp' % (filename,)
+    with io.open(tempfilename, 'w', encoding='utf-8') as tempfile:
+        for ((kind, text), count) in corpus.most_common():
+            tempfile.write(u'%s\t%s\t%s\n' % (count, kind, text.replace(u'\t', u' ').replace(u'\n', u' ')))
+    getattr(os, 'replace', os.rename)(tempfilename, filename)
+
+
+def load_corpus(filename):
+    """
+    Load a corpus file. Lines without tabs are taken as inception strings seen once
+
+    :return: Counter of (kind, string) -> count
+    """
+    corpus = Counter()
+    with io.open(filename, 'r', encoding='utf-8') as corpusfile:
+        for line in corpusfile:
+            line = line.rstrip(u'\n')
+            if not line:
+                continue
+            fields = line.split(u'\t')
+            if len(fields) == 3:
+                corpus[(fields[1], fields[2])] += int(fields[0])
+            else:
+                corpus[(u'inception', line)] += 1
+    return corpus
+
+
+SAMPLE_CORPUS = [u'1650', u'c. 1650', u'ca. 1650', u'ca 1650', u'circa 1650', u'Circa 1650', u'About 1650',
+                 u'um 1650', u'1650 (um)', u'omstreeks 1650', u'vers 1650', u'ok. 1650-1660', u'1650-1660',
+                 u'1650 - 1660', u'1650–1660', u'1650/1660', u'1650-60', u'1695/05', u'c. 1650-1660', u'ca. 1650–1660',
+                 u'circa 1650 - circa 1660', u'1650 - 1660-12-31', u'between 1650 and 1660', u'tussen 1650 en 1660',
+                 u'1650s', u'the 1650s', u'jaren 1650', u'1650er Jahre', u'17th century', u'17e eeuw',
+                 u'17. Jahrhundert', u'XVIIe siècle', u'early 17th century', u'mid-17th century', u'late 1650s',
+                 u'eind 17e eeuw', u'1650?', u'17th century (?)', u'n.d.', u'undated', u'1650-03-04',
+                 u'+1650-03-04T00:00:00Z', u'1923-05', u'04.03.1923']
+
+# Strings that were parsed wrong before with the inception fields they should give (None is unparsed)
+EXPECTED_INCEPTIONS = [(u'1650-60', {u'inceptionstart': 1650, u'inceptionend': 1660}),
+                       (u'1695/05', {u'inceptionstart': 1695, u'inceptionend': 1705}),
+                       (u'1658-2', {u'inceptionstart': 1658, u'inceptionend': 1662}),
+                       (u'1923-05', None),
+                       (u'1695-05', None),
+                       (u'2001-02', None),
+                       (u'1923/05', None),
+                       ]
+
+
+def check_expected():
+    """
+    Check the strings in EXPECTED_INCEPTIONS with a new parser
+
+    :return: Number of strings that didn't give the expected result
+    """
+    parser = DateParser(maxsize=0)
+    failed = 0
+    for (text, expected) in EXPECTED_INCEPTIONS:
+        result = parser.parse_inception(text)
+        if result != expected:
+            pywikibot.output(u'Parsed %s as %s, expected %s' % (text, result, expected))
+            failed += 1
+    return failed
+
+
+def main(*args):
+    """
+    Check the strings that were parsed wrong before, benchmark the parser without and with the memo and report
+    what it can't parse
+    """
+    corpusfile = None
+    repeat = 5
+    top = 25
+    for arg in pywikibot.handle_args(args):
+        if arg == '-startcorpus':
+            if not os.path.exists(get_corpus_filename()):
+                io.open(get_corpus_filename(), 'w', encoding='utf-8').close()
+            pywikibot.output(u'The date strings the bots see are now collected in %s' % (get_corpus_filename(),))
+            return
+        elif arg.startswith('-corpus:'):
+            corpusfile = arg[len('-corpus:'):]
+        elif arg.startswith('-repeat:'):
+            repeat = int(arg[len('-repeat:'):])
+        elif arg.startswith('-top:'):
+            top = int(arg[len('-top:'):])
+
+    failed = check_expected()
+    pywikibot.output(u'%s of %s expected inceptions are wrong' % (failed, len(EXPECTED_INCEPTIONS)))
+
+    if not corpusfile and os.path.exists(get_corpus_filename()):
+        corpusfile = get_corpus_filename()
+    corpus = None
+    if corpusfile:
+        corpus = load_corpus(corpusfile)
+        pywikibot.output(u'Using the corpus in %s' % (corpusfile,))
+    if not corpus:
+        corpus = Counter((u'inception', text) for text in SAMPLE_CORPUS)
+        pywikibot.output(u'No corpus collected yet, using the sample corpus')
+
+    # Every string as often as it was seen, so the memo gets a realistic hit rate
+    strings = list(corpus.elements()) * repeat
+    pywikibot.output(u'Benchmarking with %s strings, %s different ones' % (len(strings), len(corpus)))
+
+    for (label, maxsize) in [(u'without memo', 0), (u'with memo', 10000)]:
+        parser = DateParser(maxsize=maxsize)
+        start = time.time()
+        for (kind, text) in strings:
+            if kind.startswith(u'date'):
+                parser.parse_date(text, dayfirst={u'date dayfirst': True, u'date monthfirst': False}.get(kind))
+            else:
+                parser.parse_inception(text)
+        elapsed = max(time.time() - start, 0.000001)
+        parsed = len(strings) - sum(parser.unparsed.values())
+        pywikibot.output(u'%s: %.3f seconds, %.0f strings per second, %s hits, %s misses, %.1f%% parsed' % (
+            label, elapsed, len(strings) / elapsed, parser.hits, parser.misses, 100.0 * parsed / len(strings)))
+    parser.report_unparsed(limit=top)
+
+
+if __name__ == "__main__":
+    main()
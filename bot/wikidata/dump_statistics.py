@@ -0,0 +1,313 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Statistics engine that counts everything in one pass over a Wikidata JSON dump.
+
+The statistics bots used to do a SPARQL query per property, per count and per total. The larger of these queries
+time out or have to do without DISTINCT and give slightly wrong numbers. With a dump (the full
+https://dumps.wikimedia.org/wikidatawiki/entities/latest-all.json.gz or a smaller extract in the same format) every
+count is exact and all of them are made in the same pass.
+
+The work is done by collectors. Every collector has a cheap check on the raw line to skip most entities without
+parsing them and counts the entities it's interested in. Several collectors can share the same pass:
+
+    engine = DumpStatisticsEngine(dump_file)
+    painting_statistics = GroupedStatistics('"id":"Q3305213"', is_painting, get_collections, properties)
+    engine.add_collector(painting_statistics)
+    engine.run()
+"""
+import pywikibot
+import bz2
+import gzip
+import json
+import sys
+from collections import Counter
+
+
+def get_statements(entity, prop):
+    """
+    Get the statements for a property that are not deprecated
+    """
+    return [statement for statement in entity.get('claims', {}).get(prop, [])
+            if statement.get('rank') != 'deprecated']
+
+
+def get_best_item_values(entity, prop):
+    """
+    Get the item values of the best ranked statements of a property, like wdt: in SPARQL
+
+    :return: List of Qids
+    """
+    statements = get_statements(entity, prop)
+    preferred = [statement for statement in statements if statement.get('rank') == 'preferred']
+    result = []
+    for statement in preferred or statements:
+        mainsnak = statement.get('mainsnak')
+        if mainsnak.get('snaktype') == 'value' and mainsnak.get('datatype') == 'wikibase-item':
+            result.append(sys.intern(mainsnak.get('datavalue').get('value').get('id')))
+    return result
+
+
+def has_item_value(entity, prop, qid):
+    """
+    Check if the entity has the item as best ranked value of the property
+    """
+    return qid in get_best_item_values(entity, prop)
+
+
+def count_statements(entity):
+    """
+    Number of statements on the entity, like wikibase:statements
+    """
+    return sum(len(statements) for statements in entity.get('claims', {}).values())
+
+
+def count_sitelinks(entity):
+    """
+    Number of sitelinks on the entity, like wikibase:sitelinks
+    """
+    return len(entity.get('sitelinks', {}))
+
+
+def get_external_id_properties(entity):
+    """
+    Get the properties with an external identifier on the entity
+    """
+    result = []
+    for prop, statements in entity.get('claims', {}).items():
+        if statements and statements[0].get('mainsnak').get('datatype') == 'external-id':
+            result.append(sys.intern(prop))
+    return result
+
+
+def count_identifiers(entity):
+    """
+    Number of identifier statements on the entity, like wikibase:identifiers
+    """
+    return sum(len(entity.get('claims').get(prop)) for prop in get_external_id_properties(entity))
+
+
+class GroupedStatistics:
+    """
+    Counts per group (like a collection) how many entities there are, how many have each of the properties and
+    the statements and sitelinks they have. Also keeps the totals over all entities.
+    """
+    def __init__(self, line_filter, entity_filter, get_groups, properties):
+        """
+        Arguments:
+            * line_filter   - String that should be in the raw line of the entity, like '"id":"Q3305213"'
+            * entity_filter - Function that returns True for the entities to count
+            * get_groups    - Function that returns the list of groups of an entity
+            * properties    - The properties to count
+
+        """
+        self.line_filter = line_filter
+        self.entity_filter = entity_filter
+        self.get_groups = get_groups
+        self.properties = list(properties)
+        self.counts = Counter()
+        self.property_counts = Counter()
+        self.statements = Counter()
+        self.sitelinks = Counter()
+        self.total = 0
+        self.total_properties = Counter()
+        self.total_statements = 0
+        self.total_sitelinks = 0
+
+    def wants_line(self, line):
+        """
+        Cheap check on the raw line if the entity might be counted
+        """
+        return self.line_filter in line
+
+    def add(self, entity):
+        """
+        Count one entity
+        """
+        if not self.entity_filter(entity):
+            return
+        claims = entity.get('claims', {})
+        found_properties = [prop for prop in self.properties if claims.get(prop)]
+        statements = count_statements(entity)
+        sitelinks = count_sitelinks(entity)
+
+        self.total += 1
+        self.total_statements += statements
+        self.total_sitelinks += sitelinks
+        self.total_properties.update(found_properties)
+
+        # Set so an entity is only counted once per group
+        for group in set(self.get_groups(entity)):
+            self.counts[group] += 1
+            self.statements[group] += statements
+            self.sitelinks[group] += sitelinks
+            for prop in found_properties:
+                self.property_counts[(group, prop)] += 1
+
+    def get_top_groups(self, threshold=0, limit=1000):
+        """
+        Get the largest groups
+        :return: List of tuples of group and count, largest first
+        """
+        return [(group, count) for (group, count) in self.counts.most_common(limit) if count > threshold]
+
+    def get_property_count(self, group, prop):
+        """
+        Number of entities in the group with the property. Without group the total
+        """
+        if group is None:
+            return self.total_properties.get(prop, 0)
+        return self.property_counts.get((group, prop), 0)
+
+    def get_average_statements(self, group=None):
+        """
+        Rounded average number of statements of the entities in the group. Without group over all entities
+        """
+        if group is None:
+            return round(self.total_statements / max(self.total, 1))
+        return round(self.statements.get(group, 0) / max(self.counts.get(group, 0), 1))
+
+    def get_sum_sitelinks(self, group=None):
+        """
+        Total number of sitelinks of the entities in the group. Without group over all entities
+        """
+        if group is None:
+            return self.total_sitelinks
+        return self.sitelinks.get(group, 0)
+
+
+class PropertyPairStatistics:
+    """
+    Counts for a set of (identifier) properties how often they're used, how often they're used together and the
+    histogram of the number of identifiers. Kept for all entities and for a subset (like painters).
+    """
+    def __init__(self, line_filter, entity_filter, subset_filter, properties):
+        """
+        Arguments:
+            * line_filter   - String that should be in the raw line of the entity, like '"id":"Q5"'
+            * entity_filter - Function that returns True for the entities to count
+            * subset_filter - Function that returns True for the entities that are also in the subset
+            * properties    - The properties to count as integers (like 650 for P650)
+
+        """
+        self.line_filter = line_filter
+        self.entity_filter = entity_filter
+        self.subset_filter = subset_filter
+        self.properties = set(properties)
+        self.totals = Counter()
+        self.subset_totals = Counter()
+        self.pairs = Counter()
+        self.subset_pairs = Counter()
+        self.identifiers = Counter()
+        self.subset_identifiers = Counter()
+
+    def wants_line(self, line):
+        """
+        Cheap check on the raw line if the entity might be counted
+        """
+        return self.line_filter in line
+
+    def add(self, entity):
+        """
+        Count one entity
+        """
+        if not self.entity_filter(entity):
+            return
+        found = sorted(int(prop[1:]) for prop in entity.get('claims', {})
+                       if int(prop[1:]) in self.properties and get_statements(entity, prop))
+        if not found:
+            return
+        in_subset = self.subset_filter(entity)
+        identifiers = min(count_identifiers(entity), 11)
+        for (i, prop1) in enumerate(found):
+            self.totals[prop1] += 1
+            self.identifiers[(prop1, identifiers)] += 1
+            if in_subset:
+                self.subset_totals[prop1] += 1
+                self.subset_identifiers[(prop1, identifiers)] += 1
+            for prop2 in found[i + 1:]:
+                self.pairs[(prop1, prop2)] += 1
+                if in_subset:
+                    self.subset_pairs[(prop1, prop2)] += 1
+
+
+class DumpStatisticsEngine:
+    """
+    Go over the dump once and let every collector count what it needs
+    """
+    def __init__(self, dump_file):
+        """
+        Arguments:
+            * dump_file - The Wikidata JSON dump. Can be plain, gzip or bz2
+
+        """
+        self.dump_file = dump_file
+        self.collectors = []
+
+    def add_collector(self, collector):
+        """
+        Add a collector to the pass. It needs a wants_line(line) and an add(entity) method
+        """
+        self.collectors.append(collector)
+
+    def get_lines(self):
+        """
+        Read the dump line by line. Every line is one entity
+        """
+        if self.dump_file.endswith('.gz'):
+            dump = gzip.open(self.dump_file, 'rt', encoding='utf-8')
+        elif self.dump_file.endswith('.bz2'):
+            dump = bz2.open(self.dump_file, 'rt', encoding='utf-8')
+        else:
+            dump = open(self.dump_file, 'r', encoding='utf-8')
+        with dump:
+            for line in dump:
+                if line.startswith('{'):
+                    yield line
+
+    def run(self):
+        """
+        Do the pass over the dump
+        """
+        count = 0
+        parsed = 0
+        for line in self.get_lines():
+            count += 1
+            if count % 1000000 == 0:
+                pywikibot.output('Processed %s entities of which %s were parsed' % (count, parsed))
+            collectors = [collector for collector in self.collectors if collector.wants_line(line)]
+            if not collectors:
+                continue
+            parsed += 1
+            entity = json.loads(line.strip().rstrip(','))
+            for collector in collectors:
+                collector.add(entity)
+        pywikibot.output('Done with %s entities of which %s were parsed' % (count, parsed))
+
+
+def is_painting(entity):
+    """
+    Instance of painting
+    """
+    return has_item_value(entity, 'P31', 'Q3305213')
+
+
+def is_human(entity):
+    """
+    Instance of human
+    """
+    return has_item_value(entity, 'P31', 'Q5')
+
+
+def is_painter(entity):
+    """
+    Occupation painter
+    """
+    return has_item_value(entity, 'P106', 'Q1028181')
+
+
+def get_collections(entity):
+    """
+    The collections the entity is in
+    """
+    return get_best_item_values(entity, 'P195')
@@ -0,0 +1,246 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Reconcile the files of a museum with the files already on Wikimedia Commons.
+
+The audits used to put hundreds of thousands of Commons filenames in lists and test every museum file against them,
+which is a scan of the whole list for every file. The FileIndex keeps the normalized filenames in a dict (with the
+museum identifiers the files belong to) and an index of identifiers, so a lookup is a hash lookup and the missing
+files can be computed as set differences in one go. The filenames are kept as the exact titles because Commons treats
+X.JPG, X.jpg and X.jpeg as different files. Looking up the same name with another extension is a separate fallback.
+Indexes are saved as JSON in the pywikibot directory so the big lists only have to be downloaded again when the
+cached copy is too old.
+
+Also works with Python 2 because some of the museum bots still do.
+
+Usage:
+
+    commonsfiles = get_cached_index('met_commons_files', build_function)
+    if filename in commonsfiles:
+        ...
+    commonsfiles.find(filename, fallback=True)
+    result = reconcile(commonsfiles, museum_files)
+    result.get('missing_ids')
+"""
+import pywikibot
+import datetime
+import json
+import os
+import time
+from collections import Counter
+
+
+def normalize_filename(filename):
+    """
+    Normalize a filename like Commons does: no namespace, spaces instead of underscores, no double spaces and the
+    first letter in upper case. The extension is left alone, that's part of the title.
+    """
+    filename = filename.strip()
+    if filename[:5].lower() == u'file:':
+        filename = filename[5:]
+    filename = u' '.join(filename.replace(u'_', u' ').split())
+    return filename[:1].upper() + filename[1:]
+
+
+def fold_extension(filename):
+    """
+    Make the extension of a normalized filename lower case and .jpeg into .jpg. Only used for the fallback lookup,
+    these are different files on Commons
+    """
+    (root, extension) = os.path.splitext(filename)
+    extension = extension.lower()
+    if extension == u'.jpeg':
+        extension = u'.jpg'
+    return root + extension
+
+
+def normalize_basename(filename):
+    """
+    Normalize a filename without the extension. For lists of filenames where the extension is missing or unreliable
+    """
+    filename = normalize_filename(filename)
+    (root, extension) = os.path.splitext(filename)
+    if extension.lower() in (u'.jpg', u'.jpeg', u'.png', u'.tif', u'.tiff', u'.gif'):
+        return root
+    return filename
+
+
+class FileIndex:
+    """
+    Normalized filenames with the identifiers of the objects they belong to, indexed both ways
+    """
+    def __init__(self, normalizer=normalize_filename):
+        """
+        Arguments:
+            * normalizer - Function to normalize the filenames. Lookups use the same function
+
+        """
+        self.normalizer = normalizer
+        self.files = {}
+        self.ids = {}
+        self.folded = {}
+
+    def add(self, filename, identifier=None):
+        """
+        Add a file, optionally with the identifier of the object in the museum
+        """
+        filename = self.normalizer(filename)
+        identifiers = self.files.setdefault(filename, set())
+        self.folded.setdefault(fold_extension(filename), set()).add(filename)
+        if identifier is not None:
+            identifiers.add(identifier)
+            self.ids.setdefault(identifier, set()).add(filename)
+
+    def __contains__(self, filename):
+        return self.normalizer(filename) in self.files
+
+    def __len__(self):
+        return len(self.files)
+
+    def find(self, filename, fallback=False):
+        """
+        Find the file in the index
+
+        :param filename: The filename to look for
+        :param fallback: If the exact file is not in the index, also look for it with the extension in another case or
+                         .jpeg instead of .jpg (and the other way around)
+        :return: The normalized filename in the index or None if it's not found
+        """
+        filename = self.normalizer(filename)
+        if filename in self.files:
+            return filename
+        if fallback:
+            matches = self.folded.get(fold_extension(filename))
+            if matches:
+                return sorted(matches)[0]
+        return None
+
+    def has_id(self, identifier):
+        """
+        Check if there is at least one file of the identifier
+        """
+        return identifier in self.ids
+
+    def get_ids(self, filename):
+        """
+        Get the identifiers the file belongs to
+
+        :return: Set of identifiers, empty if unknown
+        """
+        return self.files.get(self.normalizer(filename), set())
+
+    def get_files(self, identifier):
+        """
+        Get the normalized filenames of an identifier
+
+        :return: Set of filenames, empty if unknown
+        """
+        return self.ids.get(identifier, set())
+
+    def missing(self, filenames):
+        """
+        Get the filenames that are not in the index
+
+        :param filenames: Iterable of filenames
+        :return: Set of the filenames (as given, not normalized) that are missing
+        """
+        normalized = {}
+        for filename in filenames:
+            normalized[self.normalizer(filename)] = filename
+        return set(normalized[filename] for filename in set(normalized).difference(self.files))
+
+    def missing_ids(self, identifiers):
+        """
+        Get the identifiers that don't have any file in the index
+        """
+        return set(identifiers).difference(self.ids)
+
+    def save(self, filename):
+        """
+        Save the index as JSON. Written to a temporary file first so a crash doesn't leave half a file
+        """
+        tempfilename = '%s.tmp' % (filename,)
+        with open(tempfilename, 'w') as tempfile:
+            json.dump({u'normalizer': self.normalizer.__name__,
+                       u'files': dict((name, sorted(identifiers)) for (name, identifiers) in self.files.items())},
+                      tempfile)
+        getattr(os, 'replace', os.rename)(tempfilename, filename)
+
+    def load(self, filename):
+        """
+        Load an index saved with save(). The filenames are already normalized
+
+        :return: True if it was loaded. False if the file was made with another normalizer or by an older version
+        """
+        with open(filename, 'r') as indexfile:
+            data = json.load(indexfile)
+        if not isinstance(data.get(u'files'), dict) or data.get(u'normalizer') != self.normalizer.__name__:
+            return False
+        self.files = {}
+        self.ids = {}
+        self.folded = {}
+        for (name, identifiers) in data.get(u'files').items():
+            self.files[name] = set(identifiers)
+            self.folded.setdefault(fold_extension(name), set()).add(name)
+            for identifier in identifiers:
+                self.ids.setdefault(identifier, set()).add(name)
+        return True
+
+
+def get_cached_index(name, builder, max_age=datetime.timedelta(days=1), normalizer=normalize_filename,
+                     cache_dir=None):
+    """
+    Get an index from the cache or build it and put it in the cache
+
+    :param name: Name of the index, used as filename in the cache
+    :param builder: Function returning a new FileIndex, called when the cache is missing or too old
+    :param max_age: How long the cached index can be used
+    :param normalizer: The normalizer the index was built with
+    :param cache_dir: Directory for the cache. Defaults to file_reconciliation in the pywikibot directory
+    :return: The FileIndex
+    """
+    if not cache_dir:
+        cache_dir = os.path.join(pywikibot.config.base_dir, 'file_reconciliation')
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    cachefile = os.path.join(cache_dir, '%s.json' % (name,))
+
+    if os.path.exists(cachefile) and os.path.getmtime(cachefile) > time.time() - max_age.total_seconds():
+        index = FileIndex(normalizer=normalizer)
+        if index.load(cachefile):
+            pywikibot.output(u'Loaded %s files of %s from the cache' % (len(index), name))
+            return index
+
+    index = builder()
+    index.save(cachefile)
+    pywikibot.output(u'Built the index of %s with %s files' % (name, len(index)))
+    return index
+
+
+def reconcile(index, museumfiles):
+    """
+    Compare all the files of a museum with the index in bulk
+
+    :param index: The FileIndex of what is on Commons
+    :param museumfiles: Iterable of tuples of filename and identifier from the museum
+    :return: Dict with found_same_id (number of files found with the same identifier), found_different_id (number of
+             files found with another identifier), missing (set of the missing tuples) and missing_ids (Counter of the
+             number of missing files per identifier)
+    """
+    museumfiles = [(index.normalizer(filename), filename, identifier) for (filename, identifier) in museumfiles]
+    found = set(normalized for (normalized, filename, identifier) in museumfiles).intersection(index.files)
+
+    result = {u'found_same_id': 0,
+              u'found_different_id': 0,
+              u'missing': set(),
+              u'missing_ids': Counter(),
+              }
+    for (normalized, filename, identifier) in museumfiles:
+        if normalized not in found:
+            result[u'missing'].add((filename, identifier))
+            result[u'missing_ids'][identifier] += 1
+        elif identifier in index.files[normalized]:
+            result[u'found_same_id'] += 1
+        else:
+            result[u'found_different_id'] += 1
+    return result
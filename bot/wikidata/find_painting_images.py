@@ -17,12 +17,12 @@ import random
 import pywikibot.data.sparql
 import json
 import copy
+import sys
+import urllib.parse
 from operator import itemgetter
-# import cv2 # python3 and opencv seems to be a thing
-# import numpy as np # than I don't need this one either
-# from scipy.stats import pearsonr # Also not needed
-import tempfile
-import os
+from image_hash_index import ImageHashIndex
+from report_publisher import ReportBuilder, ReportPublisher
+import sparql_client
 
 class PaintingsMatchBot:
     """
@@ -34,6 +34,7 @@ class PaintingsMatchBot:
         """
         self.commons = pywikibot.Site(u'commons', u'commons')
         self.repo = pywikibot.Site().data_repository()
+        self.publisher = ReportPublisher()
 
         self.commonsNoLink = [] # List of images without a link
         self.commonsWithoutCIA = {} # Creator, institution & accession number -> image
@@ -63,6 +64,7 @@ class PaintingsMatchBot:
         self.wikidataWithCA = {} # Creator & accession number -> item, image & url
 
         self.commonsSuggestions = {}
+        self.imageHashIndex = ImageHashIndex() # Perceptual hashes of the files to filter suggestions
         self.categorysuggestions = [] # List of images to connect to Wikidata based on category
 
         self.getCommonsWithoutLookupTables()
@@ -114,106 +116,42 @@ class PaintingsMatchBot:
         self.addMissingCommonsWikidataLinks()
         self.publishAllCommonsSuggestions()
         #self.publishCommonsNoTracker()
+        # Publish all the reports that changed in one go
+        self.publisher.flush()
+        pywikibot.output('Saved %s reports, %s reports did not change' % (self.publisher.saved,
+                                                                          self.publisher.skipped))
 
     def getCommonsWithoutLookupTables(self):
         """
         Get the dicts for the images on Commons without a link to Wikidata
         """
         url = 'http://tools.wmflabs.org/multichill/queries2/commons/paintings_from_completely_indexed_collections.txt'
-        regex = '^\* \[\[:File:(?P<image>[^\]]+)\]\] - (?P<creator>Q\d+|None) - (?P<institution>Q\d+|None) - (?P<invnum>.+)$'
-        invurlregex = '^\[(http[^\s]+)\s(.+)\]$'
-        queryPage = requests.get(url)
-        for match in re.finditer(regex, queryPage.text, flags=re.M):
-            image = match.group("image")
-            if match.group("creator").strip().startswith(u'Q'):
-                creator = match.group("creator").strip()
-            else:
-                creator = None
-            if match.group("institution").strip().startswith(u'Q'):
-                institution = match.group("institution").strip()
-            else:
-                institution = None
-            if match.group("invnum").strip()==u'None':
-                invnum = None
-            else:
-                invnum = match.group("invnum").strip()
-                invurlmatch = re.match(invurlregex, invnum)
-                if invurlmatch:
-                    invnum = invurlmatch.group(2)
-
-            ciakey = None
-            cikey = None
-            iakey = None
-            cakey = None
-
-            if creator and institution and invnum:
-                ciakey = (creator, institution, invnum)
-            if creator and institution:
-                cikey = (creator, institution)
-            if institution and invnum:
-                iakey = (institution, invnum)
-            if creator and invnum:
-                cakey = (creator, invnum)
+        regex = re.compile('^\* \[\[:File:(?P<image>[^\]]+)\]\] - (?P<creator>Q\d+|None) - (?P<institution>Q\d+|None) - (?P<invnum>.+)$')
+        tables = (self.commonsWithoutCIA, self.commonsWithoutCI, self.commonsWithoutIA, self.commonsWithoutCA)
+        for line in self.getQueryLines(url):
+            match = regex.match(line)
+            if not match:
+                continue
+            image = sys.intern(match.group("image"))
+            (creator, institution, invnum) = self.parseCommonsMatch(match)
 
             self.commonsNoLink.append(image)
-            if ciakey:
-                if not ciakey in self.commonsWithoutCIA:
-                    self.commonsWithoutCIA[ciakey] = []
-                self.commonsWithoutCIA[ciakey].append(image)
-            if cikey:
-                if not cikey in self.commonsWithoutCI:
-                    self.commonsWithoutCI[cikey] = []
-                self.commonsWithoutCI[cikey].append(image)
-            if iakey:
-                if not iakey in self.commonsWithoutIA:
-                    self.commonsWithoutIA[iakey] = []
-                self.commonsWithoutIA[iakey].append(image)
-            if cakey:
-                if not cakey in self.commonsWithoutCA:
-                    self.commonsWithoutCA[cakey] = []
-                self.commonsWithoutCA[cakey].append(image)
+            self.addToLookupTables(tables, self.getLookupKeys(creator, institution, invnum), image)
 
     def getCommonsWithLookupTables(self):
         """
         DISABLED: Get the dicts for the images on Commons with a link to Wikidata
         """
         url = u'http://tools.wmflabs.org/multichill/queries2/commons/paintings_with_wikidata_all.txt'
-        regex = u'^\* \[\[:File:(?P<image>[^\]]+)\]\] -\s*(?P<paintingitem>Q\d+) - (?P<creator>Q\d+) - (?P<institution>Q\d+) - (?P<invnum>.+)$'
-        invurlregex = u'^\[(http[^\s]+)\s(.+)\]$'
-        queryPage = requests.get(url)
-
-        for match in re.finditer(regex, queryPage.text, flags=re.M):
-            image = match.group("image")
-            item = match.group("paintingitem")
-            if match.group("creator").strip().startswith(u'Q'):
-                creator = match.group("creator").strip()
-            else:
-                creator = None
-            if match.group("institution").strip().startswith(u'Q'):
-                institution = match.group("institution").strip()
-            else:
-                institution = None
-            if match.group("invnum").strip()==u'None':
-                invnum = None
-            else:
-                invnum = match.group("invnum").strip()
-                invurlmatch = re.match(invurlregex, invnum)
-                if invurlmatch:
-                    invnum = invurlmatch.group(2)
-
-            ciakey = None
-            cikey = None
-            iakey = None
-            cakey = None
-
-            if creator and institution and invnum:
-                ciakey = (creator, institution, invnum)
-            if creator and institution:
-                cikey = (creator, institution)
-            if institution and invnum:
-                iakey = (institution, invnum)
-            if creator and invnum:
-                cakey = (creator, invnum)
+        regex = re.compile(u'^\* \[\[:File:(?P<image>[^\]]+)\]\] -\s*(?P<paintingitem>Q\d+) - (?P<creator>Q\d+) - (?P<institution>Q\d+) - (?P<invnum>.+)$')
+        tables = (self.commonsWithCIA, self.commonsWithCI, self.commonsWithIA, self.commonsWithCA)
+        for line in self.getQueryLines(url):
+            match = regex.match(line)
+            if not match:
+                continue
+            image = sys.intern(match.group("image"))
+            item = sys.intern(match.group("paintingitem"))
+            (creator, institution, invnum) = self.parseCommonsMatch(match)
 
             infodict = { u'image' : image,
                          u'item' : item,
@@ -222,23 +160,72 @@ class PaintingsMatchBot:
                          u'invnum' : invnum,
                          }
             self.commonsLink[image]=item
+            self.addToLookupTables(tables, self.getLookupKeys(creator, institution, invnum), infodict)
+
+    def getQueryLines(self, url):
+        """
+        Stream the lines of one of the query result files so the whole file doesn't have to be in memory
+        :param url: The url of the file
+        :return: Generator of lines
+        """
+        queryPage = requests.get(url, stream=True)
+        for line in queryPage.iter_lines():
+            yield line.decode('utf-8', errors='replace').rstrip('\r')
 
-            if ciakey:
-                if not ciakey in self.commonsWithCIA:
-                    self.commonsWithCIA[ciakey] = []
-                self.commonsWithCIA[ciakey].append(infodict)
-            if cikey:
-                if not cikey in self.commonsWithCI:
-                    self.commonsWithCI[cikey] = []
-                self.commonsWithCI[cikey].append(infodict)
-            if iakey:
-                if not iakey in self.commonsWithIA:
-                    self.commonsWithIA[iakey] = []
-                self.commonsWithIA[iakey].append(infodict)
-            if cakey:
-                if not cakey in self.commonsWithCA:
-                    self.commonsWithCA[cakey] = []
-                self.commonsWithCA[cakey].append(infodict)
+    def parseCommonsMatch(self, match):
+        """
+        Get the creator, institution and inventory number out of a line of one of the Commons files
+        :param match: The regex match of the line
+        :return: Tuple of creator, institution and inventory number. Missing ones are None
+        """
+        invurlregex = u'^\[(http[^\s]+)\s(.+)\]$'
+        creator = None
+        institution = None
+        invnum = None
+        if match.group("creator").strip().startswith(u'Q'):
+            creator = sys.intern(match.group("creator").strip())
+        if match.group("institution").strip().startswith(u'Q'):
+            institution = sys.intern(match.group("institution").strip())
+        if match.group("invnum").strip()!=u'None':
+            invnum = match.group("invnum").strip()
+            invurlmatch = re.match(invurlregex, invnum)
+            if invurlmatch:
+                invnum = invurlmatch.group(2)
+            invnum = sys.intern(invnum)
+        return (creator, institution, invnum)
+
+    def getLookupKeys(self, creator, institution, invnum):
+        """
+        Get the keys for the 4 types of lookup tables
+        :return: Tuple of the CIA, CI, IA and CA keys. Keys that can't be made are None
+        """
+        ciakey = None
+        cikey = None
+        iakey = None
+        cakey = None
+
+        if creator and institution and invnum:
+            ciakey = (creator, institution, invnum)
+        if creator and institution:
+            cikey = (creator, institution)
+        if institution and invnum:
+            iakey = (institution, invnum)
+        if creator and invnum:
+            cakey = (creator, invnum)
+        return (ciakey, cikey, iakey, cakey)
+
+    def addToLookupTables(self, tables, keys, value, skipkeys=(None, None, None, None)):
+        """
+        Add the value to the lookup tables
+        :param tables: Tuple of the CIA, CI, IA and CA lookup tables
+        :param keys: Tuple of the CIA, CI, IA and CA keys as returned by getLookupKeys
+        :param value: The value to add
+        :param skipkeys: Keys that were already added for this value
+        :return: Nothing
+        """
+        for table, key, skipkey in zip(tables, keys, skipkeys):
+            if key and key != skipkey:
+                table.setdefault(key, []).append(value)
 
     def getBetterImageSuggestions(self):
         """
@@ -324,11 +311,14 @@ class PaintingsMatchBot:
         OPTIONAL { ?item wdt:P276 ?location } .
         OPTIONAL { ?item wdt:P973 ?url } .
 }"""
-        sq = pywikibot.data.sparql.SparqlQuery()
-        queryresult = sq.select(query)
+        # Streamed so the few hundred thousand rows are not in memory at once
+        queryresult = sparql_client.SparqlClient().select(query, split_variable='item')
+
+        withtables = (self.wikidataWithCIA, self.wikidataWithCI, self.wikidataWithIA, self.wikidataWithCA)
+        withouttables = (self.wikidataWithoutCIA, self.wikidataWithoutCI, self.wikidataWithoutIA, self.wikidataWithoutCA)
 
         for resultitem in queryresult:
-            item = resultitem.get('item').replace(u'http://www.wikidata.org/entity/', u'')
+            item = sys.intern(resultitem.get('item').replace(u'http://www.wikidata.org/entity/', u''))
             # First clean up and put in a dictionary
             paintingdict = { u'item' : item,
                              u'image' : False,
@@ -338,113 +328,50 @@ class PaintingsMatchBot:
                              u'location' : False,
                              u'url' : False }
             if resultitem.get('image'):
-                paintingdict['image'] = pywikibot.FilePage(pywikibot.Site('commons', 'commons'),resultitem.get('image').replace(u'http://commons.wikimedia.org/wiki/Special:FilePath/', u'')).title(underscore=True, with_ns=False)
+                paintingdict['image'] = self.getImageName(resultitem.get('image'))
             if resultitem.get('creator'):
-                paintingdict ['creator'] = resultitem.get('creator').replace(u'http://www.wikidata.org/entity/', u'')
+                paintingdict ['creator'] = sys.intern(resultitem.get('creator').replace(u'http://www.wikidata.org/entity/', u''))
             if resultitem.get('institution'):
-                paintingdict['institution'] = resultitem.get('institution').replace(u'http://www.wikidata.org/entity/', u'')
+                paintingdict['institution'] = sys.intern(resultitem.get('institution').replace(u'http://www.wikidata.org/entity/', u''))
             if resultitem.get('invnum'):
-                paintingdict['invnum'] = resultitem.get('invnum')
+                paintingdict['invnum'] = sys.intern(resultitem.get('invnum'))
             if resultitem.get('location'):
-                paintingdict['location'] = resultitem.get('location').replace(u'http://www.wikidata.org/entity/', u'')
+                paintingdict['location'] = sys.intern(resultitem.get('location').replace(u'http://www.wikidata.org/entity/', u''))
             if resultitem.get('url'):
                 paintingdict['url'] = resultitem.get('url')
             elif resultitem.get('idurl'):
                 paintingdict['url'] = resultitem.get('idurl')
 
-            ciakey = None
-            clakey = None
-            cikey = None
-            clkey = None
-            iakey = None
-            lakey = None
-            cakey = None
-
-            if paintingdict.get(u'creator') and paintingdict.get(u'institution') and paintingdict.get(u'invnum'):
-                ciakey = (paintingdict.get(u'creator'),
-                          paintingdict.get(u'institution'),
-                          paintingdict.get(u'invnum'))
-            if paintingdict.get(u'creator') and paintingdict.get(u'location') and paintingdict.get(u'invnum'):
-                clakey = (paintingdict.get(u'creator'),
-                          paintingdict.get(u'location'),
-                          paintingdict.get(u'invnum'))
-            if paintingdict.get(u'creator') and paintingdict.get(u'institution'):
-                cikey = (paintingdict.get(u'creator'),
-                         paintingdict.get(u'institution'))
-            if paintingdict.get(u'creator') and paintingdict.get(u'location'):
-                clkey = (paintingdict.get(u'creator'),
-                         paintingdict.get(u'location'))
-            if paintingdict.get(u'institution') and paintingdict.get(u'invnum'):
-                iakey = (paintingdict.get(u'institution'),
-                         paintingdict.get(u'invnum'))
-            if paintingdict.get(u'location') and paintingdict.get(u'invnum'):
-                lakey = (paintingdict.get(u'location'),
-                         paintingdict.get(u'invnum'))
-            if paintingdict.get(u'creator') and paintingdict.get(u'invnum'):
-                cakey = (paintingdict.get(u'creator'),
-                         paintingdict.get(u'invnum'))
+            # Keys based on the collection and keys based on the location (if that's something else)
+            institutionkeys = self.getLookupKeys(paintingdict.get(u'creator'),
+                                                 paintingdict.get(u'institution'),
+                                                 paintingdict.get(u'invnum'))
+            locationkeys = self.getLookupKeys(paintingdict.get(u'creator'),
+                                              paintingdict.get(u'location'),
+                                              paintingdict.get(u'invnum'))
 
             if paintingdict.get(u'image'):
                 self.wikidataImages[paintingdict.get(u'image')] = paintingdict
                 self.wikidataWithImages[paintingdict.get(u'item')] = paintingdict
-                if ciakey:
-                    if not ciakey in self.wikidataWithCIA:
-                        self.wikidataWithCIA[ciakey] = []
-                    self.wikidataWithCIA[ciakey].append(paintingdict)
-                if clakey and clakey!=ciakey:
-                    if not clakey in self.wikidataWithCIA:
-                        self.wikidataWithCIA[clakey] = []
-                    self.wikidataWithCIA[clakey].append(paintingdict)
-                if cikey:
-                    if not cikey in self.wikidataWithCI:
-                        self.wikidataWithCI[cikey] = []
-                    self.wikidataWithCI[cikey].append(paintingdict)
-                if clkey and clkey!=cikey:
-                    if not clkey in self.wikidataWithCI:
-                        self.wikidataWithCI[clkey] = []
-                    self.wikidataWithCI[clkey].append(paintingdict)
-                if iakey:
-                    if not iakey in self.wikidataWithIA:
-                        self.wikidataWithIA[iakey] = []
-                    self.wikidataWithIA[iakey].append(paintingdict)
-                if lakey and lakey!=iakey:
-                    if not lakey in self.wikidataWithIA:
-                        self.wikidataWithIA[lakey] = []
-                    self.wikidataWithIA[lakey].append(paintingdict)
-                if cakey:
-                    if not cakey in self.wikidataWithCA:
-                        self.wikidataWithCA[cakey] = []
-                    self.wikidataWithCA[cakey].append(paintingdict)
+                tables = withtables
             else:
                 self.wikidataNoImages[paintingdict.get(u'item')] = paintingdict
-                if ciakey:
-                    if not ciakey in self.wikidataWithoutCIA:
-                        self.wikidataWithoutCIA[ciakey] = []
-                    self.wikidataWithoutCIA[ciakey].append(paintingdict)
-                if clakey and clakey!=ciakey:
-                    if not clakey in self.wikidataWithoutCIA:
-                        self.wikidataWithoutCIA[clakey] = []
-                    self.wikidataWithoutCIA[clakey].append(paintingdict)
-                if cikey:
-                    if not cikey in self.wikidataWithoutCI:
-                        self.wikidataWithoutCI[cikey] = []
-                    self.wikidataWithoutCI[cikey].append(paintingdict)
-                if clkey and clkey!=cikey:
-                    if not clkey in self.wikidataWithoutCI:
-                        self.wikidataWithoutCI[clkey] = []
-                    self.wikidataWithoutCI[clkey].append(paintingdict)
-                if iakey:
-                    if not iakey in self.wikidataWithoutIA:
-                        self.wikidataWithoutIA[iakey] = []
-                    self.wikidataWithoutIA[iakey].append(paintingdict)
-                if lakey and lakey!=iakey:
-                    if not lakey in self.wikidataWithoutIA:
-                        self.wikidataWithoutIA[lakey] = []
-                    self.wikidataWithoutIA[lakey].append(paintingdict)
-                if cakey:
-                    if not cakey in self.wikidataWithoutCA:
-                        self.wikidataWithoutCA[cakey] = []
-                    self.wikidataWithoutCA[cakey].append(paintingdict)
+                tables = withouttables
+            self.addToLookupTables(tables, institutionkeys, paintingdict)
+            self.addToLookupTables(tables, locationkeys, paintingdict, skipkeys=institutionkeys)
+
+    def getImageName(self, imageurl):
+        """
+        Turn the image url the query service returns into the filename with underscores like the Commons files use.
+
+        This is the same as what pywikibot.FilePage(...).title(underscore=True, with_ns=False) returns, but without
+        making a page object for every painting.
+        :param imageurl: The Special:FilePath url
+        :return: The filename
+        """
+        filename = urllib.parse.unquote(imageurl.replace(u'http://commons.wikimedia.org/wiki/Special:FilePath/', u''))
+        filename = re.sub(u'[ _]+', u'_', filename).strip(u'_')
+        return sys.intern(filename[:1].upper() + filename[1:])
 
     def getCommonsCategorySuggestions(self):
         """
@@ -494,19 +421,21 @@ class PaintingsMatchBot:
 
 
     def publishWikidataSuggestions(self, commonsdict, wikidatadict, pageTitle, samplesize=300, maxlines=1000):
-        matchesKeys = set(commonsdict.keys()) & set(wikidatadict.keys())
+        # Hash join on the keys of both lookup tables
+        matchesKeys = commonsdict.keys() & wikidatadict.keys()
         print ('Found %s matches for %s' % (len(matchesKeys), pageTitle))
 
         if len(matchesKeys) > samplesize:
-            publishKeys = random.sample(matchesKeys, samplesize)
+            publishKeys = random.sample(sorted(matchesKeys), samplesize)
         else:
             publishKeys = matchesKeys
 
         line = 0
         page = pywikibot.Page(self.repo, title=pageTitle)
 
-        text = u'{{Wikidata:WikiProject sum of all paintings/Image suggestions/header}}\n{| class="wikitable sortable"\n'
-        text = text + u'! Painting !! Image !! Image title !! Link !! Add !! Creator !! Collection !! Inventory number\n'
+        text = ReportBuilder()
+        text.add(u'{{Wikidata:WikiProject sum of all paintings/Image suggestions/header}}\n{| class="wikitable sortable"\n')
+        text.add(u'! Painting !! Image !! Image title !! Link !! Add !! Creator !! Collection !! Inventory number\n')
         for key in publishKeys:
             firstrow = True
             #(creator, institution, inv) = key
@@ -518,44 +447,44 @@ class PaintingsMatchBot:
                     line = line + 1
 
                     if line < maxlines:
-                        text = text + u'|-\n'
+                        text.add(u'|-\n')
 
                         addlink = u'[https://tools.wmflabs.org/wikidata-todo/quick_statements.php?list={{subst:urlencode:%s\tP18\t"%s"}} Add]' % (paintingdict.get('item'), image.replace(u'_', u' ')) # urlencode?
                         describedlink = u''
                         if paintingdict.get('url'):
                             describedlink = u'[%s Link]' % (paintingdict.get('url'),)
 
-                        text = text + u'| {{Q|%s}} || [[File:%s|100px]] || <small>%s</small> || %s || %s ' % (paintingdict.get('item'),
-                                                                                                              image,
-                                                                                                              image,
-                                                                                                              describedlink,
-                                                                                                              addlink,
-                                                                                                              )
+                        text.add(u'| {{Q|%s}} || [[File:%s|100px]] || <small>%s</small> || %s || %s ' % (paintingdict.get('item'),
+                                                                                                         image,
+                                                                                                         image,
+                                                                                                         describedlink,
+                                                                                                         addlink,
+                                                                                                         ))
                         if not paintingdict.get('creator'):
-                            text = text + u'|| '
+                            text.add(u'|| ')
                         elif firstrow:
-                            text = text + u'|| {{Q|%s}} ' % (paintingdict.get('creator'),)
+                            text.add(u'|| {{Q|%s}} ' % (paintingdict.get('creator'),))
                         else:
-                            text = text + u'|| [[%s]] ' % (paintingdict.get('creator'),)
+                            text.add(u'|| [[%s]] ' % (paintingdict.get('creator'),))
 
                         if not paintingdict.get('institution'):
-                            text = text + u'|| '
+                            text.add(u'|| ')
                         elif firstrow:
-                            text = text + u'|| {{Q|%s}} ' % (paintingdict.get('institution'),)
+                            text.add(u'|| {{Q|%s}} ' % (paintingdict.get('institution'),))
                         else:
-                            text = text + u'|| [[%s]] ' % (paintingdict.get('institution'),)
+                            text.add(u'|| [[%s]] ' % (paintingdict.get('institution'),))
 
                         if not paintingdict.get('invnum'):
-                            text = text + u'|| \n'
+                            text.add(u'|| \n')
                         elif firstrow:
-                            text = text + u'|| %s \n' % (paintingdict.get('invnum'),)
+                            text.add(u'|| %s \n' % (paintingdict.get('invnum'),))
 
-        text = text + u'|}\n'
-        text = text + u'\n[[Category:WikiProject sum of all paintings|Image suggestions/{{SUBPAGENAME}}]]\n'
+        text.add(u'|}\n')
+        text.add(u'\n[[Category:WikiProject sum of all paintings|Image suggestions/{{SUBPAGENAME}}]]\n')
 
         summary = u'Updating image suggestions. %s key matches out a total of %s key combinations that matched' % (len(publishKeys), len(matchesKeys))
         pywikibot.output(summary)
-        page.put(text, summary)
+        self.publisher.add(page, text, summary)
 
         # WIP: Not sure how to approach this one
         suggestions = []
@@ -592,24 +521,25 @@ class PaintingsMatchBot:
         pageTitle = u'Wikidata:WikiProject sum of all paintings/Image suggestions/Higher resolution'
         page = pywikibot.Page(self.repo, title=pageTitle)
 
-        text = u'{{Wikidata:WikiProject sum of all paintings/Image suggestions/header}}\n{| class="wikitable sortable"\n'
-        text = text + u'! Painting !! Current image !! Suggested image !! Info\n'
+        text = ReportBuilder()
+        text.add(u'{{Wikidata:WikiProject sum of all paintings/Image suggestions/header}}\n{| class="wikitable sortable"\n')
+        text.add(u'! Painting !! Current image !! Suggested image !! Info\n')
         for (usedimage, bestimage, totalincrease, sizeincrease, widthincrease, heightincrease) in bestsuggestions:
-            text = text + u'|-\n'
-            text = text + u'| {{Q|%s}}<BR/><small>( %s )</small>\n' % (usedimage.get('qidlink'), bestimage.get('image') )
-            text = text + u'| [[File:%s|100px]]\n' % (usedimage.get('image'), )
-            text = text + u'| [[File:%s|100px]]\n' % (bestimage.get('image'), )
-            text = text + u'|\n'
-            text = text + u'* Size: %s -> %s (%s)\n' % (usedimage.get('size'), bestimage.get('size'), sizeincrease,)
-            text = text + u'* Width: %s -> %s (%s)\n' % (usedimage.get('width'), bestimage.get('width'), widthincrease, )
-            text = text + u'* Height: %s -> %s (%s)\n' % (usedimage.get('height'), bestimage.get('height'), heightincrease, )
-            text = text + u'<small>[//commons.wikimedia.org/w/index.php?title=Category:Artworks_with_Wikidata_item&filefrom=+%s#mw-category-media more files]</small>\n' % (usedimage.get('qidlink'), )
-        text = text + u'|}\n'
-        text = text + u'\n[[Category:WikiProject sum of all paintings|Image suggestions/{{SUBPAGENAME}}]]\n'
+            text.add(u'|-\n')
+            text.add(u'| {{Q|%s}}<BR/><small>( %s )</small>\n' % (usedimage.get('qidlink'), bestimage.get('image') ))
+            text.add(u'| [[File:%s|100px]]\n' % (usedimage.get('image'), ))
+            text.add(u'| [[File:%s|100px]]\n' % (bestimage.get('image'), ))
+            text.add(u'|\n')
+            text.add(u'* Size: %s -> %s (%s)\n' % (usedimage.get('size'), bestimage.get('size'), sizeincrease,))
+            text.add(u'* Width: %s -> %s (%s)\n' % (usedimage.get('width'), bestimage.get('width'), widthincrease, ))
+            text.add(u'* Height: %s -> %s (%s)\n' % (usedimage.get('height'), bestimage.get('height'), heightincrease, ))
+            text.add(u'<small>[//commons.wikimedia.org/w/index.php?title=Category:Artworks_with_Wikidata_item&filefrom=+%s#mw-category-media more files]</small>\n' % (usedimage.get('qidlink'), ))
+        text.add(u'|}\n')
+        text.add(u'\n[[Category:WikiProject sum of all paintings|Image suggestions/{{SUBPAGENAME}}]]\n')
 
         summary = u'Updating %s better image suggestions out of %s.' % (len(bestsuggestions), len(self.bettersuggestions))
         pywikibot.output(summary)
-        page.put(text, summary)
+        self.publisher.add(page, text, summary)
 
     def publishAllCommonsSuggestions(self):
         """
@@ -643,29 +573,35 @@ class PaintingsMatchBot:
         self.publishCategorySuggestions(u'User:Multichill/Same image without Wikidata/Category match')
 
     def publishCommonsSuggestions(self, withoutdict, withdict, pageTitle, samplesize=300, maxlines=1000):
-        matchesKeys = set(withoutdict.keys()) & set(withdict.keys())
-        filteredKeys = set()
+        if not withdict:
+            # The Commons with lookup tables are disabled, don't bother with the keys and the image hashes
+            pywikibot.output(u'Nothing to match for %s, skipping it' % (pageTitle,))
+            return
+        # Hash join on the keys of both lookup tables
+        matchesKeys = withoutdict.keys() & withdict.keys()
 
         # Commons data we don't have a distinction between creator and institution.
         # We need to filter everything out were these are the same (can't be a match)
-        for matchkey in matchesKeys:
-            if not matchkey[0]==matchkey[1]:
-                filteredKeys.add(matchkey)
+        filteredKeys = set([matchkey for matchkey in matchesKeys if matchkey[0]!=matchkey[1]])
         print ('Found %s matches for %s' % (len(filteredKeys), pageTitle))
 
-        opencvfilter = False
+        imagefilter = False
         if len(filteredKeys) > samplesize:
             # publishKeys = random.sample(filteredKeys, samplesize)
-            # We just randomize the keys and filter it later
-            publishKeys = random.sample(filteredKeys, len(filteredKeys))
-            opencvfilter = True
+            # We just randomize the keys and filter it later. A set so the lookups below are fast
+            publishKeys = set(random.sample(sorted(filteredKeys), len(filteredKeys)))
+            imagefilter = True
         else:
             publishKeys = filteredKeys
 
+        if imagefilter:
+            self.prefetchImageHashes(withoutdict, withdict, filteredKeys, maxlines)
+
         line = 0
         page = pywikibot.Page(self.commons, title=pageTitle)
-        text = u'{{User:Multichill/Same image without Wikidata/header}}\n{| class="wikitable sortable"\n'
-        text = text + u'! Image Wikidata !! Image without !! Wikidata id !! To add !! Filenames\n'
+        text = ReportBuilder()
+        text.add(u'{{User:Multichill/Same image without Wikidata/header}}\n{| class="wikitable sortable"\n')
+        text.add(u'! Image Wikidata !! Image without !! Wikidata id !! To add !! Filenames\n')
 
         previousline = u''
         for key in filteredKeys:
@@ -678,8 +614,7 @@ class PaintingsMatchBot:
                     # Going throuh all keys, but only publishing a few
                     if key in publishKeys:
                         if line < maxlines and not imagewithout in self.commonsLink:
-                            opencvfilter = False
-                            if not opencvfilter or self.opencvmatch(withinfodict.get('image'), imagewithout):
+                            if not imagefilter or self.imagehashmatch(withinfodict.get('image'), imagewithout):
                                 thisline = u'| [[File:%s|150px]] || [[File:%s|150px]] || [[:d:%s|%s]] || <nowiki>|</nowiki> wikidata = %s<BR/>[{{fullurl:File:%s|action=edit&withJS=MediaWiki:AddWikidata.js&wikidataid=%s}} Add] || %s<BR/>%s\n' % (withinfodict.get('image'),
                                                                                                                                                                                                                                                         imagewithout,
                                                                                                                                                                                                                                                         withinfodict.get('item'),
@@ -691,76 +626,50 @@ class PaintingsMatchBot:
                                                                                                                                                                                                                                                         imagewithout)
                                 # Prevent duplicate lines
                                 if thisline!=previousline:
-                                    text = text + u'|-\n'
-                                    text = text + thisline
+                                    text.add(u'|-\n')
+                                    text.add(thisline)
                                     previousline = thisline
                                     line = line + 1
 
-        text = text + u'|}\n'
-        text = text + u'\n[[Category:WikiProject sum of all paintings]]\n'
+        text.add(u'|}\n')
+        text.add(u'\n[[Category:WikiProject sum of all paintings]]\n')
 
         summary = u'Updating image suggestions. %s key matches out a total of %s key combinations that matched' % (len(publishKeys), len(filteredKeys))
         pywikibot.output(summary)
-        #page.put(text, summary) DEBUGGING
+        #self.publisher.add(page, text, summary) DEBUGGING
 
-    def opencvmatch(self, filea, fileb):
+    def prefetchImageHashes(self, withoutdict, withdict, keys, maxpairs):
+        """
+        Make the hashes of the first maxpairs pairs of images that publishCommonsSuggestions will compare.
+        The index uses several threads for this, the ones after that are made when they're needed.
         """
-        DISABLED, packages not available
+        filenames = set()
+        pairs = 0
+        for key in keys:
+            for imagewithout in withoutdict.get(key):
+                if imagewithout in self.commonsLink:
+                    continue
+                for withinfodict in withdict.get(key):
+                    filenames.add(imagewithout)
+                    filenames.add(withinfodict.get('image'))
+                    pairs = pairs + 1
+            if pairs >= maxpairs:
+                break
+        self.imageHashIndex.prefetch(filenames)
+
+    def imagehashmatch(self, filea, fileb):
+        """
+        Compare the perceptual hashes of both files. The hashes are made only once and kept in the index.
         Returns false if both files are probably not the same.
         Returns True if not sure or it is the same
         """
-
-        #HOG parameters
-        winSize = (32,32)
-        blockSize = (16,16)
-        blockStride = (8,8)
-        cellSize = (8,8)
-        nbins = 9
-        derivAperture = 1
-        winSigma = 4.
-        histogramNormType = 0
-        L2HysThreshold = 2.0000000000000001e-01
-        gammaCorrection = 0
-        nlevels = 64
-        winStride = (8,8)
-        padding = (8,8)
-        locations = ((10,20),)
-        hog = cv2.HOGDescriptor(winSize,blockSize,blockStride,cellSize,nbins,derivAperture,winSigma,
-                                histogramNormType,L2HysThreshold,gammaCorrection,nlevels)
-
-        filePageA = pywikibot.FilePage(self.commons, title=filea)
-        filePageB = pywikibot.FilePage(self.commons, title=fileb)
-        fileaUrl = filePageA.get_file_url(url_width=600)
-        filebUrl = filePageB.get_file_url(url_width=600)
-
-        imageFileA = requests.get(fileaUrl)
-        imageFileB = requests.get(filebUrl)
-        with tempfile.NamedTemporaryFile() as tA:
-            tA.write(imageFileA.content)
-            tA.flush()
-            with tempfile.NamedTemporaryFile() as tB:
-                tB.write(imageFileB.content)
-                tB.flush()
-                try:
-                    img1 = cv2.imread(tA.name, 0)
-                    img2 = cv2.imread(tB.name, 0)
-                except:
-                    # If it fails, don't filter it
-                    return None
-                if img1 is None or img2 is None:
-                    return None
-                #compute hog
-                hist1 = hog.compute(img1, winStride, padding, locations)
-                hist2 = hog.compute(img2, winStride, padding, locations)
-                #compute distance
-                #dist=cosine_similarity(hist1,hist2)
-                dist=pearsonr(hist1,hist2)
-                correlation=0 if np.isnan(dist[0]) else dist[0]
-                pywikibot.output(u'%s correlation for %s and %s' % (correlation, filea, fileb))
-                if correlation > 0.30:
-                    return True
-                else:
-                    return False
+        result = self.imageHashIndex.is_same_image(filea, fileb)
+        if result is None:
+            # If it fails, don't filter it
+            return True
+        if not result:
+            pywikibot.output(u'Filtered out %s and %s, the images are not the same' % (filea, fileb))
+        return result
 
     def publishCategorySuggestions(self, pageTitle, samplesize=300, maxlines=1000):
         """
@@ -796,8 +705,9 @@ class PaintingsMatchBot:
 
         line = 0
         page = pywikibot.Page(self.commons, title=pageTitle)
-        text = u'{{User:Multichill/Same image without Wikidata/header}}\n{| class="wikitable sortable"\n'
-        text = text + u'! Image Wikidata !! Image without !! Wikidata id !! To add !! Filenames\n'
+        text = ReportBuilder()
+        text.add(u'{{User:Multichill/Same image without Wikidata/header}}\n{| class="wikitable sortable"\n')
+        text.add(u'! Image Wikidata !! Image without !! Wikidata id !! To add !! Filenames\n')
 
         previousline = u''
         for (imagewith, imagewithout, qid) in worksuggestions:
@@ -813,17 +723,17 @@ class PaintingsMatchBot:
                                                                                                                                                                                                                                      imagewithout)
                 # Prevent duplicate lines
                 if thisline!=previousline:
-                    text = text + u'|-\n'
-                    text = text + thisline
+                    text.add(u'|-\n')
+                    text.add(thisline)
                     previousline = thisline
                     ine = line + 1
 
-        text = text + u'|}\n'
-        text = text + u'\n[[Category:WikiProject sum of all paintings]]\n'
+        text.add(u'|}\n')
+        text.add(u'\n[[Category:WikiProject sum of all paintings]]\n')
 
         summary = u'Updating image suggestions. %s key matches out a total of %s key combinations that matched' % (len(worksuggestions), len(self.categorysuggestions))
         pywikibot.output(summary)
-        page.put(text, summary)
+        self.publisher.add(page, text, summary)
 
     def addMissingCommonsWikidataLinks(self):
         """
@@ -831,9 +741,10 @@ class PaintingsMatchBot:
         """
         pageTitle = 'User:Multichill/Unable to add Wikidata link'
         page = pywikibot.Page(self.commons, title=pageTitle)
-        text = '{{/header}}\n'
+        text = ReportBuilder()
+        text.add('{{/header}}\n')
 
-        missingCommonsLinks = set(self.wikidataImages.keys()) & set(self.commonsNoLink)
+        missingCommonsLinks = self.wikidataImages.keys() & set(self.commonsNoLink)
         for filename in missingCommonsLinks:
             wikidataitem = self.wikidataImages.get(filename).get('item')
             success = self.addMissingCommonsWikidataLink(filename, wikidataitem)
@@ -841,14 +752,14 @@ class PaintingsMatchBot:
                 # This prevents these files from showing up in the suggestions and missing link reports
                 self.commonsLink[filename]=wikidataitem
             else:
-                text = text + u'* [[:File:%s]] - <nowiki>|</nowiki> wikidata = %s\n' % (filename, wikidataitem)
+                text.add(u'* [[:File:%s]] - <nowiki>|</nowiki> wikidata = %s\n' % (filename, wikidataitem))
 
 
-        text = text + u'\n[[Category:WikiProject sum of all paintings]]\n'
+        text.add(u'\n[[Category:WikiProject sum of all paintings]]\n')
 
         summary = u'Updating list of images to which to bot was unable to add a link'
         pywikibot.output(summary)
-        page.put(text, summary)
+        self.publisher.add(page, text, summary)
 
     def addMissingCommonsWikidataLink(self, filename, wikidataitem):
         """
@@ -891,20 +802,21 @@ class PaintingsMatchBot:
         Publish a list of files that are in use on Wikidata, but don't have a tracker category
         Files that are in use on Wikidata, but not in the without Wikikidata category and also not in the with Wikidata category
         """
-        nottracked = set(self.wikidataImages.keys()) - (set(self.commonsNoLink) | set(self.commonsLink.keys()))
+        nottracked = self.wikidataImages.keys() - (set(self.commonsNoLink) | self.commonsLink.keys())
 
         pageTitle = u'User:Multichill/Painting images no artwork template'
 
         page = pywikibot.Page(self.commons, title=pageTitle)
 
-        text = u'{{/header}}\n'
+        text = ReportBuilder()
+        text.add(u'{{/header}}\n')
         for filename in nottracked:
-            text = text + u'* [[:File:%s]]\n' % filename
-        text = text + u'\n[[Category:WikiProject sum of all paintings]]\n'
+            text.add(u'* [[:File:%s]]\n' % filename)
+        text.add(u'\n[[Category:WikiProject sum of all paintings]]\n')
 
         summary = u'Updating list of %s painting images with no artwork template' % (len(nottracked),)
         pywikibot.output(summary)
-        page.put(text, summary)
+        self.publisher.add(page, text, summary)
 
     def addWikidataSuggestions(self):
         """
@@ -913,7 +825,7 @@ class PaintingsMatchBot:
         :return:
         """
         # Make a list of creator/institution/inventory number (ascession number)
-        matchesKeys = set(self.commonsWithoutCIA.keys()) & set(self.wikidataWithoutCIA.keys())
+        matchesKeys = self.commonsWithoutCIA.keys() & self.wikidataWithoutCIA.keys()
         for key in matchesKeys:
             (creator, institution, inv) = key
 
@@ -0,0 +1,249 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Persistent index of perceptual hashes of files on Commons.
+
+For every file a 64 bit difference hash (dHash) is made once from a small thumbnail and stored in a SQLite file.
+Two files are probably the same painting if the Hamming distance between their hashes is small. Searching the whole
+index is done with a BK-tree so it doesn't have to compare against every file.
+
+Needs Pillow (PIL) to make new hashes. Without it only the hashes already in the index can be used.
+
+Usage: python image_hash_index.py -file:"Some painting.jpg" to list the files in the index that look the same
+"""
+import pywikibot
+import os
+import sqlite3
+import threading
+import io
+import urllib.parse
+import requests
+from concurrent.futures import ThreadPoolExecutor
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+def hamming_distance(hasha, hashb):
+    """
+    Get the number of bits that are different between the two hashes
+    """
+    return bin(hasha ^ hashb).count('1')
+
+
+def make_dhash(imagedata, size=8):
+    """
+    Make a difference hash of an image. The image is scaled down to (size+1) x size grey pixels and every bit tells
+    if a pixel is brighter than its neighbour to the right.
+
+    :param imagedata: The bytes of the image file
+    :param size: The hash will be size x size bits
+    :return: The hash as int
+    """
+    image = Image.open(io.BytesIO(imagedata)).convert('L').resize((size + 1, size), Image.LANCZOS)
+    pixels = list(image.getdata())
+    result = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            result = (result << 1) | (left > right)
+    return result
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree to find all hashes within a Hamming distance without comparing against all of them
+    """
+    def __init__(self):
+        self.root = None
+
+    def add(self, imagehash, filename):
+        """
+        Add a file with its hash to the tree
+        """
+        if self.root is None:
+            # Node is (hash, list of filenames, dict of distance -> child node)
+            self.root = (imagehash, [filename], {})
+            return
+        node = self.root
+        while True:
+            distance = hamming_distance(imagehash, node[0])
+            if distance == 0:
+                node[1].append(filename)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (imagehash, [filename], {})
+                return
+            node = child
+
+    def search(self, imagehash, maxdistance):
+        """
+        Find the files with a hash close to this hash
+
+        :param imagehash: The hash to look for
+        :param maxdistance: The maximum Hamming distance
+        :return: List of tuples of distance and filename, closest first
+        """
+        result = []
+        if self.root is None:
+            return result
+        nodes = [self.root]
+        while nodes:
+            node = nodes.pop()
+            distance = hamming_distance(imagehash, node[0])
+            if distance <= maxdistance:
+                for filename in node[1]:
+                    result.append((distance, filename))
+            # Triangle inequality: only children in this range can be close enough
+            for childdistance, child in node[2].items():
+                if distance - maxdistance <= childdistance <= distance + maxdistance:
+                    nodes.append(child)
+        return sorted(result)
+
+
+class ImageHashIndex:
+    """
+    The hashes of files on Commons, made once and kept on disk
+    """
+    def __init__(self, filename=None, thumbnail_width=100, workers=4, maxdistance=12):
+        """
+        Arguments:
+            * filename        - The SQLite file. Defaults to image_hashes.sqlite in the pywikibot directory
+            * thumbnail_width - Width of the thumbnail that is downloaded to make the hash
+            * workers         - Number of threads to download thumbnails with in prefetch
+            * maxdistance     - Files with a Hamming distance up to this are considered the same
+
+        """
+        if not filename:
+            filename = os.path.join(pywikibot.config.base_dir, 'image_hashes.sqlite')
+        self.thumbnail_width = thumbnail_width
+        self.workers = workers
+        self.maxdistance = maxdistance
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.tree = None
+
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        # The hash is stored as a signed 64 bit integer because that's what SQLite can hold
+        self.connection.execute('CREATE TABLE IF NOT EXISTS hashes (filename TEXT PRIMARY KEY, hash INTEGER)')
+        self.connection.commit()
+        self.hashes = {}
+        for (imagename, storedhash) in self.connection.execute('SELECT filename, hash FROM hashes'):
+            self.hashes[imagename] = storedhash & 0xFFFFFFFFFFFFFFFF
+
+    def get_hash(self, filename):
+        """
+        Get the hash of a file on Commons. Makes it if it's not in the index yet.
+
+        :param filename: The filename without namespace, spaces or underscores
+        :return: The hash or None if it couldn't be made
+        """
+        filename = filename.replace(' ', '_')
+        if filename in self.hashes:
+            return self.hashes.get(filename)
+        if Image is None:
+            return None
+        try:
+            imagehash = make_dhash(self.get_thumbnail(filename))
+        except Exception as err:
+            pywikibot.output('Unable to make the hash of %s: %s' % (filename, err))
+            return None
+        self.add(filename, imagehash)
+        return imagehash
+
+    def get_session(self):
+        """
+        Get the requests session of this thread. Sessions are not thread safe so every thread gets its own
+        """
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def get_thumbnail(self, filename):
+        """
+        Download a small thumbnail of the file. Special:FilePath redirects to it so no API call is needed
+        """
+        url = 'https://commons.wikimedia.org/wiki/Special:FilePath/%s?width=%s' % (urllib.parse.quote(filename),
+                                                                                  self.thumbnail_width)
+        response = self.get_session().get(url, timeout=60)
+        response.raise_for_status()
+        return response.content
+
+    def add(self, filename, imagehash):
+        """
+        Add the hash of a file to the index
+        """
+        signedhash = imagehash - (1 << 64) if imagehash >= (1 << 63) else imagehash
+        with self.lock:
+            self.hashes[filename] = imagehash
+            self.connection.execute('INSERT OR REPLACE INTO hashes VALUES (?, ?)', (filename, signedhash))
+            self.connection.commit()
+            if self.tree is not None:
+                self.tree.add(imagehash, filename)
+
+    def prefetch(self, filenames):
+        """
+        Make the hashes of all files that are not in the index yet using several threads
+        """
+        missing = set([filename.replace(' ', '_') for filename in filenames]) - self.hashes.keys()
+        if not missing or Image is None:
+            return
+        pywikibot.output('Making the hashes of %s files' % (len(missing),))
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            list(executor.map(self.get_hash, missing))
+
+    def is_same_image(self, filea, fileb):
+        """
+        Check if both files are probably the same image.
+
+        :return: False if both files are probably not the same. True if it is the same and None if not sure
+        """
+        hasha = self.get_hash(filea)
+        hashb = self.get_hash(fileb)
+        if hasha is None or hashb is None:
+            return None
+        return hamming_distance(hasha, hashb) <= self.maxdistance
+
+    def find_similar(self, filename, maxdistance=None):
+        """
+        Find the files in the index that look the same as this file
+
+        :param filename: The file to look for
+        :param maxdistance: The maximum Hamming distance. Defaults to the one of the index
+        :return: List of tuples of distance and filename, closest first
+        """
+        if maxdistance is None:
+            maxdistance = self.maxdistance
+        imagehash = self.get_hash(filename)
+        if imagehash is None:
+            return []
+        with self.lock:
+            if self.tree is None:
+                self.tree = BKTree()
+                for (imagename, storedhash) in self.hashes.items():
+                    self.tree.add(storedhash, imagename)
+        return [(distance, imagename) for (distance, imagename) in self.tree.search(imagehash, maxdistance)
+                if imagename != filename.replace(' ', '_')]
+
+
+def main(*args):
+    """
+    List the files that look the same as the file from the arguments
+    """
+    filename = None
+    for arg in pywikibot.handle_args(args):
+        if arg.startswith('-file:'):
+            filename = arg[len('-file:'):]
+    if not filename:
+        pywikibot.output('Use -file: to set the file to look for')
+        return
+    image_hash_index = ImageHashIndex()
+    for (distance, imagename) in image_hash_index.find_similar(filename):
+        pywikibot.output('%s (distance %s)' % (imagename, distance))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Lookup of medium strings like "oil on canvas" to the materials used (P186) on Wikidata.
+
+The lookup tables and patterns are built once when the module is imported and are shared by all importers that
+use artdatabot. Medium strings are normalized (case, whitespace and punctuation) and can be in English, Dutch,
+German, French, Italian or Spanish. Media that could not be matched are counted so the coverage can be tracked
+over several runs with save_unmatched_report.
+"""
+import pywikibot
+import json
+import os
+import re
+import threading
+import functools
+from collections import Counter
+
+# Paint (or drawing material) names to Wikidata items
+PAINTS = {'Q296955': ['oil', 'oil paint', 'oils', 'öl', 'ölfarbe', 'olieverf', 'olie', 'huile', "peinture à l'huile",
+                      'olio', 'óleo', 'oleo'],
+          'Q175166': ['tempera', 'egg tempera', 'eitempera'],
+          'Q207849': ['acrylic', 'acrylic paint', 'acryl', 'acrylfarbe', 'acrylverf', 'acrylique', 'acrilico',
+                      'acrílico'],
+          'Q22915256': ['watercolor', 'watercolour', 'aquarell', 'aquarel', 'aquarelle', 'acquerello', 'acuarela'],
+          # In Germany often the type of paint is not mentioned.
+          'Q174219': ['paint', 'verf', 'farbe', 'peinture', 'pintura'],
+          'Q3387833': ['black chalk', 'schwarze kreide', 'zwart krijt', 'pierre noire'],
+          'Q183670': ['chalk', 'kreide', 'krijt', 'craie'],
+          'Q1424515': ['charcoal', 'kohle', 'houtskool', 'fusain', 'carboncino', 'carboncillo'],
+          'Q14674': ['pencil', 'graphite', 'bleistift', 'potlood', 'matita', 'lápiz'],
+          }
+
+# Surfaces (and mounts) to Wikidata items
+SURFACES = {'Q12321255': ['canvas', 'leinwand', 'doek', 'schilderdoek', 'linnen', 'toile', 'tela', 'lienzo'],
+            'Q106857709': ['panel', 'wood panel', 'wooden panel', 'wood', 'holz', 'laubholz', 'nadelholz',
+                           'holztafel', 'paneel', 'hout', 'bois', 'panneau', 'tavola', 'legno', 'tabla', 'madera'],
+            'Q11472': ['paper', 'papier', 'carta', 'papel'],
+            'Q753': ['copper', 'kupfer', 'koper', 'cuivre', 'rame', 'cobre'],
+            'Q18668582': ['cardboard', 'karton', 'pappe', 'carton', 'cartone', 'cartón'],
+            }
+
+# Types of wood for rules like "oil on oak panel"
+WOODS = {'Q107103505': ['fir', 'spruce', 'tanne', 'tannen', 'fichte', 'fichten', 'vuren', 'sapin', 'abete'],
+         'Q107296639': ['lime', 'linden', 'limewood', 'lindenholz', 'linde', 'lindenhout', 'tilleul', 'tiglio'],
+         'Q106857823': ['oak', 'eiche', 'eichen', 'eik', 'eiken', 'eikenhout', 'chêne', 'quercia', 'roble'],
+         'Q106940268': ['pine', 'kiefer', 'kiefern', 'grenen', 'pin', 'pino'],
+         'Q106857865': ['poplar', 'pappel', 'populier', 'peuplier', 'pioppo', 'álamo'],
+         'Q107103575': ['walnut', 'nussbaum', 'noten', 'notenhout', 'noyer', 'noce', 'nogal'],
+         }
+
+# Only these surfaces are used as a mount like in "oil on canvas on panel"
+MOUNTS = ['Q106857709', 'Q18668582']
+
+PAINTING_SURFACE = 'Q861259'
+PAINTING_MOUNT = 'Q107105674'
+
+PUNCTUATION_REGEX = re.compile(r'[\s,.;:()\[\]/"]+')
+CONNECTOR_REGEX = re.compile(r' (?:(?:laid down |mounted )?on|auf|sur|op|su|sobre) ')
+WOOD_PANEL_REGEX = re.compile(r'^(?:(\w+?)(?:wood| wood|holz|hout| wood panel| panel|paneel| paneel)|'
+                              r'(?:panel|paneel|panneau|tavola|tabla) (?:de |en |di )?(\w+))$')
+
+
+def build_lookup(table):
+    """
+    Turn a table of item -> list of names into a normalized name -> item lookup
+    """
+    result = {}
+    for qid, names in table.items():
+        for name in names:
+            result[normalize_medium(name)] = qid
+    return result
+
+
+def normalize_medium(medium):
+    """
+    Normalize a medium string: lower case, no punctuation and single spaces
+    :param medium: The medium string
+    :return: The normalized string
+    """
+    medium = medium.casefold().replace('’', "'").replace('‘', "'")
+    medium = PUNCTUATION_REGEX.sub(' ', medium)
+    return medium.strip()
+
+
+PAINT_LOOKUP = build_lookup(PAINTS)
+SURFACE_LOOKUP = build_lookup(SURFACES)
+WOOD_LOOKUP = build_lookup(WOODS)
+
+unmatched_mediums = Counter()
+unmatched_lock = threading.Lock()
+
+
+def match_surface(surface):
+    """
+    Match a normalized surface string to an item. Also handles types of wood like "oak panel"
+    :param surface: The normalized surface
+    :return: The Wikidata id or None
+    """
+    if surface in SURFACE_LOOKUP:
+        return SURFACE_LOOKUP.get(surface)
+    if surface in WOOD_LOOKUP:
+        return WOOD_LOOKUP.get(surface)
+    wood_match = WOOD_PANEL_REGEX.match(surface)
+    if wood_match:
+        wood = wood_match.group(1) or wood_match.group(2)
+        return WOOD_LOOKUP.get(wood)
+    return None
+
+
+@functools.lru_cache(maxsize=10000)
+def match_medium(medium):
+    """
+    Match a medium string to the materials used.
+
+    :param medium: A medium string like "oil on canvas", "Öl auf Eichenholz" or "oil on canvas on panel"
+    :return: Dict with the Wikidata ids of the paint, surface and possibly mount. None if it didn't match
+    """
+    parts = CONNECTOR_REGEX.split(normalize_medium(medium))
+    if len(parts) not in (2, 3):
+        return None
+    result = {'paint': PAINT_LOOKUP.get(parts[0]),
+              'surface': match_surface(parts[1]),
+              }
+    if len(parts) == 3:
+        result['mount'] = match_surface(parts[2])
+        if result.get('mount') not in MOUNTS:
+            return None
+    if not result.get('paint') or not result.get('surface'):
+        return None
+    return result
+
+
+def add_unmatched(medium):
+    """
+    Count a medium that could not be matched
+    """
+    with unmatched_lock:
+        unmatched_mediums[normalize_medium(medium)] += 1
+
+
+@functools.lru_cache(maxsize=None)
+def get_material_item(repo, qid):
+    """
+    Get the item for a material. The item objects are shared so they're only created once
+    """
+    return pywikibot.ItemPage(repo, qid)
+
+
+def save_unmatched_report(filename=None):
+    """
+    Add the unmatched media of this run to the frequency report on disk and print the most common ones
+
+    :param filename: The JSON file with the report. Defaults to unmatched_mediums.json in the pywikibot directory
+    :return: The Counter with the totals over all runs
+    """
+    if not filename:
+        filename = os.path.join(pywikibot.config.base_dir, 'unmatched_mediums.json')
+    totals = Counter()
+    if os.path.exists(filename):
+        with open(filename, 'r', encoding='utf-8') as reportfile:
+            totals.update(json.load(reportfile))
+    with unmatched_lock:
+        totals.update(unmatched_mediums)
+        unmatched_mediums.clear()
+    with open(filename, 'w', encoding='utf-8') as reportfile:
+        json.dump(dict(totals.most_common()), reportfile, indent=1, ensure_ascii=False)
+    for medium, count in totals.most_common(20):
+        pywikibot.output('Unmatched medium %s times: "%s"' % (count, medium))
+    return totals
@@ -6,12 +6,14 @@ https://commons.wikimedia.org/wiki/Category:Images_from_Metropolitan_Museum_of_A
 
 Turns out that the numbers don't add up. This piece of code is used to hunt down the missing files
 
-Make some lookup tables before we start.
+Make some lookup tables before we start. These are indexes from file_reconciliation.py, cached for a day.
 
 Loop over the id's at https://collectionapi.metmuseum.org/public/collection/v1/objects
 
 If it's in the public domain, check if we uploaded all the files
 
+Use -audit to only compare the Met filename dump with the files on Commons
+
 """
 import artdatabot
 import pywikibot
@@ -23,6 +25,7 @@ import os
 import csv
 import codecs
 from xml.sax.saxutils import escape
+from file_reconciliation import FileIndex, get_cached_index, normalize_basename, reconcile
 
 
 class MetFileUploadBot:
@@ -35,11 +38,11 @@ class MetFileUploadBot:
         """
         self.generator = generator
         self.metWorksOnWikidata = self.getMetWorksOnWikidata()
-        self.commonsFiles = self.getCurrentCommonsFiles()
-        self.commonsIds = self.getCurrentCommonsIds()
-        self.commonsShortFilenames = self.getCurrentCommonsShortFilenames()
+        self.commonsFiles = currentCommonsFiles()
+        self.commonsIds = currentCommonsIds()
+        self.commonsShortFilenames = currentCommonsShortFilenames()
         self.xmldata=filesFound = {}
-        self.alreadyUploaded = []
+        self.alreadyUploaded = set()
 
         #self.repo = pywikibot.Site().data_repository()
 
@@ -61,57 +64,16 @@ class MetFileUploadBot:
 
     def getCurrentCommonsFilesTransclusion(self):
         '''
-        Get the list of current Commons filenames with spaces, not underscores:
-        u'Diptyc MET ep1975.1.22.r.bw.R.jpg'
+        Get the index of current Commons filenames based on the transclusion of {{TheMet}}
+        :return: FileIndex
         '''
-        result = []
+        result = FileIndex()
         site = pywikibot.Site(u'commons', u'commons')
         pagetitle = u'Template:TheMet'
         templatepage = pywikibot.Page(site, title=pagetitle)
         references =templatepage.getReferences(onlyTemplateInclusion=True, namespaces=[6,])
         for page in references:
-            result.append(page.title(withNamespace=False,))
-        return result
-
-    def getCurrentCommonsFiles(self):
-        '''
-        Get the list of current Commons filenames with spaces, not underscores:
-        u'Diptyc MET ep1975.1.22.r.bw.R.jpg'
-        '''
-        result = []
-        urlpage = requests.get(u'https://tools.wmflabs.org/multichill/queries/commons/met_files.txt', verify=False)
-        regex =u'^\* File\:(.+)$'
-        for match in re.finditer(regex, urlpage.text, re.M):
-            # Might crash on non-integer
-            result.append(match.group(1).replace(u'_', u' '))
-        return result
-
-    def getCurrentCommonsIds(self):
-        '''
-        Get the list of current Commons filenames with spaces, not underscores:
-        u'Diptyc MET ep1975.1.22.r.bw.R.jpg'
-        '''
-        resultFiles = []
-        resultids = []
-        urlpage = requests.get(u'https://tools.wmflabs.org/multichill/queries/commons/met_urls.txt', verify=False)
-        regex =u'^\* File\:(.+) - https\:\/\/www\.metmuseum\.org\/art\/collection\/search\/(\d+)$'
-        for match in re.finditer(regex, urlpage.text, re.M):
-            # Might crash on non-integer
-            resultFiles.append(match.group(1).replace(u'_', u' '))
-            resultids.append(match.group(2))
-        return (resultFiles,resultids)
-
-    def getCurrentCommonsShortFilenames(self):
-        '''
-        Get the list of current Commons filenames with spaces, not underscores:
-        u'Diptyc MET ep1975.1.22.r.bw.R.jpg'
-        '''
-        result= {}
-        urlpage = requests.get(u'https://tools.wmflabs.org/multichill/queries/commons/met_urls.txt', verify=False)
-        regex =u'^\* File\:.*[ _]?MET[ _](.+)\.(jpg|jpeg) - https\:\/\/www\.metmuseum\.org\/art\/collection\/search\/(\d+)$'
-        for match in re.finditer(regex, urlpage.text, re.M|re.I):
-            # Might crash on non-integer
-            result[(match.group(1).replace(u' ', u'_'))] = match.group(3)
+            result.add(page.title(withNamespace=False,))
         return result
 
     def run(self):
@@ -156,16 +118,13 @@ class MetFileUploadBot:
         if not title:
             return
         fullfilename = u'%s.jpg' % (title, )
-        fullfilenamee = u'%s.jpeg' % (title, )
-        if fullfilename in self.commonsFiles:
-            self.alreadyUploaded.append(fullfilename)
-            pywikibot.output(u'Already uploaded %s' % (fullfilename,))
-            return
-        elif fullfilenamee in self.commonsFiles:
-            self.alreadyUploaded.append(fullfilenamee)
-            pywikibot.output(u'Already uploaded %s' % (fullfilenamee,))
+        # Also finds the .jpeg version so the same image is not uploaded twice
+        uploadedfilename = self.commonsFiles.find(fullfilename, fallback=True)
+        if uploadedfilename:
+            self.alreadyUploaded.add(uploadedfilename)
+            pywikibot.output(u'Already uploaded %s' % (uploadedfilename,))
             return
-        pywikibot.output(u'Probably going to upload %s' % (fullfilenamee,))
+        pywikibot.output(u'Probably going to upload %s' % (fullfilename,))
         self.outputXML(image, title, metobject)
 
     def generateCommonsTitle(self, image, metobject):
@@ -225,6 +184,49 @@ class MetFileUploadBot:
 
 
 
+def currentCommonsFiles():
+    '''
+    Get the index of current Commons filenames like u'Diptyc MET ep1975.1.22.r.bw.R.jpg'. Cached for a day
+    :return: FileIndex
+    '''
+    def buildIndex():
+        result = FileIndex()
+        urlpage = requests.get(u'https://tools.wmflabs.org/multichill/queries/commons/met_files.txt', verify=False)
+        regex =u'^\* File\:(.+)$'
+        for match in re.finditer(regex, urlpage.text, re.M):
+            result.add(match.group(1))
+        return result
+    return get_cached_index(u'met_commons_files', buildIndex)
+
+def currentCommonsIds():
+    '''
+    Get the index of current Commons filenames with the Met id they link to. Cached for a day
+    :return: FileIndex
+    '''
+    def buildIndex():
+        result = FileIndex()
+        urlpage = requests.get(u'https://tools.wmflabs.org/multichill/queries/commons/met_urls.txt', verify=False)
+        regex =u'^\* File\:(.+) - https\:\/\/www\.metmuseum\.org\/art\/collection\/search\/(\d+)$'
+        for match in re.finditer(regex, urlpage.text, re.M):
+            result.add(match.group(1), match.group(2))
+        return result
+    return get_cached_index(u'met_commons_ids', buildIndex)
+
+def currentCommonsShortFilenames():
+    '''
+    Get the index of the short Met filenames (the part after "MET", without extension) of the current Commons files
+    with the Met id they link to. Cached for a day
+    :return: FileIndex
+    '''
+    def buildIndex():
+        result = FileIndex(normalizer=normalize_basename)
+        urlpage = requests.get(u'https://tools.wmflabs.org/multichill/queries/commons/met_urls.txt', verify=False)
+        regex =u'^\* File\:.*[ _]?MET[ _](.+)\.(jpg|jpeg) - https\:\/\/www\.metmuseum\.org\/art\/collection\/search\/(\d+)$'
+        for match in re.finditer(regex, urlpage.text, re.M|re.I):
+            result.add(match.group(1), match.group(3))
+        return result
+    return get_cached_index(u'met_commons_short_filenames', buildIndex, normalizer=normalize_basename)
+
 def currentMetShortFilenamesGenerator():
     '''
 
@@ -325,7 +327,7 @@ def getMETGenerator2(csvlocation, metworks, missingids):
     xmlentries = 0
     maxentries = 10000
 
-    (currentcommons,currentIds) = currentCommonsIds()
+    currentcommons = currentCommonsIds()
 
     #currentcommons = currentCommonsFiles()
     #currentcommons = []
@@ -450,9 +452,9 @@ def getMETGenerator2(csvlocation, metworks, missingids):
                     for (imageurl, filename) in getImageUrls(cleanedrow.get('Object ID'), cleanedrow.get('Title')):
                     #pubpaintingcount = pubpaintingcount + 1
                         fullfilename = u'%s.jpg' % (filename,)
-                        fullfilenamee = u'%s.jpeg' % (filename,)
                         # FIXED: Underscores probably mess things up here, and strip too
-                        if fullfilename not in currentcommons and fullfilenamee not in currentcommons:
+                        # The index is normalized, so underscores are handled. The fallback also finds the .jpeg
+                        if currentcommons.find(fullfilename, fallback=True) is None:
                             xmlData.write('<row>' + "\n")
                             for key, value in cleanedrow.iteritems():
                                 xmlkey = key.replace(u' ', u'_')
@@ -502,27 +504,12 @@ def findMissingIdentifiers():
     """
     commonsfiles = currentCommonsShortFilenames()
     metgenerator = currentMetShortFilenamesGenerator()
-    foundit = 0
-    foundsameid = 0
-    founddifferentid = 0
-    notfound = 0
-    missingids = {}
-    for (shortfilename, identifier) in metgenerator:
-        if shortfilename not in commonsfiles:
-            #print u'The file with name "%s" and id "%s" was not found' % (shortfilename, identifier)
-            notfound = notfound + 1
-            #imageurls = getImageUrls(identifier, shortfilename)
-            #for imageurl in imageurls:
-            #    print imageurl
-            if identifier not in missingids:
-                missingids[identifier] = 0
-            missingids[identifier] = missingids[identifier] + 1
-        else:
-            foundit = foundit + 1
-            if identifier == commonsfiles.get(shortfilename):
-                foundsameid = foundsameid + 1
-            else:
-                founddifferentid = founddifferentid + 1
+    result = reconcile(commonsfiles, metgenerator)
+    foundsameid = result.get(u'found_same_id')
+    founddifferentid = result.get(u'found_different_id')
+    foundit = foundsameid + founddifferentid
+    missingids = result.get(u'missing_ids')
+    notfound = sum(missingids.values())
 
     print u'Total files found: %s' % (foundit,)
     print u'Of these total files, the files with the same id: %s' % (foundsameid,)
@@ -572,6 +559,12 @@ def getMETGenerator(isPublicDomain=None, objectName=None, metadataDate=None):
 
 def main(*args):
 
+    for arg in pywikibot.handle_args(args):
+        if arg == u'-audit':
+            # Only compare the Met filename dump with what is on Commons
+            findMissingIdentifiers()
+            return
+
     generator = getMETGenerator(metadataDate='2018-12-13')
 
     metFileUploadBot = MetFileUploadBot(generator)
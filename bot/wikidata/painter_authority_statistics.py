@@ -9,17 +9,20 @@ These are published at https://www.wikidata.org/wiki/Wikidata:WikiProject_sum_of
 import pywikibot
 import pywikibot.data.sparql
 import collections
+import dump_statistics
 
 class PainterAuthorityStatistics:
     """
     Generate painting statitics
 
     """
-    def __init__(self):
+    def __init__(self, dump_file=None):
         """
         Set what to work on and other variables here.
+        :param dump_file: Wikidata JSON dump to get the statistics from. If not set, SPARQL is used
         """
         self.repo = pywikibot.Site().data_repository()
+        self.dump_file = dump_file
         self.artistProperties = self.getArtistProperties()
         self.skipProperties = []
         self.propertyTotals = {}
@@ -50,7 +53,10 @@ class PainterAuthorityStatistics:
         Do the actual data gathering and publish the statistics
         :return:
         """
-        self.getPropertyData()
+        if self.dump_file:
+            self.getPropertyDataFromDump()
+        else:
+            self.getPropertyData()
         self.publishStatistics()
 
     def getArtistProperties(self):
@@ -111,6 +117,36 @@ class PainterAuthorityStatistics:
             #                                                                          itemtype=u'painter')
 
 
+    def getPropertyDataFromDump(self):
+        """
+        Get all the property data in one pass over the dump. The counts are exact.
+        """
+        engine = dump_statistics.DumpStatisticsEngine(self.dump_file)
+        statistics = dump_statistics.PropertyPairStatistics(u'"id":"Q5"',
+                                                            dump_statistics.is_human,
+                                                            dump_statistics.is_painter,
+                                                            self.artistProperties)
+        engine.add_collector(statistics)
+        engine.run()
+
+        for propertyid1 in self.artistProperties:
+            self.propertyTotals[propertyid1] = statistics.totals.get(propertyid1, 0)
+            self.propertyPainterTotals[propertyid1] = statistics.subset_totals.get(propertyid1, 0)
+
+            painterpercentage = round(1.0 * self.propertyPainterTotals.get(propertyid1) / max(self.propertyTotals.get(propertyid1), 1) * 100, 2)
+            if painterpercentage < 15:
+                self.skipProperties.append(propertyid1)
+                continue
+
+            self.propertyIdentifiers[propertyid1] = {}
+            self.propertyPainterIdentifiers[propertyid1] = {}
+            for i in range(1,12):
+                self.propertyIdentifiers[propertyid1][i] = statistics.identifiers.get((propertyid1, i), 0)
+                self.propertyPainterIdentifiers[propertyid1][i] = statistics.subset_identifiers.get((propertyid1, i), 0)
+
+        self.propertyPairTotals = dict(statistics.pairs)
+        self.propertyPairPainterTotals = dict(statistics.subset_pairs)
+
     def getPropertyTotals(self, propertyid, itemtype=u''):
         """
         Get the totals for one property
@@ -306,7 +342,11 @@ def main(*args):
     """
     Main function. Bot does all the work.
     """
-    painterAuthorityStatistics = PainterAuthorityStatistics()
+    dump_file = None
+    for arg in pywikibot.handle_args(args):
+        if arg.startswith('-dump:'):
+            dump_file = arg[len('-dump:'):]
+    painterAuthorityStatistics = PainterAuthorityStatistics(dump_file=dump_file)
     painterAuthorityStatistics.run()
 
 if __name__ == "__main__":
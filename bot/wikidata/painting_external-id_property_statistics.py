@@ -9,17 +9,20 @@ These are published at https://www.wikidata.org/wiki/Wikidata:WikiProject_sum_of
 import pywikibot
 import pywikibot.data.sparql
 import collections
+import dump_statistics
 
 class PaintingPropertyStatistics:
     """
     Generate painting statitics
 
     """
-    def __init__(self):
+    def __init__(self, dump_file=None):
         """
         Set what to work on and other variables here.
+        :param dump_file: Wikidata JSON dump to get the statistics from. If not set, SPARQL is used
         """
         self.repo = pywikibot.Site().data_repository()
+        self.dump_file = dump_file
         #self.collection_threshold = 50
         #self.property_threshold = 10
         self.targetPageTitle = u'Wikidata:WikiProject sum of all paintings/External identifiers property statistics'
@@ -195,15 +198,91 @@ LIMIT 1000"""
             # Just one result, return that right away
             return int(resultitem.get('count'))
 
+    def getPaintingTotalsInfo(self):
+        """
+        Get all the totals over all paintings
+
+        :return: Dictionary with the number of works, the works per property, the average statements and the
+                 total sitelinks
+        """
+        totals = {u'works' : self.getPaintingTotals(),
+                  u'properties' : {},
+                  u'statements' : self.getPaintingTotals(counts='statements'),
+                  u'sitelinks' : self.getPaintingTotals(counts='sitelinks'),
+                  }
+        for prop in self.properties:
+            totals[u'properties'][prop] = self.getPaintingTotals(prop=prop)
+        return totals
+
+    def get_artwork_external_ids(self):
+        """
+        Get the external identifiers that are Wikidata property for items about artworks (Q44847669)
+
+        :return: Set of Pids
+        """
+        query = """SELECT ?property WHERE {
+  ?property wikibase:propertyType wikibase:ExternalId ;
+            wdt:P31 wd:Q44847669 .
+}"""
+        result = set()
+        sq = pywikibot.data.sparql.SparqlQuery()
+        queryresult = sq.select(query)
+
+        for resultitem in queryresult:
+            result.add(resultitem.get('property').replace('http://www.wikidata.org/entity/', ''))
+        return result
+
+    def get_statistics_from_dump(self):
+        """
+        Get all the statistics in one pass over the dump. The counts are exact.
+
+        :return: Tuple of the external id counts and the totals
+        """
+        artwork_external_ids = self.get_artwork_external_ids()
+
+        def get_external_ids(entity):
+            return [prop for prop in dump_statistics.get_external_id_properties(entity)
+                    if prop in artwork_external_ids]
+
+        engine = dump_statistics.DumpStatisticsEngine(self.dump_file)
+        statistics = dump_statistics.GroupedStatistics(u'"id":"Q3305213"',
+                                                       dump_statistics.is_painting,
+                                                       get_external_ids,
+                                                       self.properties)
+        engine.add_collector(statistics)
+        engine.run()
+
+        external_id_counts = collections.OrderedDict(statistics.get_top_groups())
+        for prop in self.properties:
+            self.propertyData[prop] = {}
+            for external_id in external_id_counts:
+                self.propertyData[prop][external_id] = statistics.get_property_count(external_id, prop)
+        for external_id in external_id_counts:
+            self.averageStatements[external_id] = statistics.get_average_statements(external_id)
+            self.sumSitelinks[external_id] = statistics.get_sum_sitelinks(external_id)
+
+        totals = {u'works' : statistics.total,
+                  u'properties' : {},
+                  u'statements' : statistics.get_average_statements(),
+                  u'sitelinks' : statistics.get_sum_sitelinks(),
+                  }
+        for prop in self.properties:
+            totals[u'properties'][prop] = statistics.get_property_count(None, prop)
+        return (external_id_counts, totals)
+
     def run(self):
         """
         Starts the robot and do all the work.
         """
-        external_id_counts = self.get_external_id_info()
-        for prop in self.properties:
-            self.propertyData[prop] = self.get_property_info(prop)
-        self.averageStatements = self.getAverageStatements()
-        self.sumSitelinks = self.getSumSitelinks()
+        if self.dump_file:
+            (external_id_counts, totals) = self.get_statistics_from_dump()
+        else:
+            external_id_counts = self.get_external_id_info()
+            for prop in self.properties:
+                self.propertyData[prop] = self.get_property_info(prop)
+            self.averageStatements = self.getAverageStatements()
+            self.sumSitelinks = self.getSumSitelinks()
+            totals = self.getPaintingTotalsInfo()
 
         text = u'{{/Header}}\n{| class="wikitable sortable"\n'
         #text += u'! colspan="3" |[[Wikidata:WikiProject sum of all paintings/Top collections|Top Collections]] (Minimum %s paintings)\n' % (self.collection_threshold, )
@@ -233,16 +312,16 @@ LIMIT 1000"""
             text += u'| %s \n' % (self.averageStatements.get(external_id), )
             text += u'| %s \n' % (self.sumSitelinks.get(external_id), )
 
-        # Get the totals
-        totalworks = self.getPaintingTotals()
+        # The totals
+        totalworks = totals.get(u'works')
 
         text += u'|- class="sortbottom"\n|\n|\'\'\'Totals\'\'\' <small>(all paintings)<small>:\n| %s\n' % (totalworks,)
         for prop in self.properties:
-            totalprop = self.getPaintingTotals(prop=prop)
+            totalprop = totals.get(u'properties').get(prop)
             percentage = round(1.0 * totalprop / totalworks * 100, 2)
             text += u'| {{/Cell|%s|%s}}\n' % (percentage, totalprop)
-        text += u'| %s \n' % (self.getPaintingTotals(counts='statements'), )
-        text += u'| %s \n' % (self.getPaintingTotals(counts='sitelinks'), )
+        text += u'| %s \n' % (totals.get(u'statements'), )
+        text += u'| %s \n' % (totals.get(u'sitelinks'), )
         text += u'|}\n'
         text += u'{{/Footer}}\n'
         text += u'[[Category:WikiProject sum of all paintings|Property statistics]]\n'
@@ -256,7 +335,11 @@ def main(*args):
     """
     Main function. Bot does all the work.
     """
-    paintingPropertyStatistics = PaintingPropertyStatistics()
+    dump_file = None
+    for arg in pywikibot.handle_args(args):
+        if arg.startswith('-dump:'):
+            dump_file = arg[len('-dump:'):]
+    paintingPropertyStatistics = PaintingPropertyStatistics(dump_file=dump_file)
     paintingPropertyStatistics.run()
 
 if __name__ == "__main__":
@@ -9,17 +9,20 @@ These are published at https://www.wikidata.org/wiki/Wikidata:WikiProject_sum_of
 import pywikibot
 import pywikibot.data.sparql
 import collections
+import dump_statistics
 
 class PaintingPropertyStatistics:
     """
     Generate painting statitics
 
     """
-    def __init__(self):
+    def __init__(self, dump_file=None):
         """
         Set what to work on and other variables here.
+        :param dump_file: Wikidata JSON dump to get the statistics from. If not set, SPARQL is used
         """
         self.repo = pywikibot.Site().data_repository()
+        self.dump_file = dump_file
         self.collection_threshold = 60
         self.property_threshold = 10
         self.targetPageTitle = u'Wikidata:WikiProject sum of all paintings/Property statistics'
@@ -166,15 +169,91 @@ ORDER BY DESC(?count)"""
             # Just one result, return that right away
             return int(resultitem.get('count'))
 
+    def getPaintingTotalsInfo(self):
+        """
+        Get all the totals over all paintings
+
+        :return: Dictionary with the number of works, the works per property, the average statements and the
+                 total sitelinks
+        """
+        totals = {u'works' : self.getPaintingTotals(),
+                  u'properties' : {},
+                  u'statements' : self.getPaintingTotals(counts='statements'),
+                  u'sitelinks' : self.getPaintingTotals(counts='sitelinks'),
+                  }
+        for prop in self.properties:
+            totals[u'properties'][prop] = self.getPaintingTotals(prop=prop)
+        return totals
+
+    def getCollectionCountries(self, collectionqids):
+        """
+        Get the country codes of the collections
+        :param collectionqids: List of Wikidata ids of the collections
+        :return: Dictionary with the country code per collection
+        """
+        result = {}
+        if not collectionqids:
+            return result
+        query = """SELECT ?item ?countrycode WHERE {
+  VALUES ?item { wd:%s }
+  ?item wdt:P17/wdt:P298 ?countrycode .
+}""" % (u' wd:'.join(collectionqids),)
+        sq = pywikibot.data.sparql.SparqlQuery()
+        queryresult = sq.select(query)
+
+        for resultitem in queryresult:
+            qid = resultitem.get('item').replace(u'http://www.wikidata.org/entity/', u'')
+            result[qid] = resultitem.get('countrycode')
+        return result
+
+    def getStatisticsFromDump(self):
+        """
+        Get all the statistics in one pass over the dump. The counts are exact.
+
+        :return: Tuple of collection counts, collection countries and the totals
+        """
+        engine = dump_statistics.DumpStatisticsEngine(self.dump_file)
+        statistics = dump_statistics.GroupedStatistics(u'"id":"Q3305213"',
+                                                       dump_statistics.is_painting,
+                                                       dump_statistics.get_collections,
+                                                       self.properties)
+        engine.add_collector(statistics)
+        engine.run()
+
+        collectionsCounts = collections.OrderedDict(statistics.get_top_groups(threshold=self.collection_threshold))
+        collectionCountries = self.getCollectionCountries(list(collectionsCounts))
+        for prop in self.properties:
+            self.propertyData[prop] = {}
+            for collection in collectionsCounts:
+                propcount = statistics.get_property_count(collection, prop)
+                if propcount > self.property_threshold:
+                    self.propertyData[prop][collection] = propcount
+        for collection in collectionsCounts:
+            self.averageStatements[collection] = statistics.get_average_statements(collection)
+            self.sumSitelinks[collection] = statistics.get_sum_sitelinks(collection)
+
+        totals = {u'works' : statistics.total,
+                  u'properties' : {},
+                  u'statements' : statistics.get_average_statements(),
+                  u'sitelinks' : statistics.get_sum_sitelinks(),
+                  }
+        for prop in self.properties:
+            totals[u'properties'][prop] = statistics.get_property_count(None, prop)
+        return (collectionsCounts, collectionCountries, totals)
+
     def run(self):
         """
         Starts the robot and do all the work.
         """
-        (collectionsCounts, collectionCountries) = self.getCollectionInfo()
-        for prop in self.properties:
-            self.propertyData[prop] = self.getPropertyInfo(prop)
-        self.averageStatements = self.getAverageStatements()
-        self.sumSitelinks = self.getSumSitelinks()
+        if self.dump_file:
+            (collectionsCounts, collectionCountries, totals) = self.getStatisticsFromDump()
+        else:
+            (collectionsCounts, collectionCountries) = self.getCollectionInfo()
+            for prop in self.properties:
+                self.propertyData[prop] = self.getPropertyInfo(prop)
+            self.averageStatements = self.getAverageStatements()
+            self.sumSitelinks = self.getSumSitelinks()
+            totals = self.getPaintingTotalsInfo()
 
         text = u'{{/Header}}\n{| class="wikitable sortable"\n'
         text += u'! colspan="3" |[[Wikidata:WikiProject sum of all paintings/Top collections|Top Collections]] (Minimum %s paintings)\n' % (self.collection_threshold, )
@@ -208,16 +287,16 @@ ORDER BY DESC(?count)"""
             text += u'| %s \n' % (self.averageStatements.get(collection), )
             text += u'| %s \n' % (self.sumSitelinks.get(collection), )
 
-        # Get the totals
-        totalworks = self.getPaintingTotals()
+        # The totals
+        totalworks = totals.get(u'works')
 
         text += u'|- class="sortbottom"\n|\n|\'\'\'Totals\'\'\' <small>(all paintings)<small>:\n| %s\n' % (totalworks,)
         for prop in self.properties:
-            totalprop = self.getPaintingTotals(prop=prop)
+            totalprop = totals.get(u'properties').get(prop)
             percentage = round(1.0 * totalprop / totalworks * 100, 2)
             text += u'| {{/Cell|%s|%s}}\n' % (percentage, totalprop)
-        text += u'| %s \n' % (self.getPaintingTotals(counts='statements'), )
-        text += u'| %s \n' % (self.getPaintingTotals(counts='sitelinks'), )
+        text += u'| %s \n' % (totals.get(u'statements'), )
+        text += u'| %s \n' % (totals.get(u'sitelinks'), )
         text += u'|}\n'
         text += u'{{/Footer}}\n'
         text += u'[[Category:WikiProject sum of all paintings|Property statistics]]\n'
@@ -231,7 +310,11 @@ def main(*args):
     """
     Main function. Bot does all the work.
     """
-    paintingPropertyStatistics = PaintingPropertyStatistics()
+    dump_file = None
+    for arg in pywikibot.handle_args(args):
+        if arg.startswith('-dump:'):
+            dump_file = arg[len('-dump:'):]
+    paintingPropertyStatistics = PaintingPropertyStatistics(dump_file=dump_file)
     paintingPropertyStatistics.run()
 
 if __name__ == "__main__":
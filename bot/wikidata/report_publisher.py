@@ -0,0 +1,173 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Build and publish the reports the bots put on the wiki.
+
+The reports used to be built with text = text + '...', which copies the whole text for every line, and were always
+saved, even when nothing changed. The ReportBuilder collects the parts in lists and joins them once when the report
+is rendered. The ReportPublisher keeps a hash of every report it published (and the revision it made) in a JSON file
+in the pywikibot directory and skips the save when the report is the same and nobody edited the page since.
+
+Reports can be queued with add() and published together with flush(). The revisions of all queued pages are then
+looked up in batches and the state file is only written once.
+
+Usage in a bot:
+
+    report = ReportBuilder()
+    report.add('== Header ==\\n')
+    rows = report.section()
+    rows.add('* line\\n')
+    self.publisher.add(page, report, summary)
+    ...
+    self.publisher.flush()
+"""
+import pywikibot
+import hashlib
+import json
+import os
+
+
+class ReportBuilder:
+    """
+    Report text kept as a list of parts. Sections are builders in the list so they can still be added to after
+    later parts were added
+    """
+    def __init__(self):
+        self.parts = []
+
+    def add(self, text):
+        """
+        Add text to the end of the report
+        """
+        self.parts.append(text)
+
+    def section(self):
+        """
+        Add a new section at the current position
+
+        :return: The ReportBuilder of the section
+        """
+        section = ReportBuilder()
+        self.parts.append(section)
+        return section
+
+    def __len__(self):
+        return sum(len(part) for part in self.parts)
+
+    def render(self):
+        """
+        Join all the parts to the report text
+        """
+        return ''.join([part.render() if isinstance(part, ReportBuilder) else part for part in self.parts])
+
+
+class ReportPublisher:
+    """
+    Publish reports, but only the ones that changed since the last time they were published
+    """
+    def __init__(self, filename=None):
+        """
+        Arguments:
+            * filename - The JSON file with the hashes. Defaults to published_reports.json in the pywikibot directory
+
+        """
+        if not filename:
+            filename = os.path.join(pywikibot.config.base_dir, 'published_reports.json')
+        self.filename = filename
+        self.published = {}
+        self.pending = []
+        self.saved = 0
+        self.skipped = 0
+        if os.path.exists(self.filename):
+            with open(self.filename, 'r') as publishedfile:
+                self.published = json.load(publishedfile)
+
+    def get_key(self, page):
+        """
+        The key of the page in the state file
+        """
+        return '%s:%s' % (page.site.dbName(), page.title())
+
+    def get_hash(self, text):
+        """
+        The hash of the report text
+        """
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def is_unchanged(self, page, text):
+        """
+        Check if the same text was published before and nobody edited the page after that
+        """
+        published = self.published.get(self.get_key(page))
+        if not published or published.get('hash') != self.get_hash(text):
+            return False
+        if not page.exists():
+            return False
+        return page.latest_revision_id == published.get('revid')
+
+    def add(self, page, report, summary):
+        """
+        Queue a report to be published on the next flush()
+
+        :param page: The page to put the report on
+        :param report: The text or a ReportBuilder
+        :param summary: The edit summary
+        """
+        if isinstance(report, ReportBuilder):
+            report = report.render()
+        self.pending.append((page, report, summary))
+
+    def publish(self, page, report, summary):
+        """
+        Publish a report right away
+
+        :return: True if the page was saved, False if it was skipped
+        """
+        self.add(page, report, summary)
+        return self.flush() > 0
+
+    def flush(self):
+        """
+        Publish all the queued reports that changed
+
+        :return: The number of pages saved
+        """
+        pending = self.pending
+        self.pending = []
+        if not pending:
+            return 0
+        # Get the current revisions of all pages that might be skipped in batches
+        tocheck = {}
+        for (page, text, summary) in pending:
+            published = self.published.get(self.get_key(page))
+            if published and published.get('hash') == self.get_hash(text):
+                tocheck.setdefault(page.site, []).append(page)
+        for (site, pages) in tocheck.items():
+            for page in site.preloadpages(pages, groupsize=50, content=False):
+                pass
+
+        saved = 0
+        try:
+            for (page, text, summary) in pending:
+                if self.is_unchanged(page, text):
+                    pywikibot.output('No changes to %s, skipping' % (page.title(),))
+                    self.skipped += 1
+                    continue
+                page.put(text, summary)
+                saved += 1
+                self.saved += 1
+                self.published[self.get_key(page)] = {'hash': self.get_hash(text),
+                                                      'revid': page.latest_revision_id,
+                                                      }
+        finally:
+            self.save()
+        return saved
+
+    def save(self):
+        """
+        Save the state. Written to a temporary file first so a crash doesn't leave half a file
+        """
+        tempfilename = '%s.tmp' % (self.filename,)
+        with open(tempfilename, 'w') as tempfile:
+            json.dump(self.published, tempfile)
+        os.replace(tempfilename, self.filename)
@@ -11,6 +11,8 @@ Bot to compare Rijksmonumenten sources
 import pywikibot
 from pywikibot import pagegenerators
 import pywikibot.data.sparql
+import datetime
+import sparql_client
 
 
 class RijksmonumentenCompareBot:
@@ -34,8 +36,8 @@ class RijksmonumentenCompareBot:
         """
         result = {}
         query = 'SELECT ?item ?id WHERE { ?item wdt:P359 ?id }'
-        sq = pywikibot.data.sparql.SparqlQuery()
-        queryresult = sq.select(query)
+        # Streamed and split up if needed. Not cached because claims get added based on this
+        queryresult = sparql_client.SparqlClient().select(query, ttl=datetime.timedelta(0), split_variable='item')
 
         for resultitem in queryresult:
             qid = resultitem.get('item').replace('http://www.wikidata.org/entity/', '')
@@ -52,8 +54,7 @@ class RijksmonumentenCompareBot:
         """
         result = {}
         query = 'SELECT ?item ?id WHERE { ?item p:P359 [ps:P359 ?id; wikibase:rank wikibase:DeprecatedRank]}'
-        sq = pywikibot.data.sparql.SparqlQuery()
-        queryresult = sq.select(query)
+        queryresult = sparql_client.SparqlClient().select(query, ttl=datetime.timedelta(0))
 
         for resultitem in queryresult:
             qid = resultitem.get('item').replace('http://www.wikidata.org/entity/', '')
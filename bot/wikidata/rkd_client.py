@@ -0,0 +1,182 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Client for the RKD API (https://api.rkd.nl/) with a pool of connections and a response cache.
+
+Requests are done by a limited number of threads at the same time. Every response is kept in a SQLite file with the
+ETag and Last-Modified headers it came with. The next time the same url is requested these are sent along
+(If-None-Match/If-Modified-Since) so the API can answer with 304 Not Modified and only records that changed are
+transferred again.
+"""
+import pywikibot
+import itertools
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class RKDClient:
+    """
+    Concurrent and caching client for the RKD API
+    """
+    def __init__(self, cache_file=None, max_workers=6, max_age=None):
+        """
+        Arguments:
+            * cache_file  - The SQLite file. Defaults to rkd_cache.sqlite in the pywikibot directory
+            * max_workers - Maximum number of requests to the API at the same time
+            * max_age     - Seconds a cached response is used without asking the API. None to always check
+
+        """
+        if not cache_file:
+            cache_file = os.path.join(pywikibot.config.base_dir, 'rkd_cache.sqlite')
+        self.max_workers = max_workers
+        self.max_age = max_age
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.stats = {'fetched': 0, 'not_modified': 0, 'cached': 0}
+
+        self.connection = sqlite3.connect(cache_file, check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS responses '
+                                '(url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, body TEXT, fetched REAL)')
+        self.connection.commit()
+
+    def get_session(self):
+        """
+        Every thread gets its own session so the connections are reused
+        """
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def get_json(self, url):
+        """
+        Get the json of an url. Uses the cache if the API says it didn't change.
+
+        :param url: The API url
+        :return: The parsed json
+        :raises ValueError: If the API didn't return valid json
+        """
+        with self.lock:
+            row = self.connection.execute('SELECT etag, last_modified, body, fetched FROM responses WHERE url=?',
+                                          (url,)).fetchone()
+        headers = {}
+        if row:
+            (etag, last_modified, body, fetched) = row
+            if self.max_age is not None and fetched + self.max_age > time.time():
+                self.count('cached')
+                return json.loads(body)
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        response = self.get_session().get(url, headers=headers, timeout=60)
+        if row and response.status_code == 304:
+            self.count('not_modified')
+            with self.lock:
+                self.connection.execute('UPDATE responses SET fetched=? WHERE url=?', (time.time(), url))
+                self.connection.commit()
+            return json.loads(row[2])
+
+        result = response.json()
+        self.count('fetched')
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                                    (url, response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                                     response.text, time.time()))
+            self.connection.commit()
+        return result
+
+    def count(self, what):
+        """
+        Keep track of how the requests were answered
+        """
+        with self.lock:
+            self.stats[what] += 1
+
+    def get_json_many(self, urls):
+        """
+        Get the json of several urls at the same time
+
+        :param urls: List of API urls
+        :return: Generator yielding tuples of url and json (None if invalid) in the same order as the urls
+        """
+        futures = [(url, self.executor.submit(self.get_json, url)) for url in urls]
+        for (url, future) in futures:
+            try:
+                yield (url, future.result())
+            except ValueError:  # Throws simplejson.errors.JSONDecodeError
+                yield (url, None)
+
+    def get_records(self, record_type, record_ids):
+        """
+        Get several records at the same time
+
+        :param record_type: The type of record like images or artists
+        :param record_ids: List of ids
+        :return: Generator yielding tuples of id and the record json (None if invalid)
+        """
+        base_url = 'https://api.rkd.nl/api/record/%s/%s?format=json&language=en'
+        urls = [base_url % (record_type, record_id) for record_id in record_ids]
+        for (record_id, (url, record_json)) in zip(record_ids, self.get_json_many(urls)):
+            yield (record_id, record_json)
+
+    def search(self, base_search_url, rows=50):
+        """
+        Go over all the docs of a search. The next pages are already fetched while working on the current page.
+
+        :param base_search_url: The search url with %s for start and rows. Other % signs (like the %XX escapes of
+                                quoted search terms) are taken literally
+        :param rows: Number of docs per page
+        :return: Generator yielding the docs
+        """
+        first_page = self.get_search_page(base_search_url, 0, rows)
+        if not first_page:
+            return
+        numfound = first_page.get('response').get('numFound')
+        starts = iter(range(rows, numfound, rows))
+        pending = deque()
+        for start in itertools.islice(starts, self.max_workers):
+            pending.append(self.executor.submit(self.get_search_page, base_search_url, start, rows))
+        for doc in first_page.get('response').get('docs'):
+            yield doc
+        while pending:
+            search_json = pending.popleft().result()
+            start = next(starts, None)
+            if start is not None:
+                pending.append(self.executor.submit(self.get_search_page, base_search_url, start, rows))
+            if not search_json:
+                # If we don't get a valid response, just return
+                return
+            for doc in search_json.get('response').get('docs'):
+                yield doc
+
+    def get_search_page(self, base_search_url, start, rows):
+        """
+        Get one page of search results
+
+        :return: The json or None if it's not a valid response
+        """
+        try:
+            # The quoted search terms are already in the url, so only the %s's for start and rows are filled in
+            search_json = self.get_json(re.sub('%(?!s)', '%%', base_search_url) % (start, rows))
+        except ValueError:
+            return None
+        if not search_json.get('response') or not search_json.get('response').get('numFound'):
+            return None
+        return search_json
+
+    def close(self):
+        """
+        Stop the threads and print what happened to the requests
+        """
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        pywikibot.output('RKD API requests: %(fetched)s fetched, %(not_modified)s not modified, '
+                         '%(cached)s from cache' % self.stats)
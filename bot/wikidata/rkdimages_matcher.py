@@ -5,11 +5,14 @@ Tool to match RKDimages on Wikidata with RKDimages and make some sort of easy re
 
 """
 import pywikibot
-import requests
 import pywikibot.data.sparql
+import datetime
 import re
 import json
 import urllib.parse
+import sparql_client
+from rkd_client import RKDClient
+from report_publisher import ReportBuilder, ReportPublisher
 
 
 class RKDimagesMatcher:
@@ -27,6 +30,8 @@ class RKDimagesMatcher:
         self.run_mode = run_mode
         self.work_qid = work_qid
         self.autoadd = autoadd
+        self.rkd_client = RKDClient()
+        self.publisher = ReportPublisher()
 
         self.all_rkdimages_wikidata = None
         self.all_rkdartists_wikidata = None
@@ -94,8 +99,9 @@ class RKDimagesMatcher:
             ?idstatement ps:P350 ?id.
             MINUS { ?idstatement wikibase:rank wikibase:DeprecatedRank. }
             }"""
-        sq = pywikibot.data.sparql.SparqlQuery()
-        query_result = sq.select(query)
+        # Streamed and split up if needed. Not cached because claims get added based on this
+        query_result = sparql_client.SparqlClient().select(query, ttl=datetime.timedelta(0),
+                                                           split_variable=None if collection_qid else 'item')
 
         for result_item in query_result:
             qid = result_item.get('item').replace('http://www.wikidata.org/entity/', '')
@@ -423,23 +429,21 @@ class RKDimagesMatcher:
     ORDER BY DESC(?count)
     LIMIT 250"""
         sq = pywikibot.data.sparql.SparqlQuery()
-        query_result = sq.select(query)
+        query_result = list(sq.select(query))
 
-        for result_item in query_result:
+        # Get all the artists from the API at the same time
+        rkdartists_ids = [result_item.get('id') for result_item in query_result]
+        rkdartists_records = self.rkd_client.get_records('artists', rkdartists_ids)
+
+        for (result_item, (rkdartists_id, rkdartists_json)) in zip(query_result, rkdartists_records):
             qid = result_item.get('item').replace('http://www.wikidata.org/entity/', '')
             report_page = 'Wikidata:WikiProject sum of all paintings/RKD to match/%s' % (result_item.get('label'),)
-            rkdartists_id = result_item.get('id')
-
-            rkdartists_url = 'https://api.rkd.nl/api/record/artists/%s?format=json&language=en' % (rkdartists_id,)
 
             # Do some checking if it actually exists?
-            rkdartists_page = requests.get(rkdartists_url)
-            try:
-                rkdartists_json = rkdartists_page.json()
-                artistname = rkdartists_json.get('response').get('docs')[0].get('kunstenaarsnaam')
-            except ValueError:  # Throws simplejson.errors.JSONDecodeError
+            if not rkdartists_json:
                 pywikibot.output('Got invalid json for%s, skipping' % (rkdartists_id,))
                 continue
+            artistname = rkdartists_json.get('response').get('docs')[0].get('kunstenaarsnaam')
             artist_data = {'qid': qid,
                            'artistname': artistname,
                            'rkdartistsid': rkdartists_id,
@@ -487,11 +491,19 @@ class RKDimagesMatcher:
         elif self.run_mode == 'full':
             self.process_period('oldest')
             self.process_period('newest')
+            # Publish the reports as they're done so a crash later on in the run doesn't lose them
+            self.publisher.flush()
             for collection_qid in self.collections:
                 self.process_collection(collection_qid)
+                self.publisher.flush()
             for artist_qid in self.artists:
                 self.process_artist(artist_qid)
+                self.publisher.flush()
             self.publish_statistics()
+        # Publish the reports that changed and are still queued
+        self.publisher.flush()
+        pywikibot.output('Saved %s reports, %s reports did not change' % (self.publisher.saved,
+                                                                          self.publisher.skipped))
 
     def wikidata_paintings_in_collection(self, collection_qid):
         """
@@ -514,8 +526,7 @@ class RKDimagesMatcher:
         OPTIONAL { ?item wdt:P170 ?creator .
         ?creator wdt:P650 ?rkdartistid }
         } LIMIT 30000""" % (collection_qid, collection_qid, collection_qid, collection_qid)
-        sq = pywikibot.data.sparql.SparqlQuery()
-        query_result = sq.select(query)
+        query_result = sparql_client.SparqlClient().select(query, ttl=datetime.timedelta(0))
 
         for result_item in query_result:
             qid = result_item.get('item').replace('http://www.wikidata.org/entity/', '')
@@ -582,62 +593,49 @@ class RKDimagesMatcher:
         :param replacements: The replacements to do on the inventory numbers
         :return: Generator yield dicts
         """
-        start = 0
-        rows = 50
-        basesearchurl = u'https://api.rkd.nl/api/search/images?filters[collectienaam]=%s&filters[objectcategorie][]=schilderij&format=json&start=%s&rows=%s'
-        while True:
-            searchUrl = basesearchurl % (urllib.parse.quote_plus(collectienaam), start, rows)
-            searchPage = requests.get(searchUrl)  #, verify=False)
-            searchJson = searchPage.json()
-            if not searchJson.get('response') or not searchJson.get('response').get('numFound'):
-                # If we don't get a valid response, just return
-                return
-            numfound = searchJson.get('response').get('numFound')
-            if not start < numfound:
-                return
-            start = start + rows
-            for rkdimage in  searchJson.get('response').get('docs'):
-                imageinfo = {}
-                imageinfo[u'id'] = rkdimage.get(u'priref')
-                if rkdimage.get(u'benaming_kunstwerk') and rkdimage.get(u'benaming_kunstwerk')[0]:
-                    imageinfo[u'title_nl'] = rkdimage.get(u'benaming_kunstwerk')[0]
-                else:
-                    imageinfo[u'title_nl'] = u'(geen titel)'
-                imageinfo[u'title_en'] = rkdimage.get(u'titel_engels')
-                imageinfo[u'creator'] = rkdimage.get(u'kunstenaar')
-                if rkdimage.get(u'toeschrijving'):
-                    imageinfo[u'rkdartistid'] = rkdimage.get(u'toeschrijving')[0].get(u'naam_linkref')
-                    # Overwrite creator with something more readable
-                    imageinfo[u'creator'] = rkdimage.get(u'toeschrijving')[0].get(u'naam_inverted')
-                imageinfo[u'invnum'] = None
-                imageinfo[u'qid'] = None
-                imageinfo[u'url'] = None
-                for collectie in rkdimage.get(u'collectie'):
-                    #First we have to extract the collection name. This can be a string or a dict
-                    collectienaam_found = None
-                    if collectie.get('collectienaam'):
-                        if collectie.get('collectienaam')[0]:
-                            if collectie.get('collectienaam')[0].get('collectienaam'):
-                                collectienaam_found = collectie.get('collectienaam')[0].get('collectienaam')
-                        else:
-                            collectienaam_found = collectie.get('collectienaam')
-                    # And is it the one we're looking for?
-                    if collectienaam == collectienaam_found:
-                        invnum = collectie.get('inventarisnummer')
-                        if invnum:
-                            for (regex, replace) in replacements:
-                                invnum = re.sub(regex, replace, invnum)
-                        imageinfo[u'invnum'] = invnum
-                        imageinfo[u'startime'] = collectie.get('begindatum_in_collectie')
-                        if invnum in invnumbers:
-                            #pywikibot.output(u'Found a Wikidata id!')
-                            imageinfo[u'qid'] = invnumbers.get(invnum).get('qid')
-                            if invnumbers.get(invnum).get('url'):
-                                imageinfo[u'url'] = invnumbers.get(invnum).get('url')
-                            # Break out of the loop, otherwise the inventory might get overwritten
-                            break
-
-                yield imageinfo
+        basesearchurl = u'https://api.rkd.nl/api/search/images?filters[collectienaam]=%s&filters[objectcategorie][]=schilderij&format=json&start=%%s&rows=%%s' % (urllib.parse.quote_plus(collectienaam), )
+        for rkdimage in self.rkd_client.search(basesearchurl):
+            imageinfo = {}
+            imageinfo[u'id'] = rkdimage.get(u'priref')
+            if rkdimage.get(u'benaming_kunstwerk') and rkdimage.get(u'benaming_kunstwerk')[0]:
+                imageinfo[u'title_nl'] = rkdimage.get(u'benaming_kunstwerk')[0]
+            else:
+                imageinfo[u'title_nl'] = u'(geen titel)'
+            imageinfo[u'title_en'] = rkdimage.get(u'titel_engels')
+            imageinfo[u'creator'] = rkdimage.get(u'kunstenaar')
+            if rkdimage.get(u'toeschrijving'):
+                imageinfo[u'rkdartistid'] = rkdimage.get(u'toeschrijving')[0].get(u'naam_linkref')
+                # Overwrite creator with something more readable
+                imageinfo[u'creator'] = rkdimage.get(u'toeschrijving')[0].get(u'naam_inverted')
+            imageinfo[u'invnum'] = None
+            imageinfo[u'qid'] = None
+            imageinfo[u'url'] = None
+            for collectie in rkdimage.get(u'collectie'):
+                #First we have to extract the collection name. This can be a string or a dict
+                collectienaam_found = None
+                if collectie.get('collectienaam'):
+                    if collectie.get('collectienaam')[0]:
+                        if collectie.get('collectienaam')[0].get('collectienaam'):
+                            collectienaam_found = collectie.get('collectienaam')[0].get('collectienaam')
+                    else:
+                        collectienaam_found = collectie.get('collectienaam')
+                # And is it the one we're looking for?
+                if collectienaam == collectienaam_found:
+                    invnum = collectie.get('inventarisnummer')
+                    if invnum:
+                        for (regex, replace) in replacements:
+                            invnum = re.sub(regex, replace, invnum)
+                    imageinfo[u'invnum'] = invnum
+                    imageinfo[u'startime'] = collectie.get('begindatum_in_collectie')
+                    if invnum in invnumbers:
+                        #pywikibot.output(u'Found a Wikidata id!')
+                        imageinfo[u'qid'] = invnumbers.get(invnum).get('qid')
+                        if invnumbers.get(invnum).get('url'):
+                            imageinfo[u'url'] = invnumbers.get(invnum).get('url')
+                        # Break out of the loop, otherwise the inventory might get overwritten
+                        break
+
+            yield imageinfo
 
     def rkdImagesArtistGenerator(self, artistname):
         """
@@ -646,69 +644,56 @@ class RKDimagesMatcher:
         :return:
         """
         # https://api.rkd.nl/api/search/images?filters[collectienaam]=Rijksmuseum&format=json&start=100&rows=50
-        start = 0
-        rows = 50
-        basesearchurl = u'https://api.rkd.nl/api/search/images?filters[naam]=%s&filters[objectcategorie][]=schilderij&format=json&start=%s&rows=%s'
-        while True:
-            searchUrl = basesearchurl % (urllib.parse.quote_plus(artistname), start, rows)
-            searchPage = requests.get(searchUrl)
-            searchJson = searchPage.json()
-            if not searchJson.get('response') or not searchJson.get('response').get('numFound'):
-                # If we don't get a valid response, just return
-                return
-            numfound = searchJson.get('response').get('numFound')
-            if not start < numfound:
-                return
-            start = start + rows
-            for rkdimage in  searchJson.get('response').get('docs'):
-                imageinfo = {}
-                imageinfo[u'id'] = rkdimage.get(u'priref')
-                imageinfo[u'id'] = rkdimage.get(u'priref')
-                if rkdimage.get(u'benaming_kunstwerk') and rkdimage.get(u'benaming_kunstwerk')[0]:
-                    imageinfo[u'title_nl'] = rkdimage.get(u'benaming_kunstwerk')[0]
-                else:
-                    imageinfo[u'title_nl'] = u'(geen titel)'
-                imageinfo[u'title_en'] = rkdimage.get(u'titel_engels')
-                if imageinfo.get(u'title_nl')==imageinfo.get(u'title_en'):
-                    imageinfo[u'title'] = imageinfo.get(u'title_nl')
-                else:
-                    imageinfo[u'title'] = u'%s / %s' % (imageinfo.get(u'title_nl'), imageinfo.get(u'title_en'))
-                if rkdimage.get(u'datering'):
-                    datering = rkdimage.get(u'datering')[0]
-                    if datering.startswith(u'ca.'):
-                        imageinfo[u'inception'] = datering[3:] + u' ' + datering[:3]
-                    else:
-                        imageinfo[u'inception'] = datering
+        basesearchurl = u'https://api.rkd.nl/api/search/images?filters[naam]=%s&filters[objectcategorie][]=schilderij&format=json&start=%%s&rows=%%s' % (urllib.parse.quote_plus(artistname), )
+        for rkdimage in self.rkd_client.search(basesearchurl):
+            imageinfo = {}
+            imageinfo[u'id'] = rkdimage.get(u'priref')
+            imageinfo[u'id'] = rkdimage.get(u'priref')
+            if rkdimage.get(u'benaming_kunstwerk') and rkdimage.get(u'benaming_kunstwerk')[0]:
+                imageinfo[u'title_nl'] = rkdimage.get(u'benaming_kunstwerk')[0]
+            else:
+                imageinfo[u'title_nl'] = u'(geen titel)'
+            imageinfo[u'title_en'] = rkdimage.get(u'titel_engels')
+            if imageinfo.get(u'title_nl')==imageinfo.get(u'title_en'):
+                imageinfo[u'title'] = imageinfo.get(u'title_nl')
+            else:
+                imageinfo[u'title'] = u'%s / %s' % (imageinfo.get(u'title_nl'), imageinfo.get(u'title_en'))
+            if rkdimage.get(u'datering'):
+                datering = rkdimage.get(u'datering')[0]
+                if datering.startswith(u'ca.'):
+                    imageinfo[u'inception'] = datering[3:] + u' ' + datering[:3]
                 else:
-                    imageinfo[u'inception'] = u''
-
-                # Inception and collection
-                imageinfo[u'creator'] = rkdimage.get(u'kunstenaar')
-                #if rkdimage.get(u'toeschrijving'):
-                #        imageinfo[u'rkdartistid'] = rkdimage.get(u'toeschrijving')[0].get(u'naam_linkref')
-                #        # Overwrite creator with something more readable
-                #        imageinfo[u'creator'] = rkdimage.get(u'toeschrijving')[0].get(u'naam_inverted')
-                collection = u''
-                if len(rkdimage.get(u'collectie')) > 0 :
-                    for collectie in rkdimage.get(u'collectie'):
-                        if collectie.get('collectienaam'):
-                            collectienaam = None
-                            if isinstance(collectie.get('collectienaam'), str):
-                                # For some reason I sometimes get a list.
-                                collectienaam = collectie.get('collectienaam')
-                            elif collectie.get('collectienaam')[0].get('collectienaam'):
-                                collectienaam = collectie.get('collectienaam')[0].get('collectienaam')
-                            if collectienaam:
-                                if collectienaam in self.rkd_collectienaam:
-                                    collection += '{{Q|%s}}' % (self.rkd_collectienaam.get(collectienaam), )
-                                else:
-                                    collection += collectienaam
-                            if collectie.get('inventarisnummer') or collectie.get('begindatum_in_collectie'):
-                                collection = collection + u' (%s, %s)' % (collectie.get('inventarisnummer'),
-                                                                          collectie.get('begindatum_in_collectie'),)
-                            collection = collection + u'<BR/>\n'
-                imageinfo[u'collection'] = collection
-                yield imageinfo
+                    imageinfo[u'inception'] = datering
+            else:
+                imageinfo[u'inception'] = u''
+
+            # Inception and collection
+            imageinfo[u'creator'] = rkdimage.get(u'kunstenaar')
+            #if rkdimage.get(u'toeschrijving'):
+            #        imageinfo[u'rkdartistid'] = rkdimage.get(u'toeschrijving')[0].get(u'naam_linkref')
+            #        # Overwrite creator with something more readable
+            #        imageinfo[u'creator'] = rkdimage.get(u'toeschrijving')[0].get(u'naam_inverted')
+            collection = u''
+            if len(rkdimage.get(u'collectie')) > 0 :
+                for collectie in rkdimage.get(u'collectie'):
+                    if collectie.get('collectienaam'):
+                        collectienaam = None
+                        if isinstance(collectie.get('collectienaam'), str):
+                            # For some reason I sometimes get a list.
+                            collectienaam = collectie.get('collectienaam')
+                        elif collectie.get('collectienaam')[0].get('collectienaam'):
+                            collectienaam = collectie.get('collectienaam')[0].get('collectienaam')
+                        if collectienaam:
+                            if collectienaam in self.rkd_collectienaam:
+                                collection += '{{Q|%s}}' % (self.rkd_collectienaam.get(collectienaam), )
+                            else:
+                                collection += collectienaam
+                        if collectie.get('inventarisnummer') or collectie.get('begindatum_in_collectie'):
+                            collection = collection + u' (%s, %s)' % (collectie.get('inventarisnummer'),
+                                                                      collectie.get('begindatum_in_collectie'),)
+                        collection = collection + u'<BR/>\n'
+            imageinfo[u'collection'] = collection
+            yield imageinfo
 
     def process_collection(self, collection_qid):
         """
@@ -736,43 +721,43 @@ class RKDimagesMatcher:
         gen = self.rkdimages_collection_generator(invnumbers, collectienaam, replacements)
 
         # Page consists of several sections
-        autoaddedtext = u''  # List of auto added links in this run so user can review
-        nextaddedtext = u''  # List of links that will be auto added on the next run\
-        suggestionstext = u''  # List of suggestions that not completely add up
-        failedtext = u''  # List of links that failed, but might have some suggestions
-        text = u''  # Everything combined in the end
+        autoaddedtext = ReportBuilder()  # List of auto added links in this run so user can review
+        nextaddedtext = ReportBuilder()  # List of links that will be auto added on the next run\
+        suggestionstext = ReportBuilder()  # List of suggestions that not completely add up
+        failedtext = ReportBuilder()  # List of links that failed, but might have some suggestions
+        text = ReportBuilder()  # Everything combined in the end
 
-        text = text + u'This page gives an overview of [https://rkd.nl/en/explore/images#filters%%5Bcollectienaam%%5D=%s&filters%%5Bobjectcategorie%%5D%%5B%%5D=painting %s paintings in RKDimages] ' % (urllib.parse.quote_plus(collectienaam), collectienaam, )
+        text.add(u'This page gives an overview of [https://rkd.nl/en/explore/images#filters%%5Bcollectienaam%%5D=%s&filters%%5Bobjectcategorie%%5D%%5B%%5D=painting %s paintings in RKDimages] ' % (urllib.parse.quote_plus(collectienaam), collectienaam, ))
         if collection_info.get('qid') == collection_qid:
-            text = text + u'that are not in use on a painting item here on Wikidata in the {{Q|%s}} collection.\n' % (collection_qid, )
+            text.add(u'that are not in use on a painting item here on Wikidata in the {{Q|%s}} collection.\n' % (collection_qid, ))
         else:
-            text = text + u'that are not in use on a painting item here on Wikidata in the {{Q|%s}}/{{Q|%s}} collection.\n' % (collection_qid, collection_info.get('qid'))
-        text = text + u'This pages is split up in several sections.\n__TOC__'
-
-        autoaddedtext = autoaddedtext + u'\n== Auto added links ==\n'
-        autoaddedtext = autoaddedtext + u'A maxiumum of %s links have been added in the previous bot run. Please review.\n' % (self.autoadd,)
-        autoaddedtext = autoaddedtext + u'If you find an incorrect link, you have two options:\n'
-        autoaddedtext = autoaddedtext + u'# Move it to the right painting in the same collection.\n'
-        autoaddedtext = autoaddedtext + u'# Set the rank to deprecated so the bot won\'t add it again.\n'
-        autoaddedtext = autoaddedtext + u'-----\n\n'
-
-        nextaddedtext = nextaddedtext + u'\n== Links to add on next run ==\n'
-        nextaddedtext = nextaddedtext + u'On this run the bot added a maximum of %s links. Next up are these links. \n' % (self.autoadd,)
-        nextaddedtext = nextaddedtext + u'-----\n\n'
-
-        suggestionstext = suggestionstext + u'== Suggestions to add ==\n'
-        suggestionstext = suggestionstext + u'These suggestions are based on same collection and inventory number, but not a link to the same RKDartist.\n'
-        suggestionstext = suggestionstext + u'This can have several reasons: \n'
-        suggestionstext = suggestionstext + u'# It\'s a (completely) different painting. Just skip it.\n'
-        suggestionstext = suggestionstext + u'# Same painting, but Wikidata and RKD don\'t agree on the creator. Just add the link. You could check and maybe correct the creator.\n'
-        suggestionstext = suggestionstext + u'# Same painting, Wikidata and RKD agree on the creator, but the creator doesn\'t have the {{P|P650}} link. Just add the link. You can also add the missing RKDartists link to the creator.\n'
-        suggestionstext = suggestionstext + u'-----\n\n'
-
-        failedtext = failedtext + u'\n== No matches found ==\n'
-        failedtext = failedtext + u'For the following links, no direct matches were found. This is the puzzle part.\n'
-        failedtext = failedtext + u'# If the id is used on an item not in {{Q|%s}}, it will be mentioned here.\n' % (collection_qid, )
-        failedtext = failedtext + u'# If painter has other works in {{Q|%s}}, these will be suggested.\n' % (collection_qid, )
-        failedtext = failedtext + u'-----\n\n'
+            text.add(u'that are not in use on a painting item here on Wikidata in the {{Q|%s}}/{{Q|%s}} collection.\n' % (collection_qid, collection_info.get('qid')))
+        text.add(u'This pages is split up in several sections.\n__TOC__')
+
+        autoaddedtext.add(u'\n== Auto added links ==\n')
+        autoaddedtext.add(u'A maxiumum of %s links have been added in the previous bot run. Please review.\n' % (self.autoadd,))
+        autoaddedtext.add(u'If you find an incorrect link, you have two options:\n')
+        autoaddedtext.add(u'# Move it to the right painting in the same collection.\n')
+        autoaddedtext.add(u'# Set the rank to deprecated so the bot won\'t add it again.\n')
+        autoaddedtext.add(u'-----\n\n')
+
+        nextaddedtext.add(u'\n== Links to add on next run ==\n')
+        nextaddedtext.add(u'On this run the bot added a maximum of %s links. Next up are these links. \n' % (self.autoadd,))
+        nextaddedtext.add(u'-----\n\n')
+
+        suggestionstext.add(u'== Suggestions to add ==\n')
+        suggestionstext.add(u'These suggestions are based on same collection and inventory number, but not a link to the same RKDartist.\n')
+        suggestionstext.add(u'This can have several reasons: \n')
+        suggestionstext.add(u'# It\'s a (completely) different painting. Just skip it.\n')
+        suggestionstext.add(u'# Same painting, but Wikidata and RKD don\'t agree on the creator. Just add the link. You could check and maybe correct the creator.\n')
+        suggestionstext.add(u'# Same painting, Wikidata and RKD agree on the creator, but the creator doesn\'t have the {{P|P650}} link. Just add the link. You can also add the missing RKDartists link to the creator.\n')
+        suggestionstext.add(u'-----\n\n')
+
+        failedtext.add(u'\n== No matches found ==\n')
+        failedtext.add(u'For the following links, no direct matches were found. This is the puzzle part.\n')
+        failedtext.add(u'# If the id is used on an item not in {{Q|%s}}, it will be mentioned here.\n' % (collection_qid, ))
+        failedtext.add(u'# If painter has other works in {{Q|%s}}, these will be suggested.\n' % (collection_qid, ))
+        failedtext.add(u'-----\n\n')
 
         #text = u'<big><big><big>This list contains quite a few mistakes. These will probably fill up at the top. Please check every suggestion before approving</big></big></big>\n\n'
         #text = text + u'This list was generated with a bot. If I was confident enough about the suggestions I would have just have the bot add them. '
@@ -787,9 +772,9 @@ class RKDimagesMatcher:
         totalfailedinuse = 0
         totailfailedoptions= 0
         totalfailedelse = 0
-        bestsuggestions = ''
-        othersuggestions = ''
-        failedsuggestions = ''
+        bestsuggestions = ReportBuilder()
+        othersuggestions = ReportBuilder()
+        failedsuggestions = ReportBuilder()
 
         i = 0
         addcluster = 10
@@ -825,12 +810,12 @@ class RKDimagesMatcher:
                             #                                                                            rkdimageid.get(u'creator'))
                             addsuccess = self.addRkdimagesLink(rkdimageid.get('qid'), rkdimageid.get('id'), summary)
                             if addsuccess:
-                                autoaddedtext = autoaddedtext + u'* {{Q|%(qid)s}} - [https://rkd.nl/explore/images/%(id)s %(id)s] - [%(url)s %(invnum)s] - %(title_nl)s - %(title_en)s\n' % rkdimageid
+                                autoaddedtext.add(u'* {{Q|%(qid)s}} - [https://rkd.nl/explore/images/%(id)s %(id)s] - [%(url)s %(invnum)s] - %(title_nl)s - %(title_en)s\n' % rkdimageid)
                                 self.autoadd = self.autoadd - 1
                                 totalautoadded = totalautoadded + 1
                             else:
-                                suggestionstext = suggestionstext + u'* {{Q|%(qid)s}} - [https://rkd.nl/explore/images/%(id)s %(id)s] - [%(url)s %(invnum)s] - %(title_nl)s - %(title_en)s\n' % rkdimageid
-                                othersuggestions += u'* {{Q|%(qid)s}} - [https://rkd.nl/explore/images/%(id)s %(id)s] - [%(url)s %(invnum)s] - %(title_nl)s - %(title_en)s\n' % rkdimageid
+                                suggestionstext.add(u'* {{Q|%(qid)s}} - [https://rkd.nl/explore/images/%(id)s %(id)s] - [%(url)s %(invnum)s] - %(title_nl)s - %(title_en)s\n' % rkdimageid)
+                                othersuggestions.add(u'* {{Q|%(qid)s}} - [https://rkd.nl/explore/images/%(id)s %(id)s] - [%(url)s %(invnum)s] - %(title_nl)s - %(title_en)s\n' % rkdimageid)
 
                                 #addtext = addtext + u'%(qid)s\tP350\t"%(id)s"\n' % rkdimageid
                                 i = i + 1
@@ -840,13 +825,13 @@ class RKDimagesMatcher:
                                 #    addtext = u''
 
                         else:
-                            nextaddedtext = nextaddedtext + u'* {{Q|%(qid)s}} - [https://rkd.nl/explore/images/%(id)s %(id)s] - [%(url)s %(invnum)s] - %(title_nl)s - %(title_en)s\n' % rkdimageid
-                            bestsuggestions += u'* {{Q|%(qid)s}} - [https://rkd.nl/explore/images/%(id)s %(id)s] - [%(url)s %(invnum)s] - %(title_nl)s - %(title_en)s\n' % rkdimageid
+                            nextaddedtext.add(u'* {{Q|%(qid)s}} - [https://rkd.nl/explore/images/%(id)s %(id)s] - [%(url)s %(invnum)s] - %(title_nl)s - %(title_en)s\n' % rkdimageid)
+                            bestsuggestions.add(u'* {{Q|%(qid)s}} - [https://rkd.nl/explore/images/%(id)s %(id)s] - [%(url)s %(invnum)s] - %(title_nl)s - %(title_en)s\n' % rkdimageid)
                             totalnextadd = totalnextadd + 1
                     # Something is not adding up, add it to the suggestions list
                     else:
-                        suggestionstext = suggestionstext + u'* {{Q|%(qid)s}} - [https://rkd.nl/explore/images/%(id)s %(id)s] - [%(url)s %(invnum)s] - %(title_nl)s - %(title_en)s\n' % rkdimageid
-                        othersuggestions += u'* {{Q|%(qid)s}} - [https://rkd.nl/explore/images/%(id)s %(id)s] - [%(url)s %(invnum)s] - %(title_nl)s - %(title_en)s\n' % rkdimageid
+                        suggestionstext.add(u'* {{Q|%(qid)s}} - [https://rkd.nl/explore/images/%(id)s %(id)s] - [%(url)s %(invnum)s] - %(title_nl)s - %(title_en)s\n' % rkdimageid)
+                        othersuggestions.add(u'* {{Q|%(qid)s}} - [https://rkd.nl/explore/images/%(id)s %(id)s] - [%(url)s %(invnum)s] - %(title_nl)s - %(title_en)s\n' % rkdimageid)
 
                         #addtext = addtext + u'%(qid)s\tP350\t"%(id)s"\n' % rkdimageid
                         i = i + 1
@@ -859,13 +844,13 @@ class RKDimagesMatcher:
                     #    break
                 # Failed to find a Qid to suggest
                 else:
-                    failedtext = failedtext + u'* [https://rkd.nl/explore/images/%(id)s %(id)s] -  %(invnum)s - %(title_nl)s - %(title_en)s' % rkdimageid
-                    failedsuggestions += u'* [https://rkd.nl/explore/images/%(id)s %(id)s] -  %(invnum)s - %(title_nl)s - %(title_en)s' % rkdimageid
-                    failedsuggestions += u' {{Q|%s}}' % (collection_info.get('qid'),)
+                    failedtext.add(u'* [https://rkd.nl/explore/images/%(id)s %(id)s] -  %(invnum)s - %(title_nl)s - %(title_en)s' % rkdimageid)
+                    failedsuggestions.add(u'* [https://rkd.nl/explore/images/%(id)s %(id)s] -  %(invnum)s - %(title_nl)s - %(title_en)s' % rkdimageid)
+                    failedsuggestions.add(u' {{Q|%s}}' % (collection_info.get('qid'),))
                     # The id is used on some other Wikidata item.
                     if rkdimageid['id'] in self.all_rkdimages_wikidata.keys():
-                        failedtext = failedtext + u' -> Id already in use on {{Q|%s}}\n' % self.all_rkdimages_wikidata.get(rkdimageid['id'])
-                        failedsuggestions += u' -> Id already in use on {{Q|%s}}\n' % self.all_rkdimages_wikidata.get(rkdimageid['id'])
+                        failedtext.add(u' -> Id already in use on {{Q|%s}}\n' % self.all_rkdimages_wikidata.get(rkdimageid['id']))
+                        failedsuggestions.add(u' -> Id already in use on {{Q|%s}}\n' % self.all_rkdimages_wikidata.get(rkdimageid['id']))
                         totalfailedinuse = totalfailedinuse + 1
 
                     # Anonymous (rkd id 1984) will make the list explode
@@ -875,54 +860,55 @@ class RKDimagesMatcher:
                             if invitem.get(u'rkdartistid') and not invitem.get(u'rkdimageid') \
                                     and invitem.get(u'rkdartistid')==rkdimageid.get(u'rkdartistid'):
                                 if firstsuggestion:
-                                    failedtext = failedtext + u' -> Paintings by \'\'%s\'\' that still need a link: ' % (rkdimageid.get(u'creator'),)
-                                    failedsuggestions += u' -> Paintings by \'\'%s\'\' that still need a link: ' % (rkdimageid.get(u'creator'),)
+                                    failedtext.add(u' -> Paintings by \'\'%s\'\' that still need a link: ' % (rkdimageid.get(u'creator'),))
+                                    failedsuggestions.add(u' -> Paintings by \'\'%s\'\' that still need a link: ' % (rkdimageid.get(u'creator'),))
                                     firstsuggestion = False
                                     totailfailedoptions = totailfailedoptions + 1
                                 else:
-                                    failedtext = failedtext + u', '
-                                    failedsuggestions += u', '
-                                failedtext = failedtext + u'{{Q|%s}}' % (invitem.get(u'qid'),)
-                                failedsuggestions += u'{{Q|%s}}' % (invitem.get(u'qid'),)
-                        failedtext = failedtext + u'\n'
-                        failedsuggestions += u'\n'
+                                    failedtext.add(u', ')
+                                    failedsuggestions.add(u', ')
+                                failedtext.add(u'{{Q|%s}}' % (invitem.get(u'qid'),))
+                                failedsuggestions.add(u'{{Q|%s}}' % (invitem.get(u'qid'),))
+                        failedtext.add(u'\n')
+                        failedsuggestions.add(u'\n')
                         if firstsuggestion:
                             totalfailedelse = totalfailedelse + 1
                     else:
-                        failedtext = failedtext + u'\n'
-                        failedsuggestions += u'\n'
+                        failedtext.add(u'\n')
+                        failedsuggestions.add(u'\n')
                         totalfailedelse = totalfailedelse + 1
 
         # Add the last link if needed
         if addtext:
-            suggestionstext = suggestionstext + addlink % (addtext, i % addcluster)
-
-        text = text + autoaddedtext
-        text = text + nextaddedtext
-        text = text + suggestionstext
-        text = text + failedtext
-        text = text + u'\n== Statistics ==\n'
-        text = text + u'* RKDimages in this collection: %s\n' % (totalimages,)
-        text = text + u'* Needing a link: %s\n' % (totaltolink,)
-        text = text + u'* Auto added links this run: %s\n' % (totalautoadded,)
-        text = text + u'* To auto add nex run: %s\n' % (totalnextadd,)
-        text = text + u'* Number of suggestions: %s\n' % (totalsuggestions,)
-        text = text + u'* No suggestion, but in use on another item: %s\n' % (totalfailedinuse,)
-        text = text + u'* No suggestion, but paintings available by the same painter: %s\n' % (totailfailedoptions,)
-        text = text + u'* No suggestion and nothing found: %s\n' % (totalfailedelse,)
-
-        text = text + u'\n[[Category:WikiProject sum of all paintings RKD to match|%s]]' % (collectienaam, )
+            suggestionstext.add(addlink % (addtext, i % addcluster))
+
+        text.add(autoaddedtext)
+        text.add(nextaddedtext)
+        text.add(suggestionstext)
+        text.add(failedtext)
+        text.add(u'\n== Statistics ==\n')
+        text.add(u'* RKDimages in this collection: %s\n' % (totalimages,))
+        text.add(u'* Needing a link: %s\n' % (totaltolink,))
+        text.add(u'* Auto added links this run: %s\n' % (totalautoadded,))
+        text.add(u'* To auto add nex run: %s\n' % (totalnextadd,))
+        text.add(u'* Number of suggestions: %s\n' % (totalsuggestions,))
+        text.add(u'* No suggestion, but in use on another item: %s\n' % (totalfailedinuse,))
+        text.add(u'* No suggestion, but paintings available by the same painter: %s\n' % (totailfailedoptions,))
+        text.add(u'* No suggestion and nothing found: %s\n' % (totalfailedelse,))
+
+        text.add(u'\n[[Category:WikiProject sum of all paintings RKD to match|%s]]' % (collectienaam, ))
 
         page = pywikibot.Page(self.repo, title=reportpage)
 
         if collection_info.get('completely_matched') and totaltolink == 0:
-            text = 'The collection [https://rkd.nl/en/explore/images#filters%%5Bcollectienaam%%5D=%s&filters%%5Bobjectcategorie%%5D%%5B%%5D=painting %s paintings in RKDimages] ' % (urllib.parse.quote_plus(collectienaam), collectienaam, )
+            text = ReportBuilder()
+            text.add('The collection [https://rkd.nl/en/explore/images#filters%%5Bcollectienaam%%5D=%s&filters%%5Bobjectcategorie%%5D%%5B%%5D=painting %s paintings in RKDimages] ' % (urllib.parse.quote_plus(collectienaam), collectienaam, ))
             if collection_info.get('qid') == collection_qid:
-                text = text + 'has been completely matched to the {{Q|%s}} collection.\n' % (collection_qid, )
+                text.add('has been completely matched to the {{Q|%s}} collection.\n' % (collection_qid, ))
             else:
-                text = text + 'has been completely matched to the {{Q|%s}}/{{Q|%s}} collection.\n' % (collection_qid, collection_info.get('qid'))
-            text = text + 'Have a look at [[Wikidata:WikiProject sum of all paintings/RKD to match#Collections]] for other collections to match.\n'
-            text = text + u'\n[[Category:WikiProject sum of all paintings RKD completely matched|%s]]' % (collectienaam, )
+                text.add('has been completely matched to the {{Q|%s}}/{{Q|%s}} collection.\n' % (collection_qid, collection_info.get('qid')))
+            text.add('Have a look at [[Wikidata:WikiProject sum of all paintings/RKD to match#Collections]] for other collections to match.\n')
+            text.add(u'\n[[Category:WikiProject sum of all paintings RKD completely matched|%s]]' % (collectienaam, ))
             summary = 'All %s RKDimages in this collection have been matched' % (totalimages,)
         else:
             summary = u'%s RKDimages, %s to link, autoadd now %s, autoadd next %s , suggestions %s, failed in use %s, failed with options %s, left fails %s' % (totalimages,
@@ -934,7 +920,7 @@ class RKDimagesMatcher:
                                                                                                                                                                 totailfailedoptions,
                                                                                                                                                                 totalfailedelse,
                                                                                                                                                             )
-        page.put(text[0:2000000], summary)
+        self.publisher.add(page, text.render()[0:2000000], summary)
 
         collectionstats = {u'collectionid': collection_qid,
                            u'collectienaam': collectienaam,
@@ -962,19 +948,19 @@ class RKDimagesMatcher:
         #replacements = self.artists.get(artist_qid).get('artistname')
         reportpage = self.artists.get(artist_qid).get('reportpage')
 
-        text = u''  # Everything combined in the end
+        text = ReportBuilder()  # Everything combined in the end
 
-        text = text + u'This page gives an overview of [https://rkd.nl/en/explore/images#filters%%5Bnaam%%5D=%s&filters%%5Bobjectcategorie%%5D%%5B%%5D=painting %s paintings in RKDimages] ' % (artistname.replace(u' ', u'%20'), artistname, )
-        text = text + u'that are not in use on a painting item (left table) and the painting items by {{Q|%s}} that do not have a link to RKDimages (right table).\n' % (artist_qid, )
-        text = text + u'You can help by connecting these two lists.\n'
-        text = text + u'{| style=\'width:100%\'\n| style=\'width:50%;vertical-align: top;\' |\n'
-        text = text + u'== RKD with no link to Wikidata ==\n'
+        text.add(u'This page gives an overview of [https://rkd.nl/en/explore/images#filters%%5Bnaam%%5D=%s&filters%%5Bobjectcategorie%%5D%%5B%%5D=painting %s paintings in RKDimages] ' % (artistname.replace(u' ', u'%20'), artistname, ))
+        text.add(u'that are not in use on a painting item (left table) and the painting items by {{Q|%s}} that do not have a link to RKDimages (right table).\n' % (artist_qid, ))
+        text.add(u'You can help by connecting these two lists.\n')
+        text.add(u'{| style=\'width:100%\'\n| style=\'width:50%;vertical-align: top;\' |\n')
+        text.add(u'== RKD with no link to Wikidata ==\n')
 
-        text = text + u'{| class=\'wikitable sortable\' style=\'width:100%\'\n'
-        text = text + u'! RKDimage id\n'
-        text = text + u'! Title\n'
-        text = text + u'! Inception\n'
-        text = text + u'! Collection(s)\n'
+        text.add(u'{| class=\'wikitable sortable\' style=\'width:100%\'\n')
+        text.add(u'! RKDimage id\n')
+        text.add(u'! Title\n')
+        text.add(u'! Inception\n')
+        text.add(u'! Collection(s)\n')
 
         genrkd = self.rkdImagesArtistGenerator(artistname)
         rkdcount = 0
@@ -983,15 +969,15 @@ class RKDimagesMatcher:
             rkdcount = rkdcount + 1
             if imageinfo.get('id') not in self.all_rkdimages_wikidata:
                 rkdsuggestioncount = rkdsuggestioncount + 1
-                text = text + u'|-\n'
-                text = text + u'| [https://rkd.nl/explore/images/%(id)s %(id)s]\n| %(title)s \n| %(inception)s \n| %(collection)s\n' % imageinfo
-
-        text = text + u'|}\n| style=\'width:50%;vertical-align: top;\' |\n'
-        text = text + u'== Wikidata with no link to RKD ==\n'
-        text = text + u'{| class=\'wikitable sortable\' style=\'width:100%\'\n'
-        text = text + u'! Painting\n'
-        text = text + u'! Inception\n'
-        text = text + u'! Collection\n'
+                text.add(u'|-\n')
+                text.add(u'| [https://rkd.nl/explore/images/%(id)s %(id)s]\n| %(title)s \n| %(inception)s \n| %(collection)s\n' % imageinfo)
+
+        text.add(u'|}\n| style=\'width:50%;vertical-align: top;\' |\n')
+        text.add(u'== Wikidata with no link to RKD ==\n')
+        text.add(u'{| class=\'wikitable sortable\' style=\'width:100%\'\n')
+        text.add(u'! Painting\n')
+        text.add(u'! Inception\n')
+        text.add(u'! Collection\n')
         #text = text + u'! Title (nl)\n'
         #text = text + u'! Title (en)\n'
         #text = text + u'! Collection(s)\n'
@@ -1001,20 +987,20 @@ class RKDimagesMatcher:
         wdsuggestioncount = 0
         for painting in genwd:
             wdsuggestioncount = wdsuggestioncount + 1
-            text = text + u'|-\n'
-            text = text + u'| {{Q|%(qid)s}} || %(inception)s ||' % painting
+            text.add(u'|-\n')
+            text.add(u'| {{Q|%(qid)s}} || %(inception)s ||' % painting)
             if painting.get(u'collection'):
-                text = text + u' {{Q|%(collection)s}} \n' % painting
+                text.add(u' {{Q|%(collection)s}} \n' % painting)
             else:
-                text = text + u'\n'
+                text.add(u'\n')
 
-        text = text + u'|}\n\n'
+        text.add(u'|}\n\n')
 
-        text = text + u'\n[[Category:WikiProject sum of all paintings RKD to match|%s]]' % (artistname, )
+        text.add(u'\n[[Category:WikiProject sum of all paintings RKD to match|%s]]' % (artistname, ))
 
         page = pywikibot.Page(self.repo, title=reportpage)
         summary = u'Updating RKD artist page'
-        page.put(text, summary)
+        self.publisher.add(page, text, summary)
 
         artiststats = {u'artistid' : artist_qid,
                        u'artistname' : artistname,
@@ -1069,13 +1055,14 @@ class RKDimagesMatcher:
         else:
             return
 
-        text = u'This is an overview of additions to [https://rkd.nl/en/explore/images#filters%5Bobjectcategorie%5D%5B%5D=painting&start=0 paintings in RKDimages] to [[Wikidata:WikiProject sum of all paintings/RKD to match|match]].\n'
+        text = ReportBuilder()
+        text.add(u'This is an overview of additions to [https://rkd.nl/en/explore/images#filters%5Bobjectcategorie%5D%5B%5D=painting&start=0 paintings in RKDimages] to [[Wikidata:WikiProject sum of all paintings/RKD to match|match]].\n')
         #text += u'This page lists %s suggestions from %s to %s.\n' % (self.maxlength,
         #                                                              self.highestrkdimage,
         #                                                              self.lowestrkdimage)
-        text += see_also
-        text += u'{| class="wikitable sortable"\n'
-        text += u'|-\n! RKDimage !! Title !! Creator !! Collection !! Query !! Create\n'
+        text.add(see_also)
+        text.add(u'{| class="wikitable sortable"\n')
+        text.add(u'|-\n! RKDimage !! Title !! Creator !! Collection !! Query !! Create\n')
         lowest_rkdimage = None
         highest_rkdimage = None
         for foundimage in generator:
@@ -1088,27 +1075,27 @@ class RKDimagesMatcher:
             elif foundimage.get('id') > highest_rkdimage:
                 highest_rkdimage = foundimage.get('id')
 
-            text += u'|-\n'
-            text += u'| [%(url)s %(id)s]\n' % foundimage
-            text += u'| %(title_nl)s / %(title_en)s\n' % foundimage
+            text.add(u'|-\n')
+            text.add(u'| [%(url)s %(id)s]\n' % foundimage)
+            text.add(u'| %(title_nl)s / %(title_en)s\n' % foundimage)
             if foundimage.get(u'artistqid'):
-                text += '| {{Q|%(artistqid)s}} <small>([https://rkd.nl/explore/artists/%(rkdartistid)s %(creator)s])</small>\n' % foundimage
+                text.add('| {{Q|%(artistqid)s}} <small>([https://rkd.nl/explore/artists/%(rkdartistid)s %(creator)s])</small>\n' % foundimage)
             else:
-                text += '| [https://rkd.nl/explore/artists/%(rkdartistid)s %(creator)s]\n' % foundimage
+                text.add('| [https://rkd.nl/explore/artists/%(rkdartistid)s %(creator)s]\n' % foundimage)
 
 
-            text += u'| %(collection)s\n' % foundimage
-            text += u'| \n'
-            text += u'| \n'
-        text += u'|}\n'
-        text += u'\n[[Category:WikiProject sum of all paintings RKD to match| %s]]' % (sort_key, )
+            text.add(u'| %(collection)s\n' % foundimage)
+            text.add(u'| \n')
+            text.add(u'| \n')
+        text.add(u'|}\n')
+        text.add(u'\n[[Category:WikiProject sum of all paintings RKD to match| %s]]' % (sort_key, ))
 
         page = pywikibot.Page(self.repo, title=page_title)
         summary = u'Updating %s RKDimages suggestions with %s suggestions from %s to %s' % (period,
                                                                                             self.max_length,
                                                                                             lowest_rkdimage,
                                                                                             highest_rkdimage)
-        page.put(text, summary)
+        self.publisher.add(page, text, summary)
 
     def get_period_generator(self, sort_priref):
         """
@@ -1116,77 +1103,66 @@ class RKDimagesMatcher:
         :param sort_priref: asc or desc
         :return: A generator yielding metdata
         """
-        start = 0
-        rows = 50
-        base_search_url = 'https://api.rkd.nl/api/search/images?filters[objectcategorie][]=schilderij&sort[priref]=%s&format=json&start=%s&rows=%s'
+        base_search_url = 'https://api.rkd.nl/api/search/images?filters[objectcategorie][]=schilderij&sort[priref]=%s&format=json&start=%%s&rows=%%s' % (sort_priref, )
         count = 0
-        while count < self.max_length:
-            search_url = base_search_url % (sort_priref, start, rows)
-            search_page = requests.get(search_url)
-            search_json = search_page.json()
-            if not search_json.get('response') or not search_json.get('response').get('numFound'):
-                # If we don't get a valid response, just return
+        for rkdimage in self.rkd_client.search(base_search_url):
+            if count >= self.max_length:
                 return
-            numfound = search_json.get('response').get('numFound')
+            rkdimage_id = rkdimage.get('priref')
 
-            if not start < numfound:
-                return
-            start = start + rows
-            for rkdimage in search_json.get('response').get('docs'):
-                rkdimage_id = rkdimage.get('priref')
-
-                if rkdimage_id not in self.all_rkdimages_wikidata:
-                    imageinfo = {}
-                    imageinfo['id'] = rkdimage_id
-                    imageinfo[u'url'] = 'https://rkd.nl/explore/images/%s'  % (rkdimage_id,)
-                    if rkdimage.get('benaming_kunstwerk') and rkdimage.get('benaming_kunstwerk')[0]:
-                        imageinfo['title_nl'] = rkdimage.get('benaming_kunstwerk')[0]
-                    else:
-                        imageinfo[u'title_nl'] = '(geen titel)'
-                    imageinfo['title_en'] = rkdimage.get('titel_engels')
-                    imageinfo['creator'] = rkdimage.get('kunstenaar')
-                    if rkdimage.get('toeschrijving'):
-                        imageinfo[u'rkdartistid'] = rkdimage.get(u'toeschrijving')[0].get(u'naam_linkref')
-                        # Overwrite creator with something more readable
-                        imageinfo[u'creator'] = rkdimage.get(u'toeschrijving')[0].get(u'naam_inverted')
-                    imageinfo['artistqid'] = None
-                    if imageinfo.get('rkdartistid') in self.all_rkdartists_wikidata:
-                        imageinfo[u'artistqid'] = self.all_rkdartists_wikidata.get(imageinfo.get('rkdartistid'))
-
-                    collection = ''
-                    if len(rkdimage.get(u'collectie')) > 0 :
-                        for collectie in rkdimage.get('collectie'):
-                            if collectie.get('collectienaam'):
-                                collectienaam = None
-                                if isinstance(collectie.get('collectienaam'), str):
-                                    # For some reason I sometimes get a list.
-                                    collectienaam = collectie.get('collectienaam')
-                                elif collectie.get('collectienaam')[0].get('collectienaam'):
-                                    collectienaam = collectie.get('collectienaam')[0].get('collectienaam')
-                                if collectienaam:
-                                    if collectienaam in self.rkd_collectienaam:
-                                        collection_qid = self.rkd_collectienaam.get(collectienaam)
-                                        if collection_qid in self.collections:
-                                            collection += '[[%s|%s]]' % (self.collections.get(collection_qid).get('reportpage'), collectienaam)
-                                        else:
-                                            collection += '{{Q|%s}}' % (self.rkd_collectienaam.get(collectienaam), )
+            if rkdimage_id not in self.all_rkdimages_wikidata:
+                imageinfo = {}
+                imageinfo['id'] = rkdimage_id
+                imageinfo[u'url'] = 'https://rkd.nl/explore/images/%s'  % (rkdimage_id,)
+                if rkdimage.get('benaming_kunstwerk') and rkdimage.get('benaming_kunstwerk')[0]:
+                    imageinfo['title_nl'] = rkdimage.get('benaming_kunstwerk')[0]
+                else:
+                    imageinfo[u'title_nl'] = '(geen titel)'
+                imageinfo['title_en'] = rkdimage.get('titel_engels')
+                imageinfo['creator'] = rkdimage.get('kunstenaar')
+                if rkdimage.get('toeschrijving'):
+                    imageinfo[u'rkdartistid'] = rkdimage.get(u'toeschrijving')[0].get(u'naam_linkref')
+                    # Overwrite creator with something more readable
+                    imageinfo[u'creator'] = rkdimage.get(u'toeschrijving')[0].get(u'naam_inverted')
+                imageinfo['artistqid'] = None
+                if imageinfo.get('rkdartistid') in self.all_rkdartists_wikidata:
+                    imageinfo[u'artistqid'] = self.all_rkdartists_wikidata.get(imageinfo.get('rkdartistid'))
+
+                collection = ''
+                if len(rkdimage.get(u'collectie')) > 0 :
+                    for collectie in rkdimage.get('collectie'):
+                        if collectie.get('collectienaam'):
+                            collectienaam = None
+                            if isinstance(collectie.get('collectienaam'), str):
+                                # For some reason I sometimes get a list.
+                                collectienaam = collectie.get('collectienaam')
+                            elif collectie.get('collectienaam')[0].get('collectienaam'):
+                                collectienaam = collectie.get('collectienaam')[0].get('collectienaam')
+                            if collectienaam:
+                                if collectienaam in self.rkd_collectienaam:
+                                    collection_qid = self.rkd_collectienaam.get(collectienaam)
+                                    if collection_qid in self.collections:
+                                        collection += '[[%s|%s]]' % (self.collections.get(collection_qid).get('reportpage'), collectienaam)
                                     else:
-                                        collection += collectienaam
-                                if collectie.get('inventarisnummer') or collectie.get('begindatum_in_collectie'):
-                                    collection = collection + u' (%s, %s)' % (collectie.get('inventarisnummer'),
-                                                                              collectie.get('begindatum_in_collectie'),)
-                                collection = collection + u'<BR/>\n'
-                    imageinfo['collection'] = collection
-                    count += 1
-                    yield imageinfo
+                                        collection += '{{Q|%s}}' % (self.rkd_collectienaam.get(collectienaam), )
+                                else:
+                                    collection += collectienaam
+                            if collectie.get('inventarisnummer') or collectie.get('begindatum_in_collectie'):
+                                collection = collection + u' (%s, %s)' % (collectie.get('inventarisnummer'),
+                                                                          collectie.get('begindatum_in_collectie'),)
+                            collection = collection + u'<BR/>\n'
+                imageinfo['collection'] = collection
+                count += 1
+                yield imageinfo
 
     def publish_statistics(self):
         page = pywikibot.Page(self.repo, title=u'Wikidata:WikiProject sum of all paintings/RKD to match')
-        text = u'This pages gives an overview of [https://rkd.nl/en/explore/images#filters%5Bobjectcategorie%5D%5B%5D=painting paintings in RKDimages] to match with paintings in [[Wikidata:WikiProject sum of all paintings/Collection|collections]] and [[Wikidata:WikiProject sum of all paintings/Creator|creators]] on Wikidata.\n'
-        text = text + u'\nSee also the [[Wikidata:WikiProject sum of all paintings/RKD to match/Oldest additions|oldest]] and [[Wikidata:WikiProject sum of all paintings/RKD to match/Recent additions|recent additions]] to RKDimages.\n'
-        text = text + u'== Collections ==\n'
-        text = text + u'{| class="wikitable sortable"\n'
-        text = text + u'! Collection !! RKDimages !! Page !! Total RKDimages || Left to match !! Auto added !! Auto next !! Suggestions !! Failed in use !! Failed options !! Failed else\n'
+        text = ReportBuilder()
+        text.add(u'This pages gives an overview of [https://rkd.nl/en/explore/images#filters%5Bobjectcategorie%5D%5B%5D=painting paintings in RKDimages] to match with paintings in [[Wikidata:WikiProject sum of all paintings/Collection|collections]] and [[Wikidata:WikiProject sum of all paintings/Creator|creators]] on Wikidata.\n')
+        text.add(u'\nSee also the [[Wikidata:WikiProject sum of all paintings/RKD to match/Oldest additions|oldest]] and [[Wikidata:WikiProject sum of all paintings/RKD to match/Recent additions|recent additions]] to RKDimages.\n')
+        text.add(u'== Collections ==\n')
+        text.add(u'{| class="wikitable sortable"\n')
+        text.add(u'! Collection !! RKDimages !! Page !! Total RKDimages || Left to match !! Auto added !! Auto next !! Suggestions !! Failed in use !! Failed options !! Failed else\n')
 
         totalimages = 0
         totaltolink = 0
@@ -1196,10 +1172,10 @@ class RKDimagesMatcher:
         totalfailedinuse = 0
         totailfailedoptions= 0
         totalfailedelse = 0
-        bestsuggestions = ''
-        othersuggestions = ''
-        failedsuggestions = ''
-        completed_collections = ''
+        bestsuggestions = ReportBuilder()
+        othersuggestions = ReportBuilder()
+        failedsuggestions = ReportBuilder()
+        completed_collections = ReportBuilder()
 
         for collectionstats in self.collection_stats:
             rkdimageslink = '[https://rkd.nl/en/explore/images#filters%%5Bcollectienaam%%5D=%s&filters%%5Bobjectcategorie%%5D%%5B%%5D=painting %s in RKDimages] ' % (collectionstats.get('collectienaam').replace(u' ', u'%20'),
@@ -1207,18 +1183,18 @@ class RKDimagesMatcher:
             pagelink = u'[[%s|%s]]' % (collectionstats.get(u'reportpage'),
                                        collectionstats.get(u'reportpage').replace(u'Wikidata:WikiProject sum of all paintings/RKD to match/', u''),
                                        )
-            text = text + u'|-\n'
-            text = text + u'|| {{Q|%s}} ' % (collectionstats.get(u'collectionid'),)
-            text = text + u'|| %s ' % (rkdimageslink,)
-            text = text + u'|| %s ' % (pagelink,)
-            text = text + u'|| %s ' % (collectionstats.get(u'totalimages'),)
-            text = text + u'|| %s ' % (collectionstats.get(u'totaltolink'),)
-            text = text + u'|| %s ' % (collectionstats.get(u'totalautoadded'),)
-            text = text + u'|| %s ' % (collectionstats.get(u'totalnextadd'),)
-            text = text + u'|| %s ' % (collectionstats.get(u'totalsuggestions'),)
-            text = text + u'|| %s ' % (collectionstats.get(u'totalfailedinuse'),)
-            text = text + u'|| %s ' % (collectionstats.get(u'totailfailedoptions'),)
-            text = text + u'|| %s \n' % (collectionstats.get(u'totalfailedelse'),)
+            text.add(u'|-\n')
+            text.add(u'|| {{Q|%s}} ' % (collectionstats.get(u'collectionid'),))
+            text.add(u'|| %s ' % (rkdimageslink,))
+            text.add(u'|| %s ' % (pagelink,))
+            text.add(u'|| %s ' % (collectionstats.get(u'totalimages'),))
+            text.add(u'|| %s ' % (collectionstats.get(u'totaltolink'),))
+            text.add(u'|| %s ' % (collectionstats.get(u'totalautoadded'),))
+            text.add(u'|| %s ' % (collectionstats.get(u'totalnextadd'),))
+            text.add(u'|| %s ' % (collectionstats.get(u'totalsuggestions'),))
+            text.add(u'|| %s ' % (collectionstats.get(u'totalfailedinuse'),))
+            text.add(u'|| %s ' % (collectionstats.get(u'totailfailedoptions'),))
+            text.add(u'|| %s \n' % (collectionstats.get(u'totalfailedelse'),))
 
             totalimages = totalimages + collectionstats.get(u'totalimages')
             totaltolink = totaltolink + collectionstats.get(u'totaltolink')
@@ -1228,43 +1204,47 @@ class RKDimagesMatcher:
             totalfailedinuse = totalfailedinuse + collectionstats.get(u'totalfailedinuse')
             totailfailedoptions = totailfailedoptions + collectionstats.get(u'totailfailedoptions')
             totalfailedelse = totalfailedelse + collectionstats.get(u'totalfailedelse')
-            bestsuggestions += collectionstats.get(u'bestsuggestions')  # FIXME: Move to different list
-            othersuggestions += collectionstats.get('othersuggestions')  # FIXME: Move to different list too
+            bestsuggestions.add(collectionstats.get(u'bestsuggestions'))  # FIXME: Move to different list
+            othersuggestions.add(collectionstats.get('othersuggestions'))  # FIXME: Move to different list too
             if collectionstats.get('completely_matched'):
-                failedsuggestions += collectionstats.get('failedsuggestions')  # FIXME: Move to different list too
+                failedsuggestions.add(collectionstats.get('failedsuggestions'))  # FIXME: Move to different list too
             elif collectionstats.get(u'totalimages') > 0 and collectionstats.get(u'totaltolink') == 0:
-                completed_collections += '* %s\n' % (pagelink,)
-
-        text = text + u'|- class="sortbottom"\n'
-        text = text + u'| || || || %s || %s || %s || %s || %s || %s || %s || %s\n' % (totalimages,
-                                                                                      totaltolink,
-                                                                                      totalautoadded,
-                                                                                      totalnextadd,
-                                                                                      totalsuggestions,
-                                                                                      totalfailedinuse,
-                                                                                      totailfailedoptions,
-                                                                                      totalfailedelse,
-                                                                                )
-        text = text + u'|}\n\n'
-        text = text + u'<small>Collections configuration is at [[User:BotMultichillT/rkdimages collections.js]]</small>\n'
-        text = text + u'=== Best suggestions ===\n'
-        text = text + bestsuggestions + '\n\n'
-        text = text + u'=== Other suggestions ===\n'
-        text = text + othersuggestions + '\n\n'
-        text = text + u'=== Suggestions from previously completely matched collections ===\n'
-        text = text + failedsuggestions + '\n\n'
+                completed_collections.add('* %s\n' % (pagelink,))
+
+        text.add(u'|- class="sortbottom"\n')
+        text.add(u'| || || || %s || %s || %s || %s || %s || %s || %s || %s\n' % (totalimages,
+                                                                                 totaltolink,
+                                                                                 totalautoadded,
+                                                                                 totalnextadd,
+                                                                                 totalsuggestions,
+                                                                                 totalfailedinuse,
+                                                                                 totailfailedoptions,
+                                                                                 totalfailedelse,
+                                                                           ))
+        text.add(u'|}\n\n')
+        text.add(u'<small>Collections configuration is at [[User:BotMultichillT/rkdimages collections.js]]</small>\n')
+        text.add(u'=== Best suggestions ===\n')
+        text.add(bestsuggestions)
+        text.add('\n\n')
+        text.add(u'=== Other suggestions ===\n')
+        text.add(othersuggestions)
+        text.add('\n\n')
+        text.add(u'=== Suggestions from previously completely matched collections ===\n')
+        text.add(failedsuggestions)
+        text.add('\n\n')
         if completed_collections:
-            text = text + u'=== Completed collections ===\n'
-            text = text + u'These collections appear to have been completed. Configuration at [[User:BotMultichillT/rkdimages collections.js]] should be updated.\n'
-            text = text + completed_collections + '\n\n'
+            text.add(u'=== Completed collections ===\n')
+            text.add(u'These collections appear to have been completed. Configuration at [[User:BotMultichillT/rkdimages collections.js]] should be updated.\n')
+            text.add(completed_collections)
+            text.add('\n\n')
 
         totalrkd = 0
         totalrkdsuggestions = 0
         totalwikidata = 0
 
-        text = text + u'== Artists ==\n'
-        text = text + u'{| class="wikitable sortable"\n'
-        text = text + u'! Artist !! RKDimages !! Page !! Total RKDimages !! RKDimages left to match !! Wikidata possibilities\n'
+        text.add(u'== Artists ==\n')
+        text.add(u'{| class="wikitable sortable"\n')
+        text.add(u'! Artist !! RKDimages !! Page !! Total RKDimages !! RKDimages left to match !! Wikidata possibilities\n')
 
         for artiststats in self.artist_stats:
             rkdimageslink = '[https://rkd.nl/en/explore/images#filters%%5Bnaam%%5D=%s&filters%%5Bobjectcategorie%%5D%%5B%%5D=painting %s in RKDimages] ' % (artiststats.get('artistname').replace(u' ', u'%20'),
@@ -1272,24 +1252,24 @@ class RKDimagesMatcher:
             pagelink = u'[[%s|%s]]' % (artiststats.get(u'reportpage'),
                                        artiststats.get(u'reportpage').replace(u'Wikidata:WikiProject sum of all paintings/RKD to match/', u''),
                                        )
-            text = text + u'|-\n'
-            text = text + u'|| {{Q|%s}} ' % (artiststats.get(u'artistid'),)
-            text = text + u'|| %s ' % (rkdimageslink,)
-            text = text + u'|| %s ' % (pagelink,)
-            text = text + u'|| %s ' % (artiststats.get(u'rkdcount'),)
-            text = text + u'|| %s ' % (artiststats.get(u'rkdsuggestioncount'),)
-            text = text + u'|| %s \n' % (artiststats.get(u'wdsuggestioncount'),)
+            text.add(u'|-\n')
+            text.add(u'|| {{Q|%s}} ' % (artiststats.get(u'artistid'),))
+            text.add(u'|| %s ' % (rkdimageslink,))
+            text.add(u'|| %s ' % (pagelink,))
+            text.add(u'|| %s ' % (artiststats.get(u'rkdcount'),))
+            text.add(u'|| %s ' % (artiststats.get(u'rkdsuggestioncount'),))
+            text.add(u'|| %s \n' % (artiststats.get(u'wdsuggestioncount'),))
 
             totalrkd = totalrkd + artiststats.get(u'rkdcount')
             totalrkdsuggestions = totalrkdsuggestions + artiststats.get(u'rkdsuggestioncount')
             totalwikidata = totalwikidata + artiststats.get(u'wdsuggestioncount')
 
-        text = text + u'|- class="sortbottom"\n'
-        text = text + u'| || || || %s || %s || %s\n' % (totalrkd,
-                                                        totalrkdsuggestions,
-                                                        totalwikidata,
-                                                        )
-        text = text + u'|}\n\n[[Category:WikiProject sum of all paintings RKD to match| ]]'
+        text.add(u'|- class="sortbottom"\n')
+        text.add(u'| || || || %s || %s || %s\n' % (totalrkd,
+                                                   totalrkdsuggestions,
+                                                   totalwikidata,
+                                                   ))
+        text.add(u'|}\n\n[[Category:WikiProject sum of all paintings RKD to match| ]]')
 
         summary = u'%s RKDimages, %s to link, autoadd now %s, autoadd next %s , suggestions %s, failed in use %s, failed with options %s, left fails %s' % (totalimages,
                                                                                                                                                             totaltolink,
@@ -1300,7 +1280,7 @@ class RKDimagesMatcher:
                                                                                                                                                             totailfailedoptions,
                                                                                                                                                             totalfailedelse,
                                                                                                                                                         )
-        page.put(text, summary)
+        self.publisher.add(page, text, summary)
 
     def guess_collection_name(self, qid, collection_names, sample_size=15, verbose=False):
         """
@@ -1321,27 +1301,22 @@ class RKDimagesMatcher:
         sq = pywikibot.data.sparql.SparqlQuery()
         queryresult = sq.select(query)
 
-        for resultitem in queryresult:
+        # Get all the sample records from the API at the same time
+        rkdimages_ids = [resultitem.get('id') for resultitem in queryresult]
+        for (rkdimages_id, rkdimages_json) in self.rkd_client.get_records('images', rkdimages_ids):
             result_count += 1
-            qid = resultitem.get('item').replace('http://www.wikidata.org/entity/', '')
-            rkdimages_id = resultitem.get('id')
-            rkdimages_url = 'https://api.rkd.nl/api/record/images/%s?format=json&language=en' % (rkdimages_id,)
-
             # Do some checking if it actually exists?
-            rkdimages_page = requests.get(rkdimages_url)
-            try:
-                rkdimages_json = rkdimages_page.json()
-                for rkdimage in rkdimages_json.get('response').get('docs'):
-                    if len(rkdimage.get('collectie')) > 0 :
-                        for collectie in rkdimage.get('collectie'):
-                            collectienaam = collectie.get('collectienaam')
-                            if not collectienaam in collection_names:
-                                if collectienaam not in collections:
-                                    collections[collectienaam] = 0
-                                collections[collectienaam] += 1
-            except ValueError:  # Throws simplejson.errors.JSONDecodeError
+            if not rkdimages_json:
                 pywikibot.output('Got invalid json for%s, skipping' % (rkdimages_id,))
                 return None
+            for rkdimage in rkdimages_json.get('response').get('docs'):
+                if len(rkdimage.get('collectie')) > 0 :
+                    for collectie in rkdimage.get('collectie'):
+                        collectienaam = collectie.get('collectienaam')
+                        if not collectienaam in collection_names:
+                            if collectienaam not in collections:
+                                collections[collectienaam] = 0
+                            collections[collectienaam] += 1
         if verbose:
             pywikibot.output(json.dumps(collections, indent=4, sort_keys=True))
 
@@ -1366,14 +1341,19 @@ class RKDimagesMatcher:
         """
         base_search_url = 'https://api.rkd.nl/api/search/images?filters[collectienaam]=%s&filters[objectcategorie][]=schilderij&format=json&start=0&rows=10'
         use_collections = []
+        search_urls = {}
         for collection in self.manual_collections:
             collectienaam = self.manual_collections.get(collection).get('collectienaam')
             if self.manual_collections.get(collection).get('use_collection'):
                 use_collections.append(self.manual_collections.get(collection).get('use_collection'))
             if collectienaam:
-                search_url = base_search_url % (urllib.parse.quote_plus(collectienaam),)
-                search_page = requests.get(search_url)
-                number_found = search_page.json().get('response').get('numFound')
+                search_urls[base_search_url % (urllib.parse.quote_plus(collectienaam),)] = (collection, collectienaam)
+
+        # Check all the collections at the same time
+        for (search_url, search_json) in self.rkd_client.get_json_many(list(search_urls)):
+            (collection, collectienaam) = search_urls.get(search_url)
+            if search_json:
+                number_found = search_json.get('response').get('numFound')
                 if number_found == 0:
                     pywikibot.output('On %s the collectienaam %s did not return anything at all' % (collection, collectienaam))
                     collectienaam = self.guess_collection_name(collection, [], sample_size=15)
@@ -1392,37 +1372,23 @@ class RKDimagesMatcher:
         :return:
         """
         collection_names = {}
-        start = 0
-        rows = 50
         base_search_url = 'https://api.rkd.nl/api/search/images?filters[objectcategorie][]=schilderij&sort[priref]=desc&format=json&start=%s&rows=%s'
 
-        while True:
-            search_url = base_search_url % (start, rows)
-            search_page = requests.get(search_url)
-            search_json = search_page.json()
-            if not search_json.get('response') or not search_json.get('response').get('numFound'):
-                # If we don't get a valid response, just go to the next page
-                continue
-            numfound = search_json.get('response').get('numFound')
-
-            if not start < numfound:
-                break
-            start = start + rows
-            for rkdimage in search_json.get('response').get('docs'):
-                if len(rkdimage.get('collectie')) > 0 :
-                    for collectie in rkdimage.get('collectie'):
-                        if collectie.get('collectienaam'):
-                            collectienaam = None
-                            if isinstance(collectie.get('collectienaam'), str):
-                                # For some reason I sometimes get a list.
-                                collectienaam = collectie.get('collectienaam')
-                            elif collectie.get('collectienaam')[0].get('collectienaam'):
-                                collectienaam = collectie.get('collectienaam')[0].get('collectienaam')
-                            if collectienaam:
-                                if collectienaam not in self.rkd_collectienaam:
-                                    if collectienaam not in collection_names:
-                                        collection_names[collectienaam] = 0
-                                    collection_names[collectienaam] +=1
+        for rkdimage in self.rkd_client.search(base_search_url):
+            if len(rkdimage.get('collectie')) > 0 :
+                for collectie in rkdimage.get('collectie'):
+                    if collectie.get('collectienaam'):
+                        collectienaam = None
+                        if isinstance(collectie.get('collectienaam'), str):
+                            # For some reason I sometimes get a list.
+                            collectienaam = collectie.get('collectienaam')
+                        elif collectie.get('collectienaam')[0].get('collectienaam'):
+                            collectienaam = collectie.get('collectienaam')[0].get('collectienaam')
+                        if collectienaam:
+                            if collectienaam not in self.rkd_collectienaam:
+                                if collectienaam not in collection_names:
+                                    collection_names[collectienaam] = 0
+                                collection_names[collectienaam] +=1
         pywikibot.output('Overview of collections not used yet on Wikidata:')
         for collectienaam in sorted(collection_names, key=collection_names.get, reverse=True)[:100]:
             pywikibot.output('* "%s" - %s' % (collectienaam, collection_names.get(collectienaam)))
@@ -1468,7 +1434,10 @@ def main(*args):
             run_mode = 'newest'
 
     rkimages_matcher = RKDimagesMatcher(run_mode=run_mode, work_qid=work_qid, autoadd=autoadd)
-    rkimages_matcher.run()
+    try:
+        rkimages_matcher.run()
+    finally:
+        rkimages_matcher.rkd_client.close()
 
 
 if __name__ == "__main__":
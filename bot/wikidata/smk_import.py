@@ -11,6 +11,7 @@ import HTMLParser
 import time
 import json
 import artdatabot
+import date_parser
 import pywikibot
 import requests
 import re
@@ -85,26 +86,16 @@ def getPaintingGenerator(query=u''):
 
             # Inception
             if item.get('object_production_date_text_en'):
-                circadateRegex = u'^(Circa|About)\s*(\d\d\d\d)$'
-                perioddateRegex = u'^(\d\d\d\d)-(\d\d\d\d)$'
-
-                circadateMatch = re.match(circadateRegex, item.get('object_production_date_text_en'))
-                perioddateMatch = re.match(perioddateRegex, item.get('object_production_date_text_en'))
-                if circadateMatch:
-                    metadata['inception'] = htmlparser.unescape(circadateMatch.group(2))
-                    metadata['inceptioncirca'] = True
-                elif perioddateMatch:
-                    metadata['inceptionstart'] = int(perioddateMatch.group(1),)
-                    metadata['inceptionend'] = int(perioddateMatch.group(2),)
+                inception = date_parser.parse_inception(htmlparser.unescape(item.get('object_production_date_text_en')))
+                if inception:
+                    metadata.update(inception)
                 else:
                     metadata[u'inception'] = item.get('object_production_date_text_en')
 
             # Sometimes some junk in this field that makes the bot trip
             if item.get('acq_date'):
-                acqdateregex = u'^(\d\d\d\d)$'
-                acqdateMatch = re.match(acqdateregex, item.get('acq_date'))
-                if acqdateMatch:
-                    metadata[u'acquisitiondate'] = acqdateMatch.group(1)
+                if date_parser.parse_date(item.get('acq_date')):
+                    metadata[u'acquisitiondate'] = item.get('acq_date').strip()
 
             if item.get('prod_technique_en'):
                 metadata[u'medium'] = item.get('prod_technique_en').lower()
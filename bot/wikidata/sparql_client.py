@@ -0,0 +1,233 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Shared SPARQL client for the bots with caching and streaming of the results.
+
+pywikibot.data.sparql.SparqlQuery().select() loads the whole JSON result in memory. This client asks for CSV
+instead and saves the response to a file on disk while it's coming in. The rows are read back one at a time so
+memory use stays flat, even for queries returning hundreds of thousands of rows. The file is also used as cache:
+running the same query again within the time to live doesn't hit the query service. Results of queries with a time
+to live of 0 are never kept and cached results older than cache_max_age are removed when a client is made.
+
+Queries that run into the query service timeout can be split up automatically in ranges of Wikidata ids. The range
+filter is on the string of the id, so the query service still has to match the whole pattern for every range. It only
+helps when the time goes into what comes after the matching (OPTIONALs, the label service, sorting and sending a lot
+of rows), not for patterns that are too expensive to match in the first place.
+
+Usage in a bot:
+
+    sparql_client = SparqlClient()
+    for resultitem in sparql_client.select(query):
+        qid = resultitem.get('item').replace('http://www.wikidata.org/entity/', '')
+
+The rows are dicts like the ones SparqlQuery.select() returns. Unbound variables are None.
+"""
+import pywikibot
+import pywikibot.comms.http
+import csv
+import datetime
+import hashlib
+import os
+import time
+import requests
+
+
+class SparqlTimeout(Exception):
+    """
+    The query service gave up on a query because it ran too long
+    """
+
+
+class SparqlClient:
+    """
+    Client to run SELECT queries with the results cached on disk
+    """
+    def __init__(self, endpoint='https://query.wikidata.org/sparql', cache_dir=None,
+                 ttl=datetime.timedelta(hours=6), max_retries=5, retry_wait=30, max_splits=8,
+                 cache_max_age=datetime.timedelta(days=7)):
+        """
+        Arguments:
+            * endpoint     - The SPARQL endpoint
+            * cache_dir    - Directory for the cached results. Defaults to sparql_cache in the pywikibot directory
+            * ttl          - How long a cached result can be used. Can be overridden per query
+            * max_retries  - Number of times to retry a query that failed
+            * retry_wait   - Seconds to wait after the first failure. Doubles after every next failure
+            * max_splits   - How many times a query that timed out can be split in two ranges
+            * cache_max_age - Cached results older than this are removed. Should be more than the longest ttl used
+
+        """
+        if not cache_dir:
+            cache_dir = os.path.join(pywikibot.config.base_dir, 'sparql_cache')
+        os.makedirs(cache_dir, exist_ok=True)
+        self.endpoint = endpoint
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_retries = max_retries
+        self.retry_wait = retry_wait
+        self.max_splits = max_splits
+        self.session = requests.Session()
+        self.session.headers.update({'Accept': 'text/csv',
+                                     'User-Agent': pywikibot.comms.http.user_agent()})
+        self.clear_cache(cache_max_age)
+
+    def select(self, query, ttl=None, split_variable=None):
+        """
+        Run a SELECT query and yield the rows one at a time
+
+        :param query: The SPARQL query
+        :param ttl: How long a cached result can be used. Use a timedelta of 0 to always run the query and not keep
+                    the result, for example for queries with a timestamp in them
+        :param split_variable: Variable with Wikidata items (like 'item') to split the query on if it times out
+        :return: Generator of dicts with the variable as key and the value as string
+        """
+        if not split_variable:
+            for row in self.read_result(self.get_result_file(query, ttl)):
+                yield row
+            return
+        ranges = [(0, None, 0)]
+        while ranges:
+            (low, high, splits) = ranges.pop(0)
+            range_query = self.add_range_filter(query, split_variable, low, high)
+            try:
+                result_file = self.get_result_file(range_query, ttl)
+            except SparqlTimeout:
+                if splits >= self.max_splits:
+                    raise
+                middle = (low + high) // 2 if high is not None else max(low * 2, 1 << 26)
+                pywikibot.output('The query timed out, splitting it in Q%s-Q%s and Q%s-%s' %
+                                 (low, middle, middle, 'Q%s' % (high,) if high is not None else 'end'))
+                ranges[0:0] = [(low, middle, splits + 1), (middle, high, splits + 1)]
+                continue
+            for row in self.read_result(result_file):
+                yield row
+
+    def add_range_filter(self, query, variable, low, high):
+        """
+        Add a filter on the numeric part of the Wikidata id of the variable. The last } of the query is used.
+        The filter can't use an index, it only reduces the rows the rest of the query works on
+        """
+        if low == 0 and high is None:
+            return query
+        number = 'xsd:integer(STRAFTER(STR(?%s), "/entity/Q"))' % (variable,)
+        conditions = ['%s >= %s' % (number, low)]
+        if high is not None:
+            conditions.append('%s < %s' % (number, high))
+        range_filter = 'FILTER(%s)\n' % (' && '.join(conditions),)
+        end = query.rindex('}')
+        return query[:end] + range_filter + query[end:]
+
+    def get_cache_filename(self, query):
+        """
+        Get the name of the file to cache the result of the query in
+        """
+        key = hashlib.sha1(('%s\n%s' % (self.endpoint, query)).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, '%s.csv' % (key,))
+
+    def get_result_file(self, query, ttl=None):
+        """
+        Get the file with the result of the query. Runs the query if it's not in the cache or expired.
+
+        :return: The filename. With a ttl of 0 the result is not cached and this is a temporary file that
+                 read_result() removes
+        """
+        if ttl is None:
+            ttl = self.ttl
+        filename = self.get_cache_filename(query)
+        if os.path.exists(filename) and os.path.getmtime(filename) + ttl.total_seconds() > time.time():
+            return filename
+
+        tempfilename = '%s.%s.tmp' % (filename, os.getpid())
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.download(query, tempfilename)
+                if not ttl:
+                    return tempfilename
+                os.replace(tempfilename, filename)
+                return filename
+            except SparqlTimeout:
+                if os.path.exists(tempfilename):
+                    os.remove(tempfilename)
+                raise
+            except requests.exceptions.RequestException as err:
+                if os.path.exists(tempfilename):
+                    os.remove(tempfilename)
+                if attempt >= self.max_retries:
+                    raise
+                wait = self.retry_wait * 2 ** attempt
+                if err.response is not None and err.response.status_code == 429:
+                    # Too many requests, the query service tells how long to wait
+                    wait = int(err.response.headers.get('Retry-After', wait))
+                pywikibot.output('The query failed: %s. Trying again in %s seconds' % (err, wait))
+                time.sleep(wait)
+
+    def download(self, query, filename):
+        """
+        Run the query and write the response to the file as it's coming in
+        """
+        response = self.session.post(self.endpoint, data={'query': query}, stream=True, timeout=(30, 120))
+        if response.status_code == 500 and 'TimeoutException' in response.text:
+            raise SparqlTimeout(query)
+        response.raise_for_status()
+        with open(filename, 'wb') as resultfile:
+            for chunk in response.iter_content(chunk_size=1 << 16):
+                resultfile.write(chunk)
+        # If the query times out after the first rows were sent, the error ends up at the end of the body
+        with open(filename, 'rb') as resultfile:
+            resultfile.seek(max(os.path.getsize(filename) - 4096, 0))
+            if b'TimeoutException' in resultfile.read():
+                raise SparqlTimeout(query)
+
+    def read_result(self, filename):
+        """
+        Read the rows of a result file and remove it after if it's a temporary one
+        """
+        try:
+            for row in self.read_rows(filename):
+                yield row
+        finally:
+            if filename.endswith('.tmp') and os.path.exists(filename):
+                os.remove(filename)
+
+    def read_rows(self, filename):
+        """
+        Read the rows from a result file one at a time
+        """
+        with open(filename, 'r', encoding='utf-8', newline='') as resultfile:
+            reader = csv.reader(resultfile)
+            header = next(reader, None)
+            if not header:
+                return
+            for values in reader:
+                row = {}
+                for (variable, value) in zip(header, values):
+                    row[variable] = value if value != '' else None
+                yield row
+
+    def clear_cache(self, max_age=None):
+        """
+        Remove the cached results (and temporary files left behind by a crash) older than max_age (defaults to the
+        ttl)
+        """
+        if max_age is None:
+            max_age = self.ttl
+        for filename in os.listdir(self.cache_dir):
+            fullname = os.path.join(self.cache_dir, filename)
+            try:
+                if os.path.getmtime(fullname) + max_age.total_seconds() < time.time():
+                    os.remove(fullname)
+            except FileNotFoundError:
+                # Removed by another bot at the same time
+                continue
+
+
+def main(*args):
+    """
+    Clean up the expired results in the cache
+    """
+    for arg in pywikibot.handle_args(args):
+        pass
+    SparqlClient().clear_cache()
+
+
+if __name__ == "__main__":
+    main()
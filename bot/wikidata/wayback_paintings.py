@@ -6,6 +6,8 @@ Let's add a ton of links to https://archive.org/web/
 The bot will take a SPARQL query that will return a bunch of links.
 Bot will run over these links and if needed, add them to the Wayback machine.
 This is part of https://www.wikidata.org/wiki/Wikidata:WikiProject_sum_of_all_paintings/Link_rot
+
+Use -pipeline (and optionally -workers:<number>) to check and submit the url's concurrently, see wayback_pipeline.py
 """
 import pywikibot
 from pywikibot import pagegenerators
@@ -15,19 +17,24 @@ import re
 import datetime
 import time
 import urllib
+from wayback_pipeline import WaybackPipeline
 
 class WaybackPaintingsBot:
     """
     A bot to enrich humans on Wikidata
     """
-    def __init__(self, query):
+    def __init__(self, query, pipeline=False, workers=8):
         """
         Arguments:
             * query    - A valid SPARQL query with url's in the ?url field
+            * pipeline - Check and submit the url's with the concurrent pipeline instead of one by one
+            * workers  - Number of threads resolving redirects in the pipeline
 
         """
         self.generator = self.getUrlGenerator(query)
         self.repo = pywikibot.Site().data_repository()
+        self.pipeline = pipeline
+        self.workers = workers
 
 
     def getUrlGenerator(self, query):
@@ -49,6 +56,10 @@ class WaybackPaintingsBot:
         """
         Starts the robot.
         """
+        if self.pipeline:
+            waybackPipeline = WaybackPipeline(redirect_workers=self.workers)
+            waybackPipeline.run(self.generator)
+            return
         for url in self.generator:
             self.processUrl(url)
 
@@ -124,6 +135,8 @@ def main(*args):
     queryname = u''
     query = u''
     queryvariable = u''
+    pipeline = False
+    workers = 8
     for arg in pywikibot.handle_args(args):
         if arg=='-allurl':
             queryname = u'allurl'
@@ -143,6 +156,11 @@ def main(*args):
         elif arg.startswith(u'-collectionid:'):
             queryname = u'collection'
             queryvariable = arg.replace(u'-collectionid:', u'')
+        elif arg==u'-pipeline':
+            pipeline = True
+        elif arg.startswith(u'-workers:'):
+            pipeline = True
+            workers = int(arg.replace(u'-workers:', u''))
 
     if queryname==u'allurl':
         query = u"""SELECT DISTINCT ?url WHERE {
@@ -217,7 +235,7 @@ LIMIT 200000"""
         pywikibot.output(u'No valid query option found. Please use -query:<option>')
 
     if query:
-        waybackPaintingsBot = WaybackPaintingsBot(query)
+        waybackPaintingsBot = WaybackPaintingsBot(query, pipeline=pipeline, workers=workers)
         waybackPaintingsBot.run()
 
 if __name__ == "__main__":
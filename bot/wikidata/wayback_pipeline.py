@@ -0,0 +1,374 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Pipeline to check a lot of url's against the Wayback Machine and submit the ones that are missing.
+
+Every url goes through three stages, each with its own pool of worker threads connected by bounded queues:
+* redirect - resolve redirects on the website itself
+* available - ask https://archive.org/wayback/available if there already is a snapshot
+* submit - add the url to the persistent WaybackQueue, which submits it in the background
+
+The url's waiting for the redirect stage are kept in a queue per host. A worker takes the next url of a host whose
+rate limit allows a request, so a website with a lot of url's doesn't hold up the rest and no website gets hammered.
+Url's that are confirmed to be archived are kept in a SQLite file in the pywikibot directory so a next run can skip
+them without any request. The number of url's per second per stage is reported every minute.
+
+Submitting is slow (the Wayback Machine only allows a few saves per minute). When the checks are done the pipeline
+waits up to submit_timeout seconds for the WaybackQueue. What is still in it after that is submitted on the next run
+or by running wayback_queue.py.
+
+See also https://www.wikidata.org/wiki/Wikidata:WikiProject_sum_of_all_paintings/Link_rot
+"""
+import pywikibot
+import os
+import queue
+import sqlite3
+import threading
+import time
+import urllib.parse
+import requests
+from collections import Counter, OrderedDict, deque
+from wayback_queue import WaybackQueue
+
+
+class HostRateLimiter:
+    """
+    Rate limiter with a separate budget for every host
+    """
+    def __init__(self, default_rate=1.0, rates=None):
+        """
+        Arguments:
+            * default_rate - Maximum number of requests per second to a host
+            * rates        - Dict with the maximum number of requests per second for specific hosts
+
+        """
+        self.default_rate = default_rate
+        self.rates = rates or {}
+        self.lock = threading.Lock()
+        self.next_request = {}
+
+    def wait(self, url):
+        """
+        Wait until the rate limit of the host of the url allows the next request
+        """
+        host = urllib.parse.urlsplit(url).netloc.lower()
+        interval = 1.0 / self.rates.get(host, self.default_rate)
+        with self.lock:
+            now = time.time()
+            wait = self.next_request.get(host, 0) - now
+            self.next_request[host] = max(now, self.next_request.get(host, 0)) + interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+class HostQueues:
+    """
+    Bounded queue with a queue per host. get() returns an url of a host whose rate limit allows the next request
+    """
+    def __init__(self, default_rate=1.0, rates=None, maxsize=1000):
+        """
+        Arguments:
+            * default_rate - Maximum number of requests per second to a host
+            * rates        - Dict with the maximum number of requests per second for specific hosts
+            * maxsize      - Maximum number of url's in all the queues together
+
+        """
+        self.default_rate = default_rate
+        self.rates = rates or {}
+        self.maxsize = maxsize
+        self.condition = threading.Condition()
+        # host -> deque of url's. The host that was served last is moved to the end
+        self.hosts = OrderedDict()
+        self.next_request = {}
+        self.size = 0
+        self.closed = False
+
+    def put(self, url):
+        """
+        Add an url. Waits while the queues are full
+        """
+        host = urllib.parse.urlsplit(url).netloc.lower()
+        with self.condition:
+            while self.size >= self.maxsize:
+                self.condition.wait()
+            self.hosts.setdefault(host, deque()).append(url)
+            self.size += 1
+            self.condition.notify_all()
+
+    def close(self):
+        """
+        No more url's will be added. get() returns None when everything is taken
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def get(self):
+        """
+        Take the next url of a host that is ready, waits until one is
+
+        :return: The url or None if the queues are closed and empty
+        """
+        with self.condition:
+            while True:
+                now = time.time()
+                wait = None
+                for (host, urls) in self.hosts.items():
+                    ready = self.next_request.get(host, 0)
+                    if ready <= now:
+                        url = urls.popleft()
+                        if urls:
+                            self.hosts.move_to_end(host)
+                        else:
+                            del self.hosts[host]
+                        self.next_request[host] = now + 1.0 / self.rates.get(host, self.default_rate)
+                        self.size -= 1
+                        self.condition.notify_all()
+                        return url
+                    if wait is None or ready - now < wait:
+                        wait = ready - now
+                if not self.hosts and self.closed:
+                    return None
+                self.condition.wait(wait)
+
+
+class ArchivedStore:
+    """
+    The url's that are confirmed to be in the Wayback Machine
+    """
+    def __init__(self, filename=None):
+        """
+        Arguments:
+            * filename - The SQLite file. Defaults to wayback_archived.sqlite in the pywikibot directory
+
+        """
+        if not filename:
+            filename = os.path.join(pywikibot.config.base_dir, 'wayback_archived.sqlite')
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS archived (url TEXT PRIMARY KEY, timestamp REAL)')
+        self.connection.commit()
+        self.urls = set(url for (url,) in self.connection.execute('SELECT url FROM archived'))
+
+    def __contains__(self, url):
+        return url in self.urls
+
+    def __len__(self):
+        return len(self.urls)
+
+    def add(self, *urls):
+        """
+        Add one or more url's, for example the url and where it redirects to
+        """
+        with self.lock:
+            now = time.time()
+            for url in urls:
+                if url not in self.urls:
+                    self.urls.add(url)
+                    self.connection.execute('INSERT OR IGNORE INTO archived VALUES (?, ?)', (url, now))
+            self.connection.commit()
+
+
+class ProgressCounter:
+    """
+    Thread safe counters per stage with the number of url's per second
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.starttime = time.time()
+
+    def count(self, stage, amount=1):
+        """
+        Count url's that went through a stage
+        """
+        with self.lock:
+            self.counts[stage] += amount
+
+    def output(self):
+        """
+        Output the counts and the rates
+        """
+        with self.lock:
+            counts = dict(self.counts)
+        elapsed = max(time.time() - self.starttime, 0.001)
+        pywikibot.output('Wayback pipeline after %.0f seconds: %s' % (
+            elapsed, ', '.join(['%s %s (%.2f/s)' % (stage, count, count / elapsed)
+                                for (stage, count) in sorted(counts.items())])))
+
+
+class WaybackPipeline:
+    """
+    Check and submit url's to the Wayback Machine with a pool of workers per stage
+    """
+    def __init__(self, redirect_workers=8, available_workers=4, submit_workers=2, queuesize=1000, default_rate=1.0,
+                 available_rate=5.0, report_interval=60, submit_timeout=3600, wayback_queue=None, archived_store=None):
+        """
+        Arguments:
+            * redirect_workers  - Number of threads resolving redirects
+            * available_workers - Number of threads checking the availability in the Wayback Machine
+            * submit_workers    - Number of threads of the WaybackQueue submitting the url's
+            * queuesize         - Maximum number of url's waiting between two stages
+            * default_rate      - Maximum number of requests per second to a website
+            * available_rate    - Maximum number of requests per second to the availability API
+            * report_interval   - Seconds between progress reports
+            * submit_timeout    - Seconds to wait for the WaybackQueue to submit everything at the end. None for no limit
+            * wayback_queue     - The WaybackQueue to submit to. Defaults to the persistent queue
+            * archived_store    - The ArchivedStore. Defaults to the store in the pywikibot directory
+
+        """
+        self.redirect_workers = redirect_workers
+        self.available_workers = available_workers
+        self.report_interval = report_interval
+        self.submit_timeout = submit_timeout
+        self.limiter = HostRateLimiter(default_rate=default_rate, rates={'archive.org': available_rate})
+        self.wayback_queue = wayback_queue or WaybackQueue(workers=submit_workers)
+        self.archived = archived_store or ArchivedStore()
+        self.progress = ProgressCounter()
+        self.redirect_queue = HostQueues(default_rate=default_rate, maxsize=queuesize)
+        self.available_queue = queue.Queue(maxsize=queuesize)
+        self.sessions = threading.local()
+        self.done = threading.Event()
+
+    def get_session(self):
+        """
+        Every worker thread has its own requests session
+        """
+        if not hasattr(self.sessions, 'session'):
+            self.sessions.session = requests.Session()
+        return self.sessions.session
+
+    def run(self, generator):
+        """
+        Run all the url's from the generator through the pipeline
+        """
+        redirect_threads = self.start_threads(self.redirect_worker, self.redirect_workers, 'redirect')
+        available_threads = self.start_threads(self.available_worker, self.available_workers, 'available')
+        reporter = threading.Thread(target=self.reporter, name='wayback-progress', daemon=True)
+        reporter.start()
+        self.wayback_queue.start()
+        try:
+            for url in generator:
+                self.progress.count('input')
+                if url in self.archived:
+                    self.progress.count('skipped')
+                    continue
+                self.redirect_queue.put(url)
+            self.redirect_queue.close()
+            for thread in redirect_threads:
+                thread.join()
+            self.stop_threads(self.available_queue, available_threads)
+            pywikibot.output('Checks done, waiting for the Wayback queue to submit the missing url\'s')
+            self.wayback_queue.join(timeout=self.submit_timeout)
+        finally:
+            self.done.set()
+            self.wayback_queue.stop()
+            self.progress.output()
+            pywikibot.output('Wayback queue status: %s' % (self.wayback_queue.get_counts(),))
+
+    def start_threads(self, target, number, name):
+        """
+        Start a pool of worker threads
+        """
+        threads = []
+        for i in range(number):
+            thread = threading.Thread(target=target, name='wayback-%s-%s' % (name, i), daemon=True)
+            thread.start()
+            threads.append(thread)
+        return threads
+
+    def stop_threads(self, workqueue, threads):
+        """
+        Let the workers finish what's in the queue and stop them
+        """
+        for thread in threads:
+            workqueue.put(None)
+        for thread in threads:
+            thread.join()
+
+    def reporter(self):
+        """
+        Report the progress every report_interval seconds
+        """
+        while not self.done.wait(self.report_interval):
+            self.progress.output()
+            pywikibot.output('Wayback queue status: %s' % (self.wayback_queue.get_counts(),))
+
+    def redirect_worker(self):
+        """
+        Resolve redirects and pass the url on to the availability check
+        """
+        while True:
+            # The queue already waits for the rate limit of the host
+            url = self.redirect_queue.get()
+            if url is None:
+                return
+            try:
+                resolved = self.resolve_redirect(url)
+            except requests.exceptions.RequestException:
+                # Still worth checking if the Wayback Machine has it
+                self.progress.count('redirect errors')
+                resolved = url
+            except Exception as err:
+                # Don't let one weird url kill the worker
+                pywikibot.output('Resolving the redirect of %s failed: %s' % (url, err))
+                self.progress.count('redirect errors')
+                continue
+            self.progress.count('redirect')
+            if resolved != url and resolved in self.archived:
+                self.archived.add(url)
+                self.progress.count('skipped')
+                continue
+            self.available_queue.put((url, resolved))
+
+    def available_worker(self):
+        """
+        Check if the url is available in the Wayback Machine. If it isn't, submit it
+        """
+        while True:
+            urls = self.available_queue.get()
+            if urls is None:
+                return
+            (url, resolved) = urls
+            try:
+                self.limiter.wait('https://archive.org/')
+                available = self.is_available(resolved)
+            except (requests.exceptions.RequestException, ValueError):
+                self.progress.count('available errors')
+                continue
+            except Exception as err:
+                pywikibot.output('Checking the availability of %s failed: %s' % (resolved, err))
+                self.progress.count('available errors')
+                continue
+            self.progress.count('available')
+            try:
+                if available:
+                    self.archived.add(url, resolved)
+                    self.progress.count('already archived')
+                elif self.wayback_queue.add(resolved):
+                    self.progress.count('submit')
+                else:
+                    self.progress.count('already queued')
+            except Exception as err:
+                pywikibot.output('Storing the result for %s failed: %s' % (resolved, err))
+                self.progress.count('available errors')
+
+    def resolve_redirect(self, url):
+        """
+        Try to resolve redirect, otherwise just return the url
+        """
+        session = self.get_session()
+        page = session.head(url, verify=False, timeout=60)
+        if page.status_code in [301, 302]:
+            page = session.get(url, verify=False, timeout=60)
+            if page.url != url:
+                return page.url
+        return url
+
+    def is_available(self, url):
+        """
+        Check at https://archive.org/help/wayback_api.php if an url is already available or not
+        """
+        waybackurl = 'https://archive.org/wayback/available?url=%s' % (urllib.parse.quote(url),)
+        page = self.get_session().get(waybackurl, timeout=60)
+        return bool(page.json().get('archived_snapshots'))
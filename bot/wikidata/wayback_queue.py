@@ -0,0 +1,235 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Background queue to have the Wayback Machine make snapshots of url's.
+
+The url's are kept in a SQLite file so nothing gets lost when the bot is stopped. Worker threads submit them to
+https://web.archive.org/save/ with a cap on the number of requests per minute. Failed url's are retried later with
+an increasing delay.
+
+See also https://www.wikidata.org/wiki/Wikidata:WikiProject_sum_of_all_paintings/Link_rot
+"""
+import pywikibot
+import os
+import sqlite3
+import threading
+import time
+import requests
+
+
+class WaybackQueue:
+    """
+    A persistent and deduplicated queue of url's to submit to the Wayback Machine
+    """
+    def __init__(self, filename=None, workers=2, requests_per_minute=12, max_attempts=5, retry_delay=60,
+                 save_url='https://web.archive.org/save/%s'):
+        """
+        Arguments:
+            * filename     - The SQLite file. Defaults to wayback_queue.sqlite in the pywikibot directory
+            * workers      - Number of worker threads
+            * requests_per_minute - Cap on the number of save requests for all workers together
+            * max_attempts - Give up on an url after this many failed attempts
+            * retry_delay  - Seconds to wait after the first failure. Doubles after every next failure
+            * save_url     - The save endpoint. Can be pointed to a local stub for testing
+
+        """
+        if not filename:
+            filename = os.path.join(pywikibot.config.base_dir, 'wayback_queue.sqlite')
+        self.workers = workers
+        self.interval = 60.0 / requests_per_minute
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.save_url = save_url
+
+        self.lock = threading.Lock()
+        self.rate_lock = threading.Lock()
+        self.next_request = 0
+        self.stopping = threading.Event()
+        self.wakeup = threading.Event()
+        self.threads = []
+
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        # status: 0 is waiting, 1 is in progress, 2 is done and 3 is given up
+        self.connection.execute('CREATE TABLE IF NOT EXISTS urls '
+                                '(url TEXT PRIMARY KEY, status INTEGER, attempts INTEGER, next_attempt REAL)')
+        # Url's that were in progress when the bot got stopped should be done again
+        self.connection.execute('UPDATE urls SET status=0 WHERE status=1')
+        self.connection.commit()
+
+    def add(self, url):
+        """
+        Add an url to the queue. Url's that are already in the queue or were already done are ignored.
+
+        :param url: The url to archive
+        :return: True if the url was added
+        """
+        with self.lock:
+            cursor = self.connection.execute('INSERT OR IGNORE INTO urls VALUES (?, 0, 0, 0)', (url,))
+            self.connection.commit()
+        if cursor.rowcount:
+            self.wakeup.set()
+            return True
+        return False
+
+    def start(self):
+        """
+        Start the worker threads. They will first work on whatever was left from a previous run
+        """
+        if self.threads:
+            return
+        self.stopping.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.work, name='wayback-%s' % (i,), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self, timeout=None):
+        """
+        Stop the worker threads after their current request. The url's still waiting stay in the queue for next time.
+
+        :param timeout: Seconds to wait for every worker to finish
+        :return: Nothing
+        """
+        self.stopping.set()
+        self.wakeup.set()
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+
+    def join(self, timeout=None):
+        """
+        Wait until there's nothing left to do in the queue or until the timeout has passed
+
+        :param timeout: Maximum number of seconds to wait
+        :return: True if the queue is empty
+        """
+        end = time.time() + timeout if timeout is not None else None
+        while True:
+            counts = self.get_counts()
+            if not counts.get(0) and not counts.get(1):
+                return True
+            if end is not None and time.time() > end:
+                return False
+            time.sleep(1)
+
+    def get_counts(self):
+        """
+        Get the number of url's per status
+        :return: Dict with the status as key and the number of url's as value
+        """
+        with self.lock:
+            return dict(self.connection.execute('SELECT status, COUNT(*) FROM urls GROUP BY status').fetchall())
+
+    def take_next(self):
+        """
+        Take the next url that is due and mark it as in progress
+
+        :return: Tuple of the url and the number of previous attempts or None if nothing is due
+        """
+        with self.lock:
+            row = self.connection.execute('SELECT url, attempts FROM urls WHERE status=0 AND next_attempt<=? '
+                                          'ORDER BY next_attempt LIMIT 1', (time.time(),)).fetchone()
+            if row:
+                self.connection.execute('UPDATE urls SET status=1 WHERE url=?', (row[0],))
+                self.connection.commit()
+            return row
+
+    def get_idle_time(self, maximum=10):
+        """
+        Get the number of seconds until the next retry is due
+        """
+        with self.lock:
+            row = self.connection.execute('SELECT MIN(next_attempt) FROM urls WHERE status=0').fetchone()
+        if not row or row[0] is None:
+            return maximum
+        return min(max(row[0] - time.time(), 0.1), maximum)
+
+    def finish(self, url, attempts, result):
+        """
+        Mark the url as done or given up or schedule a retry
+
+        :param result: The result of submit(): 'done', 'retry' or 'failed'
+        """
+        with self.lock:
+            if result == 'done':
+                self.connection.execute('UPDATE urls SET status=2 WHERE url=?', (url,))
+            elif result == 'failed':
+                self.connection.execute('UPDATE urls SET status=3, attempts=? WHERE url=?', (attempts + 1, url))
+            elif attempts + 1 >= self.max_attempts:
+                pywikibot.output('Giving up on backing up %s to the Wayback Machine' % (url,))
+                self.connection.execute('UPDATE urls SET status=3, attempts=? WHERE url=?', (attempts + 1, url))
+            else:
+                next_attempt = time.time() + self.retry_delay * 2 ** attempts
+                self.connection.execute('UPDATE urls SET status=0, attempts=?, next_attempt=? WHERE url=?',
+                                        (attempts + 1, next_attempt, url))
+            self.connection.commit()
+
+    def wait_for_turn(self):
+        """
+        Wait until the rate limit allows the next request. Shared by all workers.
+        """
+        with self.rate_lock:
+            now = time.time()
+            wait = self.next_request - now
+            self.next_request = max(now, self.next_request) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+    def work(self):
+        """
+        The loop of a worker thread
+        """
+        session = requests.Session()
+        while not self.stopping.is_set():
+            next_url = self.take_next()
+            if not next_url:
+                self.wakeup.wait(timeout=self.get_idle_time())
+                self.wakeup.clear()
+                continue
+            url, attempts = next_url
+            self.wait_for_turn()
+            self.finish(url, attempts, self.submit(session, url))
+
+    def submit(self, session, url):
+        """
+        Submit an url to the Wayback Machine
+
+        :param session: The requests session of the worker
+        :param url: The url to archive
+        :return: 'done' if the Wayback Machine accepted it, 'retry' if it's worth trying again later and 'failed'
+                 if the Wayback Machine refused it
+        """
+        pywikibot.output('Backing up this url to the Wayback Machine: %s' % (url,))
+        try:
+            response = session.post(self.save_url % (url,), timeout=120)
+        except requests.exceptions.RequestException as err:
+            pywikibot.output('Requests threw an exception. The wayback backup of %s failed: %s' % (url, err))
+            return 'retry'
+        # 429 is too many requests and 5xx is the Wayback Machine having trouble, both worth trying again
+        if response.status_code == 429 or response.status_code >= 500:
+            pywikibot.output('The wayback backup of %s failed with status %s' % (url, response.status_code))
+            return 'retry'
+        # Other 4xx like 403 and 404 mean the save failed for this url
+        if response.status_code >= 400:
+            pywikibot.output('The wayback backup of %s was refused with status %s' % (url, response.status_code))
+            return 'failed'
+        return 'done'
+
+
+def main(*args):
+    """
+    Work on whatever is left in the queue
+    """
+    for arg in pywikibot.handle_args(args):
+        pass
+    wayback_queue = WaybackQueue()
+    wayback_queue.start()
+    try:
+        wayback_queue.join()
+    finally:
+        wayback_queue.stop()
+    pywikibot.output('Done: %s' % (wayback_queue.get_counts(),))
+
+
+if __name__ == "__main__":
+    main()